@@ -0,0 +1,3 @@
+"""
+Benchmarks of testrunner, run as modules: python -m benchmarks.<name>
+"""
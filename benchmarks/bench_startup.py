@@ -0,0 +1,262 @@
+"""
+Start up of python -m testrunner.
+
+Measures:
+ - time to first watch: from start of process to file events being
+   processed (handler is ready, watcher.WAITING_MARK logged), on small
+   tree
+ - time of --help
+ - time to import testrunner and modules taking most of it, from
+   python -X importtime (or import hook where it is not supported)
+
+    python -m benchmarks.bench_startup -o new.json
+    python -m benchmarks.bench_startup --compare old.json new.json
+    python -m benchmarks.bench_startup --max-first-watch 0.2
+"""
+import json
+import os
+import re
+import select
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from os import path
+from time import time
+
+import testrunner
+from testrunner.watcher import WAITING_MARK
+
+from benchmarks.common import compare, print_comparison, summary, write_results
+
+WAIT_TIMEOUT = 30
+SLOWEST_IMPORTS = 15
+
+LOCAL_CONFIG = """\
+TEST_RUNNER = "true"
+TEST_RUNNER_OPTIONS = ""
+TESTS = ""
+STATE_DIR = {state_dir!r}
+"""
+
+# Same output as python -X importtime, for interpreters without it
+IMPORT_HOOK = r"""
+import sys
+from time import time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+original = builtins.__import__
+children = [0]
+
+
+def timed_import(name, *args, **kwargs):
+    known = name in sys.modules
+    children.append(0)
+    started = time()
+    try:
+        return original(name, *args, **kwargs)
+    finally:
+        elapsed = time() - started
+        nested = children.pop()
+        children[-1] += elapsed
+        if not known and name in sys.modules:
+            sys.stderr.write("import time: {:9d} | {:10d} | {}{}\n".format(
+                int((elapsed - nested) * 1e6), int(elapsed * 1e6),
+                "  " * len(children), name))
+
+
+builtins.__import__ = timed_import
+"""
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def repo_env():
+    """
+    Environment of child processes, testrunner imported from this tree
+    """
+
+    root = path.dirname(path.dirname(path.abspath(testrunner.__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [root, env.get("PYTHONPATH")]))
+    return env
+
+
+def has_importtime(python):
+    with open(os.devnull, "w") as devnull:
+        return subprocess.call([python, "-X", "importtime", "-c", "pass"],
+                               stdout=devnull, stderr=subprocess.STDOUT) == 0
+
+
+def parse_importtime(output):
+    """
+    Imported modules as (name, self seconds, cumulative seconds)
+    """
+
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules.append(
+                (name, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+
+    return modules
+
+
+def import_testrunner(cmd):
+    """
+    Seconds import of testrunner took and what interpreter logged
+    """
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, env=repo_env())
+    output, errors = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("Import failed:\n" + errors)
+
+    return float(output), errors
+
+
+def measure_imports(python, samples):
+    """
+    Seconds to import testrunner and self time of slowest modules.
+    Modules are timed by separate run, timing them slows imports down
+    """
+
+    code = (
+        "import sys; from time import time; started = time(); "
+        "import testrunner; sys.stdout.write(repr(time() - started))"
+    )
+    timings = [import_testrunner([python, "-c", code])[0]
+               for _ in range(samples)]
+
+    if has_importtime(python):
+        _, errors = import_testrunner([python, "-X", "importtime", "-c", code])
+    else:
+        _, errors = import_testrunner([python, "-c", IMPORT_HOOK + code])
+
+    modules = sorted(parse_importtime(errors),
+                     key=lambda module: module[1], reverse=True)
+    return timings, dict(
+        (name, self_time) for name, self_time, _ in modules[:SLOWEST_IMPORTS])
+
+
+def measure_help(python, samples):
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(samples):
+            started = time()
+            subprocess.check_call([python, "-m", "testrunner", "--help"],
+                                  stdout=devnull, env=repo_env())
+            timings.append(time() - started)
+
+    return timings
+
+
+def first_watch(python, work_dir):
+    """
+    Seconds from start of testrunner until it processes file events
+    """
+
+    cmd = [python, "-m", "testrunner", "-c", "config.py", "-d", "src"]
+    started = time()
+    proc = subprocess.Popen(cmd, cwd=work_dir, env=repo_env(),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            preexec_fn=os.setsid)
+    output = []
+    try:
+        deadline = started + WAIT_TIMEOUT
+        while time() < deadline:
+            ready, _, _ = select.select([proc.stdout], [], [], 0.1)
+            if not ready:
+                continue
+
+            line = proc.stdout.readline()
+            if not line:
+                break
+
+            output.append(line)
+            if WAITING_MARK in line:
+                return time() - started
+    finally:
+        # Whole group, pool worker goes away too
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait()
+
+    raise RuntimeError("Testrunner did not start watching:\n" +
+                       "".join(output))
+
+
+def measure_first_watch(python, samples, base_dir):
+    work_dir = tempfile.mkdtemp(prefix="bench-", dir=base_dir)
+    try:
+        src_dir = path.join(work_dir, "src")
+        os.mkdir(src_dir)
+        for idx in range(10):
+            with open(path.join(src_dir, "mod{}.py".format(idx)), "w") as dst:
+                dst.write("X = {}\n".format(idx))
+
+        with open(path.join(work_dir, "config.py"), "w") as dst:
+            dst.write(LOCAL_CONFIG.format(
+                state_dir=path.join(work_dir, "state")))
+
+        return [first_watch(python, work_dir) for _ in range(samples)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        prog="bench_startup", description="Start up benchmark")
+    parser.add_argument("--python", default=sys.executable,
+                        help="Interpreter running testrunner")
+    parser.add_argument("--samples", type=int, default=10,
+                        help="Starts measured per metric")
+    parser.add_argument("--dir", help="Where to create tree (tmp dir)")
+    parser.add_argument("--max-first-watch", type=float, metavar="SECONDS",
+                        help="Fail if median time to first watch is longer")
+    parser.add_argument("-o", "--output", help="JSON file (stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two result files")
+    args = parser.parse_args(args)
+
+    if args.compare:
+        documents = []
+        for file_path in args.compare:
+            with open(file_path) as src:
+                documents.append(json.load(src))
+        print_comparison(compare(documents[0], documents[1], ["command"]))
+        return 0
+
+    import_timings, slowest = measure_imports(args.python, args.samples)
+    result = {
+        "command": "python -m testrunner",
+        "first_watch_s": summary(
+            measure_first_watch(args.python, args.samples, args.dir)),
+        "help_s": summary(measure_help(args.python, args.samples)),
+        "import_s": summary(import_timings),
+        "imports_self_s": slowest,
+    }
+
+    write_results("startup", [result], args.output)
+
+    first_watch_s = result["first_watch_s"]["p50"]
+    if args.max_first_watch is not None and \
+            first_watch_s > args.max_first_watch:
+        sys.stderr.write(
+            "Time to first watch {:.3f}s is over limit {:.3f}s\n".format(
+                first_watch_s, args.max_first_watch))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -0,0 +1,245 @@
+"""
+Watcher scaling and latency on synthetic source trees.
+
+For every tree (number of files and shape) measures:
+ - time and memory needed to set up watches (Config.update_watch)
+ - overhead of handling single event (FileChangeHandler)
+ - latency from file write to end of test run (task_done),
+   with trivial test command
+
+    python -m benchmarks.bench_watcher --sizes 1000 10000 -o new.json
+    python -m benchmarks.bench_watcher --compare old.json new.json
+"""
+import gc
+import json
+import logging
+import os
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from os import path
+from threading import Event
+from time import sleep, time
+
+import pyinotify
+
+from testrunner.configurator import Config
+from testrunner.watcher import FileChangeHandler
+
+from benchmarks.common import (
+    compare, print_comparison, rss_kb, summary, write_results
+)
+
+FILES_PER_DIR = 10
+DEEP_DEPTH = 20
+WAIT_TIMEOUT = 30
+
+LOCAL_CONFIG = """\
+QUIET_PERIOD = 0
+TEST_RUNNER = "true"
+TEST_RUNNER_OPTIONS = ""
+TESTS = ""
+STATE_DIR = {state_dir!r}
+"""
+
+
+def make_tree(root, files, shape):
+    """
+    Source tree with FILES_PER_DIR files per directory. Directories of
+    "wide" tree are all in root, "deep" tree has chains of DEEP_DEPTH
+    nested directories. Returns list of created files
+    """
+
+    created = []
+    dir_path = root
+    for idx in range(files // FILES_PER_DIR or 1):
+        if shape == "wide" or idx % DEEP_DEPTH == 0:
+            dir_path = path.join(root, "pkg{}".format(idx))
+        else:
+            dir_path = path.join(dir_path, "sub{}".format(idx))
+        os.mkdir(dir_path)
+
+        for file_idx in range(FILES_PER_DIR):
+            file_path = path.join(dir_path, "mod{}.py".format(file_idx))
+            with open(file_path, "w") as dst:
+                dst.write("X = {}\n".format(file_idx))
+            created.append(file_path)
+
+    return created
+
+
+class BenchHandler(FileChangeHandler):
+    """
+    Handler recording when test runs end, without notifications
+    """
+
+    def my_init(self, config):  # pylint: disable=arguments-differ
+        super(BenchHandler, self).my_init(config)
+        self.done = Event()
+
+    def task_done(self, callback_result):
+        super(BenchHandler, self).task_done(callback_result)
+        self.done.set()
+
+    def show_notification(self, result, info):
+        pass
+
+
+def wait_idle(handler, timeout=WAIT_TIMEOUT):
+    """
+    Wait for test runs triggered by trailing events to end
+    """
+
+    deadline = time() + timeout
+    while time() < deadline:
+        if not handler.coalescer.running and not handler.coalescer.pending:
+            return True
+        sleep(0.01)
+
+    return False
+
+
+def measure_setup(root, conf_file):
+    gc.collect()
+    rss_before = rss_kb()
+
+    started = time()
+    wmgr = pyinotify.WatchManager()
+    config = Config(watch_manager=wmgr,
+                    command_args=["-c", conf_file, "-d", root])
+    setup_time = time() - started
+
+    gc.collect()
+    return wmgr, config, {
+        "watch_setup_s": setup_time,
+        "watch_rss_kb": rss_kb() - rss_before,
+        "watches": len(wmgr.watches),
+    }
+
+
+def measure_latency(handler, files, samples):
+    """
+    Seconds from file write to end of test run it triggered
+    """
+
+    latencies = []
+    step = max(len(files) // samples, 1)
+    for idx, file_path in enumerate(files[::step][:samples]):
+        handler.done.clear()
+
+        started = time()
+        with open(file_path, "w") as dst:
+            dst.write("X = 'changed {}'\n".format(idx))
+
+        if not handler.done.wait(WAIT_TIMEOUT):
+            logging.warning("No test run for change of %s", file_path)
+            continue
+
+        latencies.append(time() - started)
+        wait_idle(handler)
+
+    return latencies
+
+
+def measure_events(handler, files, events):
+    """
+    Seconds spent handling single event, as it comes from notifier.
+    Changes are only collected, tests are not run
+    """
+
+    handler.coalescer.quiet_period = 3600
+    timings = []
+    for idx in range(events):
+        file_path = files[idx % len(files)]
+        event = pyinotify.Event({
+            "wd": 1,
+            "mask": pyinotify.IN_MODIFY,
+            "cookie": 0,
+            "path": path.dirname(file_path),
+            "name": path.basename(file_path),
+        })
+
+        started = time()
+        handler(event)
+        timings.append(time() - started)
+
+    handler.coalescer.cancel()
+    return timings
+
+
+def run_case(base_dir, files, shape, events, samples):
+    work_dir = tempfile.mkdtemp(prefix="bench-", dir=base_dir)
+    try:
+        root = path.join(work_dir, "src")
+        os.mkdir(root)
+        created = make_tree(root, files, shape)
+
+        conf_dir = path.join(work_dir, "conf")
+        os.mkdir(conf_dir)
+        conf_file = path.join(conf_dir, "bench_config.py")
+        with open(conf_file, "w") as dst:
+            dst.write(LOCAL_CONFIG.format(
+                state_dir=path.join(work_dir, "state")))
+
+        wmgr, config, result = measure_setup(root, conf_file)
+        result.update({"files": len(created), "shape": shape})
+
+        handler = BenchHandler(config=config)
+        notifier = pyinotify.ThreadedNotifier(wmgr, handler)
+        notifier.start()
+        try:
+            latencies = measure_latency(handler, created, samples)
+        finally:
+            notifier.stop()
+
+        timings = measure_events(handler, created, events)
+        handler._pool.terminate()  # pylint: disable=protected-access
+
+        result["latency_s"] = summary(latencies)
+        # Where latency goes, as seen by handler and runner
+        result["phases_s"] = handler.stats.summary()
+        result["event_s"] = summary(timings)
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        prog="bench_watcher", description="Watcher scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="Numbers of files in trees (ie. 1000 100000)")
+    parser.add_argument("--shapes", nargs="+", default=["wide", "deep"],
+                        choices=["wide", "deep"])
+    parser.add_argument("--events", type=int, default=1000,
+                        help="Events used to measure handler overhead")
+    parser.add_argument("--samples", type=int, default=20,
+                        help="File writes used to measure latency")
+    parser.add_argument("--dir", help="Where to create trees (tmp dir)")
+    parser.add_argument("-o", "--output", help="JSON file (stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two result files")
+    args = parser.parse_args(args)
+
+    if args.compare:
+        documents = []
+        for file_path in args.compare:
+            with open(file_path) as src:
+                documents.append(json.load(src))
+        print_comparison(compare(documents[0], documents[1],
+                                 ["shape", "files"]))
+        return
+
+    logging.getLogger("testrunner").setLevel(logging.WARNING)
+
+    results = []
+    for shape in args.shapes:
+        for files in args.sizes:
+            results.append(run_case(args.dir, files, shape,
+                                    args.events, args.samples))
+
+    write_results("watcher", results, args.output)
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,124 @@
+"""
+Helpers shared by benchmarks: statistics, memory and JSON results
+"""
+import json
+import os
+import platform
+import resource
+import sys
+from time import time
+
+
+def summary(samples):
+    """
+    Mean and percentiles (nearest rank) of samples
+    """
+
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+
+    def percentile(pct):
+        rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+        return ordered[rank]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / float(len(ordered)),
+        "min": ordered[0],
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "max": ordered[-1],
+    }
+
+
+def rss_kb():
+    """
+    Resident memory of current process in kB
+    """
+
+    try:
+        with open("/proc/self/statm") as src:
+            pages = int(src.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        # Peak, not current, usage on systems without procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return pages * resource.getpagesize() // 1024
+
+
+def environment():
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.sysconf("SC_NPROCESSORS_ONLN"),
+        "timestamp": time(),
+    }
+
+
+def write_results(name, results, output=None):
+    """
+    Dump results as JSON document to output file (stdout if not given)
+    """
+
+    document = {
+        "benchmark": name,
+        "environment": environment(),
+        "results": results,
+    }
+
+    if output is None:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+        return
+
+    with open(output, "w") as dst:
+        json.dump(document, dst, indent=2, sort_keys=True)
+
+
+def _metrics(result, prefix=""):
+    for name, value in sorted(result.items()):
+        if isinstance(value, dict):
+            for item in _metrics(value, prefix + name + "."):
+                yield item
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix + name, value
+
+
+def compare(baseline, current, keys):
+    """
+    Relative change of numeric metrics between two result documents.
+    Results are matched by values of keys (ie. tree shape and size)
+    """
+
+    def by_case(document):
+        return dict(
+            (tuple(result.get(key) for key in keys), result)
+            for result in document["results"]
+        )
+
+    old_cases = by_case(baseline)
+    changes = []
+    for case, result in sorted(by_case(current).items()):
+        old = old_cases.get(case)
+        if old is None:
+            continue
+
+        old_metrics = dict(_metrics(old))
+        for metric, value in _metrics(result):
+            old_value = old_metrics.get(metric)
+            if metric in keys or not old_value:
+                continue
+            changes.append((case, metric, old_value, value,
+                            (value - old_value) / float(old_value)))
+
+    return changes
+
+
+def print_comparison(changes, stream=sys.stdout):
+    for case, metric, old_value, value, change in changes:
+        stream.write("{:<24} {:<28} {:>12.6g} {:>12.6g} {:>+8.1%}\n".format(
+            "/".join(str(part) for part in case), metric,
+            old_value, value, change))
@@ -0,0 +1,215 @@
+"""
+Changes of python files by their syntax tree, used to skip runs for
+edits of comments, docstrings or formatting only.
+
+Fingerprint of module keeps digest of its interface (module level
+statements, names and signatures of functions and classes) and digest
+of body of each function and class (statements of class other than
+methods). Change is classified by comparing fingerprints:
+
+ - NOOP: same tree, ignoring docstrings
+ - BODY: only bodies of some functions or classes changed
+ - INTERFACE: anything else, or change is not known
+"""
+import ast
+import hashlib
+from collections import OrderedDict, namedtuple
+
+NOOP = "noop"
+BODY = "body"
+INTERFACE = "interface"
+
+AstChange = namedtuple("AstChange", "kind symbols")
+
+DEFINITIONS = tuple(
+    getattr(ast, name) for name in
+    ("FunctionDef", "AsyncFunctionDef", "ClassDef") if hasattr(ast, name)
+)
+
+
+def _digest(nodes):
+    digest = hashlib.sha1()
+    for node in nodes:
+        digest.update(ast.dump(node).encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def _without_docstring(body):
+    if body and isinstance(body[0], ast.Expr) and \
+            isinstance(body[0].value, ast.Str):
+        return body[1:]
+
+    return body
+
+
+def _signature(node):
+    """
+    Parts of definition other than its body
+    """
+
+    parts = list(node.decorator_list)
+    if isinstance(node, ast.ClassDef):
+        parts.extend(node.bases)
+        parts.extend(getattr(node, "keywords", None) or [])
+    else:
+        parts.append(node.args)
+        if getattr(node, "returns", None) is not None:
+            parts.append(node.returns)
+
+    return [ast.Str(node.name)] + parts
+
+
+def _add_definitions(body, prefix, interface, symbols):
+    """
+    Split statements of body into interface and symbols, returns
+    statements which are not definitions
+    """
+
+    statements = []
+    for node in _without_docstring(body):
+        if not isinstance(node, DEFINITIONS):
+            statements.append(node)
+            continue
+
+        name = prefix + node.name
+        interface.extend(_signature(node))
+        if isinstance(node, ast.ClassDef):
+            own = _add_definitions(node.body, name + ".", interface, symbols)
+        else:
+            own = _without_docstring(node.body)
+        symbols[name] = _digest(own)
+
+    return statements
+
+
+def _concrete_classes(body):
+    """
+    Names of module level classes no class of module derives from
+    """
+
+    classes = [node for node in body if isinstance(node, ast.ClassDef)]
+    bases = set(
+        base.id for node in classes for base in node.bases
+        if isinstance(base, ast.Name)
+    )
+    return frozenset(node.name for node in classes if node.name not in bases)
+
+
+def fingerprint(source):
+    """
+    Fingerprint of module source, None if it is not valid python.
+    Classes which can be test cases (see symbol_test_id) come along
+    """
+
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, TypeError, ValueError):
+        return None
+
+    interface = []
+    symbols = {}
+    statements = _add_definitions(tree.body, "", interface, symbols)
+
+    return (_digest(statements + interface), symbols,
+            _concrete_classes(tree.body))
+
+
+def classify(old, new):
+    """
+    AstChange between two fingerprints, symbols are names of changed
+    functions and classes (None unless kind is BODY)
+    """
+
+    if old is None or new is None or old[0] != new[0]:
+        return AstChange(INTERFACE, None)
+
+    symbols = sorted(
+        name for name, digest in new[1].items() if old[1].get(name) != digest
+    )
+    if not symbols:
+        return AstChange(NOOP, None)
+
+    return AstChange(BODY, symbols)
+
+
+class FingerprintCache(object):
+    """
+    LRU cache path -> fingerprint of python file, bounded to max_size
+    entries. Change of file not seen before is not known (INTERFACE)
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_path):
+        return file_path in self._entries
+
+    def change(self, file_path):
+        """
+        Change of file since it was seen last time, remembers
+        current content
+        """
+
+        try:
+            with open(file_path, "rb") as src:
+                current = fingerprint(src.read())
+        except (IOError, OSError):
+            current = None
+
+        known = self._entries.pop(file_path, None)
+        if current is not None:
+            self._entries[file_path] = current
+            while len(self._entries) > max(self.max_size, 0):
+                self._entries.popitem(last=False)
+
+        return classify(known, current)
+
+    def test_classes(self, file_path):
+        """
+        Classes of file seen last time which can be test cases,
+        None if it is not known
+        """
+
+        known = self._entries.get(file_path)
+        return known[2] if known is not None else None
+
+    def changes(self, paths):
+        """
+        Path -> AstChange for python files among paths
+        """
+
+        return dict(
+            (file_path, self.change(file_path))
+            for file_path in paths if file_path.endswith(".py")
+        )
+
+
+def symbol_test_id(kind, name, symbol, classes):
+    """
+    Id of test function symbol of test module name (path for pytest),
+    as understood by test runner kind. None if symbol is not a test or
+    it is method of class other than classes (test cases of module):
+    tests of base classes and mixins run in their subclasses
+    """
+
+    parts = symbol.split(".")
+    if not parts[-1].startswith("test") or len(parts) > 2:
+        return None
+    if len(parts) == 2 and (classes is None or parts[0] not in classes):
+        return None
+
+    if kind == "pytest":
+        return "::".join([name] + parts)
+    if kind == "nose":
+        return "{}:{}".format(name, symbol)
+    if len(parts) < 2:
+        # Only methods of test cases are tests of unittest
+        return None
+
+    return "{}.{}".format(name, symbol)
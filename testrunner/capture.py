@@ -0,0 +1,142 @@
+"""
+Output of test processes in bounded memory.
+
+Last max_memory characters of output are kept in memory. Once output is
+longer, whole of it goes to temp file too, which is kept for inspection
+until next run of project (see Runner.discard_output)
+"""
+import logging
+import os
+import tempfile
+from collections import deque
+
+_log = logging.getLogger(__name__)
+
+
+class OutputCapture(object):
+    """
+    File like object keeping tail of output in memory,
+    spilling whole output to temp file when tail is not all of it
+    """
+
+    def __init__(self, max_memory=1 << 20, spill_dir=None):
+        self.max_memory = max(max_memory, 1)
+        self.spill_dir = spill_dir
+        # Characters written
+        self.size = 0
+        # Temp file with whole output, once it is spilled
+        self.file_path = None
+
+        self._chunks = deque()
+        self._kept = 0
+        self._file = None
+        self._spill_failed = False
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def truncated(self):
+        """
+        Part of output is not in memory
+        """
+
+        return self.size > self._kept
+
+    def write(self, data):
+        if not data:
+            return
+
+        self.size += len(data)
+        if self._file is None and not self._spill_failed and \
+                self._kept + len(data) > self.max_memory:
+            self._spill()
+
+        if self._file is not None:
+            self._file.write(data.encode("utf-8"))
+
+        self._chunks.append(data)
+        self._kept += len(data)
+        self._trim()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def _spill(self):
+        try:
+            fd, self.file_path = tempfile.mkstemp(
+                prefix="testrunner-", suffix=".log", dir=self.spill_dir)
+            self._file = os.fdopen(fd, "wb")
+            for chunk in self._chunks:
+                self._file.write(chunk.encode("utf-8"))
+        except (IOError, OSError) as err:
+            _log.warning("Can not keep whole output of tests: %s", err)
+            self._spill_failed = True
+            self.file_path = self._file = None
+
+    def _trim(self):
+        excess = self._kept - self.max_memory
+        while excess > 0:
+            chunk = self._chunks.popleft()
+            if len(chunk) > excess:
+                self._chunks.appendleft(chunk[excess:])
+                self._kept -= excess
+                break
+
+            self._kept -= len(chunk)
+            excess -= len(chunk)
+
+    def tail(self, size=None):
+        """
+        Last size characters of output (all kept in memory if not given)
+        """
+
+        if size is None:
+            return u"".join(self._chunks)
+
+        parts = []
+        for chunk in reversed(self._chunks):
+            if size <= 0:
+                break
+            parts.append(chunk[-size:])
+            size -= len(chunk)
+
+        return u"".join(reversed(parts))
+
+    def summary(self, tracebacks=()):
+        """
+        Output to report: whole of it if it is in memory, otherwise
+        tracebacks of failed tests and tail of output
+        """
+
+        if not self.truncated:
+            return self.tail()
+
+        omitted = self.size - self._kept
+        if self.file_path is not None:
+            note = u"[{} characters of output omitted, whole output " \
+                   u"in {}]".format(omitted, self.file_path)
+        else:
+            note = u"[{} characters of output omitted]".format(omitted)
+
+        failures = u"\n".join(tracebacks)[:self.max_memory]
+        return u"\n".join(filter(None, [failures, note, self.tail()]))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """
+        Remove temp file with whole output
+        """
+
+        self.close()
+        if self.file_path is not None:
+            try:
+                os.remove(self.file_path)
+            except OSError:
+                pass
+            self.file_path = None
@@ -0,0 +1,161 @@
+"""
+Batching file system events into test runs
+"""
+import logging
+from threading import Lock, Timer
+from time import time
+
+_log = logging.getLogger(__name__)
+
+
+class ChangeBatch(object):
+    """
+    Paths changed between two test runs
+    """
+
+    def __init__(self):
+        self.paths = set()
+        self.events = 0
+        self.first_event = None
+        self.last_event = None
+        # Paths of cancelled run, their content was seen already
+        self.retried = set()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __nonzero__(self):
+        return self.events > 0
+
+    __bool__ = __nonzero__
+
+    def add(self, pathname, timestamp=None):
+        timestamp = timestamp or time()
+
+        self.paths.add(pathname)
+        self.events += 1
+        self.last_event = timestamp
+        if self.first_event is None:
+            self.first_event = timestamp
+
+    def retry(self, batch):
+        """
+        Take over paths of batch which run was cancelled
+        """
+
+        self.paths.update(batch.paths)
+        self.retried.update(batch.paths)
+        self.events += batch.events
+        if batch.first_event is not None:
+            self.first_event = min(
+                self.first_event or batch.first_event, batch.first_event)
+        self.last_event = self.last_event or batch.last_event
+
+
+class EventCoalescer(object):
+    """
+    Collects changed paths until no event comes for quiet_period seconds,
+    then hands whole batch to callback.
+
+    Only one batch is handled at a time. Callback returns True when it
+    started a run, changes coming in meantime wait until release().
+
+    timer creates threading.Timer like objects (ie. run by event loop)
+    """
+
+    def __init__(self, callback, quiet_period=0, timer=None):
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.timer = timer
+
+        self._lock = Lock()
+        self._batch = ChangeBatch()
+        self._timer = None
+        self._running = False
+
+    @property
+    def pending(self):
+        return self._batch
+
+    @property
+    def running(self):
+        return self._running
+
+    def add(self, pathname):
+        with self._lock:
+            self._batch.add(pathname)
+            running = self._running
+
+        if not running:
+            self._schedule()
+
+    def _schedule(self):
+        if not self.quiet_period or self.quiet_period <= 0:
+            self.flush()
+            return
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+
+            self._timer = (self.timer or Timer)(self.quiet_period, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if self._running or not self._batch:
+                return
+
+            batch, self._batch = self._batch, ChangeBatch()
+            self._running = True
+
+        _log.debug("Flushing %d paths from %d events",
+                   len(batch), batch.events)
+
+        if not self.callback(batch):
+            self.release()
+
+    def retry(self, batch):
+        """
+        Hand batch of cancelled run over again, with changes collected
+        in meantime
+        """
+
+        with self._lock:
+            self._batch.retry(batch)
+
+    def acquire(self):
+        """
+        Mark run started outside of flush (ie. test suite) as running,
+        returns False when other run is in progress
+        """
+
+        with self._lock:
+            if self._running:
+                return False
+
+            self._running = True
+            return True
+
+    def release(self):
+        """
+        Run is done, handle changes collected in meantime
+        """
+
+        with self._lock:
+            self._running = False
+            pending = bool(self._batch)
+
+        if pending:
+            self._schedule()
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
@@ -1,5 +1,5 @@
 import logging
-import logging.config
+import sys
 from time import time
 import imp
 from os import path
@@ -8,10 +8,90 @@ from argparse import ArgumentParser
 import pyinotify
 
 from testrunner import default_config
+from testrunner.filters import PathFilter
+from testrunner.lazy import LazyModule
+from testrunner.poller import DirPoller
 
-logging.config.dictConfig(default_config.LOGGING)
 _log = logging.getLogger(__name__)
 
+linecoverage = LazyModule("testrunner.linecoverage")
+logging_config = LazyModule("logging.config")
+parsers = LazyModule("testrunner.parsers")
+tracer = LazyModule("testrunner.tracer")
+
+
+# Options of test runners to stop on first failing test
+FAIL_FAST_OPTIONS = {
+    "unittest": "--failfast",
+    "nose": "--stop",
+    "pytest": "-x",
+}
+
+
+def setup_logging():
+    """
+    Logging as in default config, done when watching starts
+    (importing testrunner leaves logging alone)
+    """
+
+    logging_config.dictConfig(default_config.LOGGING)
+
+
+def watch_path(pathname):
+    """
+    Path as it is stored by pyinotify watch manager
+    """
+
+    if isinstance(pathname, unicode):
+        pathname = pathname.encode(sys.getfilesystemencoding())
+
+    return path.normpath(pathname)
+
+
+def command_line_parser():
+    parser = ArgumentParser(
+        prog="testrunner", description="Automatic test runner for TDD")
+    parser.add_argument("-r", help="Test runner", dest="runner")
+    parser.add_argument("-c", help="Config file", dest="config")
+    parser.add_argument("-d", help="Dir/file to watch", dest="dir")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not use cached test results")
+    parser.add_argument("--project", action="append", dest="projects",
+                        metavar="DIR[:CONFIG]",
+                        help="Watch several projects in one process "
+                             "(repeat for each project)")
+    parser.add_argument("--max-runs", type=int, default=1,
+                        help="Test runs at once for all projects")
+    parser.add_argument("test", nargs="*", help="Tests to run")
+    return parser
+
+
+def parse_projects(command_args=None):
+    """
+    Projects given on command line (multi-project mode) and limit of
+    test runs at once. No projects means single project mode
+    """
+
+    args = command_line_parser().parse_args(args=command_args)
+    if not args.projects:
+        return [], args.max_runs
+
+    if args.dir or args.config:
+        raise ValueError("Dir and config are given by --project")
+
+    projects = [ProjectConfig.parse(spec) for spec in args.projects]
+    roots = sorted(
+        path.join(path.abspath(project.WATCH_DIR), "")
+        for project in projects
+    )
+    for root, next_root in zip(roots, roots[1:]):
+        # Shared watch manager has single watch per dir
+        if next_root.startswith(root):
+            raise ValueError("Projects {!r} and {!r} overlap".format(
+                root, next_root))
+
+    return projects, args.max_runs
+
 
 class CommandLineConfig(object):  # pylint: disable=too-few-public-methods
     """
@@ -20,38 +100,78 @@ class CommandLineConfig(object):  # pylint: disable=too-few-public-methods
     pass
 
 
+class ProjectConfig(object):  # pylint: disable=too-few-public-methods
+    """
+    Defaults of single project in multi-project mode, its files
+    are in its dir
+    """
+
+    # pylint: disable=invalid-name
+    def __init__(self, watch_dir, config_file=None):
+        self.name = path.basename(path.abspath(watch_dir))
+        self.WATCH_DIR = watch_dir
+        self.CONFIG = config_file or path.join(
+            watch_dir, default_config.CONFIG)
+        self.STATE_DIR = path.join(watch_dir, default_config.STATE_DIR)
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Project from DIR[:CONFIG]
+        """
+
+        watch_dir, _, config_file = spec.partition(":")
+        return cls(watch_dir, config_file or None)
+
+
 class Config(object):
     CONF_DEFAULT = 1
     CONF_LOCAL = 2
     CONF_COMMAND_LINE = 3
 
+    RUNNER_OPTIONS = (
+        "RUNNER_MODE",
+        "PRELOAD_MODULES",
+        "STATE_DIR",
+        "FAIL_FAST",
+        "RESULT_PARSER",
+        "OUTPUT_MEMORY",
+        "SUITE_WORKERS",
+        "SUITE_WORKER_TIMEOUT",
+        "WATCH_DIR",
+        "EXCLUDE_FILTER",
+        "GITIGNORE",
+    )
+
+    config = None
+    command_line = None
     filter_test = None
+    # Dirs which inotify can not watch
+    poller = None
+    # Defaults of project in multi-project mode
+    project = None
 
-    def __init__(self, watch_manager, command_args=None):
+    def __init__(self, watch_manager, command_args=None, project=None):
         assert isinstance(watch_manager, pyinotify.WatchManager)
 
         self.config = None
         self.command_line = None
+        self.project = project
 
         self.config_loaded_at = None
         self.watcher_added_at = None
 
         self.watch_manager = watch_manager
-        self.watch_descriptors = None
+        self.watch_settings = None
+        self.conf_watch = None
+        self.poller = DirPoller(exclude_filter=self.filter_wrapper)
 
         self.parse_command_line(command_args)
         self.load_config()
         self.update_watch()
 
     def parse_command_line(self, command_args=None):
-        parser = ArgumentParser(
-            prog="testrunner", description="Automatic test runner for TDD")
-        parser.add_argument("-r", help="Test runner", dest="runner")
-        parser.add_argument("-c", help="Config file", dest="config")
-        parser.add_argument("-d", help="Dir/file to watch", dest="dir")
-        parser.add_argument("test", nargs="*", help="Tests to run")
-
-        args = parser.parse_args(args=command_args)
+        args = command_line_parser().parse_args(args=command_args)
         self.command_line = CommandLineConfig()
 
         parser_mapping = (
@@ -68,6 +188,9 @@ class Config(object):
 
             setattr(self.command_line, conf_name, cmd_val)
 
+        if getattr(args, "no_cache", False):
+            self.command_line.RESULT_CACHE = False
+
         self.config_loaded_at = int(time())
 
     def load_config(self):
@@ -92,16 +215,28 @@ class Config(object):
 
             module_path = path.dirname(config_file)
             module_info = imp.find_module(module_name, [module_path])
-            self.config = imp.load_module("local_config", *module_info)
+            self.config = imp.load_module(self.module_name(), *module_info)
             _log.info("Config reloaded")
 
         self.config_loaded_at = int(time())
         self.update_watch()
 
+    def module_name(self):
+        """
+        Name of local config module, imp reloads module of the same name
+        so configs of projects need their own
+        """
+
+        if self.project is None:
+            return "local_config"
+
+        return "local_config_{:x}".format(id(self))
+
     def get_value(self, name, source=False):
         order = (
             (self.command_line, self.CONF_COMMAND_LINE),
             (self.config, self.CONF_LOCAL),
+            (self.project, self.CONF_DEFAULT),
             (default_config, self.CONF_DEFAULT),
         )
 
@@ -121,7 +256,22 @@ class Config(object):
     def get_values(self, names, source=False):
         return [self.get_value(name, source) for name in names]
 
-    def tests_command(self, suite=False):
+    def runner_options(self):
+        """
+        Plain values of options used by Runner (it is sent to other process)
+        """
+
+        return dict(zip(self.RUNNER_OPTIONS,
+                        self.get_values(self.RUNNER_OPTIONS)))
+
+    def tests_command(self, suite=False, tests=None, fail_fast=False,
+                      exclude=()):
+        """
+        Command to run configured tests, explicit list of tests
+        replaces configured ones. Runner stops on first failure with
+        fail_fast, excluded test ids are left out by pytest only
+        """
+
         params = ["TEST_RUNNER", "TEST_RUNNER_OPTIONS"]
 
         if not suite:
@@ -131,19 +281,65 @@ class Config(object):
 
         conf_values = self.get_values(params)
 
+        if tests is not None:
+            conf_values[-1] = list(tests)
+
         if conf_values[0] is None or conf_values[-1] is None:
             return None
 
+        kind = None
+        if fail_fast or exclude:
+            kind = self.runner_kind(" ".join(filter(None, conf_values[:2])))
+        if fail_fast:
+            conf_values.insert(-1, FAIL_FAST_OPTIONS[kind])
+
         if isinstance(conf_values[-1], list):
             tests = conf_values.pop()
             conf_values.extend(tests)
 
+        if kind == "pytest":
+            conf_values.extend(
+                "--deselect {}".format(test_id) for test_id in exclude)
+
         conf_values = filter(None, conf_values)
 
         test_cmd = " ".join(conf_values)
+        if self.get_value("COVERAGE_SELECT"):
+            test_cmd = self.traced_command(test_cmd, suite)
+
         _log.debug("Command to run: %s", test_cmd)
         return test_cmd
 
+    def runner_kind(self, test_cmd=None):
+        """
+        Test runner used (key of parsers.PARSERS), guessed from command
+        if it is not configured
+        """
+
+        if test_cmd is None:
+            test_cmd = " ".join(filter(None, self.get_values(
+                ["TEST_RUNNER", "TEST_RUNNER_OPTIONS"])))
+
+        return self.get_value("RESULT_PARSER") or parsers.guess_kind(test_cmd)
+
+    def traced_command(self, test_cmd, suite=False):
+        """
+        Test command recording lines run by each test (see tracer)
+        """
+
+        traced = tracer.traced_command(
+            test_cmd, linecoverage.coverage_dir(self.get_value("STATE_DIR")),
+            self.get_value("WATCH_DIR"),
+            kind=self.runner_kind(test_cmd),
+            suite=suite)
+
+        if traced is None:
+            _log.warning("Coverage of tests can not be recorded, "
+                         "not python command: %s", test_cmd)
+            return test_cmd
+
+        return traced
+
     def update_watch(self):
         if self.watcher_added_at >= self.config_loaded_at:
             _log.debug("Watcher up to date with config")
@@ -153,6 +349,7 @@ class Config(object):
         exclude = self.get_value("EVENTS_EXCLUDE")
         watch = self.get_value("WATCH_DIR")
         exclude_filter = self.get_value("EXCLUDE_FILTER")
+        gitignore = self.get_value("GITIGNORE")
         conf_name = self.get_value("CONFIG")
 
         _log.debug("Dir to watch: %s", watch)
@@ -166,25 +363,139 @@ class Config(object):
 
         mask = include & ~exclude
 
-        for descriptor in self.watch_descriptors or ():
-            self.watch_manager.rm_watch(descriptor.values(),
-                                        rec=True)
+        if isinstance(exclude_filter, (list, tuple)):
+            exclude_filter = list(exclude_filter)
 
-        if exclude_filter:
-            self.filter_test = pyinotify.ExcludeFilter(exclude_filter)
+        settings = (watch, mask, exclude_filter, gitignore)
+        if settings != self.watch_settings:
+            self.update_dirs_watch(watch, mask, exclude_filter, gitignore)
+            self.watch_settings = settings
         else:
-            self.filter_test = None
+            _log.debug("Watched dirs up to date with config")
 
-        src_wd = self.watch_manager.add_watch(
-            path=watch, mask=mask, auto_add=True,
-            rec=True, exclude_filter=self.filter_wrapper)
-
-        conf_wd = self.watch_manager.add_watch(path=conf_name, mask=mask)
+        self.update_conf_watch(conf_name, mask)
 
         self.watcher_added_at = int(time())
-        self.watch_descriptors = (src_wd, conf_wd)
         _log.info("Watcher updated")
 
+    def update_dirs_watch(self, watch, mask, exclude_filter, gitignore):
+        """
+        Make watched dirs match config. Only watches which differ are
+        added, removed or updated, the rest is kept as it is
+        """
+
+        if exclude_filter or gitignore:
+            self.filter_test = PathFilter(
+                exclude_filter, root=watch if gitignore else None)
+            path_filter = self.filter_test
+        else:
+            self.filter_test = None
+            path_filter = PathFilter()
+
+        # Excluded dirs are not crawled at all, new dirs are
+        # checked by pyinotify when they are created (auto_add)
+        desired = set(watch_path(dir_path)
+                      for dir_path in path_filter.watch_dirs(watch))
+
+        conf_wd = self.conf_watch[2] if self.conf_watch else None
+        current = dict(
+            (watch_obj.path, wd)
+            for wd, watch_obj in self.watch_manager.watches.items()
+            if wd != conf_wd and self.owns_watch(watch_obj)
+        )
+        polled = self.poller.dirs if self.poller is not None else set()
+
+        removed = [wd for dir_path, wd in current.items()
+                   if dir_path not in desired]
+        kept = [wd for dir_path, wd in current.items() if dir_path in desired]
+        added = sorted(desired.difference(current).difference(polled))
+
+        if removed:
+            self.watch_manager.rm_watch(removed)
+
+        if self.poller is not None:
+            self.poller.mask = mask
+            self.poller.remove(polled.difference(desired))
+
+        if kept and self.watch_settings and self.watch_settings[1] != mask:
+            # auto_add needs IN_CREATE, add_watch adds it too
+            self.watch_manager.update_watch(
+                kept, mask=mask | pyinotify.IN_CREATE)
+
+        if added:
+            wds = self.watch_manager.add_watch(
+                path=added, mask=mask, auto_add=True,
+                rec=False, exclude_filter=self.filter_wrapper)
+            self.poll_unwatched(
+                [dir_path for dir_path, wd in wds.items() if wd < 0])
+
+        _log.debug("Watches added: %d, removed: %d, kept: %d, polled: %d",
+                   len(added), len(removed), len(kept),
+                   len(self.poller) if self.poller is not None else 0)
+
+    def owns_watch(self, watch_obj):
+        """
+        Watch belongs to this config, watch manager may be shared
+        by projects. Watches added by auto_add inherit exclude filter
+        """
+
+        if self.conf_watch is not None and watch_obj.wd == self.conf_watch[2]:
+            return True
+
+        return getattr(watch_obj.exclude_filter, "__self__", None) is self
+
+    def poll_unwatched(self, dirs):
+        """
+        Dirs inotify could not watch are polled instead
+        """
+
+        if not dirs or self.poller is None:
+            return
+
+        _log.warning("Can not watch %d dirs (fs.inotify.max_user_watches "
+                     "reached?), polling them", len(dirs))
+        self.poller.add(dirs)
+
+    def check_created_dir(self, dir_path):
+        """
+        Poll new dir if inotify could not watch it when it was created,
+        read .gitignore files it came with
+        """
+
+        dir_path = watch_path(dir_path)
+        if self.filter_wrapper(dir_path):
+            return
+
+        # Directory could come with .gitignore files (ie. moved in)
+        if self.filter_test is not None:
+            self.filter_test.watch_dirs(dir_path)
+
+        if self.poller is None or dir_path in self.poller:
+            return
+
+        if self.watch_manager.get_wd(dir_path) is None:
+            self.poll_unwatched([dir_path])
+
+    def update_conf_watch(self, conf_name, mask):
+        """
+        Config file is watched on its own. Watch is replaced when file
+        or mask changed or when it is gone (ie. file was replaced)
+        """
+
+        conf_path = watch_path(conf_name)
+        watches = self.watch_manager.watches
+
+        if self.conf_watch is not None:
+            old_path, old_mask, old_wd = self.conf_watch
+            if old_wd in watches and (old_path, old_mask) == (conf_path, mask):
+                return
+
+            if old_wd in watches:
+                self.watch_manager.rm_watch(old_wd)
+
+        conf_wd = self.watch_manager.add_watch(path=conf_name, mask=mask)
+        self.conf_watch = (conf_path, mask, conf_wd.get(conf_name))
+
     def config_file(self):
         """
         Returns location of local config
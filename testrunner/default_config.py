@@ -10,6 +10,7 @@ from pyinotify import (  # pylint: disable=E0611
 # Global
 LOG_LEVEL = "INFO"
 CONFIG = "config.py"  # name of local config file
+STATE_DIR = ".testrunner"  # state kept between runs (ie. test outcomes)
 
 # Watcher
 WATCH_DIR = "."
@@ -18,6 +19,8 @@ EXCLUDE_FILTER = [
     r'.*/\.',
     r'.*\.pyc$',
 ]
+# Do not watch paths ignored by .gitignore files in WATCH_DIR
+GITIGNORE = True
 EVENTS_INCLUDE = ALL_EVENTS
 EVENTS_EXCLUDE = [
     IN_ACCESS,
@@ -27,6 +30,24 @@ EVENTS_EXCLUDE = [
     IN_CLOSE_NOWRITE,
 ]
 RUNNER_DELAY = 2
+# Changes are collected until there is no event for QUIET_PERIOD seconds
+QUIET_PERIOD = 0.1
+# Cancel test run in progress when files change, run tests again
+PREEMPT_RUNS = False
+# Run TEST_SUITE as separate, low priority run: only when tests of
+# latest change passed and files did not change for SUITE_QUIET_PERIOD
+# seconds. Changes cancel suite in progress, it runs again later
+DEFER_SUITE = False
+SUITE_QUIET_PERIOD = 2.0
+# Do not run tests when content of changed files is the same as last time
+SKIP_UNCHANGED = True
+HASH_CACHE_SIZE = 10000
+# Do not run tests when only comments, docstrings or formatting of python
+# files changed (doctests are not run for them). When only test functions
+# of test modules changed and tests are selected (SELECT_TESTS or
+# COVERAGE_SELECT), only they run: their ids replace TESTS, so
+# TEST_RUNNER_OPTIONS has to accept them (ie. no "discover")
+SKIP_NOOP_EDITS = False
 
 # Test runner
 TEST_RUNNER = "python -m unittest"
@@ -35,6 +56,78 @@ TESTS = ""
 TESTS_OPTIONS = ""
 TEST_SUITE = None
 TEST_SUITE_OPTIONS = ""
+# Format of test output: "unittest", "nose", "pytest" or None (guess from
+# command). Results of single tests are known only for verbose output (-v)
+RESULT_PARSER = None
+# Characters of output of test process kept in memory. Longer output is
+# kept whole in temp file until next run, tracebacks of failed tests and
+# tail of output are reported
+OUTPUT_MEMORY = 1 << 20
+
+# "spawn" - new process per run, "fork" - fork runs from long living process
+# with PRELOAD_MODULES imported (only "python -m/-c/script" commands,
+# others are spawned)
+RUNNER_MODE = "spawn"
+PRELOAD_MODULES = []
+
+# "pool" - tests run by pool worker process, file events are read by
+# notifier thread. "loop" - single asyncore loop watches files and runs
+# test processes (no RUNNER_MODE "fork", debugger prompts are not
+# interactive)
+ENGINE = "pool"
+
+# Test selection and sharding
+# Tests found by testrunner replace TESTS / TEST_SUITE, so
+# TEST_RUNNER_OPTIONS has to accept them (ie. no "discover").
+# TEST_NAMES: "module" - pass dotted module names (unittest, nose),
+# "path" - pass file paths (py.test)
+TEST_NAMES = "module"
+TEST_MODULE_PATTERN = "test*.py"
+# Run only test modules depending (by imports) on changed files
+SELECT_TESTS = False
+# Run only tests which run changed lines, known from line coverage of
+# each test recorded (in STATE_DIR) when suite runs. Changes not covered
+# by it (ie. new files, code run on import) are selected as without it.
+# Tests run slower (traced), TEST_RUNNER has to be python command
+COVERAGE_SELECT = False
+# Keep dependency index and hashes of files in STATE_DIR, on start
+# only files changed since (by size and mtime) are parsed again
+INDEX_SNAPSHOT = True
+# Split suite into SUITE_SHARDS run in parallel (None - number of CPUs)
+SHARD_SUITE = False
+SUITE_SHARDS = None
+# Balance shards by durations of test modules recorded in STATE_DIR
+# (slowest first), otherwise tests are split round robin
+SHARD_BY_DURATION = True
+# Run shards (SHARD_SUITE) on worker daemons ("host:port" each) started
+# on other machines (or locally) by: python -m testrunner.worker --dir DIR.
+# Workers get files of WATCH_DIR which they do not have, shard of worker
+# which does not answer for SUITE_WORKER_TIMEOUT seconds goes to other one
+SUITE_WORKERS = []
+SUITE_WORKER_TIMEOUT = 30
+
+# Run tests which failed last time first (test ids are passed to
+# TEST_RUNNER_OPTIONS, like selected tests), only ones of selected test
+# modules. With FAIL_FAST runner stops on first of them which still
+# fails (configurator.FAIL_FAST_OPTIONS), remaining tests do not run
+FAILURE_FIRST = False
+FAIL_FAST = False
+
+# Skip selected test modules which passed before with the same code
+# (module and modules it imports, directly or not), test command and
+# RESULT_CACHE_DATA files (glob patterns in WATCH_DIR).
+# Works with SELECT_TESTS, --no-cache disables it
+RESULT_CACHE = False
+RESULT_CACHE_SIZE = 1000
+RESULT_CACHE_DATA = []
+
+# Timings of runs (debounce, spawn, startup, stages), percentiles are
+# computed over METRICS_WINDOW recent runs. METRICS_LOG - JSON lines file,
+# METRICS_PORT - serve them for Prometheus on localhost (ie. 9477),
+# projects with the same port share it (stats have project label)
+METRICS_WINDOW = 100
+METRICS_LOG = None
+METRICS_PORT = None
 
 LOGGING = {
     'version': 1,
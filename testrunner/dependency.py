@@ -0,0 +1,341 @@
+"""
+Import graph of python modules in watched directory
+"""
+import ast
+import logging
+import os
+from collections import defaultdict
+from fnmatch import fnmatch
+from os import path
+
+_log = logging.getLogger(__name__)
+
+
+def module_name(root, file_path):
+    """
+    Dotted module name of a file relative to root, None for non-python files
+    """
+
+    if not file_path.endswith(".py"):
+        return None
+
+    rel_path = path.relpath(path.abspath(file_path), root)
+    if rel_path.startswith(os.pardir):
+        return None
+
+    parts = rel_path[:-3].split(os.sep)
+    if parts[-1] == "__init__":
+        parts.pop()
+
+    return ".".join(parts) or None
+
+
+def parse_imports(source, name, is_package=False):
+    """
+    Names of all modules that could be imported by module source.
+
+    Every candidate is returned (including parent packages and implicit
+    relative imports), so graph errs on the side of selecting too much.
+    """
+
+    tree = ast.parse(source)
+    package = name if is_package else name.rpartition(".")[0]
+    imported = set()
+
+    def add(full_name):
+        parts = full_name.split(".")
+        for idx in range(1, len(parts) + 1):
+            imported.add(".".join(parts[:idx]))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                add(alias.name)
+                if package:
+                    add("{}.{}".format(package, alias.name))
+
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package.split(".") if package else []
+                base = base[:len(base) - node.level + 1]
+                if node.module:
+                    base.append(node.module)
+                base = ".".join(base)
+            else:
+                base = node.module or ""
+                if package:
+                    add("{}.{}".format(package, base))
+
+            if base:
+                add(base)
+
+            for alias in node.names:
+                if alias.name != "*":
+                    add("{}.{}".format(base, alias.name).lstrip("."))
+
+    imported.discard(name)
+    return imported
+
+
+def python_files(top, exclude_filter=None):
+    """
+    Paths of python files in top, skipping excluded dirs and files
+    """
+
+    for dir_path, dir_names, file_names in os.walk(top):
+        if exclude_filter is not None:
+            dir_names[:] = [
+                name for name in dir_names
+                if not exclude_filter(path.join(dir_path, name))
+            ]
+
+        for name in file_names:
+            file_path = path.join(dir_path, name)
+            if not name.endswith(".py"):
+                continue
+            if exclude_filter is None or not exclude_filter(file_path):
+                yield file_path
+
+
+def file_stat(file_path):
+    """
+    (size, mtime) of file, None if it does not exist
+    """
+
+    try:
+        stat_info = os.stat(file_path)
+    except OSError:
+        return None
+
+    return stat_info.st_size, stat_info.st_mtime
+
+
+def find_test_files(root, test_pattern="test*.py", exclude_filter=None):
+    """
+    Paths of test modules in root, without parsing them
+    """
+
+    return sorted(
+        file_path
+        for file_path in python_files(path.abspath(root), exclude_filter)
+        if fnmatch(path.basename(file_path), test_pattern)
+    )
+
+
+class DependencyIndex(object):
+    """
+    Module -> modules that import it, built by parsing sources
+    """
+
+    # Modules parsed or removed, tells when snapshot is outdated
+    changes = 0
+
+    def __init__(self, root, test_pattern="test*.py", exclude_filter=None):
+        self.root = path.abspath(root)
+        self.test_pattern = test_pattern
+        self.exclude_filter = exclude_filter
+
+        self._files = {}
+        self._imports = {}
+        self._importers = defaultdict(set)
+        # Module -> (size, mtime) of file when it was parsed
+        self._stats = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def _excluded(self, file_path):
+        return self.exclude_filter is not None and \
+            self.exclude_filter(file_path)
+
+    def build(self, snapshot=None):
+        """
+        Parse python files in root. Files of snapshot (see snapshot)
+        which size and mtime did not change are not parsed again
+        """
+
+        known = {}
+        if snapshot is not None and snapshot.get("root") == self.root:
+            known = snapshot.get("files", {})
+
+        parsed = 0
+        for file_path in python_files(self.root, self.exclude_filter):
+            entry = known.get(path.relpath(file_path, self.root))
+            if entry is not None and \
+                    file_stat(file_path) == tuple(entry[:2]):
+                self._restore(file_path, entry)
+            else:
+                self._add(file_path)
+                parsed += 1
+
+        _log.info("Dependency index built: %d modules (%d parsed)",
+                  len(self), parsed)
+
+    def snapshot(self):
+        """
+        Plain (JSON) state of index: (size, mtime, imports) of parsed
+        files by path relative to root
+        """
+
+        files = {}
+        for name, file_path in self._files.items():
+            if name in self._stats:
+                files[path.relpath(file_path, self.root)] = list(
+                    self._stats[name]) + [sorted(self._imports[name])]
+
+        return {"root": self.root, "files": files}
+
+    def _restore(self, file_path, entry):
+        name = module_name(self.root, file_path)
+        if name is None:
+            return
+
+        size, mtime, imports = entry
+        self._set_imports(name, set(imports))
+        self._files[name] = file_path
+        self._stats[name] = (size, mtime)
+
+    def _add(self, file_path):
+        name = module_name(self.root, file_path)
+        if name is None:
+            return None
+
+        self.changes += 1
+        # Taken before reading, file changed in meantime is parsed again
+        file_stats = file_stat(file_path)
+        try:
+            with open(file_path) as src:
+                source = src.read()
+            imports = parse_imports(
+                source, name, path.basename(file_path) == "__init__.py")
+        except (IOError, SyntaxError, TypeError, ValueError) as err:
+            # Keep edges known so far, file may be saved half way through
+            _log.debug("Can not parse %s: %s", file_path, err)
+            imports = self._imports.get(name, set())
+            file_stats = None
+
+        self._set_imports(name, imports)
+        self._files[name] = file_path
+        if file_stats is not None:
+            self._stats[name] = file_stats
+        else:
+            self._stats.pop(name, None)
+        return name
+
+    def _remove(self, name):
+        self.changes += 1
+        self._set_imports(name, set())
+        self._imports.pop(name, None)
+        self._files.pop(name, None)
+        self._stats.pop(name, None)
+
+    def _set_imports(self, name, imports):
+        old_imports = self._imports.get(name, set())
+
+        for imported in old_imports - imports:
+            self._importers[imported].discard(name)
+
+        for imported in imports - old_imports:
+            self._importers[imported].add(name)
+
+        self._imports[name] = imports
+
+    def update(self, file_path):
+        """
+        Incrementally refresh index for changed (created/deleted) file or dir.
+        Returns names of affected modules
+        """
+
+        file_path = path.abspath(file_path)
+
+        if path.isdir(file_path):
+            prefix = file_path + os.sep
+            names = set(
+                name for name, known_path in self._files.items()
+                if known_path.startswith(prefix)
+            )
+            for name in names:
+                self._remove(name)
+
+            for child_path in python_files(file_path, self.exclude_filter):
+                names.add(self._add(child_path))
+
+            names.discard(None)
+            return names
+
+        name = module_name(self.root, file_path)
+        if name is None:
+            return set()
+
+        if path.exists(file_path) and not self._excluded(file_path):
+            self._add(file_path)
+        else:
+            self._remove(name)
+
+        return set([name])
+
+    def is_test(self, name):
+        file_path = self._files.get(name)
+        return file_path is not None and \
+            fnmatch(path.basename(file_path), self.test_pattern)
+
+    def test_modules(self):
+        return sorted(name for name in self._files if self.is_test(name))
+
+    def test_files(self):
+        return [self._files[name] for name in self.test_modules()]
+
+    def file_path(self, name):
+        return self._files.get(name)
+
+    def dependants(self, names):
+        """
+        Names (including given ones) of modules importing given modules,
+        directly or not
+        """
+
+        seen = set(names)
+        pending = list(names)
+
+        while pending:
+            for importer in self._importers.get(pending.pop(), ()):
+                if importer not in seen:
+                    seen.add(importer)
+                    pending.append(importer)
+
+        return seen
+
+    def dependencies(self, name):
+        """
+        Names (including given one) of indexed modules imported
+        by module, directly or not
+        """
+
+        seen = set([name])
+        pending = [name]
+
+        while pending:
+            for imported in self._imports.get(pending.pop(), ()):
+                if imported not in seen and imported in self._files:
+                    seen.add(imported)
+                    pending.append(imported)
+
+        return seen
+
+    def affected_tests(self, paths):
+        """
+        Test modules depending on any of the changed paths.
+
+        Returns None when a change can not be mapped to python module
+        (ie. data or config file), meaning everything should run.
+        """
+
+        names = set()
+        for file_path in paths:
+            name = module_name(self.root, file_path)
+            if name is None:
+                return None
+            names.add(name)
+
+        return sorted(
+            name for name in self.dependants(names) if self.is_test(name))
@@ -0,0 +1,395 @@
+"""
+Suite shards run by worker daemons (see worker) over TCP.
+
+Coordinator hands shards out to workers, one at a time to each of them.
+Messages are JSON objects, one per line:
+
+    coordinator                         worker
+    job: cmd, options, manifest   ->
+                                  <-    need: paths
+    file: path, data (base64)     ->    (one per needed path)
+                                  <-    result: TestResult of single test
+                                  <-    alive (while shard runs)
+                                  <-    done: ShardResult
+
+Manifest is relative path -> digest of files of tree (WATCH_DIR without
+excluded paths), worker keeps mirror of it and asks only for files it does
+not have with the same content. Shard of worker which fails or does not
+answer for SUITE_WORKER_TIMEOUT goes to other worker, idle worker runs
+again shard running much longer than finished ones (first result counts).
+Shards no worker could run are run locally
+"""
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from os import path
+from time import time
+
+from filters import PathFilter
+from hashcache import ContentHashCache
+from parsers import TestResult
+from runner import ShardResult
+
+_log = logging.getLogger(__name__)
+
+PROTOCOL = 1
+DEFAULT_PORT = 7100
+
+# Options of Runner passed to workers
+WORKER_OPTIONS = ("RESULT_PARSER", "OUTPUT_MEMORY")
+
+# Digests of files of tree, kept between runs
+_hashes = ContentHashCache(max_size=1 << 20)
+
+
+class WorkerError(Exception):
+    """
+    Worker could not run shard
+    """
+
+
+def parse_address(address):
+    """
+    (host, port) of "host:port", "host" or "port"
+    """
+
+    host, _, port = str(address).rpartition(":")
+    if not host and not port.isdigit():
+        host, port = port, ""
+
+    return host or "localhost", int(port or DEFAULT_PORT)
+
+
+class Connection(object):
+    """
+    Messages over socket, they can be sent by several threads
+    """
+
+    block_size = 1 << 16
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._send_lock = threading.Lock()
+        # Received lines and start of next one
+        self._lines = deque()
+        self._partial = []
+
+    @classmethod
+    def connect(cls, address, timeout):
+        return cls(socket.create_connection(parse_address(address), timeout))
+
+    def send(self, message):
+        data = json.dumps(message, separators=(",", ":")) + "\n"
+        with self._send_lock:
+            self.sock.sendall(data.encode("utf-8"))
+
+    def receive(self):
+        """
+        Next message, None once other side closed connection.
+        Timeout of socket does not lose data received so far
+        """
+
+        while not self._lines:
+            data = self.sock.recv(self.block_size)
+            if not data:
+                return None
+
+            parts = data.split(b"\n")
+            self._partial.append(parts[0])
+            if len(parts) > 1:
+                self._lines.append(b"".join(self._partial))
+                self._lines.extend(parts[1:-1])
+                self._partial = [parts[-1]]
+
+        return json.loads(self._lines.popleft().decode("utf-8"))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+def tree_manifest(root, path_filter=None, hashes=_hashes):
+    """
+    Relative path -> digest of files of root not excluded by path_filter
+    """
+
+    path_filter = path_filter or PathFilter()
+    manifest = {}
+
+    for dir_path in path_filter.watch_dirs(root):
+        try:
+            names = os.listdir(dir_path)
+        except OSError:
+            continue
+
+        for name in names:
+            file_path = path.join(dir_path, name)
+            if path_filter(file_path) or not path.isfile(file_path):
+                continue
+
+            digest = hashes.digest(file_path)
+            if digest is not None:
+                manifest[path.relpath(file_path, root)] = digest
+
+    return manifest
+
+
+def result_message(result):
+    return {"type": "result", "test_id": result.test_id,
+            "outcome": result.outcome, "duration": result.duration,
+            "traceback": result.traceback}
+
+
+def done_message(shard):
+    message = dict(shard._asdict())
+    message["type"] = "done"
+    return message
+
+
+class Coordinator(object):
+    """
+    Runs shard commands of runner on workers ("host:port" each),
+    returns ShardResult for each command
+    """
+
+    # Seconds between checks of cancel and of shards finished elsewhere
+    poll_interval = 1
+    # Shard running this many times longer than median of finished
+    # shards is slow, idle worker runs it too
+    slow_factor = 2
+
+    def __init__(self, runner, workers):
+        self.runner = runner
+        self.workers = list(workers or ())
+        self.timeout = runner.options.get("SUITE_WORKER_TIMEOUT") or 30
+        self.root = runner.options.get("WATCH_DIR") or "."
+
+        self.test_cmds = []
+        self.manifest = {}
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        # Shard index -> (started, workers running it)
+        self._running = {}
+        self._results = {}
+        self._elapsed = []
+
+    def path_filter(self):
+        exclude_filter = self.runner.options.get("EXCLUDE_FILTER")
+        gitignore = self.runner.options.get("GITIGNORE")
+        return PathFilter(exclude_filter,
+                          root=self.root if gitignore else None)
+
+    def command(self, test_cmd):
+        """
+        Command for worker, paths in tree are relative to it
+        """
+
+        return test_cmd.replace(path.join(path.abspath(self.root), ""), "")
+
+    def run(self, test_cmds):
+        self.test_cmds = list(test_cmds)
+        self.manifest = tree_manifest(self.root, self.path_filter())
+        self._pending = deque(range(len(self.test_cmds)))
+        self._running = {}
+        self._results = {}
+        self._elapsed = []
+
+        threads = [
+            threading.Thread(target=self._serve, args=(address,))
+            for address in self.workers
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return self._collect()
+
+    def _collect(self):
+        missing = [
+            idx for idx in range(len(self.test_cmds))
+            if idx not in self._results
+        ]
+        if missing and self.runner.cancelled():
+            for idx in missing:
+                self._results[idx] = ShardResult(
+                    False, u"Tests cancelled", [], 0, {})
+        elif missing:
+            _log.warning("No worker could run shards %s, running them here",
+                         ", ".join(str(idx + 1) for idx in missing))
+            pool = ThreadPool(len(missing))
+            try:
+                results = pool.map(self.runner.run_shard,
+                                   [self.test_cmds[idx] for idx in missing])
+            finally:
+                pool.close()
+            self._results.update(zip(missing, results))
+
+        return [self._results[idx] for idx in range(len(self.test_cmds))]
+
+    def _serve(self, address):
+        """
+        Run shards on worker until there are none left or it fails
+        """
+
+        while True:
+            idx = self._next_shard(address)
+            if idx is None:
+                return
+
+            try:
+                result = self._run_remote(address, idx)
+            except (socket.error, ValueError, KeyError, TypeError,
+                    WorkerError) as err:
+                _log.warning("Worker %s failed to run shard %d/%d: %s",
+                             address, idx + 1, len(self.test_cmds), err)
+                self._release(idx, address, None)
+                return
+
+            self._release(idx, address, result)
+
+    def _over(self):
+        return len(self._results) == len(self.test_cmds) or \
+            self.runner.cancelled()
+
+    def _next_shard(self, address):
+        """
+        Index of shard worker runs next, None if it is not needed anymore
+        """
+
+        with self._cond:
+            while not self._over():
+                if self._pending:
+                    idx = self._pending.popleft()
+                    break
+
+                idx = self._slow_shard(address)
+                if idx is not None:
+                    _log.info("Shard %d/%d is slow, running it on %s too",
+                              idx + 1, len(self.test_cmds), address)
+                    break
+
+                self._cond.wait(self.poll_interval)
+            else:
+                return None
+
+            self._running.setdefault(idx, (time(), set()))[1].add(address)
+            return idx
+
+    def _slow_shard(self, address):
+        if not self._elapsed:
+            return None
+
+        elapsed = sorted(self._elapsed)
+        limit = self.slow_factor * elapsed[len(elapsed) // 2]
+        now = time()
+        slow = [
+            (started, idx)
+            for idx, (started, addresses) in self._running.items()
+            if len(addresses) == 1 and address not in addresses and
+            now - started > limit
+        ]
+        return min(slow)[1] if slow else None
+
+    def _release(self, idx, address, result):
+        """
+        Worker is done with shard: result is first one or shard goes
+        back to pending when worker failed and nobody else runs it
+        """
+
+        with self._cond:
+            started, addresses = self._running.get(idx, (None, set()))
+            addresses.discard(address)
+
+            if result is not None and idx not in self._results:
+                self._results[idx] = result
+                self._elapsed.append(result.elapsed)
+                self._running.pop(idx, None)
+            elif not addresses and idx not in self._results:
+                self._running.pop(idx, None)
+                self._pending.appendleft(idx)
+
+            self._cond.notify_all()
+
+    def _superseded(self, idx):
+        with self._cond:
+            return idx in self._results or self.runner.cancelled()
+
+    def _run_remote(self, address, idx):
+        """
+        ShardResult of shard run by worker, None if it is not needed
+        anymore (connection is closed, worker kills test process)
+        """
+
+        conn = Connection.connect(address, self.timeout)
+        try:
+            conn.send({
+                "type": "job",
+                "protocol": PROTOCOL,
+                "cmd": self.command(self.test_cmds[idx]),
+                "options": dict(
+                    (name, self.runner.options.get(name))
+                    for name in WORKER_OPTIONS),
+                "manifest": self.manifest,
+            })
+            conn.sock.settimeout(self.poll_interval)
+            return self._follow(conn, idx)
+        finally:
+            conn.close()
+
+    def _follow(self, conn, idx):
+        last_message = time()
+        while not self._superseded(idx):
+            try:
+                message = conn.receive()
+            except socket.timeout:
+                if time() - last_message > self.timeout:
+                    raise WorkerError(
+                        "no answer for {}s".format(self.timeout))
+                continue
+
+            if message is None:
+                raise WorkerError("connection closed")
+
+            last_message = time()
+            kind = message.get("type")
+            if kind == "need":
+                self._send_files(conn, message["paths"])
+            elif kind == "result":
+                self.runner.on_result(TestResult(
+                    message["test_id"], message["outcome"],
+                    message["duration"], message["traceback"]))
+            elif kind == "done":
+                return ShardResult(
+                    message["result"], message["output"], message["failed"],
+                    message["elapsed"], message["durations"])
+            elif kind == "error":
+                raise WorkerError(message.get("error"))
+
+        return None
+
+    def _send_files(self, conn, paths):
+        conn.sock.settimeout(self.timeout)
+        for rel_path in paths:
+            if rel_path not in self.manifest:
+                conn.send({"type": "file", "path": rel_path, "data": None})
+                continue
+
+            try:
+                with open(path.join(self.root, rel_path), "rb") as src:
+                    data = base64.b64encode(src.read())
+            except (IOError, OSError):
+                # Removed in meantime
+                data = None
+
+            conn.send({"type": "file", "path": rel_path, "data": data})
+        conn.sock.settimeout(self.poll_interval)
@@ -0,0 +1,449 @@
+"""
+Single threaded engine: watching files, scheduling runs, running tests
+and streaming their output in one asyncore loop, without pool process
+in between (Runner is not pickled, results are not sent back)
+"""
+import asyncore
+import codecs
+import heapq
+import itertools
+import logging
+import os
+import pty
+import shlex
+import signal
+import subprocess
+import sys
+from collections import deque
+from threading import Thread
+from time import sleep, time
+
+from capture import OutputCapture
+from metrics import SPAWNED
+from pump import read_terminal
+from runner import RunResult, Step, kill_group
+
+_log = logging.getLogger(__name__)
+
+
+class LoopTimer(object):
+    """
+    threading.Timer look-alike, function is called by event loop
+    """
+
+    daemon = True
+
+    def __init__(self, loop, interval, function, args=None, kwargs=None):
+        self.loop = loop
+        self.interval = interval
+        self.function = function
+        self.args = args or []
+        self.kwargs = kwargs or {}
+        self._cancelled = False
+
+    def start(self):
+        self.loop.call_later(self.interval, self._run)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _run(self):
+        if not self._cancelled:
+            self.function(*self.args, **self.kwargs)
+
+
+class EventLoop(object):
+    """
+    asyncore loop with timers. Dispatchers (ie. pyinotify.AsyncNotifier)
+    have to use loop's map
+    """
+
+    max_wait = 1.0
+
+    def __init__(self):
+        self.map = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._running = False
+
+    def call_later(self, delay, callback, *args):
+        # Also used by other threads: single push is atomic, new timer
+        # is run in at most max_wait
+        heapq.heappush(self._timers, (
+            time() + delay, next(self._sequence), callback, args))
+
+    def timer(self, interval, function, args=None, kwargs=None):
+        return LoopTimer(self, interval, function, args, kwargs)
+
+    def run_once(self):
+        timeout = self.max_wait
+        if self._timers:
+            timeout = max(0, min(timeout, self._timers[0][0] - time()))
+
+        if self.map:
+            asyncore.loop(timeout, use_poll=True, map=self.map, count=1)
+        elif timeout:
+            sleep(timeout)
+
+        now = time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            try:
+                callback(*args)
+            except Exception:  # pylint: disable=broad-except
+                _log.exception("Callback of event loop failed")
+
+    def run(self):
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def stop(self):
+        self._running = False
+
+
+class OutputReader(asyncore.file_dispatcher):
+    """
+    Reads output of test process from master side of its pseudo terminal
+    """
+
+    block_size = 1 << 16
+
+    def __init__(self, fd, on_data, on_eof, channel_map):
+        asyncore.file_dispatcher.__init__(self, fd, channel_map)
+        self.on_data = on_data
+        self.on_eof = on_eof
+
+    def writable(self):
+        return False
+
+    def _read(self):
+        return read_terminal(self.socket.fd, self.block_size)
+
+    def handle_read(self):
+        data = self._read()
+        if data:
+            self.on_data(data)
+        else:
+            self.handle_close()
+
+    def handle_close(self):
+        # Hang up comes with output still buffered
+        for data in iter(self._read, b""):
+            self.on_data(data)
+
+        self.close()
+        self.on_eof()
+
+
+class LoopProcess(object):
+    """
+    Test command in pseudo terminal (like pexpect does it), output
+    streamed to parser and capture. on_exit gets the process when it ended
+    """
+
+    poll_interval = 0.01
+
+    def __init__(self, loop, test_cmd, parser, on_exit, progress=False,
+                 capture=None):
+        self.loop = loop
+        self.test_cmd = test_cmd
+        self.parser = parser
+        self.on_exit = on_exit
+        self.progress = progress
+        self.capture = capture if capture is not None else OutputCapture()
+
+        self.proc = None
+        self.started = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    @property
+    def exitstatus(self):
+        return self.proc.returncode
+
+    @property
+    def output(self):
+        """
+        Output kept in memory, see OutputCapture
+        """
+
+        return self.capture.tail()
+
+    def start(self):
+        self.started = time()
+        master, slave = pty.openpty()
+        try:
+            with open(os.devnull) as stdin:
+                # New session, like pexpect children, so whole group
+                # can be killed. There is no terminal for debugger
+                self.proc = subprocess.Popen(
+                    shlex.split(self.test_cmd), stdin=stdin, stdout=slave,
+                    stderr=slave, close_fds=True, preexec_fn=os.setsid)
+        except Exception:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+
+        OutputReader(master, self._data, self._eof, self.loop.map)
+        # Reader has its own copy
+        os.close(master)
+
+    def _data(self, data, final=False):
+        text = self._decoder.decode(data, final)
+        if not text:
+            return
+
+        self.capture.write(text)
+        self.parser.write(text)
+        if self.progress:
+            sys.stderr.write(text)
+
+    def _eof(self):
+        self._data(b"", final=True)
+        self._wait()
+
+    def _wait(self):
+        if self.proc.poll() is None:
+            self.loop.call_later(self.poll_interval, self._wait)
+            return
+
+        self.on_exit(self)
+
+    def kill(self, sig):
+        if self.proc is not None and self.proc.returncode is None:
+            kill_group(self.proc.pid, sig)
+
+
+class LoopRunControl(object):
+    """
+    RunControl of runs in event loop, test processes are children
+    of this process
+    """
+
+    def __init__(self, loop, grace_period=1):
+        self.loop = loop
+        self.grace_period = grace_period
+        self._processes = set()
+        self._cancelled = False
+
+    def started(self, process):
+        self._processes.add(process)
+
+    def finished(self, process):
+        self._processes.discard(process)
+
+    def cancelled(self):
+        return self._cancelled
+
+    def reset(self):
+        self._cancelled = False
+
+    def cancel(self):
+        """
+        Stop current run: TERM test processes, KILL them after grace period
+        """
+
+        self._cancelled = True
+
+        for process in list(self._processes):
+            _log.info("Cancelling test process %d", process.pid)
+            process.kill(signal.SIGTERM)
+            self.loop.call_later(
+                self.grace_period, process.kill, signal.SIGKILL)
+
+
+class RunSlots(object):
+    """
+    Limit of test runs at once shared by pools of several projects,
+    runs over limit wait in order they came
+    """
+
+    def __init__(self, limit=1):
+        self.limit = max(limit, 1)
+        self.running = 0
+        self._waiting = deque()
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def acquire(self, start):
+        """
+        Call start once there is free slot
+        """
+
+        if self.running < self.limit:
+            self.running += 1
+            start()
+        else:
+            self._waiting.append(start)
+
+    def release(self):
+        if self._waiting:
+            # Slot is handed over to next run
+            self._waiting.popleft()()
+        else:
+            self.running -= 1
+
+
+class LoopTask(object):
+    """
+    Run of Runner stages, test processes are started in event loop
+    and their results are sent back to stages
+    """
+
+    # RunSlots the task took, if any
+    slots = None
+
+    def __init__(self, loop, control, runner, args, callback=None):
+        self.loop = loop
+        self.control = control
+        self.runner = runner
+        self.args = args
+        self.callback = callback
+
+        self._stages = None
+        self._ready = False
+
+    def ready(self):
+        return self._ready
+
+    def start(self):
+        if self.control.cancelled():
+            # Outdated while it waited for free slot
+            self._finish(False, u"Tests cancelled")
+            return
+
+        self.runner.timings = {}
+        self.runner.run_control = self.control
+        self._stages = self.runner.stages(*self.args)
+        self._advance(next, self._stages)
+
+    def _advance(self, method, *args):
+        """
+        Get next step of stages, start its processes or finish
+        """
+
+        try:
+            step = method(*args)
+            if isinstance(step, Step):
+                self._run_step(step)
+                return
+        except StopIteration:
+            step = False, u"Running tests failed: no result"
+        except Exception as err:  # pylint: disable=broad-except
+            _log.exception("Running tests failed")
+            step = False, u"Running tests failed: {}".format(err)
+
+        self._finish(*step)
+
+    def _finish(self, result, info):
+        try:
+            if self._stages is not None:
+                self._stages.close()
+        except Exception:  # pylint: disable=broad-except
+            _log.exception("Finishing test run failed")
+
+        self._ready = True
+        if self.slots is not None:
+            self.slots.release()
+        if self.callback is not None:
+            self.callback(RunResult(result, info, self.runner.timings,
+                                    self.runner.passed_keys))
+
+    def _send(self, result):
+        # Processes left after failure of the run
+        if self._ready:
+            return
+
+        self._advance(self._stages.send, result)
+
+    def _run_step(self, step):
+        runner = self.runner
+        runner.last_traceback = ""
+
+        if isinstance(step.cmd, list) and \
+                runner.options.get("SUITE_WORKERS"):
+            self._run_remote_shards(step.cmd)
+            return
+        if isinstance(step.cmd, list):
+            self._run_shards(step.cmd)
+            return
+
+        def finished(process):
+            self.control.finished(process)
+            self._send(runner.test_finished(
+                process.parser, process.exitstatus, process.capture))
+
+        self._spawn(step.cmd, finished, **step.options)
+
+    def _run_shards(self, test_cmds):
+        results = [None] * len(test_cmds)
+        pending = set(range(len(test_cmds)))
+
+        def finished(idx, process):
+            self.control.finished(process)
+            results[idx] = self.runner.shard_finished(
+                process.parser, process.exitstatus, process.capture,
+                time() - process.started)
+
+            pending.discard(idx)
+            if not pending:
+                self._send(self.runner.shards_finished(test_cmds, results))
+
+        for idx, test_cmd in enumerate(test_cmds):
+            self._spawn(test_cmd, lambda process, idx=idx: finished(
+                idx, process))
+
+    def _run_remote_shards(self, test_cmds):
+        """
+        Shards run by workers, coordinator waits for them in thread
+        and result is sent back to stages by loop
+        """
+
+        def coordinate():
+            try:
+                result = self.runner.run_remote_shards(test_cmds)
+            except Exception:  # pylint: disable=broad-except
+                _log.exception("Running shards on workers failed")
+                result = False
+            self.loop.call_later(0, self._send, result)
+
+        thread = Thread(target=coordinate)
+        thread.daemon = True
+        thread.start()
+
+    def _spawn(self, test_cmd, on_exit, progress=False):
+        _log.debug("To run: %s", test_cmd)
+
+        process = LoopProcess(self.loop, test_cmd,
+                              self.runner.parser(test_cmd), on_exit, progress,
+                              capture=self.runner.capture())
+        process.start()
+        self.runner.mark(SPAWNED, time())
+        self.control.started(process)
+
+
+class LoopPool(object):
+    """
+    multiprocessing.Pool look-alike running tests in event loop
+    """
+
+    def __init__(self, loop, grace_period=1, slots=None):
+        self.loop = loop
+        self.control = LoopRunControl(loop, grace_period)
+        self.slots = slots
+
+    def apply_async(self, func, args=(), callback=None):
+        task = LoopTask(self.loop, self.control, func, args, callback)
+        # Started by loop, caller gets the task first
+        if self.slots is None:
+            self.loop.call_later(0, task.start)
+        else:
+            task.slots = self.slots
+            self.loop.call_later(0, self.slots.acquire, task.start)
+        return task
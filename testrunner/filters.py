@@ -0,0 +1,302 @@
+"""
+Excluding paths from watching: regular expressions from config
+and rules of .gitignore files found in watched tree
+"""
+import logging
+import os
+import re
+from itertools import groupby
+from operator import itemgetter
+from os import path
+
+_log = logging.getLogger(__name__)
+
+GITIGNORE = ".gitignore"
+
+
+def compile_patterns(patterns):
+    """
+    Single regular expression matching when any of patterns matches,
+    None if there are no patterns
+    """
+
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+
+    patterns = list(patterns or ())
+    if not patterns:
+        return None
+
+    return re.compile("|".join("(?:{})".format(pat) for pat in patterns))
+
+
+def translate_glob(pattern):
+    """
+    Regular expression for gitignore glob, matched against path
+    relative to directory of .gitignore file
+    """
+
+    # Glob with slash is relative to .gitignore, otherwise matches at any level
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    parts = []
+    idx, length = 0, len(pattern)
+    while idx < length:
+        char = pattern[idx]
+
+        if pattern.startswith("**", idx):
+            whole_part = (idx == 0 or pattern[idx - 1] == "/") and \
+                (idx + 2 == length or pattern[idx + 2] == "/")
+            if whole_part and idx + 2 == length:
+                parts.append(".*")
+                idx += 2
+            elif whole_part:
+                parts.append("(?:.*/)?")
+                idx += 3
+            else:
+                parts.append("[^/]*")
+                idx += 2
+            continue
+
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "\\" and idx + 1 < length:
+            idx += 1
+            parts.append(re.escape(pattern[idx]))
+        elif char == "[":
+            end = idx + 1
+            if end < length and pattern[end] == "!":
+                end += 1
+            if end < length and pattern[end] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end < 0:
+                parts.append(re.escape(char))
+            else:
+                chars = pattern[idx + 1:end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                parts.append("[{}]".format(chars))
+                idx = end
+        else:
+            parts.append(re.escape(char))
+
+        idx += 1
+
+    regex = "".join(parts)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+
+    return regex + "$"
+
+
+def parse_gitignore(lines):
+    """
+    Rules (regex, negated, only_dirs) of .gitignore lines, in file order
+    """
+
+    rules = []
+    for line in lines:
+        if not line.endswith("\\ "):
+            line = line.rstrip()
+
+        if not line or line.startswith("#"):
+            continue
+
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+
+        only_dirs = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        rules.append((translate_glob(line), negated, only_dirs))
+
+    return rules
+
+
+class GitIgnore(object):
+    """
+    Compiled rules of single .gitignore file
+    """
+
+    def __init__(self, lines):
+        rules = parse_gitignore(lines)
+        self.has_dir_rules = any(only_dirs for _, _, only_dirs in rules)
+
+        # Consecutive rules of same kind are joined into one expression,
+        # groups are checked from the end as the last matching rule wins
+        self._groups = []
+        for negated, group in groupby(rules, key=itemgetter(1)):
+            group = list(group)
+            self._groups.append((
+                negated,
+                compile_patterns([regex for regex, _, _ in group]),
+                compile_patterns([
+                    regex for regex, _, only_dirs in group if not only_dirs
+                ]),
+            ))
+
+        self._groups.reverse()
+
+    def __len__(self):
+        return len(self._groups)
+
+    @classmethod
+    def from_file(cls, file_path):
+        with open(file_path) as src:
+            return cls(src.read().splitlines())
+
+    def match(self, relative_path, is_dir):
+        """
+        True if path is ignored, False if it is explicitly included,
+        None if no rule is about it
+        """
+
+        for negated, any_regex, files_regex in self._groups:
+            regex = any_regex if is_dir else files_regex
+            if regex is not None and regex.match(relative_path):
+                return not negated
+
+        return None
+
+
+class PathFilter(object):
+    """
+    Exclude filter for pyinotify: returns True for paths not to be watched.
+
+    Paths are excluded when any of regular expressions matches them
+    (re.match, like pyinotify.ExcludeFilter) or when they are ignored
+    by .gitignore files read while crawling root
+    """
+
+    def __init__(self, patterns=(), root=None):
+        self._regex = compile_patterns(patterns)
+        self.root = path.abspath(root) if root is not None else None
+
+        self._ignores = {}
+        self._dir_rules = False
+        # Directory -> ignored, so ignored parent is not checked every time
+        self._ignored_dirs = {}
+
+    def __call__(self, pathname):
+        # Rules change with the file, even when it is excluded itself
+        if self.root is not None and path.basename(pathname) == GITIGNORE:
+            self.load_gitignore(path.dirname(pathname))
+
+        if self._regex is not None and self._regex.match(pathname):
+            return True
+
+        if not self._ignores:
+            return False
+
+        abs_path = path.abspath(pathname)
+        if self._dir_ignored(path.dirname(abs_path)):
+            return True
+
+        is_dir = self._dir_rules and path.isdir(abs_path)
+        return self._ignored(abs_path, is_dir)
+
+    def load_gitignore(self, dir_path):
+        """
+        Read .gitignore file of directory, rules of removed or empty
+        file are dropped
+        """
+
+        if self.root is None:
+            return
+
+        dir_path = path.abspath(dir_path)
+        file_path = path.join(dir_path, GITIGNORE)
+        ignore = None
+        if path.isfile(file_path):
+            try:
+                ignore = GitIgnore.from_file(file_path)
+            except (IOError, OSError) as err:
+                _log.warning("Can not read %s: %s", file_path, err)
+                return
+
+        if ignore:
+            _log.debug("Using rules of %s", file_path)
+            self._ignores[dir_path] = ignore
+        elif self._ignores.pop(dir_path, None) is not None:
+            _log.debug("Rules of %s dropped", file_path)
+        else:
+            return
+
+        self._dir_rules = any(
+            rules.has_dir_rules for rules in self._ignores.values())
+        self._ignored_dirs.clear()
+
+    def _inside_root(self, abs_path):
+        return abs_path == self.root or \
+            abs_path.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    def _dir_ignored(self, dir_path):
+        ignored = self._ignored_dirs.get(dir_path)
+        if ignored is not None:
+            return ignored
+
+        parent = path.dirname(dir_path)
+        if not self._inside_root(parent) or parent == dir_path:
+            return False
+
+        ignored = self._dir_ignored(parent) or self._ignored(dir_path, True)
+        self._ignored_dirs[dir_path] = ignored
+        return ignored
+
+    def _ignored(self, abs_path, is_dir):
+        # Rules of deeper .gitignore take precedence
+        dir_path = path.dirname(abs_path)
+        while self._inside_root(dir_path):
+            ignore = self._ignores.get(dir_path)
+            if ignore is not None:
+                ignored = ignore.match(
+                    path.relpath(abs_path, dir_path), is_dir)
+                if ignored is not None:
+                    return ignored
+
+            parent = path.dirname(dir_path)
+            if parent == dir_path:
+                break
+            dir_path = parent
+
+        return False
+
+    def watch_dirs(self, top):
+        """
+        Directories of top to watch. Excluded directories are pruned
+        with whole subtree, .gitignore files are read on the way
+        """
+
+        if self(top):
+            return []
+
+        if path.islink(top) or not path.isdir(top):
+            return [top]
+
+        dirs = []
+        for dir_path, dir_names, _ in os.walk(top):
+            self.load_gitignore(dir_path)
+
+            dirs.append(dir_path)
+            dir_names[:] = [
+                name for name in dir_names
+                if not self.dir_excluded(path.join(dir_path, name))
+            ]
+
+        return dirs
+
+    def dir_excluded(self, dir_path):
+        if self._regex is not None and self._regex.match(dir_path):
+            return True
+
+        if not self._ignores:
+            return False
+
+        return self._dir_ignored(path.abspath(dir_path))
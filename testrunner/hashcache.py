@@ -0,0 +1,137 @@
+"""
+Content hashes of watched files, used to skip runs for files
+which were touched but did not change
+"""
+import hashlib
+import os
+import stat
+from collections import OrderedDict
+
+
+def file_digest(file_path, block_size=1 << 16):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as src:
+        for block in iter(lambda: src.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class ContentHashCache(object):
+    """
+    LRU cache path -> (size, mtime, digest), bounded to max_size entries.
+
+    Size and mtime are checked first, file is read only when they differ.
+    """
+
+    # Entries stored or dropped, tells when snapshot is outdated
+    changes = 0
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_path):
+        return file_path in self._entries
+
+    def _store(self, file_path, entry):
+        if self._entries.pop(file_path, None) != entry:
+            self.changes += 1
+        self._entries[file_path] = entry
+        self._trim()
+
+    def _trim(self):
+        while len(self._entries) > max(self.max_size, 0):
+            self._entries.popitem(last=False)
+
+    def _drop(self, file_path):
+        if self._entries.pop(file_path, None) is not None:
+            self.changes += 1
+
+    def snapshot(self):
+        """
+        Entries as [path, size, mtime, digest], least recently used first
+        """
+
+        return [[file_path] + list(entry)
+                for file_path, entry in self._entries.items()]
+
+    def restore(self, entries):
+        """
+        Add entries of snapshot as least recently used ones, known
+        entries are kept. They are checked by size and mtime when used
+        """
+
+        restored = OrderedDict(
+            (file_path, (size, mtime, digest))
+            for file_path, size, mtime, digest in entries
+            if file_path not in self._entries
+        )
+        restored.update(self._entries)
+        self._entries = restored
+        self._trim()
+
+    def state(self, file_path):
+        """
+        Current (size, mtime, digest) of file, None if it does not exist.
+        Digest is None for anything else than regular file
+        """
+
+        try:
+            stat_info = os.stat(file_path)
+        except OSError:
+            return None
+
+        size, mtime = stat_info.st_size, stat_info.st_mtime
+        if not stat.S_ISREG(stat_info.st_mode):
+            return size, mtime, None
+
+        known = self._entries.get(file_path)
+        if known is not None and known[:2] == (size, mtime):
+            return known
+
+        try:
+            return size, mtime, file_digest(file_path)
+        except IOError:
+            return size, mtime, None
+
+    def digest(self, file_path):
+        """
+        Digest of current content of file, None if it can not be read
+        """
+
+        current = self.state(file_path)
+        if current is None:
+            self._drop(file_path)
+            return None
+
+        self._store(file_path, current)
+        return current[2]
+
+    def changed(self, paths):
+        """
+        Paths which content differs from the one seen last time,
+        remembers current content
+        """
+
+        changed = set()
+
+        for file_path in paths:
+            known = self._entries.get(file_path)
+            current = self.state(file_path)
+
+            if current is None:
+                if known is not None:
+                    changed.add(file_path)
+                self._drop(file_path)
+                continue
+
+            if known is None or current[2] is None or current[2] != known[2]:
+                changed.add(file_path)
+
+            self._store(file_path, current)
+
+        return changed
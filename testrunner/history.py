@@ -0,0 +1,142 @@
+"""
+Outcomes and durations of tests persisted between runs
+"""
+import json
+import logging
+import os
+from os import path
+from tempfile import NamedTemporaryFile
+from time import time
+
+_log = logging.getLogger(__name__)
+
+HISTORY_FILE = "history.json"
+DURATIONS_FILE = "durations.json"
+
+
+def history_file(state_dir):
+    return path.join(state_dir, HISTORY_FILE)
+
+
+def durations_file(state_dir):
+    return path.join(state_dir, DURATIONS_FILE)
+
+
+def dump_json(file_path, document):
+    """
+    Write JSON document to file aside and rename it,
+    so other process never reads half of it
+    """
+
+    dir_path = path.dirname(file_path)
+    if dir_path and not path.isdir(dir_path):
+        os.makedirs(dir_path)
+
+    with NamedTemporaryFile("w", dir=dir_path or ".", delete=False) as dst:
+        json.dump(document, dst)
+
+    os.rename(dst.name, file_path)
+
+
+class StateFile(object):
+    """
+    Test -> entry (dict with last_run), kept in JSON file
+    """
+
+    def __init__(self, file_path, max_size=1000):
+        self.file_path = file_path
+        self.max_size = max_size
+        self.tests = {}
+
+    def load(self):
+        try:
+            with open(self.file_path) as src:
+                self.tests = json.load(src)["tests"]
+        except (IOError, OSError):
+            self.tests = {}
+        except (ValueError, KeyError, TypeError):
+            _log.warning("History %s is broken, starting new one",
+                         self.file_path)
+            self.tests = {}
+
+        return self
+
+    def save(self):
+        if len(self.tests) > self.max_size:
+            recent = sorted(self.tests.items(),
+                            key=lambda item: item[1]["last_run"])
+            self.tests = dict(recent[-self.max_size:])
+
+        dump_json(self.file_path, {"tests": self.tests})
+
+
+class RunHistory(StateFile):
+    """
+    Test id -> last outcome
+    """
+
+    def record(self, test_id, failed, timestamp=None):
+        timestamp = timestamp or time()
+        entry = self.tests.setdefault(
+            test_id, {"failed": False, "failures": 0, "last_failure": None})
+
+        entry["failed"] = failed
+        entry["last_run"] = timestamp
+        if failed:
+            entry["failures"] += 1
+            entry["last_failure"] = timestamp
+
+    def record_run(self, failed, result, run_tests=()):
+        """
+        Record failed tests of run. Tests explicitly run (run_tests)
+        which did not fail passed when run finished fine or when
+        failures of other tests were found
+        """
+
+        timestamp = time()
+
+        for test_id in failed:
+            self.record(test_id, True, timestamp)
+
+        if result or failed:
+            for test_id in run_tests:
+                if test_id not in failed:
+                    self.record(test_id, False, timestamp)
+
+    def failing(self):
+        """
+        Tests which failed last time they run, recently failed first
+        """
+
+        failing = [
+            (entry["last_failure"], test_id)
+            for test_id, entry in self.tests.items() if entry["failed"]
+        ]
+
+        return [test_id for _, test_id in sorted(failing, reverse=True)]
+
+
+class DurationHistory(StateFile):
+    """
+    Test module -> seconds its tests take, smoothed over runs
+    """
+
+    # Weight of latest run
+    smoothing = 0.5
+
+    def record(self, test_name, duration, timestamp=None):
+        entry = self.tests.get(test_name)
+        if entry is not None:
+            duration = self.smoothing * duration + \
+                (1 - self.smoothing) * entry["duration"]
+
+        self.tests[test_name] = {
+            "duration": duration,
+            "last_run": timestamp or time(),
+        }
+
+    def durations(self):
+        return dict(
+            (test_name, entry["duration"])
+            for test_name, entry in self.tests.items()
+        )
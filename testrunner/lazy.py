@@ -0,0 +1,27 @@
+"""
+Modules imported when they are used for the first time.
+
+Keeps start up (and --help) of testrunner fast, slow to import
+modules which are not always needed (pexpect, multiprocessing, ...)
+are imported by first access to their attributes
+"""
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands in for module, imports it on first attribute access
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module {!r}>".format(self._name)
@@ -0,0 +1,346 @@
+"""
+Selecting tests by lines they run.
+
+Tests run by tracer (see tracer) record lines they executed. Index keeps
+file -> test id -> covered line ranges, for content of file with known
+digest (kept in sources dir). Changed file is diffed against that content
+and tests which covered changed lines are the ones to run
+"""
+import bisect
+import difflib
+import json
+import logging
+import os
+from os import path
+
+from history import dump_json
+
+_log = logging.getLogger(__name__)
+
+COVERAGE_DIR = "coverage"
+INDEX_FILE = "index.json"
+# Bumped when format of index or run files changes
+VERSION = 1
+# "Test" of lines run outside of tests, ie. on import
+OUTSIDE_TESTS = ""
+
+
+def coverage_dir(state_dir):
+    return path.join(state_dir, COVERAGE_DIR)
+
+
+def runs_dir(cov_dir):
+    """
+    Coverage recorded by test processes, file per process
+    """
+
+    return path.join(cov_dir, "runs")
+
+
+def sources_dir(cov_dir):
+    """
+    Content of covered files by digest, coverage refers to its lines
+    """
+
+    return path.join(cov_dir, "sources")
+
+
+def read_lines(file_path):
+    with open(file_path, "rb") as src:
+        return src.read().splitlines()
+
+
+def to_ranges(lines):
+    """
+    Line numbers as sorted [first, last] ranges
+    """
+
+    ranges = []
+    for line in sorted(lines):
+        if ranges and line <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], line)
+        else:
+            ranges.append([line, line])
+
+    return ranges
+
+
+def from_ranges(ranges):
+    lines = set()
+    for first, last in ranges:
+        lines.update(range(first, last + 1))
+
+    return lines
+
+
+def intersects(ranges, other):
+    """
+    Sorted ranges (see to_ranges) have common line
+    """
+
+    idx = other_idx = 0
+    while idx < len(ranges) and other_idx < len(other):
+        first, last = ranges[idx]
+        other_first, other_last = other[other_idx]
+        if last < other_first:
+            idx += 1
+        elif other_last < first:
+            other_idx += 1
+        else:
+            return True
+
+    return False
+
+
+def changed_lines(old, new):
+    """
+    Ranges of lines of old content (list of lines) which differ in new
+    one. Lines around inserted ones count as changed
+    """
+
+    changed = set()
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, first, last, _, _ in matcher.get_opcodes():
+        if tag == "insert":
+            changed.update([first, first + 1])
+        elif tag != "equal":
+            changed.update(range(first + 1, last + 1))
+
+    changed.discard(0)
+    return to_ranges(changed)
+
+
+class LineMap(object):
+    """
+    Line numbers of old content -> line numbers in new one. Replaced
+    lines map to whole replacement, deleted ones to nothing
+    """
+
+    def __init__(self, old, new):
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        self._blocks = [
+            block for block in matcher.get_opcodes() if block[0] != "insert"
+        ]
+        self._starts = [block[1] for block in self._blocks]
+
+    def lines(self, line):
+        idx = bisect.bisect_right(self._starts, line - 1) - 1
+        if idx < 0:
+            return []
+
+        tag, first, last, new_first, new_last = self._blocks[idx]
+        if line > last:
+            return []
+        if tag == "equal":
+            return [new_first + line - first]
+        if tag == "replace":
+            return range(new_first + 1, new_last + 1)
+
+        return []
+
+    def ranges(self, ranges):
+        lines = set()
+        for line in from_ranges(ranges):
+            lines.update(self.lines(line))
+
+        return to_ranges(lines)
+
+
+class CoverageIndex(object):
+    """
+    File -> test id -> ranges of lines test run, with digests of file
+    content the lines are of. Only files run by suite are indexed,
+    coverage of their tests is complete
+    """
+
+    def __init__(self, cov_dir):
+        self.cov_dir = cov_dir
+        self.files = {}
+        self.digests = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def file_path(self):
+        return path.join(self.cov_dir, INDEX_FILE)
+
+    def load(self):
+        try:
+            with open(self.file_path) as src:
+                document = json.load(src)
+        except (IOError, OSError):
+            return self
+        except ValueError:
+            _log.warning("Coverage index %s is broken, starting new one",
+                         self.file_path)
+            return self
+
+        if isinstance(document, dict) and document.get("version") == VERSION:
+            self.files = document["files"]
+            self.digests = document["digests"]
+
+        return self
+
+    def save(self):
+        dump_json(self.file_path, {
+            "version": VERSION,
+            "files": self.files,
+            "digests": self.digests,
+        })
+        self._prune_sources()
+
+    def _prune_sources(self):
+        """
+        Remove content of files coverage does not refer to any more
+        """
+
+        known = set(self.digests.values())
+        try:
+            names = os.listdir(sources_dir(self.cov_dir))
+        except OSError:
+            return
+
+        for name in names:
+            if name not in known:
+                try:
+                    os.remove(path.join(sources_dir(self.cov_dir), name))
+                except OSError:
+                    pass
+
+    def source(self, digest):
+        """
+        Lines of content with digest, None if it is not known
+        """
+
+        try:
+            return read_lines(path.join(sources_dir(self.cov_dir), digest))
+        except (IOError, OSError):
+            return None
+
+    def changed_tests(self, file_path):
+        """
+        Tests which run lines of file changed since coverage was recorded.
+        None if it is not known: file is not indexed (or its content),
+        or lines run outside of tests (ie. on import) changed
+        """
+
+        digest = self.digests.get(file_path)
+        old = self.source(digest) if digest is not None else None
+        if old is None:
+            return None
+
+        try:
+            changed = changed_lines(old, read_lines(file_path))
+        except (IOError, OSError):
+            return None
+
+        coverage = self.files.get(file_path, {})
+        if intersects(coverage.get(OUTSIDE_TESTS, []), changed):
+            return None
+
+        return set(
+            test_id for test_id, ranges in coverage.items()
+            if test_id != OUTSIDE_TESTS and intersects(ranges, changed)
+        )
+
+    def _read_runs(self):
+        runs = []
+        dir_path = runs_dir(self.cov_dir)
+        try:
+            names = sorted(os.listdir(dir_path))
+        except OSError:
+            return runs
+
+        for name in names:
+            file_path = path.join(dir_path, name)
+            try:
+                with open(file_path) as src:
+                    runs.append(json.load(src))
+            except (IOError, OSError, ValueError) as err:
+                _log.debug("Can not read coverage %s: %s", file_path, err)
+
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+        return [run for run in runs
+                if isinstance(run, dict) and run.get("version") == VERSION]
+
+    def discard_runs(self):
+        """
+        Forget coverage of cancelled run, it may be incomplete
+        """
+
+        self._read_runs()
+
+    def merge_runs(self):
+        """
+        Add coverage recorded by test processes of finished run.
+        Suite (all its shards) replaces index, coverage of other tests
+        replaces what was known about them. Returns True if index changed
+        """
+
+        runs = self._read_runs()
+        suite = [run for run in runs if run.get("suite")]
+
+        if suite:
+            self.files = {}
+            self.digests = {}
+            for run in suite:
+                self._add(run)
+        else:
+            for run in runs:
+                self._update(run)
+
+        return bool(runs)
+
+    def _add(self, run):
+        self.digests.update(run["digests"])
+
+        for test_id, files in run["tests"].items():
+            for file_path, ranges in files.items():
+                coverage = self.files.setdefault(file_path, {})
+                if test_id in coverage:
+                    # Shards import the same modules
+                    ranges = to_ranges(from_ranges(coverage[test_id]) |
+                                       from_ranges(ranges))
+                coverage[test_id] = ranges
+
+    def _update(self, run):
+        for file_path, digest in run["digests"].items():
+            known = self.digests.get(file_path)
+            if file_path in self.files and known != digest and \
+                    not self._remap(file_path, known, digest):
+                # Not indexed until next suite run
+                del self.files[file_path]
+                del self.digests[file_path]
+
+        for test_id in run["tests"]:
+            if test_id != OUTSIDE_TESTS:
+                for coverage in self.files.values():
+                    coverage.pop(test_id, None)
+
+        for test_id, files in run["tests"].items():
+            for file_path, ranges in files.items():
+                if file_path in self.files:
+                    self.files[file_path][test_id] = ranges
+
+    def _remap(self, file_path, old_digest, new_digest):
+        """
+        Move lines of tests to content with new digest
+        """
+
+        old = self.source(old_digest)
+        new = self.source(new_digest)
+        if old is None or new is None:
+            return False
+
+        line_map = LineMap(old, new)
+        coverage = self.files[file_path]
+        for test_id, ranges in coverage.items():
+            coverage[test_id] = line_map.ranges(ranges)
+
+        self.digests[file_path] = new_digest
+        return True
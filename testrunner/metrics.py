@@ -0,0 +1,298 @@
+"""
+Timings of test runs: where time goes between file change
+and test results, over recent runs
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from collections import deque
+from os import path
+from time import time
+
+from lazy import LazyModule
+
+_log = logging.getLogger(__name__)
+
+# Imported on first use, metrics are not served by default
+BaseHTTPServer = LazyModule("BaseHTTPServer")
+
+# Moments of single run, first two are known to handler,
+# the rest to runner
+FIRST_EVENT = "first_event"
+SCHEDULED = "scheduled"
+SPAWNED = "spawned"
+FIRST_OUTPUT = "first_output"
+STAGE1_DONE = "stage1_done"
+STAGE2_DONE = "stage2_done"
+
+# Phase -> (from, to), from is the first known moment of candidates
+# (tests may print nothing, first stage may be cached), None as to is
+# the last known moment
+PHASES = (
+    ("debounce", (FIRST_EVENT,), SCHEDULED),
+    ("spawn", (SCHEDULED,), SPAWNED),
+    ("startup", (SPAWNED,), FIRST_OUTPUT),
+    ("stage1", (FIRST_OUTPUT, SPAWNED, SCHEDULED), STAGE1_DONE),
+    ("stage2", (STAGE1_DONE,), STAGE2_DONE),
+    ("total", (FIRST_EVENT,), None),
+)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def durations(marks):
+    """
+    Seconds spent in phases of run, only for phases with both moments known
+    """
+
+    result = {}
+    for phase, starts, end in PHASES:
+        ended = marks.get(end) if end is not None else \
+            max(marks.values() or [None])
+        if ended is None:
+            continue
+
+        for start in starts:
+            started = marks.get(start)
+            # First output may come from second stage
+            if started is not None and started <= ended:
+                result[phase] = ended - started
+                break
+
+    return result
+
+
+def percentile(ordered, quantile):
+    """
+    Nearest rank percentile of sorted values
+    """
+
+    if not ordered:
+        return None
+
+    rank = int(round(quantile * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+class RunStats(object):
+    """
+    Phase durations of last window runs. Runs are recorded by pool
+    callback thread, read by anyone
+    """
+
+    def __init__(self, window=100):
+        self.runs_total = 0
+        self._runs = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._runs)
+
+    def record(self, marks):
+        """
+        Record moments of finished run, returns durations of its phases
+        """
+
+        run = durations(marks)
+        with self._lock:
+            self._runs.append(run)
+            self.runs_total += 1
+
+        return run
+
+    def samples(self, phase):
+        with self._lock:
+            return sorted(run[phase] for run in self._runs if phase in run)
+
+    def percentiles(self, phase, quantiles=QUANTILES):
+        ordered = self.samples(phase)
+        return dict(
+            (quantile, percentile(ordered, quantile))
+            for quantile in quantiles
+        )
+
+    def summary(self, quantiles=QUANTILES):
+        """
+        Phase -> count, sum and percentiles over window
+        """
+
+        result = {}
+        for phase, _, _ in PHASES:
+            ordered = self.samples(phase)
+            if not ordered:
+                continue
+
+            result[phase] = {
+                "count": len(ordered),
+                "sum": sum(ordered),
+                "quantiles": dict(
+                    (quantile, percentile(ordered, quantile))
+                    for quantile in quantiles
+                ),
+            }
+
+        return result
+
+    def prometheus(self):
+        """
+        Stats in Prometheus text exposition format
+        """
+
+        return prometheus({None: self})
+
+
+def _labels(project, **labels):
+    if project is not None:
+        labels["project"] = project
+
+    if not labels:
+        return ""
+
+    return "{{{}}}".format(",".join(
+        '{}="{}"'.format(name, value)
+        for name, value in sorted(labels.items())))
+
+
+def prometheus(stats_by_project):
+    """
+    RunStats of projects (None: single project, no label) in Prometheus
+    text exposition format
+    """
+
+    projects = sorted(stats_by_project.items())
+    lines = [
+        "# HELP testrunner_runs_total Finished test runs",
+        "# TYPE testrunner_runs_total counter",
+    ]
+    for project, run_stats in projects:
+        lines.append("testrunner_runs_total{} {}".format(
+            _labels(project), run_stats.runs_total))
+
+    lines.extend([
+        "# HELP testrunner_phase_seconds Duration of test run phases "
+        "(recent runs)",
+        "# TYPE testrunner_phase_seconds summary",
+    ])
+    for project, run_stats in projects:
+        for phase, stats in sorted(run_stats.summary().items()):
+            for quantile, value in sorted(stats["quantiles"].items()):
+                lines.append("testrunner_phase_seconds{} {!r}".format(
+                    _labels(project, phase=phase, quantile=quantile), value))
+            lines.append("testrunner_phase_seconds_sum{} {!r}".format(
+                _labels(project, phase=phase), stats["sum"]))
+            lines.append("testrunner_phase_seconds_count{} {}".format(
+                _labels(project, phase=phase), stats["count"]))
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsLog(object):
+    """
+    JSON lines file with single run per line
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def write(self, marks, run_durations, result=None):
+        log_dir = path.dirname(self.file_path)
+        if log_dir and not path.isdir(log_dir):
+            os.makedirs(log_dir)
+
+        line = json.dumps({
+            "timestamp": time(),
+            "result": result,
+            "marks": marks,
+            "durations": run_durations,
+        }, sort_keys=True)
+
+        with open(self.file_path, "a") as dst:
+            dst.write(line + "\n")
+
+
+class MetricsServer(object):
+    """
+    Local HTTP endpoint serving stats for Prometheus (GET /metrics),
+    stats of several projects are told apart by project label
+    """
+
+    def __init__(self, stats, port, host="127.0.0.1", project=None):
+        self.stats = {project: stats}
+        self._server = BaseHTTPServer.HTTPServer(
+            (host, port), self._request_handler())
+        self._thread = None
+
+    def add(self, stats, project):
+        """
+        Serve stats of other project too
+        """
+
+        self.stats[project] = stats
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def _request_handler(self):
+        stats = self.stats
+
+        class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = prometheus(dict(stats))
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                _log.debug(fmt, *args)
+
+        return MetricsHandler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        _log.info("Metrics served on http://%s:%d/metrics",
+                  self._server.server_address[0], self.port)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Port -> MetricsServer, projects watched by one process share them
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def serve_metrics(stats, port, project=None):
+    """
+    Serve stats on port, server already serving other projects there
+    serves them too. Returns MetricsServer, None if port can not be used
+    (metrics are not served, tests run anyway)
+    """
+
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is not None:
+            server.add(stats, project)
+            return server
+
+        try:
+            server = MetricsServer(stats, port, project=project)
+        except socket.error as err:
+            _log.warning("Can not serve metrics on port %s: %s", port, err)
+            return None
+        _servers[port] = server
+
+    server.start()
+    return server
@@ -0,0 +1,381 @@
+"""
+Incremental parsers of test runner output, turning it into
+results of single tests while the output streams
+"""
+import logging
+import re
+from collections import namedtuple, OrderedDict
+from time import time
+
+_log = logging.getLogger(__name__)
+
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+SKIPPED = "skipped"
+
+TestResult = namedtuple("TestResult", "test_id outcome duration traceback")
+TestResult.__new__.__defaults__ = (None, None, None)
+
+
+class OutputParser(object):
+    """
+    File like object (pexpect logfile_read) parsing output line by line.
+
+    Callback gets TestResult whenever something new is known about test,
+    ie. first its outcome, later its traceback. Only results are kept,
+    not the output itself
+    """
+
+    # Partial line printed when test starts (verbose mode), used for duration
+    started_re = None
+    max_line = 1 << 16
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.results = OrderedDict()
+        self.tests_run = None
+        # When test process printed anything, for run timings
+        self.first_output = None
+
+        self._partial = u""
+        self._started = None
+
+    def write(self, data):
+        if self.first_output is None and data:
+            self.first_output = time()
+
+        lines = (self._partial + data).split(u"\n")
+        self._partial = lines.pop()
+
+        for line in lines:
+            self.parse_line(line.rstrip(u"\r"))
+
+        if len(self._partial) > self.max_line:
+            self.parse_line(self._partial)
+            self._partial = u""
+
+        self._check_started()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Output ended, parse what is left
+        """
+
+        if self._partial:
+            self.parse_line(self._partial.rstrip(u"\r"))
+            self._partial = u""
+
+        self.finish()
+
+    def parse_line(self, line):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def _check_started(self):
+        if self.started_re is None:
+            return
+
+        match = self.started_re.match(self._partial)
+        if match is None:
+            return
+
+        test_id = self.test_id(*match.groups())
+        if self._started is None or self._started[0] != test_id:
+            self._started = (test_id, time())
+
+    def duration(self, test_id):
+        if self._started is None or self._started[0] != test_id:
+            return None
+
+        return time() - self._started[1]
+
+    def test_id(self, *parts):
+        return u"".join(parts)
+
+    def emit(self, test_id, outcome=None, duration=None, traceback=None):
+        known = self.results.get(test_id) or TestResult(test_id)
+        result = TestResult(
+            test_id,
+            outcome or known.outcome,
+            duration if duration is not None else known.duration,
+            traceback if traceback is not None else known.traceback,
+        )
+
+        self.results[test_id] = result
+        if self.callback is not None:
+            self.callback(result)
+
+    def failed(self):
+        """
+        Ids of failed tests in order they were reported
+        """
+
+        return [
+            result.test_id for result in self.results.values()
+            if result.outcome in (FAILED, ERROR)
+        ]
+
+    def tracebacks(self):
+        """
+        Tracebacks of failed tests in order they were reported
+        """
+
+        return [
+            result.traceback for result in self.results.values()
+            if result.outcome in (FAILED, ERROR) and result.traceback
+        ]
+
+
+class UnittestParser(OutputParser):
+    """
+    Output of python -m unittest. Outcomes of passing tests
+    are known only in verbose mode (-v)
+    """
+
+    started_re = re.compile(r"^(\w+) \(([\w.]+)\) \.\.\. $")
+    outcome_re = re.compile(
+        r"^(\w+) \(([\w.]+)\) \.\.\. "
+        r"(ok|FAIL|ERROR|skipped|expected failure|unexpected success)")
+    failure_re = re.compile(r"^(FAIL|ERROR): (\w+) \(([\w.]+)\)$")
+    ran_re = re.compile(r"^Ran (\d+) tests? in")
+
+    outcomes = {
+        "ok": PASSED,
+        "FAIL": FAILED,
+        "ERROR": ERROR,
+        "skipped": SKIPPED,
+        "expected failure": PASSED,
+        "unexpected success": FAILED,
+    }
+
+    def __init__(self, callback=None):
+        super(UnittestParser, self).__init__(callback)
+        self._failure = None
+        self._traceback = []
+
+    def test_id(self, name, test_class):  # pylint: disable=arguments-differ
+        # Python 3.11+ prints full test id: test_add (pkg.TestCalc.test_add)
+        if test_class.endswith(u"." + name):
+            test_class = test_class[:-len(name) - 1]
+
+        return u"{}.{}".format(test_class, name)
+
+    def parse_line(self, line):
+        if line.startswith("=" * 70):
+            self._end_failure()
+            return
+
+        match = self.failure_re.match(line)
+        if match is not None:
+            self._end_failure()
+            kind, name, test_class = match.groups()
+            test_id = self.test_id(name, test_class)
+            self._failure = (test_id, self.outcomes[kind])
+            return
+
+        match = self.ran_re.match(line)
+        if match is not None:
+            self._end_failure()
+            self.tests_run = int(match.group(1))
+            return
+
+        if self._failure is not None:
+            self._traceback.append(line)
+            return
+
+        match = self.outcome_re.match(line)
+        if match is not None:
+            name, test_class, outcome = match.groups()
+            test_id = self.test_id(name, test_class)
+            self.emit(test_id, self.outcomes[outcome], self.duration(test_id))
+
+    def _end_failure(self):
+        if self._failure is None:
+            return
+
+        test_id, outcome = self._failure
+        lines = self._traceback
+        # Separators around traceback
+        while lines and (not lines[-1] or lines[-1].startswith("-" * 70)):
+            lines.pop()
+        if lines and lines[0].startswith("-" * 70):
+            lines.pop(0)
+
+        self.emit(test_id, outcome, traceback=u"\n".join(lines))
+        self._failure = None
+        self._traceback = []
+
+    def finish(self):
+        self._end_failure()
+
+
+class NoseParser(UnittestParser):
+    """
+    Output of nosetests, ids are in "module:Class.test" form
+    """
+
+    function_failure_re = re.compile(r"^(FAIL|ERROR): ([\w.]+)$")
+    function_outcome_re = re.compile(
+        r"^([\w.]+) \.\.\. (ok|FAIL|ERROR|SKIP|skipped)")
+
+    outcomes = dict(UnittestParser.outcomes, SKIP=SKIPPED)
+
+    def test_id(self, name, test_class=None):
+        if test_class is None:
+            # Test function, reported as module.function
+            module, _, name = name.rpartition(".")
+            return u"{}:{}".format(module, name) if module else name
+
+        module, _, class_name = test_class.rpartition(".")
+        return u"{}:{}.{}".format(module, class_name, name)
+
+    def parse_line(self, line):
+        # Test functions are reported with dotted names
+        match = self.function_failure_re.match(line)
+        if match is not None:
+            self._end_failure()
+            kind, name = match.groups()
+            self._failure = (self.test_id(name), self.outcomes[kind])
+            return
+
+        match = self.function_outcome_re.match(line)
+        if match is not None and self._failure is None:
+            name, outcome = match.groups()
+            self.emit(self.test_id(name), self.outcomes[outcome])
+            return
+
+        super(NoseParser, self).parse_line(line)
+
+
+class PytestParser(OutputParser):
+    """
+    Output of py.test. Outcomes of passing tests are known only
+    in verbose mode (-v), durations from --durations report
+    """
+
+    started_re = re.compile(r"^(\S+::\S+) $")
+    outcome_re = re.compile(
+        r"^(\S+::\S+) (PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS)\b")
+    summary_re = re.compile(r"^(FAILED|ERROR) (\S+::\S+)")
+    section_re = re.compile(r"^_{3,} (?:ERROR at \w+ of )?(.+?) _{3,}$")
+    duration_re = re.compile(r"^(\d+\.\d+)s (?:call|setup|teardown)\s+(\S+)$")
+    counts_re = re.compile(r"(\d+) (?:passed|failed|error|skipped|x\w+)")
+
+    outcomes = {
+        "PASSED": PASSED,
+        "FAILED": FAILED,
+        "ERROR": ERROR,
+        "SKIPPED": SKIPPED,
+        "XFAIL": PASSED,
+        "XPASS": FAILED,
+    }
+
+    def __init__(self, callback=None):
+        super(PytestParser, self).__init__(callback)
+        self._section = None
+        self._traceback = []
+        # Tracebacks of failure sections, by name used in section header
+        self._tracebacks = {}
+
+    def parse_line(self, line):
+        if line.startswith("==="):
+            self._end_section()
+            counts = self.counts_re.findall(line)
+            if counts:
+                self.tests_run = sum(int(count) for count in counts)
+            return
+
+        match = self.section_re.match(line)
+        if match is not None:
+            self._end_section()
+            self._section = match.group(1)
+            return
+
+        if self._section is not None:
+            self._traceback.append(line)
+            return
+
+        match = self.outcome_re.match(line)
+        if match is not None:
+            test_id, outcome = match.groups()
+            self.emit(test_id, self.outcomes[outcome], self.duration(test_id))
+            return
+
+        match = self.summary_re.match(line)
+        if match is not None:
+            outcome, test_id = match.groups()
+            traceback = self._tracebacks.pop(self.section_name(test_id), None)
+            if test_id not in self.results or traceback is not None:
+                self.emit(test_id, self.outcomes[outcome], traceback=traceback)
+            return
+
+        match = self.duration_re.match(line)
+        if match is not None:
+            duration, test_id = match.groups()
+            known = self.results.get(test_id)
+            total = float(duration) + ((known and known.duration) or 0)
+            self.emit(test_id, duration=total)
+
+    @staticmethod
+    def section_name(test_id):
+        """
+        Name of test in failure section header: Class.test_name
+        """
+
+        return test_id.split("::", 1)[-1].replace("::", ".")
+
+    def _end_section(self):
+        if self._section is None:
+            return
+
+        traceback = u"\n".join(self._traceback).strip(u"\n")
+
+        for test_id, result in self.results.items():
+            if result.outcome in (FAILED, ERROR) and \
+                    self.section_name(test_id) == self._section:
+                self.emit(test_id, traceback=traceback)
+                break
+        else:
+            # Outcome comes later in short summary
+            self._tracebacks[self._section] = traceback
+
+        self._section = None
+        self._traceback = []
+
+    def finish(self):
+        self._end_section()
+
+
+PARSERS = {
+    "unittest": UnittestParser,
+    "nose": NoseParser,
+    "pytest": PytestParser,
+}
+
+
+def guess_kind(test_cmd):
+    """
+    Test runner (key of PARSERS) used by command
+    """
+
+    if "py.test" in test_cmd or "pytest" in test_cmd:
+        return "pytest"
+    elif "nose" in test_cmd:
+        return "nose"
+
+    return "unittest"
+
+
+def parser_for(test_cmd, kind=None, callback=None):
+    """
+    Parser of output of test command, kind is guessed from command if
+    not given
+    """
+
+    return PARSERS[kind or guess_kind(test_cmd)](callback)
@@ -0,0 +1,279 @@
+"""
+Polling of directories which can not be watched by inotify
+(ie. fs.inotify.max_user_watches is exhausted). Changes are found
+by comparing snapshots of directories and handed to the same
+handler as inotify events
+"""
+import errno
+import logging
+import os
+import stat
+import threading
+from os import path
+from time import time
+
+import pyinotify
+
+try:
+    from os import scandir  # pylint: disable=no-name-in-module
+except ImportError:
+    try:
+        from scandir import scandir  # pylint: disable=import-error
+    except ImportError:
+        scandir = None
+
+_log = logging.getLogger(__name__)
+
+
+def list_dir(dir_path):
+    """
+    Entries of directory: name -> (is_dir, mtime, size, inode)
+    """
+
+    entries = {}
+    if scandir is not None:
+        for entry in scandir(dir_path):
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue  # removed in meantime
+            entries[entry.name] = _entry(entry_stat)
+        return entries
+
+    for name in os.listdir(dir_path):
+        try:
+            entry_stat = os.lstat(path.join(dir_path, name))
+        except OSError:
+            continue
+        entries[name] = _entry(entry_stat)
+
+    return entries
+
+
+def _entry(entry_stat):
+    return (stat.S_ISDIR(entry_stat.st_mode), entry_stat.st_mtime,
+            entry_stat.st_size, entry_stat.st_ino)
+
+
+def diff_dir(old, new):
+    """
+    Changes between two listings of directory as (mask, name, is_dir)
+    """
+
+    changes = []
+    for name, entry in sorted(new.items()):
+        old_entry = old.get(name)
+        if old_entry is None:
+            changes.append((pyinotify.IN_CREATE, name, entry[0]))
+        elif old_entry != entry and not entry[0]:
+            changes.append((pyinotify.IN_MODIFY, name, entry[0]))
+
+    for name in sorted(set(old).difference(new)):
+        changes.append((pyinotify.IN_DELETE, name, old[name][0]))
+
+    return changes
+
+
+class DirPoller(object):
+    """
+    Polls directories (not recursively, like single inotify watch)
+    and feeds changes to handler (pyinotify.ProcessEvent).
+
+    Interval grows up to max_interval while nothing changes, and
+    is kept above scan time * cost_factor
+    """
+
+    min_interval = 0.5
+    max_interval = 5.0
+    cost_factor = 20
+
+    def __init__(self, mask=pyinotify.ALL_EVENTS, exclude_filter=None):
+        self.mask = mask
+        self.exclude_filter = exclude_filter
+        self.interval = self.min_interval
+
+        self.handler = None
+        self._loop = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def __contains__(self, dir_path):
+        return dir_path in self._snapshots
+
+    @property
+    def dirs(self):
+        with self._lock:
+            return set(self._snapshots)
+
+    def attach(self, handler, loop=None):
+        """
+        Hand changes to handler, polling is done by loop (see engine)
+        or own thread once there is something to poll
+        """
+
+        self.handler = handler
+        self._loop = loop
+        if self._snapshots:
+            self._start()
+
+    def add(self, dirs):
+        for dir_path in dirs:
+            snapshot = self._listing(dir_path)
+            if snapshot is None:
+                continue
+
+            with self._lock:
+                self._snapshots.setdefault(dir_path, snapshot)
+
+        if self._snapshots and self.handler is not None:
+            self._start()
+
+    def remove(self, dirs):
+        with self._lock:
+            for dir_path in dirs:
+                self._snapshots.pop(dir_path, None)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _start(self):
+        if self._loop is not None:
+            if self._thread is None:
+                # Only marks polling as scheduled
+                self._thread = True
+                self._loop.call_later(self.interval, self._loop_poll)
+            return
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._poll_safe()
+
+    def _loop_poll(self):
+        if self._stopped.is_set():
+            return
+
+        self._poll_safe()
+        self._loop.call_later(self.interval, self._loop_poll)
+
+    def _poll_safe(self):
+        try:
+            self.poll()
+        except Exception:  # pylint: disable=broad-except
+            _log.exception("Polling of directories failed")
+
+    @staticmethod
+    def _listing(dir_path):
+        try:
+            return list_dir(dir_path)
+        except OSError as err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                _log.warning("Can not poll %s: %s", dir_path, err)
+            return None
+
+    def poll(self):
+        """
+        Compare directories with their snapshots, hand changes to handler.
+        Returns number of changes
+        """
+
+        started = time()
+        events = []
+        for dir_path in sorted(self.dirs):
+            events.extend(self._poll_dir(dir_path))
+
+        for event in events:
+            if self.handler is not None and event.mask & self.mask:
+                self.handler(event)
+
+        duration = time() - started
+        if events:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.interval = max(self.interval, duration * self.cost_factor)
+
+        return len(events)
+
+    def _poll_dir(self, dir_path):
+        with self._lock:
+            old = self._snapshots.get(dir_path)
+        if old is None:
+            return []
+
+        new = self._listing(dir_path)
+        if new is None:
+            self.remove([dir_path])
+            return [self._event(pyinotify.IN_DELETE_SELF, dir_path, "")]
+
+        with self._lock:
+            if dir_path in self._snapshots:
+                self._snapshots[dir_path] = new
+
+        events = []
+        for mask, name, is_dir in diff_dir(old, new):
+            entry_path = path.join(dir_path, name)
+            if is_dir and mask & pyinotify.IN_DELETE:
+                self.remove([entry_path])
+            elif is_dir and mask & pyinotify.IN_CREATE:
+                if self.exclude_filter and self.exclude_filter(entry_path):
+                    continue
+                # Like auto_add of inotify watches
+                events.append(self._event(mask, dir_path, name, is_dir))
+                events.extend(self._new_dir(entry_path))
+                continue
+
+            events.append(self._event(mask, dir_path, name, is_dir))
+
+        return events
+
+    def _new_dir(self, dir_path):
+        """
+        Start polling new dir, its content is reported as created
+        """
+
+        snapshot = self._listing(dir_path)
+        if snapshot is None:
+            return []
+
+        with self._lock:
+            self._snapshots[dir_path] = snapshot
+
+        events = []
+        for name, entry in sorted(snapshot.items()):
+            entry_path = path.join(dir_path, name)
+            is_dir = entry[0]
+            if is_dir and self.exclude_filter and \
+                    self.exclude_filter(entry_path):
+                continue
+
+            events.append(
+                self._event(pyinotify.IN_CREATE, dir_path, name, is_dir))
+            if is_dir:
+                events.extend(self._new_dir(entry_path))
+
+        return events
+
+    @staticmethod
+    def _event(mask, dir_path, name, is_dir=False):
+        if is_dir:
+            mask |= pyinotify.IN_ISDIR
+
+        return pyinotify.Event({
+            "wd": -1,
+            "mask": mask,
+            "cookie": 0,
+            "path": dir_path,
+            "name": name,
+            "dir": is_dir,
+        })
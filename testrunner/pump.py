@@ -0,0 +1,102 @@
+"""
+Output of test process pumped from its pseudo terminal to parser,
+capture and console in large chunks, without buffering it
+"""
+import codecs
+import errno
+import os
+import select
+from time import time
+
+# Test process waits for input after these (see Runner.run_test)
+PROMPTS = (u"ipdb>", u"(Pdb)")
+
+
+def read_terminal(fd, size):
+    """
+    Next bytes of output read from master side of pseudo terminal,
+    empty once output ended
+    """
+
+    try:
+        return os.read(fd, size)
+    except OSError as err:
+        # Linux reports closed slave side as EIO
+        if err.errno not in (errno.EIO, errno.EBADF):
+            raise
+        return b""
+
+
+class OutputPump(object):
+    """
+    Reads fd (master side of pseudo terminal) until output ends or test
+    process stops at debugger prompt, text goes to files. on_tick is
+    called every interval seconds, whether there is output or not
+    """
+
+    block_size = 1 << 16
+
+    def __init__(self, fd, files, on_tick=None, interval=1,
+                 prompts=PROMPTS):
+        self.fd = fd
+        self.files = files
+        self.on_tick = on_tick
+        self.interval = interval
+        self.prompts = prompts
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        # End of output, prompt can be split between chunks
+        self._tail = u""
+        self._tail_size = 2 * max(len(prompt) for prompt in prompts)
+
+    def run(self):
+        """
+        Pump output, returns True if test process stopped in debugger
+        """
+
+        next_tick = time() + self.interval
+        while True:
+            ready = self._wait(max(next_tick - time(), 0))
+            if time() >= next_tick:
+                if self.on_tick is not None:
+                    self.on_tick()
+                next_tick = time() + self.interval
+            if not ready:
+                continue
+
+            data = self._read()
+            if not data:
+                self._forward(self._decoder.decode(b"", True))
+                return False
+
+            text = self._decoder.decode(data)
+            self._forward(text)
+            if self._at_prompt(text):
+                return True
+
+    def _wait(self, timeout):
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return False
+
+        return bool(ready)
+
+    def _read(self):
+        return read_terminal(self.fd, self.block_size)
+
+    def _forward(self, text):
+        if not text:
+            return
+
+        for dst in self.files:
+            dst.write(text)
+
+    def _at_prompt(self, text):
+        if not text:
+            return False
+
+        self._tail = (self._tail + text[-self._tail_size:])[-self._tail_size:]
+        return self._tail.rstrip().endswith(self.prompts)
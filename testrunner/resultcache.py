@@ -0,0 +1,133 @@
+"""
+Outcomes of test modules cached on disk, by hash of everything
+test module depends on
+"""
+import hashlib
+import json
+import logging
+import os
+from os import path
+from time import time
+
+_log = logging.getLogger(__name__)
+
+RESULTS_DIR = "results"
+
+
+def results_dir(state_dir):
+    return path.join(state_dir, RESULTS_DIR)
+
+
+def closure_key(index, name, digest, salt=u""):
+    """
+    Hash of test module, modules it imports (directly or not)
+    and salt (ie. test command, data files).
+
+    digest returns content hash of file
+    """
+
+    key = hashlib.sha1(salt.encode("utf-8"))
+    for dependency in sorted(index.dependencies(name)):
+        key.update(u"\0{}\0{}".format(
+            dependency, digest(index.file_path(dependency))).encode("utf-8"))
+
+    return key.hexdigest()
+
+
+def failed_in(test_name, test_id):
+    """
+    Test id (as reported by parser) belongs to test module
+    given as module name or path
+    """
+
+    if "::" in test_id:
+        # py.test ids are relative to its root dir
+        id_path = test_id.split("::", 1)[0]
+        return test_name == id_path or test_name.endswith(os.sep + id_path)
+
+    return test_id == test_name or \
+        test_id.startswith(test_name + ".") or \
+        test_id.startswith(test_name + ":")
+
+
+class ResultCache(object):
+    """
+    Directory with file per cached outcome. Files are touched when used,
+    least recently used are removed above max_size entries
+    """
+
+    def __init__(self, cache_dir, max_size=1000):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        return path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path) as src:
+                entry = json.load(src)
+            os.utime(entry_path, None)
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            _log.debug("Broken cache entry %s", entry_path)
+            return None
+
+        return entry.get("outcome")
+
+    def passed(self, keys):
+        """
+        Tests (from test -> key mapping) cached as passing
+        """
+
+        return set(
+            test_name for test_name, key in keys.items()
+            if self.get(key) == "passed"
+        )
+
+    def store(self, keys, outcome="passed"):
+        if not keys:
+            return
+
+        if not path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        stored = time()
+        for test_name, key in keys.items():
+            with open(self._entry_path(key), "w") as dst:
+                json.dump({
+                    "test": test_name,
+                    "outcome": outcome,
+                    "stored": stored,
+                }, dst)
+
+        self.evict()
+
+    def evict(self):
+        try:
+            names = [
+                name for name in os.listdir(self.cache_dir)
+                if name.endswith(".json")
+            ]
+        except OSError:
+            return
+
+        if len(names) <= self.max_size:
+            return
+
+        entries = []
+        for name in names:
+            entry_path = path.join(self.cache_dir, name)
+            try:
+                entries.append((os.stat(entry_path).st_mtime, entry_path))
+            except OSError:
+                continue
+
+        entries.sort()
+        for _, entry_path in entries[:len(entries) - self.max_size]:
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
@@ -1,59 +1,533 @@
+import errno
 import logging
+import os
+import signal
 import sys
+from collections import namedtuple
+from threading import Timer
+from time import time
 
-import pexpect
+from capture import OutputCapture
+from history import (
+    DurationHistory, RunHistory, durations_file, history_file
+)
+from lazy import LazyModule
+from metrics import FIRST_OUTPUT, SPAWNED, STAGE1_DONE, STAGE2_DONE
+from parsers import ERROR, FAILED, parser_for
+from pump import OutputPump
 
 _log = logging.getLogger(__name__)
 
+# Imported on first use, not needed to start watching
+distributed = LazyModule("testrunner.distributed")
+multiprocessing = LazyModule("multiprocessing")
+multiprocessing_pool = LazyModule("multiprocessing.pool")
+pexpect = LazyModule("pexpect")
+resultcache = LazyModule("testrunner.resultcache")
+sharding = LazyModule("testrunner.sharding")
+zygote = LazyModule("testrunner.zygote")
+
+# RunControl of pool worker process, see init_worker
+control = None
+
+# Output captured during current run of project (by WATCH_DIR), kept in
+# process: Runner is pickled to pool worker for each run
+_captures = {}
+
+# Single test process of run: command (list of commands - shards run in
+# parallel) and options of Runner.run_test
+Step = namedtuple("Step", "cmd options")
+
+# Finished shard: outcome, output (see OutputCapture.summary), failed
+# test ids, seconds it took and durations of single tests reported by parser
+ShardResult = namedtuple(
+    "ShardResult", "result output failed elapsed durations")
+
+
+def init_worker(run_control):
+    """
+    Pool initializer, makes run control available to Runner in worker
+    """
+
+    global control  # pylint: disable=global-statement
+    control = run_control
+
+
+def kill_group(pid, sig):
+    """
+    Signal process group of test process (pexpect children are session
+    leaders), so processes started by tests go away too
+    """
+
+    try:
+        os.killpg(pid, sig)
+    except OSError as err:
+        if err.errno != errno.ESRCH:
+            raise
+
+
+class RunControl(object):
+    """
+    State of test run shared by handler and pool worker,
+    allows handler to cancel running tests
+    """
+
+    def __init__(self, grace_period=1):
+        self.grace_period = grace_period
+        self._pid = multiprocessing.Value("i", 0)
+        self._cancelled = multiprocessing.Event()
+
+    def started(self, pid):
+        self._pid.value = pid
+
+    def finished(self):
+        self._pid.value = 0
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def reset(self):
+        self._cancelled.clear()
+
+    def cancel(self):
+        """
+        Stop current run: TERM test process, KILL it after grace period
+        """
+
+        self._cancelled.set()
+
+        pid = self._pid.value
+        if not pid:
+            return
+
+        _log.info("Cancelling test process %d", pid)
+        kill_group(pid, signal.SIGTERM)
+
+        timer = Timer(self.grace_period, kill_group, [pid, signal.SIGKILL])
+        timer.daemon = True
+        timer.start()
+
+
+class RunResult(tuple):
+    """
+    (result, info) of test run, with moments of run known to runner
+    and cache keys of test modules which passed (handler caches them)
+    """
+
+    def __new__(cls, result, info, timings=None, passed_keys=None):
+        run_result = super(RunResult, cls).__new__(cls, (result, info))
+        run_result.timings = timings or {}
+        run_result.passed_keys = passed_keys or {}
+        return run_result
+
+    def __reduce__(self):
+        return RunResult, (self[0], self[1], self.timings, self.passed_keys)
+
 
 class Runner(object):
-    def __init__(self):
-        self._excepted = [pexpect.EOF, u"ipdb>", u"(Pdb)"]
+    timings = None
+    # Test -> cache key of test modules passed in last run
+    passed_keys = None
+    # Control of runs driven in the same process, see engine
+    run_control = None
+    # ShardResults of last sharded step
+    last_shards = None
+    # Seconds between checks of cancel of shards
+    poll_interval = 1
+
+    def __init__(self, options=None):
         self.last_traceback = ""
+        self.last_failed = []
+        self.options = options or {}
+
+    def cancelled(self):
+        run_control = self.run_control or control
+        return run_control is not None and run_control.cancelled()
+
+    def mark(self, moment, timestamp=None):
+        """
+        Remember when moment of run happened first time
+        """
+
+        if self.timings is not None and timestamp is not None:
+            self.timings.setdefault(moment, timestamp)
+
+    def spawn(self, test_cmd):
+        if self.options.get("RUNNER_MODE") == "fork":
+            proc = zygote.spawn(
+                test_cmd, self.options.get("PRELOAD_MODULES") or ())
+            if proc is not None:
+                return proc
+
+        return pexpect.spawnu(test_cmd)
+
+    def parser(self, test_cmd):
+        """
+        Parser of test output, results are known as soon as they are printed
+        """
+
+        return parser_for(test_cmd, self.options.get("RESULT_PARSER"),
+                          callback=self.on_result)
+
+    def capture(self):
+        """
+        Output of test process, kept until next run
+        """
+
+        capture = OutputCapture(self.options.get("OUTPUT_MEMORY") or 1 << 20)
+        _captures.setdefault(self.options.get("WATCH_DIR"), []).append(
+            capture)
+        return capture
+
+    def discard_output(self):
+        """
+        Remove output of previous run
+        """
+
+        for capture in _captures.pop(self.options.get("WATCH_DIR"), ()):
+            capture.discard()
+
+    @staticmethod
+    def on_result(result):
+        if result.outcome in (FAILED, ERROR) and result.traceback is None:
+            _log.info(u"%s: %s", result.outcome.upper(), result.test_id)
 
     def run_test(self, test_cmd, progress=False):
         _log.debug("To run: %s", test_cmd)
 
         self.last_traceback = ""
-        proc = pexpect.spawnu(test_cmd)
+        proc = self.spawn(test_cmd)
+        self.mark(SPAWNED, time())
+        parser = self.parser(test_cmd)
+        capture = self.capture()
+        files = [parser, capture]
+        if control is not None:
+            control.started(proc.pid)
+            # Cancelled before handler could know the pid
+            if control.cancelled():
+                kill_group(proc.pid, signal.SIGKILL)
 
         if progress:
-            proc.logfile = sys.stderr
+            files.append(sys.stderr)
 
-        state = proc.expect(self._excepted, timeout=5)
+        try:
+            if self.pump(proc, files):
+                _log.info(capture.tail().rstrip("\r\n"))
+                proc.sendline("")
+                proc.interact()
 
-        if state != 0:
-            _log.info(proc.before.rstrip("\r\n"))
-            proc.sendline("")
-            proc.interact()
+            proc.close()
+        finally:
+            if control is not None:
+                control.finished()
 
-        proc.close()
+        return self.test_finished(parser, proc.exitstatus, capture)
+
+    def pump(self, proc, files, on_tick=None):
+        """
+        Pass output of test process to files until it ends, returns True
+        if it stopped in debugger (see OutputPump)
+        """
 
-        test_result = proc.exitstatus == 0
+        return OutputPump(proc.child_fd, files, on_tick,
+                          self.poll_interval).run()
+
+    def test_finished(self, parser, exitstatus, capture):
+        """
+        Outcome of finished test process
+        """
+
+        parser.close()
+        capture.close()
+        self.mark(FIRST_OUTPUT, parser.first_output)
+        self.last_failed = parser.failed()
+        test_result = exitstatus == 0
 
         if not test_result:
-            self.last_traceback = proc.before
-            _log.error(u"\n{}".format(proc.before))
+            self.last_traceback = capture.summary(parser.tracebacks())
+            _log.error(u"\n{}".format(self.last_traceback))
 
         return test_result
 
-    def __call__(self, test_cmd, suite_cmd=None):
-        if not self.run_test(test_cmd, progress=False):
-            msg = "Tests failed"
-            _log.error(msg)
-            return False, msg
+    def run_shard(self, test_cmd, cwd=None):
+        """
+        Run single shard to the end, returns (result, output, failed tests).
+        Shards run in parallel, so debugger can not be used there
+        """
+
+        _log.debug("To run shard: %s", test_cmd)
+
+        started = time()
+        proc = pexpect.spawnu(test_cmd, cwd=cwd)
+        self.mark(SPAWNED, time())
+        parser = self.parser(test_cmd)
+        capture = self.capture()
+
+        def check_cancelled():
+            if self.cancelled():
+                kill_group(proc.pid, signal.SIGKILL)
+
+        self.pump(proc, [parser, capture], on_tick=check_cancelled)
+        proc.close()
+        return self.shard_finished(
+            parser, proc.exitstatus, capture, time() - started)
+
+    def shard_finished(self, parser, exitstatus, capture, elapsed):
+        """
+        Outcome of finished shard process as ShardResult
+        """
+
+        parser.close()
+        capture.close()
+        self.mark(FIRST_OUTPUT, parser.first_output)
+
+        durations = dict(
+            (result.test_id, result.duration)
+            for result in parser.results.values()
+            if result.duration is not None
+        )
+        return ShardResult(exitstatus == 0,
+                           capture.summary(parser.tracebacks()),
+                           parser.failed(), elapsed, durations)
+
+    def run_shards(self, test_cmds):
+        """
+        Run commands in parallel processes, result is fine only
+        if all of them are fine
+        """
+
+        self.last_traceback = ""
+        pool = multiprocessing_pool.ThreadPool(len(test_cmds))
+        try:
+            results = pool.map(self.run_shard, test_cmds)
+        finally:
+            pool.close()
+
+        return self.shards_finished(test_cmds, results)
+
+    def run_remote_shards(self, test_cmds):
+        """
+        Run commands on SUITE_WORKERS (see distributed), result is fine
+        only if all of them are fine
+        """
+
+        self.last_traceback = ""
+        coordinator = distributed.Coordinator(
+            self, self.options.get("SUITE_WORKERS"))
+        return self.shards_finished(test_cmds, coordinator.run(test_cmds))
+
+    def shards_finished(self, test_cmds, results):
+        """
+        Outcome of finished shards, ShardResult each
+        """
+
+        self.last_shards = results
+        failed = [
+            (idx, shard.output) for idx, shard in enumerate(results)
+            if not shard.result
+        ]
+        self.last_failed = [
+            test_id for shard in results for test_id in shard.failed
+        ]
+
+        tracebacks = []
+        for idx, output in failed:
+            tracebacks.append(u"Shard {}/{}: {}\n{}".format(
+                idx + 1, len(test_cmds), test_cmds[idx], output))
+
+        self.last_traceback = u"\n".join(tracebacks)
+        if failed:
+            _log.error(u"\n{}".format(self.last_traceback))
+
+        return not failed
+
+    def __call__(self, test_cmd, suite_cmd=None, failed_cmd=None,
+                 cache_keys=None, shards=None, failed_tests=None):
+        self.timings = {}
+        # Result has to be always delivered, handler waits for it
+        try:
+            result, info = self.run_stages(
+                test_cmd, suite_cmd, failed_cmd, cache_keys, shards,
+                failed_tests)
+        except Exception as err:  # pylint: disable=broad-except
+            _log.exception("Running tests failed")
+            result, info = False, u"Running tests failed: {}".format(err)
+
+        return RunResult(result, info, self.timings, self.passed_keys)
+
+    def history(self):
+        """
+        Outcomes of earlier runs, None if state is not persisted
+        """
+
+        state_dir = self.options.get("STATE_DIR")
+        if not state_dir:
+            return None
+
+        return RunHistory(history_file(state_dir)).load()
+
+    def run_stages(self, test_cmd, suite_cmd=None, failed_cmd=None,
+                   cache_keys=None, shards=None, failed_tests=None):
+        """
+        Run stages one after another, returns (result, info)
+        """
+
+        stages = self.stages(
+            test_cmd, suite_cmd, failed_cmd, cache_keys, shards, failed_tests)
+        try:
+            step = next(stages)
+            while isinstance(step, Step):
+                step = stages.send(self.run_step(step))
+        finally:
+            stages.close()
+
+        return step
+
+    def run_step(self, step):
+        if isinstance(step.cmd, list) and self.options.get("SUITE_WORKERS"):
+            return self.run_remote_shards(step.cmd)
+        if isinstance(step.cmd, list):
+            return self.run_shards(step.cmd)
+
+        return self.run_test(step.cmd, **step.options)
+
+    def stages(self, test_cmd, suite_cmd=None, failed_cmd=None,
+               cache_keys=None, shards=None, failed_tests=None):
+        """
+        Stages of run as generator: yields Step to run and gets its result
+        back, last item is (result, info). Leaves running of test processes
+        to caller (run_stages or engine).
+
+        Shards are tests of suite commands, durations of their test
+        modules are recorded. Failed tests are ones failed_cmd runs,
+        all failing ones when they are not known
+        """
+
+        history = self.history()
+        self.last_shards = None
+        self.passed_keys = {}
+        self.discard_output()
+        try:
+            if failed_cmd:
+                # Tests failing last time, see FileChangeHandler.failed_tests
+                failing = failed_tests
+                if failing is None:
+                    failing = history.failing() if history is not None else ()
+                failed_result = yield Step(failed_cmd, {})
+                fail_fast = self.options.get("FAIL_FAST")
+                # Runner stopped on first failure, the rest did not run
+                if fail_fast and not failed_result:
+                    failing = ()
+                self.record(history, failed_result, failing)
+
+                if not failed_result and fail_fast:
+                    self.mark(STAGE1_DONE, time())
+                    msg = u"Previously failed tests still fail"
+                    _log.error(msg)
+                    yield False, msg
+                    return
+
+                if self.cancelled():
+                    yield False, u"Tests cancelled"
+                    return
+
+            if test_cmd is not None:
+                test_result = yield Step(test_cmd, {"progress": False})
+                self.record(history, test_result)
+                self.passed_keys = self.passed_modules(
+                    cache_keys, test_result)
+                msg = u"Tests are fine \u263A"
+            elif cache_keys is None:
+                # Suite on its own, see FileChangeHandler.start_suite_async
+                test_result = True
+                msg = u"Running test suite"
+            else:
+                # Results of all tests are cached
+                test_result = True
+                msg = u"Tests are fine (cached) \u263A"
+            self.mark(STAGE1_DONE, time())
+
+            if not test_result:
+                msg = "Tests failed"
+                _log.error(msg)
+                yield False, msg
+                return
+
+            _log.info(msg)
+
+            if not suite_cmd:
+                yield True, msg
+                return
+
+            if self.cancelled():
+                yield False, u"Tests cancelled"
+                return
+
+            suite_result = yield Step(suite_cmd, {})
+            self.mark(STAGE2_DONE, time())
+            self.record(history, suite_result)
+            self.record_durations(shards)
+
+            if not suite_result:
+                msg = u"Test suite failed"
+                _log.error(msg)
+                yield False, msg
+                return
+
+            _log.info(u"Test suite run fine too \u263A")
+
+            yield True, u"All tests are fine \u263A"
+        finally:
+            if history is not None:
+                history.save()
+
+    def record(self, history, result, run_tests=()):
+        if history is not None:
+            history.record_run(self.last_failed, result, run_tests)
+
+    def record_durations(self, shards):
+        """
+        Remember how long test modules of finished shards took,
+        report expected and real time of shards
+        """
+
+        state_dir = self.options.get("STATE_DIR")
+        results = self.last_shards
+        if not shards or not state_dir or self.cancelled() or \
+                results is None or len(results) != len(shards):
+            return
+
+        history = DurationHistory(durations_file(state_dir)).load()
+        known = history.durations()
+
+        for idx, (tests, shard) in enumerate(zip(shards, results)):
+            expected = sum(sharding.estimate_durations(tests, known).values())
+            _log.info("Shard %d/%d: %d test modules expected %.2fs, "
+                      "took %.2fs", idx + 1, len(shards), len(tests),
+                      expected, shard.elapsed)
+
+            durations = sharding.module_durations(
+                tests, shard.elapsed, shard.durations)
+            for test_name, duration in durations.items():
+                history.record(test_name, duration)
 
-        msg = u"Tests are fine \u263A"
-        _log.info(msg)
+        history.save()
 
-        if not suite_cmd:
-            return True, msg
+    def passed_modules(self, cache_keys, result):
+        """
+        Test -> cache key of passing test modules of finished run,
+        handler caches them (see FileChangeHandler.cache_results)
+        """
 
-        if not self.run_test(suite_cmd):
-            msg = u"Test suite failed"
-            _log.error(msg)
-            return False, msg
+        if not cache_keys:
+            return {}
 
-        _log.info(u"Test suite run fine too \u263A")
+        # Modules of cancelled or crashed run may not have run at all
+        if self.cancelled() or not result and not self.last_failed:
+            return {}
 
-        return True, u"All tests are fine \u263A"
+        return dict(
+            (test_name, key) for test_name, key in cache_keys.items()
+            if not any(resultcache.failed_in(test_name, test_id)
+                       for test_id in self.last_failed)
+        )
@@ -0,0 +1,87 @@
+"""
+Splitting tests into shards run in parallel
+"""
+import heapq
+
+from lazy import LazyModule
+from resultcache import failed_in
+
+multiprocessing = LazyModule("multiprocessing")
+
+# Expected seconds of test module when nothing is known
+DEFAULT_DURATION = 1.0
+
+
+def shard_count(configured, tests_count):
+    """
+    Number of shards, by default as many as CPUs
+    """
+
+    count = configured or multiprocessing.cpu_count()
+    return max(1, min(count, tests_count))
+
+
+def split_tests(tests, count):
+    """
+    Split tests round robin into count shards
+    """
+
+    shards = [[] for _ in range(count)]
+    for idx, test in enumerate(sorted(tests)):
+        shards[idx % count].append(test)
+
+    return [shard for shard in shards if shard]
+
+
+def estimate_durations(tests, known):
+    """
+    Expected seconds of tests from known durations, tests without
+    history are expected to take as long as median of known ones
+    """
+
+    ordered = sorted(known.values())
+    default = ordered[len(ordered) // 2] if ordered else DEFAULT_DURATION
+
+    return dict((test, known.get(test, default)) for test in tests)
+
+
+def balance_tests(tests, count, durations):
+    """
+    Longest processing time first: slowest tests go first, each to
+    shard expected to end soonest. Returns [(tests, expected seconds)]
+    """
+
+    shards = [(0.0, idx, []) for idx in range(count)]
+    for test in sorted(tests, key=lambda name: (-durations[name], name)):
+        expected, idx, shard = heapq.heappop(shards)
+        shard.append(test)
+        heapq.heappush(shards, (expected + durations[test], idx, shard))
+
+    return [
+        (sorted(shard), expected)
+        for expected, _, shard in sorted(shards, key=lambda item: item[1])
+        if shard
+    ]
+
+
+def module_durations(tests, elapsed, test_durations):
+    """
+    Seconds spent in test modules of shard. Durations reported for
+    single tests are summed, the rest of shard time is split among
+    modules without them
+    """
+
+    durations = {}
+    for test_id, duration in test_durations.items():
+        for test in tests:
+            if failed_in(test, test_id):
+                durations[test] = durations.get(test, 0.0) + duration
+                break
+
+    unknown = [test for test in tests if test not in durations]
+    if unknown:
+        rest = max(elapsed - sum(durations.values()), 0.0)
+        for test in unknown:
+            durations[test] = rest / len(unknown)
+
+    return durations
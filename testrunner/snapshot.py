@@ -0,0 +1,56 @@
+"""
+Dependency index and content hashes saved between runs, so start up
+parses and hashes only files which changed in meantime
+"""
+import json
+import logging
+from os import path
+
+from history import dump_json
+
+_log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "index.json"
+# Snapshots of other version (ie. other parsing of imports) are ignored
+VERSION = 1
+
+
+def snapshot_file(state_dir):
+    return path.join(state_dir, SNAPSHOT_FILE)
+
+
+class IndexSnapshot(object):
+    """
+    DependencyIndex.snapshot and ContentHashCache.snapshot in JSON file
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.index = None
+        self.hashes = []
+
+    def load(self):
+        try:
+            with open(self.file_path) as src:
+                document = json.load(src)
+        except (IOError, OSError):
+            return self
+        except ValueError:
+            _log.warning("Snapshot %s is broken, ignoring it", self.file_path)
+            return self
+
+        if not isinstance(document, dict) or \
+                document.get("version") != VERSION:
+            _log.info("Snapshot %s is outdated, ignoring it", self.file_path)
+            return self
+
+        self.index = document.get("index")
+        self.hashes = document.get("hashes") or []
+        return self
+
+    def save(self):
+        dump_json(self.file_path, {
+            "version": VERSION,
+            "index": self.index,
+            "hashes": self.hashes,
+        })
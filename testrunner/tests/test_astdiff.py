@@ -0,0 +1,204 @@
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.astdiff import (
+    BODY, INTERFACE, NOOP, FingerprintCache, classify, fingerprint,
+    symbol_test_id
+)
+
+SOURCE = '''\
+"""
+Module
+"""
+import os
+
+LIMIT = 10
+
+
+def a(x):
+    """
+    Function
+    """
+    return x + 1
+
+
+class B(object):
+    name = "b"
+
+    def c(self):
+        return os.sep
+'''
+
+
+class TestClassify(TestCase):
+
+    def change(self, old, new):
+        return classify(fingerprint(old), fingerprint(new))
+
+    def test_same(self):
+        self.assertEqual(self.change(SOURCE, SOURCE), (NOOP, None))
+
+    def test_comments_and_formatting(self):
+        new = SOURCE.replace("x + 1", "(x +\n            1)  # next") + \
+            "\n# end\n"
+
+        self.assertEqual(self.change(SOURCE, new).kind, NOOP)
+
+    def test_docstrings(self):
+        new = SOURCE.replace("Function", "Adds one").replace("Module", "")
+
+        self.assertEqual(self.change(SOURCE, new).kind, NOOP)
+
+    def test_function_body(self):
+        new = SOURCE.replace("x + 1", "x + 2")
+
+        self.assertEqual(self.change(SOURCE, new), (BODY, ["a"]))
+
+    def test_method_body(self):
+        new = SOURCE.replace("return os.sep", "return os.pathsep")
+
+        self.assertEqual(self.change(SOURCE, new), (BODY, ["B.c"]))
+
+    def test_class_body(self):
+        """
+        Statements of class other than methods are its body
+        """
+
+        new = SOURCE.replace('name = "b"', 'name = "B"')
+
+        self.assertEqual(self.change(SOURCE, new), (BODY, ["B"]))
+
+    def test_signature(self):
+        new = SOURCE.replace("def a(x):", "def a(x, y=1):")
+
+        self.assertEqual(self.change(SOURCE, new), (INTERFACE, None))
+
+    def test_module_statement(self):
+        new = SOURCE.replace("LIMIT = 10", "LIMIT = 11")
+
+        self.assertEqual(self.change(SOURCE, new).kind, INTERFACE)
+
+    def test_function_added(self):
+        new = SOURCE + "\n\ndef d():\n    pass\n"
+
+        self.assertEqual(self.change(SOURCE, new).kind, INTERFACE)
+
+    def test_syntax_error(self):
+        new = SOURCE.replace("def a(x):", "def a(x:")
+
+        self.assertIsNone(fingerprint(new))
+        self.assertEqual(self.change(SOURCE, new).kind, INTERFACE)
+
+
+class TestFingerprintCache(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.file_path = self.tmp.putfile("mod.py", SOURCE)
+        self.cache = FingerprintCache()
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_unknown_file(self):
+        changes = self.cache.changes([self.file_path, self.tmp.join("a.txt")])
+
+        self.assertEqual(changes, {self.file_path: (INTERFACE, None)})
+        self.assertIn(self.file_path, self.cache)
+
+    def test_changes_compared_to_last_seen(self):
+        self.cache.change(self.file_path)
+        self.tmp.putfile("mod.py", SOURCE + "# comment\n")
+        noop = self.cache.change(self.file_path)
+        self.tmp.putfile("mod.py", SOURCE.replace("x + 1", "x - 1"))
+        body = self.cache.change(self.file_path)
+
+        self.assertEqual(noop.kind, NOOP)
+        self.assertEqual(body, (BODY, ["a"]))
+
+    def test_test_classes(self):
+        self.assertIsNone(self.cache.test_classes(self.file_path))
+
+        self.cache.change(self.file_path)
+
+        self.assertEqual(self.cache.test_classes(self.file_path),
+                         frozenset(["B"]))
+
+    def test_deleted_file(self):
+        self.cache.change(self.file_path)
+
+        change = self.cache.change(self.tmp.join("missing.py"))
+
+        self.assertEqual(change.kind, INTERFACE)
+        self.assertNotIn(self.tmp.join("missing.py"), self.cache)
+
+    def test_bounded(self):
+        cache = FingerprintCache(max_size=1)
+        other = self.tmp.putfile("other.py", "X = 1\n")
+
+        cache.change(self.file_path)
+        cache.change(other)
+
+        self.assertEqual(len(cache), 1)
+        self.assertIn(other, cache)
+
+
+class TestSymbolTestId(TestCase):
+
+    classes = frozenset(["TestA"])
+
+    def test_unittest(self):
+        self.assertEqual(
+            symbol_test_id("unittest", "pkg.test_a", "TestA.test_b",
+                           self.classes),
+            "pkg.test_a.TestA.test_b")
+        self.assertIsNone(symbol_test_id(
+            "unittest", "pkg.test_a", "test_b", self.classes))
+
+    def test_nose(self):
+        self.assertEqual(
+            symbol_test_id("nose", "pkg.test_a", "TestA.test_b",
+                           self.classes),
+            "pkg.test_a:TestA.test_b")
+        self.assertEqual(
+            symbol_test_id("nose", "pkg.test_a", "test_b", self.classes),
+            "pkg.test_a:test_b")
+
+    def test_pytest(self):
+        self.assertEqual(
+            symbol_test_id("pytest", "/src/test_a.py", "TestA.test_b",
+                           self.classes),
+            "/src/test_a.py::TestA::test_b")
+
+    def test_not_test(self):
+        self.assertIsNone(symbol_test_id(
+            "nose", "pkg.test_a", "TestA.setUp", self.classes))
+        self.assertIsNone(symbol_test_id(
+            "pytest", "/src/test_a.py", "TestA", self.classes))
+
+    def test_base_class(self):
+        """
+        Tests of base classes and mixins run in their subclasses
+        """
+
+        self.assertIsNone(symbol_test_id(
+            "unittest", "pkg.test_a", "Base.test_b", self.classes))
+        self.assertIsNone(symbol_test_id(
+            "unittest", "pkg.test_a", "TestA.test_b", None))
+        self.assertIsNone(symbol_test_id(
+            "pytest", "/src/test_a.py", "TestA.Nested.test_b",
+            self.classes))
+
+
+class TestConcreteClasses(TestCase):
+
+    def test_classes(self):
+        source = (
+            "class Mixin(object):\n    pass\n"
+            "class Base(TestCase):\n    pass\n"
+            "class TestA(Mixin, Base):\n    pass\n"
+            "class TestB(mod.Base):\n    pass\n")
+
+        self.assertEqual(fingerprint(source)[2],
+                         frozenset(["TestA", "TestB"]))
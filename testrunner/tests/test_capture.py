@@ -0,0 +1,87 @@
+import io
+import os
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.capture import OutputCapture
+
+
+class TestOutputCapture(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+
+    def tearDown(self):
+        del self.tmp
+
+    def capture(self, max_memory):
+        return OutputCapture(max_memory, spill_dir=unicode(self.tmp))
+
+    def test_short_output(self):
+        capture = self.capture(100)
+
+        capture.write(u"abc")
+        capture.write(u"")
+        capture.write(u"def")
+
+        self.assertEqual(capture.tail(), u"abcdef")
+        self.assertEqual(capture.summary([u"traceback"]), u"abcdef")
+        self.assertFalse(capture.truncated)
+        self.assertIsNone(capture.file_path)
+
+    def test_tail_kept(self):
+        capture = self.capture(5)
+
+        for chunk in [u"abc", u"def", u"ghijkl", u"m"]:
+            capture.write(chunk)
+
+        self.assertEqual(capture.tail(), u"ijklm")
+        self.assertEqual(capture.tail(2), u"lm")
+        self.assertEqual(capture.tail(100), u"ijklm")
+        self.assertEqual(len(capture), 13)
+        self.assertTrue(capture.truncated)
+
+    def test_spilled_to_file(self):
+        capture = self.capture(5)
+
+        capture.write(u"abc")
+        capture.write(u"d\u263Aef")
+        capture.close()
+
+        with io.open(capture.file_path, encoding="utf-8") as src:
+            self.assertEqual(src.read(), u"abcd\u263Aef")
+
+    def test_summary(self):
+        """
+        Tracebacks of failures come first, they may not be in tail
+        """
+
+        capture = self.capture(25)
+        capture.write(u"0123456789" * 3)
+
+        summary = capture.summary([u"Traceback A", u"Traceback B"])
+
+        self.assertEqual(summary, (
+            u"Traceback A\nTraceback B\n"
+            u"[5 characters of output omitted, whole output in {}]\n"
+            u"5678901234567890123456789").format(capture.file_path))
+
+    def test_spill_failed(self):
+        capture = OutputCapture(5, spill_dir=self.tmp.join("missing"))
+
+        capture.write(u"0123456789")
+
+        self.assertIsNone(capture.file_path)
+        self.assertEqual(capture.summary(),
+                         u"[5 characters of output omitted]\n56789")
+
+    def test_discard(self):
+        capture = self.capture(1)
+        capture.write(u"ab")
+        file_path = capture.file_path
+
+        capture.discard()
+
+        self.assertFalse(os.path.exists(file_path))
+        self.assertIsNone(capture.file_path)
@@ -0,0 +1,164 @@
+from threading import Event
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from testrunner.coalescer import ChangeBatch, EventCoalescer
+
+
+class TestChangeBatch(TestCase):
+
+    def test_empty(self):
+        batch = ChangeBatch()
+
+        self.assertFalse(batch)
+        self.assertEqual(len(batch), 0)
+
+    def test_events_counted(self):
+        batch = ChangeBatch()
+
+        batch.add("a", 1)
+        batch.add("a", 2)
+        batch.add("b", 3)
+
+        self.assertTrue(batch)
+        self.assertEqual(batch.paths, set(["a", "b"]))
+        self.assertEqual(batch.events, 3)
+        self.assertEqual(batch.first_event, 1)
+        self.assertEqual(batch.last_event, 3)
+
+    def test_retry(self):
+        cancelled = ChangeBatch()
+        cancelled.add("a", 1)
+        batch = ChangeBatch()
+        batch.add("b", 2)
+
+        batch.retry(cancelled)
+
+        self.assertEqual(batch.paths, set(["a", "b"]))
+        self.assertEqual(batch.retried, set(["a"]))
+        self.assertEqual(batch.events, 2)
+        self.assertEqual(batch.first_event, 1)
+        self.assertEqual(batch.last_event, 2)
+
+
+class TestEventCoalescer(TestCase):
+
+    def test_no_quiet_period(self):
+        """
+        Without quiet period every event is handed over immediately
+        """
+
+        callback = Mock(return_value=False)
+        coalescer = EventCoalescer(callback, quiet_period=0)
+
+        coalescer.add("a")
+
+        self.assertEqual(callback.call_count, 1)
+        batch = callback.call_args[0][0]
+        self.assertEqual(batch.paths, set(["a"]))
+
+    def test_changes_collected_while_running(self):
+        """
+        Changes during a run are handed over as one batch after it
+        """
+
+        callback = Mock(return_value=True)
+        coalescer = EventCoalescer(callback, quiet_period=0)
+
+        coalescer.add("a")
+        coalescer.add("b")
+        coalescer.add("c")
+        coalescer.add("b")
+
+        self.assertEqual(callback.call_count, 1)
+
+        coalescer.release()
+
+        self.assertEqual(callback.call_count, 2)
+        batch = callback.call_args[0][0]
+        self.assertEqual(batch.paths, set(["b", "c"]))
+        self.assertEqual(batch.events, 3)
+
+    def test_release_without_changes(self):
+        callback = Mock(return_value=True)
+        coalescer = EventCoalescer(callback, quiet_period=0)
+
+        coalescer.add("a")
+        coalescer.release()
+
+        self.assertEqual(callback.call_count, 1)
+
+    def test_run_not_started(self):
+        """
+        When callback does not start a run, next change is handled at once
+        """
+
+        callback = Mock(return_value=False)
+        coalescer = EventCoalescer(callback, quiet_period=0)
+
+        coalescer.add("a")
+        coalescer.add("b")
+
+        self.assertEqual(callback.call_count, 2)
+
+    def test_acquired(self):
+        """
+        Run started outside of coalescer holds changes back too
+        """
+
+        callback = Mock(return_value=True)
+        coalescer = EventCoalescer(callback, quiet_period=0)
+
+        self.assertTrue(coalescer.acquire())
+        self.assertFalse(coalescer.acquire())
+        coalescer.add("a")
+        self.assertFalse(callback.called)
+
+        coalescer.release()
+
+        self.assertEqual(callback.call_count, 1)
+
+    @patch("testrunner.coalescer.Timer", autospec=True)
+    def test_quiet_period_restarted(self, Timer):
+        coalescer = EventCoalescer(Mock(), quiet_period=5)
+
+        coalescer.add("a")
+        first_timer = Timer.return_value
+        coalescer.add("b")
+
+        self.assertEqual(Timer.call_count, 2)
+        Timer.assert_called_with(5, coalescer.flush)
+        first_timer.cancel.assert_called_once_with()
+
+    def test_timer_factory(self):
+        """
+        Timers can be run by event loop instead of threads
+        """
+
+        timer = Mock()
+        coalescer = EventCoalescer(Mock(), quiet_period=5, timer=timer)
+
+        coalescer.add("a")
+
+        timer.assert_called_once_with(5, coalescer.flush)
+        timer.return_value.start.assert_called_once_with()
+
+    def test_burst_in_one_batch(self):
+        done = Event()
+        batches = []
+
+        def callback(batch):
+            batches.append(batch)
+            done.set()
+            return False
+
+        coalescer = EventCoalescer(callback, quiet_period=0.05)
+        for name in "abcab":
+            coalescer.add(name)
+
+        done.wait(2)
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].paths, set(["a", "b", "c"]))
+        self.assertEqual(batches[0].events, 5)
@@ -2,9 +2,13 @@ from unittest import TestCase
 from argparse import Namespace
 
 from mock import MagicMock, Mock, patch, ANY, call
-from pyinotify import WatchManager
+from pyinotify import IN_CREATE, WatchManager
 
-from testrunner.configurator import Config
+from testrunner.configurator import (
+    Config, ProjectConfig, parse_projects, watch_path
+)
+from testrunner.filters import PathFilter
+from testrunner.poller import DirPoller
 from testrunner import default_config
 
 
@@ -32,6 +36,79 @@ class TestConfigCmdRun(TestCase):
 
         self.assertEqual(cmd, "1 2 3 4")
 
+    @patch.object(Config, "get_value", autospec=True)
+    def test_cmd_traced(self, get_value, init, get_values):
+        get_values.return_value = ["python -m unittest", None, None, "a"]
+        get_value.side_effect = lambda conf, name: {
+            "COVERAGE_SELECT": True,
+            "STATE_DIR": "/state",
+            "WATCH_DIR": "/src",
+            "RESULT_PARSER": None,
+        }[name]
+        conf = Config(None)
+
+        cmd = conf.tests_command(suite=True)
+
+        self.assertEqual(
+            cmd, "python -m testrunner.tracer --output /state/coverage "
+            "--root /src --ids unittest --suite -- -m unittest a")
+
+    @patch.object(Config, "get_value", autospec=True)
+    def test_cmd_not_traced(self, get_value, init, get_values):
+        """
+        Only python commands can be traced
+        """
+
+        get_values.return_value = ["nosetests", None, None, "a"]
+        get_value.side_effect = lambda conf, name: {
+            "COVERAGE_SELECT": True,
+            "STATE_DIR": "/state",
+            "WATCH_DIR": "/src",
+            "RESULT_PARSER": None,
+        }[name]
+        conf = Config(None)
+
+        self.assertEqual(conf.tests_command(), "nosetests a")
+
+    @patch.object(Config, "get_value", autospec=True)
+    def test_runner_kind(self, get_value, init, get_values):
+        """
+        Test runner is guessed from command if it is not configured
+        """
+
+        get_values.return_value = ["python -m pytest", None]
+        get_value.return_value = None
+        conf = Config(None)
+
+        self.assertEqual(conf.runner_kind(), "pytest")
+        get_value.return_value = "nose"
+        self.assertEqual(conf.runner_kind(), "nose")
+
+    @patch.object(Config, "get_value", autospec=True, return_value=None)
+    def test_cmd_fail_fast(self, get_value, init, get_values):
+        get_values.return_value = ["python -m unittest", None, "-v", "a"]
+        conf = Config(None)
+
+        self.assertEqual(conf.tests_command(fail_fast=True),
+                         "python -m unittest -v --failfast a")
+        get_values.return_value = ["py.test", None, None, ["a", "b"]]
+        self.assertEqual(conf.tests_command(fail_fast=True), "py.test -x a b")
+
+    @patch.object(Config, "get_value", autospec=True, return_value=None)
+    def test_cmd_excluded_tests(self, get_value, init, get_values):
+        """
+        Only pytest can leave out single tests
+        """
+
+        get_values.return_value = ["py.test", None, None, "a.py"]
+        conf = Config(None)
+
+        self.assertEqual(conf.tests_command(exclude=["a.py::test_x"]),
+                         "py.test a.py --deselect a.py::test_x")
+        get_values.return_value = ["nosetests", None, None, "a"]
+        self.assertEqual(conf.tests_command(exclude=["a.test_x"]),
+                         "nosetests a")
+
     def test_cmd_runner_options_missing(self, init, get_values):
         get_values.return_value = ["1", None, "3", "4"]
         conf = Config(None)
@@ -77,6 +154,22 @@ class TestConfigCmdRun(TestCase):
 
         self.assertEqual(cmd, None)
 
+    def test_cmd_explicit_tests(self, init, get_values):
+        get_values.return_value = ["1", "2", "3", "4"]
+        conf = Config(None)
+        cmd = conf.tests_command(tests=["a", "b"])
+
+        get_values.assert_called_with(conf, self.test_args)
+
+        self.assertEqual(cmd, "1 2 3 a b")
+
+    def test_cmd_explicit_tests_configured_missing(self, init, get_values):
+        get_values.return_value = ["1", "2", "3", None]
+        conf = Config(None)
+        cmd = conf.tests_command(tests=["a"])
+
+        self.assertEqual(cmd, "1 2 3 a")
+
     def test_cmd_suite_all_available(self, init, get_values):
         get_values.return_value = ["1", "2", "3", "4"]
         conf = Config(None)
@@ -160,6 +253,22 @@ class TestConfigOther(TestCase):
         load.assert_called_once_with(conf)
         watch.assert_called_once_with(conf)
 
+    @patch.object(Config, "__init__", return_value=None, autospec=True)
+    @patch.object(Config, "get_values", autospec=True)
+    def test_runner_options(self, get_values, init):
+        """
+        Runner gets plain dict of its options
+        """
+
+        conf = Config(None)
+        get_values.return_value = ["fork", ["json"]]
+
+        options = conf.runner_options()
+
+        get_values.assert_called_once_with(conf, Config.RUNNER_OPTIONS)
+        self.assertEqual(
+            options, {"RUNNER_MODE": "fork", "PRELOAD_MODULES": ["json"]})
+
     @patch.object(Config, "__init__", return_value=None, autospec=True)
     @patch.object(Config, "get_value", autospec=True)
     def test_config_file_location(self, get_value, init):
@@ -246,6 +355,17 @@ class TestConfigCommandLineParser(TestCase):
         add_argument.assert_any_call("test", nargs="*", help=ANY)
         self.assertEqual(conf.command_line.__dict__, {"TESTS": [1, 2]})
 
+    def test_parsing_no_cache(self, init):
+        """
+        Result cache can be disabled for single session
+        """
+
+        conf = Config(None)
+
+        conf.parse_command_line(["--no-cache"])
+
+        self.assertEqual(conf.command_line.__dict__, {"RESULT_CACHE": False})
+
 
 @patch.object(Config, "__init__", return_value=None, autospec=True)
 class TestConfigGetValue(TestCase):
@@ -270,6 +390,22 @@ class TestConfigGetValue(TestCase):
         self.assertEqual(value, "test value")
         self.assertEqual(source, Config.CONF_LOCAL)
 
+    def test_project_value(self, init):
+        """
+        Project defaults come before defaults of testrunner
+        """
+
+        conf = Config(None)
+        conf.command_line = object()
+        conf.config = object()
+        conf.project = ProjectConfig("api")
+
+        value, source = conf.get_value("STATE_DIR", True)
+
+        self.assertEqual(value, "api/.testrunner")
+        self.assertEqual(source, Config.CONF_DEFAULT)
+        self.assertEqual(conf.get_value("LOG_LEVEL"), default_config.LOG_LEVEL)
+
     def test_existing_value_command_line(self, init):
         conf = Config(None)
         conf.command_line = Mock(LOG_LEVEL="value form command line")
@@ -495,11 +631,18 @@ class TestConfigUpdatingWatcher(TestCase):
         conf = Config(None)
         conf.watcher_added_at = 1
         conf.config_loaded_at = 2
-        conf.watch_descriptors = None
+        conf.watch_settings = None
+        conf.conf_watch = None
         conf.watch_manager = Mock()
+        conf.watch_manager.watches = {}
+        conf.watch_manager.add_watch.return_value = {"config": 9}
 
         self.conf = conf
 
+    def _watch(self, wd, watch_path):
+        self.conf.watch_manager.watches[wd] = Mock(
+            wd=wd, path=watch_path, exclude_filter=self.conf.filter_wrapper)
+
     def test_too_early_to_update(self, get_value, init):
         """
         It should be safe to call update watch at any point,
@@ -514,160 +657,353 @@ class TestConfigUpdatingWatcher(TestCase):
         # Early return, no values should be accessed
         self.assertFalse(get_value.called)
 
-    def test_no_watch_decriptor(self, get_value, init):
+    def test_no_watches(self, get_value, init):
         """
-        When descriptor does not exits yet, do not try to remove it
+        When there are no watches yet, nothing is removed
         """
         self._helper()
-        get_value.side_effect = iter([1, 4, "dir", None, "config"])
+        get_value.side_effect = iter([1, 4, "dir", None, False, "config"])
 
         self.conf.update_watch()
 
         self.assertFalse(self.conf.watch_manager.rm_watch.called)
 
-    # @expectedFailure
-    def test_watch_decriptor_present(self, get_value, init):
+    @patch("testrunner.configurator.time")
+    def test_set_new_watch(self, mock_time, get_value, init):
         """
-        When descriptor does not exits yet, do not try to remove it
+        Setting new watch for dir
         """
         self._helper()
-        src_descriptor = Mock()
-        src_descriptor.values.return_value = "src_descr"
-        conf_descriptor = Mock()
-        conf_descriptor.values.return_value = "conf_descr"
-        self.conf.watch_descriptors = [src_descriptor, conf_descriptor]
-        get_value.side_effect = iter([1, 4, "dir", None, "config"])
+        add_watch = self.conf.watch_manager.add_watch
+        get_value.side_effect = iter([1, 2, "dir", None, False, "config"])
+        mock_time.return_value = 2
 
         self.conf.update_watch()
 
-        self.conf.watch_manager.rm_watch.assert_has_calls([
-            call("src_descr", rec=True),
-            call("conf_descr", rec=True),
+        self.assertEqual(add_watch.call_count, 2)
+        add_watch.assert_has_calls([
+            call(path=["dir"], mask=1 & ~2, auto_add=True,
+                 rec=False, exclude_filter=self.conf.filter_wrapper),
+            call(path="config", mask=1 & ~2),
         ])
+        self.assertEqual(self.conf.conf_watch, ("config", 1 & ~2, 9))
+        self.assertEqual(self.conf.watcher_added_at, 2)
 
-    @patch("testrunner.configurator.pyinotify.ExcludeFilter")
+    @patch("testrunner.configurator.PathFilter")
+    def test_only_difference_applied(self, path_filter, get_value, init):
+        """
+        Watches of dirs still wanted are kept, others removed, new added
+        """
+        self._helper()
+        self.conf.watch_settings = ("dir", 1, ["old"], False)
+        self.conf.conf_watch = ("config", 1, 3)
+        self._watch(1, "dir")
+        self._watch(2, "dir/old")
+        self._watch(3, "config")
+        path_filter.return_value.watch_dirs.return_value = [
+            "dir", "./dir/new"]
+        get_value.side_effect = iter([1, 0, "dir", ["new"], False, "config"])
+
+        self.conf.update_watch()
+
+        wmgr = self.conf.watch_manager
+        wmgr.rm_watch.assert_called_once_with([2])
+        self.assertFalse(wmgr.update_watch.called)
+        wmgr.add_watch.assert_called_once_with(
+            path=["dir/new"], mask=1, auto_add=True,
+            rec=False, exclude_filter=self.conf.filter_wrapper)
+        self.assertEqual(self.conf.watch_settings,
+                         ("dir", 1, ["new"], False))
+
+    def test_mask_changed(self, get_value, init):
+        """
+        Kept watches get new mask
+        """
+        self._helper()
+        self.conf.watch_settings = ("dir", 1, None, False)
+        self._watch(1, "dir")
+        get_value.side_effect = iter([3, 0, "dir", None, False, "config"])
+
+        self.conf.update_watch()
+
+        self.conf.watch_manager.update_watch.assert_called_once_with(
+            [1], mask=3 | IN_CREATE)
+
+    @patch("testrunner.configurator.PathFilter")
+    def test_same_settings(self, path_filter, get_value, init):
+        """
+        Tree is not crawled again when watch settings did not change
+        """
+        self._helper()
+        self.conf.watch_settings = ("dir", 1, ["filters"], False)
+        self.conf.conf_watch = ("config", 1, 3)
+        self._watch(3, "config")
+        get_value.side_effect = iter(
+            [1, 0, "dir", ["filters"], False, "config"])
+
+        self.conf.update_watch()
+
+        self.assertFalse(path_filter.called)
+        self.assertFalse(self.conf.watch_manager.add_watch.called)
+        self.assertFalse(self.conf.watch_manager.rm_watch.called)
+
+    def test_conf_watch_gone(self, get_value, init):
+        """
+        Config file was replaced, its watch is added again
+        """
+        self._helper()
+        self.conf.watch_settings = ("dir", 1, None, False)
+        self.conf.conf_watch = ("config", 1, 3)
+        get_value.side_effect = iter([1, 0, "dir", None, False, "config"])
+
+        self.conf.update_watch()
+
+        self.assertFalse(self.conf.watch_manager.rm_watch.called)
+        self.conf.watch_manager.add_watch.assert_called_once_with(
+            path="config", mask=1)
+        self.assertEqual(self.conf.conf_watch, ("config", 1, 9))
+
+    def test_conf_file_changed(self, get_value, init):
+        """
+        Watch of previous config file is removed
+        """
+        self._helper()
+        self.conf.watch_settings = ("dir", 1, None, False)
+        self.conf.conf_watch = ("old_config", 1, 3)
+        self._watch(3, "old_config")
+        get_value.side_effect = iter([1, 0, "dir", None, False, "config"])
+
+        self.conf.update_watch()
+
+        self.conf.watch_manager.rm_watch.assert_called_once_with(3)
+        self.conf.watch_manager.add_watch.assert_called_once_with(
+            path="config", mask=1)
+
+    @patch("testrunner.configurator.PathFilter")
     def test_filter_present(self, in_filter, get_value, init):
         """
-        Test applying filters
+        Test applying filters, only not excluded dirs are watched
         """
 
         self._helper()
-        get_value.side_effect = iter([1, 4, "dir", "filters", "config"])
+        get_value.side_effect = iter([1, 4, "dir", "filters", False, "config"])
         self.conf.filter_test = "some function"
-        in_filter.return_value = "new function"
+        in_filter.return_value.watch_dirs.return_value = ["dir", "dir/a"]
+
+        self.conf.update_watch()
+
+        in_filter.assert_called_once_with("filters", root=None)
+        in_filter.return_value.watch_dirs.assert_called_once_with("dir")
+        self.assertEqual(self.conf.filter_test, in_filter.return_value)
+        self.conf.watch_manager.add_watch.assert_any_call(
+            path=["dir", "dir/a"], mask=1 & ~4, auto_add=True,
+            rec=False, exclude_filter=self.conf.filter_wrapper)
+
+    @patch("testrunner.configurator.PathFilter")
+    def test_gitignore_filter(self, in_filter, get_value, init):
+        """
+        Filter is used for .gitignore files even without regular expressions
+        """
+
+        self._helper()
+        get_value.side_effect = iter([1, 4, "dir", [], True, "config"])
 
         self.conf.update_watch()
 
-        in_filter.assert_called_once_with("filters")
-        self.assertEqual(self.conf.filter_test, "new function")
+        in_filter.assert_called_once_with([], root="dir")
+        self.assertEqual(self.conf.filter_test, in_filter.return_value)
 
-    @patch("testrunner.configurator.pyinotify.ExcludeFilter")
-    def test_filters_not_set(self, in_filter, get_value, init):
+    def test_filters_not_set(self, get_value, init):
         """
         Test filters not set
         """
 
         self._helper()
-        get_value.side_effect = iter([1, 4, "dir", [], "config"])
+        get_value.side_effect = iter([1, 4, "dir", [], False, "config"])
         self.conf.filter_test = "some function"
-        in_filter.return_value = "new function"
 
         self.conf.update_watch()
 
-        self.assertFalse(in_filter.called)
         self.assertEqual(self.conf.filter_test, None)
 
-    @patch("testrunner.configurator.time")
-    def test_set_new_watch(self, mock_time, get_value, init):
+    def test_include_excelude_list(self, get_value, init):
         """
-        Setting new watch for dir
+        Include/exclude should accept a list of flags
         """
         self._helper()
-        self.conf.watcher_added_at = 1
-        add_watch = Mock()
-        add_watch.side_effect = iter(["dir descriptor", "conf descriptor"])
-        self.conf.watch_manager.add_watch = add_watch
-        get_value.side_effect = iter([1, 2, "dir", None, "config"])
-        mock_time.return_value = 2
+        get_value.side_effect = iter([
+            [1, 4094], [8, 16, 32], "dir", None, False, "config"
+        ])
 
         self.conf.update_watch()
 
-        self.assertEqual(add_watch.call_count, 2)
-        add_watch.assert_has_calls([
-            call(path="dir", mask=1 & ~2, auto_add=True,
-                 rec=True, exclude_filter=self.conf.filter_wrapper),
-            call(path="config", mask=1 & ~2),
-        ])
-        self.assertEqual(
-            self.conf.watch_descriptors, ("dir descriptor", "conf descriptor"))
-        self.assertEqual(self.conf.watcher_added_at, 2)
+        self.conf.watch_manager.add_watch.assert_any_call(
+            path="config", mask=4095 & ~56)
 
-    @patch("testrunner.configurator.time")
-    def test_include_excelude_list(self, mock_time, get_value, init):
+    def test_include_excelude_tuple(self, get_value, init):
         """
-        Include/exclude should accept a list of flags
+        Include/exclude should accept a tuple of flags
         """
         self._helper()
-        self.conf.watcher_added_at = 1
-        add_watch = Mock()
-        add_watch.side_effect = iter(["src descr", "conf descr"])
-        self.conf.watch_manager.add_watch = add_watch
-
-        filter_include = [1, 4094]
-        filter_exclude = [8, 16, 32]
         get_value.side_effect = iter([
-            filter_include, filter_exclude, "dir", None, "config"
+            (1, 4094), (8, 16, 32), "dir", None, False, "config"
         ])
 
-        ored_include = 4095
-        ored_exclude = 56
-        expected_mask = ored_include & ~ored_exclude
+        self.conf.update_watch()
 
-        mock_time.return_value = 2
+        self.conf.watch_manager.add_watch.assert_any_call(
+            path="config", mask=4095 & ~56)
+
+    @patch("testrunner.configurator.PathFilter")
+    def test_unwatched_dirs_polled(self, path_filter, get_value, init):
+        """
+        Dirs which inotify can not watch (ie. limit of watches) are polled
+        """
+        self._helper()
+        self.conf.poller = MagicMock(spec=DirPoller, dirs=set())
+        self.conf.watch_manager.add_watch.side_effect = iter([
+            {"dir": 1, "dir/a": -2}, {"config": 9}])
+        path_filter.return_value.watch_dirs.return_value = ["dir", "dir/a"]
+        get_value.side_effect = iter([1, 0, "dir", None, False, "config"])
 
         self.conf.update_watch()
 
-        self.assertEqual(add_watch.call_count, 2)
-        add_watch.assert_has_calls([
-            call(path="dir", mask=expected_mask, auto_add=True,
-                 rec=True, exclude_filter=self.conf.filter_wrapper),
-            call(path="config", mask=expected_mask),
-        ])
-        self.assertEqual(
-            self.conf.watch_descriptors, ("src descr", "conf descr"))
-        self.assertEqual(self.conf.watcher_added_at, 2)
+        self.conf.poller.add.assert_called_once_with(["dir/a"])
+        self.assertEqual(self.conf.poller.mask, 1)
 
-    @patch("testrunner.configurator.time")
-    def test_include_excelude_tuple(self, mock_time, get_value, init):
+    @patch("testrunner.configurator.PathFilter")
+    def test_polled_dirs_kept(self, path_filter, get_value, init):
         """
-        Include/exclude should accept a tuple of flags
+        Polled dirs are not added as watches again, unwanted are removed
         """
         self._helper()
-        self.conf.watcher_added_at = 1
-        add_watch = Mock()
-        add_watch.side_effect = iter(["src descr", "conf descr"])
-        self.conf.watch_manager.add_watch = add_watch
+        self.conf.watch_settings = ("dir", 1, None, False)
+        self.conf.poller = MagicMock(
+            spec=DirPoller, dirs=set(["dir/a", "old"]))
+        self._watch(1, "dir")
+        path_filter.return_value.watch_dirs.return_value = ["dir", "dir/a"]
+        get_value.side_effect = iter([1, 0, "dir", ["x"], False, "config"])
 
-        filter_include = (1, 4094)
-        filter_exclude = (8, 16, 32)
-        get_value.side_effect = iter([
-            filter_include, filter_exclude, "dir", None, "config"
-        ])
+        self.conf.update_watch()
 
-        ored_include = 4095
-        ored_exclude = 56
-        expected_mask = ored_include & ~ored_exclude
+        self.conf.watch_manager.add_watch.assert_called_once_with(
+            path="config", mask=1)
+        self.conf.poller.remove.assert_called_once_with(set(["old"]))
 
-        mock_time.return_value = 2
 
-        self.conf.update_watch()
+@patch.object(Config, "__init__", return_value=None, autospec=True)
+class TestConfigCreatedDir(TestCase):
 
-        self.assertEqual(add_watch.call_count, 2)
-        add_watch.assert_has_calls([
-            call(path="dir", mask=expected_mask, auto_add=True,
-                 rec=True, exclude_filter=self.conf.filter_wrapper),
-            call(path="config", mask=expected_mask),
-        ])
+    def _config(self, wd=None, polled=False):
+        conf = Config(None)
+        conf.watch_manager = Mock(spec=WatchManager)
+        conf.watch_manager.get_wd.return_value = wd
+        conf.poller = MagicMock(spec=DirPoller)
+        conf.poller.__contains__.return_value = polled
+        return conf
+
+    def test_auto_add_failed(self, init):
+        conf = self._config()
+
+        conf.check_created_dir(u"dir/new/")
+
+        conf.watch_manager.get_wd.assert_called_once_with("dir/new")
+        conf.poller.add.assert_called_once_with(["dir/new"])
+
+    def test_watched(self, init):
+        conf = self._config(wd=5)
+
+        conf.check_created_dir("dir/new")
+
+        self.assertFalse(conf.poller.add.called)
+
+    def test_already_polled(self, init):
+        conf = self._config(polled=True)
+
+        conf.check_created_dir("dir/new")
+
+        self.assertFalse(conf.watch_manager.get_wd.called)
+        self.assertFalse(conf.poller.add.called)
+
+    def test_gitignore_read(self, init):
+        conf = self._config(wd=5)
+        conf.filter_test = Mock(spec=PathFilter, return_value=False)
+
+        conf.check_created_dir("dir/new")
+
+        conf.filter_test.watch_dirs.assert_called_once_with("dir/new")
+
+
+@patch.object(Config, "__init__", return_value=None, autospec=True)
+class TestConfigOwnsWatch(TestCase):
+
+    def test_owned(self, init):
+        conf = Config(None)
+        conf.conf_watch = ("config", 1, 9)
+
+        self.assertTrue(conf.owns_watch(
+            Mock(wd=1, exclude_filter=conf.filter_wrapper)))
+        self.assertTrue(conf.owns_watch(Mock(wd=9, exclude_filter=None)))
+
+    def test_other_project(self, init):
+        conf = Config(None)
+        other = Config(None)
+        conf.conf_watch = None
+
+        self.assertFalse(conf.owns_watch(
+            Mock(wd=1, exclude_filter=other.filter_wrapper)))
+        self.assertFalse(conf.owns_watch(Mock(wd=9, exclude_filter=None)))
+
+    def test_module_name(self, init):
+        """
+        Local configs of projects do not replace each other
+        """
+
+        conf = Config(None)
+        other = Config(None)
+        other.project = conf.project = ProjectConfig("api")
+
+        self.assertEqual(Config(None).module_name(), "local_config")
+        self.assertNotEqual(conf.module_name(), other.module_name())
+
+
+class TestProjects(TestCase):
+
+    def test_single_project(self):
+        self.assertEqual(parse_projects(["-d", "dir"]), ([], 1))
+
+    def test_projects(self):
+        projects, max_runs = parse_projects([
+            "--project", "api", "--project", "web:conf/web.py",
+            "--max-runs", "2"])
+
+        self.assertEqual(max_runs, 2)
         self.assertEqual(
-            self.conf.watch_descriptors, ("src descr", "conf descr"))
-        self.assertEqual(self.conf.watcher_added_at, 2)
+            [(project.name, project.WATCH_DIR, project.CONFIG)
+             for project in projects],
+            [("api", "api", "api/config.py"),
+             ("web", "web", "conf/web.py")])
+        self.assertEqual(projects[1].STATE_DIR, "web/.testrunner")
+
+    def test_nested_projects(self):
+        with self.assertRaises(ValueError):
+            parse_projects(["--project", "api", "--project", "api/v2"])
+
+    def test_similar_names(self):
+        projects, _ = parse_projects(
+            ["--project", "api", "--project", "api2"])
+
+        self.assertEqual(len(projects), 2)
+
+    def test_dir_given(self):
+        with self.assertRaises(ValueError):
+            parse_projects(["--project", "api", "-d", "web"])
+
+
+class TestWatchPath(TestCase):
+
+    def test_normalized(self):
+        self.assertEqual(watch_path("./dir/sub/"), "dir/sub")
+
+    def test_unicode(self):
+        self.assertIsInstance(watch_path(u"dir"), str)
@@ -0,0 +1,163 @@
+from os import path, remove
+from unittest import TestCase
+
+from fixture.io import TempIO
+from mock import patch
+
+from testrunner.dependency import DependencyIndex, module_name, parse_imports
+
+
+class TestModuleName(TestCase):
+
+    def test_module(self):
+        self.assertEqual(module_name("/src", "/src/pkg/mod.py"), "pkg.mod")
+
+    def test_package(self):
+        self.assertEqual(module_name("/src", "/src/pkg/__init__.py"), "pkg")
+
+    def test_not_python(self):
+        self.assertIsNone(module_name("/src", "/src/pkg/data.json"))
+
+    def test_outside_root(self):
+        self.assertIsNone(module_name("/src", "/other/mod.py"))
+
+
+class TestParseImports(TestCase):
+
+    def test_absolute_imports(self):
+        imports = parse_imports("import a.b\nfrom c import d", "x")
+
+        self.assertEqual(imports, set(["a", "a.b", "c", "c.d"]))
+
+    def test_relative_imports(self):
+        imports = parse_imports(
+            "from . import a\nfrom ..b import c", "pkg.sub.mod")
+
+        self.assertIn("pkg.sub.a", imports)
+        self.assertIn("pkg.b.c", imports)
+
+    def test_implicit_relative_imports(self):
+        """
+        Python 2 resolves "import x" against current package first
+        """
+
+        imports = parse_imports("import mod", "pkg", is_package=True)
+
+        self.assertIn("pkg.mod", imports)
+        self.assertIn("mod", imports)
+
+
+class TestDependencyIndex(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tmp.pkg = "pkg"
+        self.tmp.pkg.putfile("__init__.py", "")
+        self.tmp.pkg.putfile("core.py", "X = 1")
+        self.tmp.pkg.putfile("utils.py", "from pkg.core import X")
+        self.tmp.pkg.putfile("test_core.py", "import pkg.core")
+        self.tmp.pkg.putfile("test_utils.py", "from pkg import utils")
+        self.tmp.pkg.putfile("test_other.py", "import os")
+
+        self.index = DependencyIndex(unicode(self.tmp))
+        self.index.build()
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_build(self):
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(
+            self.index.test_modules(),
+            ["pkg.test_core", "pkg.test_other", "pkg.test_utils"])
+
+    @patch("testrunner.dependency.parse_imports", wraps=parse_imports)
+    def test_built_from_snapshot(self, parse):
+        """
+        Only files changed since snapshot was taken are parsed
+        """
+
+        self.tmp.pkg.putfile("test_other.py", "from pkg import core")
+        index = DependencyIndex(unicode(self.tmp))
+
+        index.build(self.index.snapshot())
+        tests = index.affected_tests([self.tmp.pkg.join("core.py")])
+
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(
+            tests, ["pkg.test_core", "pkg.test_other", "pkg.test_utils"])
+        self.assertEqual(index.snapshot()["files"]["pkg/test_other.py"][2],
+                         ["pkg", "pkg.core", "pkg.pkg"])
+
+    @patch("testrunner.dependency.parse_imports", wraps=parse_imports)
+    def test_snapshot_of_other_root(self, parse):
+        snapshot = self.index.snapshot()
+        snapshot["root"] = "/elsewhere"
+        index = DependencyIndex(unicode(self.tmp))
+
+        index.build(snapshot)
+
+        self.assertEqual(parse.call_count, 6)
+
+    def test_transitive_dependants(self):
+        tests = self.index.affected_tests([self.tmp.pkg.join("core.py")])
+
+        self.assertEqual(tests, ["pkg.test_core", "pkg.test_utils"])
+
+    def test_dependencies(self):
+        self.assertEqual(
+            self.index.dependencies("pkg.test_utils"),
+            set(["pkg.test_utils", "pkg", "pkg.utils", "pkg.core"]))
+
+    def test_changed_test(self):
+        tests = self.index.affected_tests([self.tmp.pkg.join("test_other.py")])
+
+        self.assertEqual(tests, ["pkg.test_other"])
+
+    def test_non_python_change(self):
+        self.tmp.pkg.putfile("data.json", "{}")
+
+        tests = self.index.affected_tests([self.tmp.pkg.join("data.json")])
+
+        self.assertIsNone(tests)
+
+    def test_update_changed_imports(self):
+        self.tmp.pkg.putfile("test_other.py", "from pkg import core")
+
+        self.index.update(self.tmp.pkg.join("test_other.py"))
+        tests = self.index.affected_tests([self.tmp.pkg.join("core.py")])
+
+        self.assertIn("pkg.test_other", tests)
+
+    def test_update_removed_file(self):
+        remove(self.tmp.pkg.join("test_core.py"))
+
+        self.index.update(self.tmp.pkg.join("test_core.py"))
+        tests = self.index.affected_tests([self.tmp.pkg.join("core.py")])
+
+        self.assertEqual(tests, ["pkg.test_utils"])
+
+    def test_update_new_dir(self):
+        self.tmp.pkg.sub = "sub"
+        self.tmp.pkg.sub.putfile("test_sub.py", "from pkg import utils")
+
+        self.index.update(self.tmp.pkg.join("sub"))
+        tests = self.index.affected_tests([self.tmp.pkg.join("core.py")])
+
+        self.assertIn("pkg.sub.test_sub", tests)
+
+    def test_syntax_error_keeps_edges(self):
+        self.tmp.pkg.putfile("test_core.py", "import pkg.core\ndef (")
+
+        self.index.update(self.tmp.pkg.join("test_core.py"))
+        tests = self.index.affected_tests([self.tmp.pkg.join("core.py")])
+
+        self.assertIn("pkg.test_core", tests)
+
+    def test_excluded_files(self):
+        index = DependencyIndex(
+            unicode(self.tmp),
+            exclude_filter=lambda name: path.basename(name) == "test_core.py")
+        index.build()
+
+        self.assertNotIn("pkg.test_core", index.test_modules())
@@ -0,0 +1,275 @@
+import socket
+import sys
+import threading
+from time import time
+from unittest import TestCase
+
+from fixture.io import TempIO
+from mock import Mock, patch
+
+from testrunner.distributed import (
+    Connection, Coordinator, parse_address, tree_manifest
+)
+from testrunner.filters import PathFilter
+from testrunner.hashcache import ContentHashCache
+from testrunner.runner import Runner, ShardResult
+from testrunner.worker import ShardWorker, WorkerServer
+
+PYTHON = sys.executable
+
+TEST_MODULE = """\
+import unittest
+
+
+class T(unittest.TestCase):
+
+    def test_{name}(self):
+        self.assertTrue({result})
+"""
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "localhost:{}".format(server.server_address[1])
+
+
+def unused_address():
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    address = "localhost:{}".format(sock.getsockname()[1])
+    sock.close()
+    return address
+
+
+class SilentServer(object):
+    """
+    Worker which takes job and never answers
+    """
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("localhost", 0))
+        self.sock.listen(5)
+        self.accepted = []
+        self.address = "localhost:{}".format(self.sock.getsockname()[1])
+
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        try:
+            while True:
+                self.accepted.append(self.sock.accept()[0])
+        except socket.error:
+            pass
+
+    def close(self):
+        for conn in self.accepted:
+            conn.close()
+        self.sock.close()
+
+
+class TestParseAddress(TestCase):
+
+    def test_address(self):
+        self.assertEqual(parse_address("build:7200"), ("build", 7200))
+        self.assertEqual(parse_address("build"), ("build", 7100))
+        self.assertEqual(parse_address("7200"), ("localhost", 7200))
+
+
+class TestConnection(TestCase):
+
+    def setUp(self):
+        left, right = socket.socketpair()
+        self.conn = Connection(left)
+        self.other = right
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.other.close)
+
+    def test_messages(self):
+        Connection(self.other).send({"type": "need", "paths": [u"a.py"]})
+        Connection(self.other).send({"type": "alive"})
+
+        self.assertEqual(self.conn.receive(),
+                         {"type": "need", "paths": [u"a.py"]})
+        self.assertEqual(self.conn.receive(), {"type": "alive"})
+
+    def test_message_split(self):
+        """
+        Part of message received before timeout is kept
+        """
+
+        self.conn.sock.settimeout(0.01)
+        self.other.sendall(b'{"type":')
+
+        self.assertRaises(socket.timeout, self.conn.receive)
+        self.other.sendall(b'"alive"}\n')
+        self.assertEqual(self.conn.receive(), {"type": "alive"})
+
+    def test_closed(self):
+        self.other.close()
+
+        self.assertIsNone(self.conn.receive())
+
+
+class TestTreeManifest(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_manifest(self):
+        self.tmp.putfile("pkg/mod.py", "X = 1\n")
+        self.tmp.putfile("pkg/mod.pyc", "compiled")
+        self.tmp.putfile(".git/HEAD", "master")
+        root = unicode(self.tmp)
+
+        manifest = tree_manifest(
+            root, PathFilter([r".*\.pyc$", r".*/\."]), ContentHashCache())
+
+        self.assertEqual(list(manifest), ["pkg/mod.py"])
+        self.assertEqual(len(manifest["pkg/mod.py"]), 40)
+
+
+class TestCoordinator(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tree = self.tmp.mkdir("tree")
+        self.tree.putfile("test_a.py", TEST_MODULE.format(
+            name="a", result=True))
+        self.tree.putfile("test_b.py", TEST_MODULE.format(
+            name="b", result=False))
+        self.tree.putfile("test_c.py", TEST_MODULE.format(
+            name="c", result=True))
+
+        self.runner = Runner({
+            "WATCH_DIR": unicode(self.tree),
+            "SUITE_WORKER_TIMEOUT": 5,
+        })
+        self.runner.on_result = Mock()
+        self.workers = []
+
+    def tearDown(self):
+        for server in self.workers:
+            server.shutdown()
+            server.server_close()
+        del self.tmp
+
+    def worker(self):
+        dir_path = self.tmp.mkdir("worker{}".format(len(self.workers)))
+        server = WorkerServer(("localhost", 0), ShardWorker(dir_path))
+        self.workers.append(server)
+        return start_server(server)
+
+    def commands(self, *names):
+        return [
+            "{} -m unittest -v test_{}".format(PYTHON, name)
+            for name in names
+        ]
+
+    def coordinator(self, *addresses):
+        coordinator = Coordinator(self.runner, addresses)
+        coordinator.poll_interval = 0.05
+        return coordinator
+
+    def test_workers(self):
+        coordinator = self.coordinator(self.worker(), self.worker())
+
+        results = coordinator.run(self.commands("a", "b", "c"))
+
+        self.assertEqual([shard.result for shard in results],
+                         [True, False, True])
+        self.assertEqual(results[1].failed, [u"test_b.T.test_b"])
+        self.assertIn(u"AssertionError", results[1].output)
+        streamed = [
+            (result.test_id, result.outcome)
+            for (result,), _ in self.runner.on_result.call_args_list
+        ]
+        self.assertIn(("test_a.T.test_a", "passed"), streamed)
+
+    def test_changed_files_synced(self):
+        address = self.worker()
+        self.coordinator(address).run(self.commands("b"))
+        self.tree.putfile("test_b.py", TEST_MODULE.format(
+            name="b", result=True))
+
+        results = self.coordinator(address).run(self.commands("b"))
+
+        self.assertTrue(results[0].result)
+
+    def test_dead_worker(self):
+        """
+        Shards of worker which can not be reached go to other worker
+        """
+
+        coordinator = self.coordinator(unused_address(), self.worker())
+
+        results = coordinator.run(self.commands("a", "c"))
+
+        self.assertEqual([shard.result for shard in results], [True, True])
+
+    def test_silent_worker(self):
+        """
+        Shard of worker which stops answering goes to other worker
+        """
+
+        silent = SilentServer()
+        self.addCleanup(silent.close)
+        self.runner.options["SUITE_WORKER_TIMEOUT"] = 0.2
+        coordinator = self.coordinator(silent.address, self.worker())
+
+        results = coordinator.run(self.commands("a", "c"))
+
+        self.assertEqual([shard.result for shard in results], [True, True])
+        self.assertEqual(len(silent.accepted), 1)
+
+    def test_no_worker(self):
+        """
+        Shards no worker could run are run locally
+        """
+
+        self.runner.run_shard = Mock(
+            return_value=ShardResult(True, u"", [], 1, {}))
+        coordinator = self.coordinator(unused_address())
+
+        results = coordinator.run(["cmd 0"])
+
+        self.assertTrue(results[0].result)
+        self.runner.run_shard.assert_called_once_with("cmd 0")
+
+    @patch.object(Runner, "cancelled", autospec=True, return_value=True)
+    def test_cancelled(self, cancelled):
+        coordinator = self.coordinator(self.worker())
+
+        results = coordinator.run(self.commands("a"))
+
+        self.assertFalse(results[0].result)
+        self.assertEqual(results[0].output, u"Tests cancelled")
+
+    def test_slow_shard(self):
+        """
+        Idle worker runs shard running much longer than finished ones
+        """
+
+        coordinator = self.coordinator()
+        coordinator._elapsed = [1, 2, 3]
+        coordinator._running = {
+            0: (time() - 10, set(["w1"])),
+            1: (time() - 1, set(["w2"])),
+        }
+
+        self.assertEqual(coordinator._slow_shard("w3"), 0)
+        self.assertIsNone(coordinator._slow_shard("w1"))
+
+    def test_command(self):
+        coordinator = self.coordinator()
+        test_file = self.tree.join("test_a.py")
+
+        self.assertEqual(coordinator.command("pytest -v " + test_file),
+                         "pytest -v test_a.py")
@@ -0,0 +1,213 @@
+import sys
+from time import time
+from unittest import TestCase
+
+from mock import Mock
+
+from testrunner.engine import EventLoop, LoopPool, LoopProcess, RunSlots
+from testrunner.metrics import SPAWNED, STAGE2_DONE
+from testrunner.parsers import UnittestParser
+from testrunner.runner import Runner
+
+PYTHON = sys.executable
+
+
+def run_until(loop, condition, timeout=10):
+    deadline = time() + timeout
+    while not condition() and time() < deadline:
+        loop.run_once()
+
+    return condition()
+
+
+class TestEventLoop(TestCase):
+
+    def test_call_later_order(self):
+        loop = EventLoop()
+        called = []
+
+        loop.call_later(0.02, called.append, 2)
+        loop.call_later(0, called.append, 1)
+
+        self.assertTrue(run_until(loop, lambda: len(called) == 2))
+        self.assertEqual(called, [1, 2])
+
+    def test_timer_cancelled(self):
+        loop = EventLoop()
+        function = Mock()
+        timer = loop.timer(0, function, ["a"])
+
+        timer.start()
+        timer.cancel()
+        loop.run_once()
+
+        self.assertFalse(function.called)
+
+    def test_failing_callback(self):
+        """
+        Loop goes on when callback fails
+        """
+
+        loop = EventLoop()
+        called = []
+        loop.call_later(0, Mock(side_effect=ValueError))
+        loop.call_later(0, called.append, 1)
+
+        loop.run_once()
+
+        self.assertEqual(called, [1])
+
+
+class TestLoopProcess(TestCase):
+
+    def _run(self, test_cmd):
+        loop = EventLoop()
+        on_exit = Mock()
+        parser = UnittestParser()
+        process = LoopProcess(loop, test_cmd, parser, on_exit)
+
+        process.start()
+        run_until(loop, lambda: on_exit.called)
+
+        on_exit.assert_called_once_with(process)
+        return process
+
+    def test_output_streamed(self):
+        process = self._run(
+            PYTHON + " -c 'print(\"test_a (pkg.T) ... FAIL\")'")
+
+        self.assertEqual(process.exitstatus, 0)
+        self.assertEqual(process.output, u"test_a (pkg.T) ... FAIL\r\n")
+        self.assertEqual(process.parser.failed(), ["pkg.T.test_a"])
+
+    def test_exit_status(self):
+        process = self._run(PYTHON + " -c 'import sys; sys.exit(3)'")
+
+        self.assertEqual(process.exitstatus, 3)
+
+
+class TestLoopPool(TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.pool = LoopPool(self.loop, grace_period=0.1)
+        self.runner = Runner()
+        self.callback = Mock()
+
+    def _run(self, *args):
+        task = self.pool.apply_async(self.runner, args, self.callback)
+        self.assertFalse(task.ready())
+
+        run_until(self.loop, task.ready)
+
+        self.assertTrue(task.ready())
+        self.assertEqual(self.callback.call_count, 1)
+        return self.callback.call_args[0][0]
+
+    def test_stages(self):
+        run_result = self._run("true", "true")
+
+        self.assertEqual(run_result, (True, u"All tests are fine \u263A"))
+        self.assertIn(SPAWNED, run_result.timings)
+
+    def test_test_failed(self):
+        run_result = self._run(PYTHON + " -c 'print(1); 1/0'", "true")
+
+        self.assertEqual(run_result, (False, u"Tests failed"))
+        self.assertIn(u"ZeroDivisionError", self.runner.last_traceback)
+
+    def test_shards(self):
+        run_result = self._run("true", ["true", "false"])
+
+        self.assertEqual(run_result, (False, u"Test suite failed"))
+        self.assertIn(u"Shard 2/2: false", self.runner.last_traceback)
+
+    def test_shards_on_workers(self):
+        self.runner.options["SUITE_WORKERS"] = ["localhost:7100"]
+        self.runner.run_remote_shards = Mock(return_value=False)
+
+        run_result = self._run("true", ["shard-1", "shard-2"])
+
+        self.assertEqual(run_result, (False, u"Test suite failed"))
+        self.runner.run_remote_shards.assert_called_once_with(
+            ["shard-1", "shard-2"])
+
+    def test_command_not_found(self):
+        run_result = self._run("no-such-command-for-tests")
+
+        self.assertFalse(run_result[0])
+        self.assertIn(u"Running tests failed", run_result[1])
+
+    def test_cancelled(self):
+        task = self.pool.apply_async(
+            self.runner, ["sleep 10", "true"], self.callback)
+        run_until(self.loop, lambda: self.runner.timings)
+
+        self.pool.control.cancel()
+        run_until(self.loop, task.ready, timeout=5)
+
+        self.assertEqual(self.callback.call_args[0][0],
+                         (False, u"Tests failed"))
+        # Suite is not started
+        self.assertTrue(self.pool.control.cancelled())
+        self.assertNotIn(STAGE2_DONE, self.runner.timings)
+
+
+class TestRunSlots(TestCase):
+
+    def test_limit(self):
+        slots = RunSlots(2)
+        started = []
+
+        for name in "abc":
+            slots.acquire(lambda name=name: started.append(name))
+
+        self.assertEqual(started, ["a", "b"])
+        self.assertEqual(len(slots), 1)
+
+        slots.release()
+        self.assertEqual(started, ["a", "b", "c"])
+        self.assertEqual(slots.running, 2)
+
+        slots.release()
+        slots.release()
+        self.assertEqual(slots.running, 0)
+
+
+class TestLoopPoolSlots(TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.slots = RunSlots(1)
+        self.pools = [LoopPool(self.loop, slots=self.slots) for _ in "ab"]
+        self.callback = Mock()
+
+    def test_runs_wait(self):
+        """
+        Runs of pools sharing slots wait for each other
+        """
+
+        first = self.pools[0].apply_async(
+            Runner(), ["sleep 0.2"], self.callback)
+        second = self.pools[1].apply_async(Runner(), ["true"], self.callback)
+        run_until(self.loop, lambda: self.slots.running)
+
+        self.assertEqual(len(self.slots), 1)
+
+        run_until(self.loop, second.ready)
+
+        self.assertTrue(first.ready())
+        self.assertEqual(self.callback.call_count, 2)
+        self.assertEqual(self.slots.running, 0)
+
+    def test_cancelled_while_waiting(self):
+        callback = Mock()
+        self.pools[0].apply_async(Runner(), ["sleep 0.2"], self.callback)
+        second = self.pools[1].apply_async(Runner(), ["true"], callback)
+        run_until(self.loop, lambda: self.slots.running)
+
+        self.pools[1].control.cancel()
+        run_until(self.loop, second.ready)
+
+        callback.assert_called_once_with((False, u"Tests cancelled"))
+        self.assertEqual(self.slots.running, 0)
@@ -0,0 +1,175 @@
+import os
+import re
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.filters import (
+    GitIgnore, PathFilter, compile_patterns, translate_glob
+)
+
+
+class TestCompilePatterns(TestCase):
+
+    def test_no_patterns(self):
+        self.assertIsNone(compile_patterns([]))
+        self.assertIsNone(compile_patterns(None))
+
+    def test_any_pattern_matches(self):
+        regex = compile_patterns([r".*\.pyc$", r".*/\."])
+
+        self.assertTrue(regex.match("./pkg/mod.pyc"))
+        self.assertTrue(regex.match("./.git/HEAD"))
+        self.assertFalse(regex.match("./pkg/mod.py"))
+
+    def test_single_pattern(self):
+        self.assertTrue(compile_patterns(r".*\.tmp$").match("a.tmp"))
+
+
+class TestTranslateGlob(TestCase):
+
+    def matches(self, pattern, relative_path):
+        return bool(re.match(translate_glob(pattern), relative_path))
+
+    def test_any_level(self):
+        self.assertTrue(self.matches("*.log", "a.log"))
+        self.assertTrue(self.matches("*.log", "deep/dir/a.log"))
+        self.assertFalse(self.matches("*.log", "a.log.txt"))
+
+    def test_anchored(self):
+        self.assertTrue(self.matches("/build", "build"))
+        self.assertFalse(self.matches("/build", "src/build"))
+        self.assertTrue(self.matches("doc/*.txt", "doc/a.txt"))
+        self.assertFalse(self.matches("doc/*.txt", "doc/sub/a.txt"))
+
+    def test_double_star(self):
+        self.assertTrue(self.matches("**/cache", "a/b/cache"))
+        self.assertTrue(self.matches("**/cache", "cache"))
+        self.assertTrue(self.matches("out/**", "out/a/b"))
+        self.assertTrue(self.matches("a/**/b", "a/b"))
+        self.assertTrue(self.matches("a/**/b", "a/x/y/b"))
+
+    def test_character_class(self):
+        self.assertTrue(self.matches("mod[0-9].py", "mod1.py"))
+        self.assertFalse(self.matches("mod[!0-9].py", "mod1.py"))
+        self.assertTrue(self.matches("file?", "file1"))
+        self.assertFalse(self.matches("file?", "file/"))
+
+    def test_escaped(self):
+        self.assertTrue(self.matches("\\#notes", "#notes"))
+
+
+class TestGitIgnore(TestCase):
+
+    def test_comments_and_blank_lines(self):
+        ignore = GitIgnore(["# comment", "", "   "])
+
+        self.assertEqual(len(ignore), 0)
+
+    def test_last_rule_wins(self):
+        ignore = GitIgnore(["*.log", "!keep.log", "debug/keep.log"])
+
+        self.assertTrue(ignore.match("a.log", False))
+        self.assertFalse(ignore.match("keep.log", False))
+        self.assertTrue(ignore.match("debug/keep.log", False))
+        self.assertIsNone(ignore.match("mod.py", False))
+
+    def test_dir_only_rule(self):
+        ignore = GitIgnore(["build/"])
+
+        self.assertTrue(ignore.match("build", True))
+        self.assertIsNone(ignore.match("build", False))
+        self.assertTrue(ignore.has_dir_rules)
+
+
+class TestPathFilter(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tmp.putfile(".gitignore", "node_modules/\n*.log\nbuild\n")
+        self.tmp.src = "src"
+        self.tmp.src.putfile("mod.py", "")
+        self.tmp.src.putfile("debug.log", "")
+        self.tmp.src.putfile(".gitignore", "!debug.log\n")
+        self.tmp.src.node_modules = "node_modules"
+        self.tmp.src.node_modules.putfile("lib.js", "")
+        self.tmp.build = "build"
+        self.tmp.build.lib = "lib"
+        self.tmp.hidden = ".hidden"
+
+        self.root = unicode(self.tmp)
+        self.path_filter = PathFilter([r".*/\."], root=self.root)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_regex_only(self):
+        path_filter = PathFilter([r".*\.pyc$"])
+
+        self.assertTrue(path_filter("/src/mod.pyc"))
+        self.assertFalse(path_filter("/src/mod.py"))
+
+    def test_excluded_dirs_pruned(self):
+        dirs = self.path_filter.watch_dirs(self.root)
+
+        self.assertEqual(sorted(dirs), [self.root, self.tmp.src])
+
+    def test_gitignore_rules(self):
+        self.path_filter.watch_dirs(self.root)
+
+        self.assertTrue(self.path_filter(self.tmp.join("a.log")))
+        self.assertFalse(self.path_filter(self.tmp.src.join("mod.py")))
+        self.assertTrue(self.path_filter(self.tmp.join(".hidden")))
+
+    def test_nested_gitignore_precedence(self):
+        self.path_filter.watch_dirs(self.root)
+
+        self.assertFalse(self.path_filter(self.tmp.src.join("debug.log")))
+        self.assertTrue(self.path_filter(self.tmp.src.join("other.log")))
+
+    def test_inside_ignored_dir(self):
+        self.path_filter.watch_dirs(self.root)
+
+        self.assertTrue(self.path_filter(self.tmp.build.lib.join("mod.py")))
+        self.assertTrue(
+            self.path_filter(self.tmp.src.node_modules.join("lib.js")))
+
+    def test_gitignore_disabled(self):
+        path_filter = PathFilter([r".*/\."])
+
+        dirs = path_filter.watch_dirs(self.root)
+
+        self.assertEqual(len(dirs), 5)
+        self.assertFalse(path_filter(self.tmp.join("a.log")))
+
+    def test_gitignore_changed(self):
+        """
+        Rules are read again when .gitignore changes, also in directory
+        created after start
+        """
+
+        self.path_filter.watch_dirs(self.root)
+        mod = self.tmp.src.join("mod.py")
+        self.assertFalse(self.path_filter(mod))
+
+        self.tmp.src.putfile(".gitignore", "mod.py\n")
+        self.assertTrue(self.path_filter(self.tmp.src.join(".gitignore")))
+        self.assertTrue(self.path_filter(mod))
+
+        self.tmp.src.new = "new"
+        self.tmp.src.new.putfile(".gitignore", "*.py\n")
+        self.path_filter(self.tmp.src.new.join(".gitignore"))
+        self.assertTrue(self.path_filter(self.tmp.src.new.join("a.py")))
+
+    def test_gitignore_removed(self):
+        self.path_filter.watch_dirs(self.root)
+        os.remove(self.tmp.join(".gitignore"))
+
+        self.path_filter(self.tmp.join(".gitignore"))
+
+        self.assertFalse(self.path_filter(self.tmp.build.lib.join("mod.py")))
+
+    def test_watch_file(self):
+        file_path = self.tmp.src.join("mod.py")
+
+        self.assertEqual(self.path_filter.watch_dirs(file_path), [file_path])
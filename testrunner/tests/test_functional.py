@@ -59,6 +59,8 @@ class TestFunctional(TestCase):
 
         self._copy_default_config(default_config)
         default_config.RUNNER_DELAY = -1
+        default_config.QUIET_PERIOD = 0.01
+        default_config.STATE_DIR = self.tmp_output.join("state")
 
         wm = WatchManager()
         config = Config(watch_manager=wm, command_args=command_args)
@@ -94,6 +96,8 @@ class TestFunctional(TestCase):
 
         self._copy_default_config(default_config)
         default_config.RUNNER_DELAY = -1
+        default_config.QUIET_PERIOD = 0.01
+        default_config.STATE_DIR = self.tmp_output.join("state")
 
         wm = WatchManager()
         config = Config(watch_manager=wm, command_args=command_args)
@@ -129,6 +133,8 @@ class TestFunctional(TestCase):
 
         self._copy_default_config(default_config)
         default_config.RUNNER_DELAY = -1
+        default_config.QUIET_PERIOD = 0.01
+        default_config.STATE_DIR = self.tmp_output.join("state")
 
         wm = WatchManager()
         config = Config(watch_manager=wm, command_args=command_args)
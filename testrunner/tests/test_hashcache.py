@@ -0,0 +1,154 @@
+import os
+from unittest import TestCase
+
+from fixture.io import TempIO
+from mock import patch
+
+from testrunner.hashcache import ContentHashCache, file_digest
+
+
+class TestContentHashCache(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.file_path = self.tmp.putfile("mod.py", "X = 1")
+        self.cache = ContentHashCache()
+
+    def tearDown(self):
+        del self.tmp
+
+    def touch(self, content=None):
+        if content is not None:
+            self.tmp.putfile("mod.py", content)
+        stat_info = os.stat(self.file_path)
+        os.utime(self.file_path, (stat_info.st_atime, stat_info.st_mtime + 10))
+
+    def test_unknown_file_changed(self):
+        changed = self.cache.changed([self.file_path])
+
+        self.assertEqual(changed, set([self.file_path]))
+        self.assertIn(self.file_path, self.cache)
+
+    def test_same_stat_not_read(self):
+        self.cache.changed([self.file_path])
+
+        with patch("testrunner.hashcache.file_digest") as digest:
+            changed = self.cache.changed([self.file_path])
+
+        self.assertEqual(changed, set())
+        self.assertFalse(digest.called)
+
+    def test_touched_same_content(self):
+        self.cache.changed([self.file_path])
+        self.touch()
+
+        self.assertEqual(self.cache.changed([self.file_path]), set())
+
+    def test_content_changed(self):
+        self.cache.changed([self.file_path])
+        self.touch("X = 2")
+
+        self.assertEqual(self.cache.changed([self.file_path]),
+                         set([self.file_path]))
+
+    def test_reverted_content(self):
+        """
+        Content compared with the one seen last time, not the first one
+        """
+
+        self.cache.changed([self.file_path])
+        self.touch("X = 2")
+        self.cache.changed([self.file_path])
+        self.touch("X = 1")
+
+        self.assertEqual(self.cache.changed([self.file_path]),
+                         set([self.file_path]))
+
+    def test_deleted_file(self):
+        self.cache.changed([self.file_path])
+        os.remove(self.file_path)
+
+        self.assertEqual(self.cache.changed([self.file_path]),
+                         set([self.file_path]))
+        self.assertNotIn(self.file_path, self.cache)
+
+    def test_unknown_missing_file(self):
+        """
+        Temporary file created and removed before run
+        """
+
+        missing = self.tmp.join("mod.py.swp")
+
+        self.assertEqual(self.cache.changed([missing]), set())
+
+    def test_directory_always_changed(self):
+        self.cache.changed([unicode(self.tmp)])
+
+        self.assertEqual(self.cache.changed([unicode(self.tmp)]),
+                         set([unicode(self.tmp)]))
+
+    def test_bounded(self):
+        other = self.tmp.putfile("other.py", "")
+        self.cache.max_size = 1
+
+        self.cache.changed([self.file_path])
+        self.cache.changed([other])
+
+        self.assertEqual(len(self.cache), 1)
+        self.assertNotIn(self.file_path, self.cache)
+        self.assertIn(other, self.cache)
+
+    def test_snapshot_restored(self):
+        self.cache.changed([self.file_path])
+        cache = ContentHashCache()
+
+        cache.restore(self.cache.snapshot())
+        with patch("testrunner.hashcache.file_digest") as digest:
+            changed = cache.changed([self.file_path])
+
+        self.assertEqual(changed, set())
+        self.assertFalse(digest.called)
+
+    def test_snapshot_revalidated(self):
+        """
+        File changed after snapshot was taken
+        """
+
+        snapshot = [[self.file_path, 5, 0, "outdated"]]
+        self.cache.restore(snapshot)
+
+        self.assertEqual(self.cache.changed([self.file_path]),
+                         set([self.file_path]))
+
+    def test_restore_keeps_known(self):
+        other = self.tmp.putfile("other.py", "")
+        digest = self.cache.digest(self.file_path)
+        self.cache.max_size = 2
+
+        self.cache.restore([[other, 0, 0, "a"], [self.file_path, 5, 0, "b"],
+                            [self.tmp.join("old.py"), 0, 0, "c"]])
+
+        self.assertEqual(self.cache.digest(self.file_path), digest)
+        self.assertNotIn(other, self.cache)
+
+    def test_changes_counted(self):
+        self.cache.digest(self.file_path)
+        changes = self.cache.changes
+
+        self.cache.digest(self.file_path)
+        self.assertEqual(self.cache.changes, changes)
+
+        os.remove(self.file_path)
+        self.cache.digest(self.file_path)
+        self.assertEqual(self.cache.changes, changes + 1)
+
+    def test_digest_remembered(self):
+        digest = self.cache.digest(self.file_path)
+
+        self.assertEqual(digest, file_digest(self.file_path))
+        self.assertIn(self.file_path, self.cache)
+        self.assertIsNone(self.cache.digest(self.tmp.join("missing.py")))
+
+    def test_file_digest(self):
+        self.assertEqual(file_digest(self.file_path),
+                         "f482f743a9454a54273d06cc864d6611a498a627")
@@ -0,0 +1,106 @@
+from os import path
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.history import (
+    DurationHistory, RunHistory, durations_file, history_file
+)
+
+
+class TestRunHistory(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.file_path = history_file(self.tmp.join("state"))
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_missing_file(self):
+        history = RunHistory(self.file_path).load()
+
+        self.assertEqual(history.tests, {})
+
+    def test_broken_file(self):
+        file_path = self.tmp.putfile("history.json", "{broken")
+
+        history = RunHistory(file_path).load()
+
+        self.assertEqual(history.tests, {})
+
+    def test_saved_and_loaded(self):
+        history = RunHistory(self.file_path)
+        history.record("test_a", True)
+        history.save()
+
+        loaded = RunHistory(self.file_path).load()
+
+        self.assertTrue(path.isfile(self.file_path))
+        self.assertEqual(loaded.failing(), ["test_a"])
+
+    def test_recently_failed_first(self):
+        history = RunHistory(self.file_path)
+        history.record("test_old", True, timestamp=1)
+        history.record("test_new", True, timestamp=2)
+        history.record("test_fixed", True, timestamp=3)
+        history.record("test_fixed", False, timestamp=4)
+
+        self.assertEqual(history.failing(), ["test_new", "test_old"])
+
+    def test_run_recorded(self):
+        history = RunHistory(self.file_path)
+        run_tests = ["pkg.test_calc.TestCalc.test_add", "pkg.test_b.T.test"]
+
+        history.record_run(["pkg.test_calc.TestCalc.test_add"], False,
+                           run_tests)
+
+        self.assertTrue(history.tests[run_tests[0]]["failed"])
+        self.assertFalse(history.tests[run_tests[1]]["failed"])
+
+    def test_crashed_run(self):
+        """
+        Without failures in output it is not known which tests passed
+        """
+
+        history = RunHistory(self.file_path)
+        history.record("test_a", True)
+
+        history.record_run([], False, ["test_a"])
+
+        self.assertEqual(history.failing(), ["test_a"])
+
+    def test_bounded(self):
+        history = RunHistory(self.file_path, max_size=1)
+        history.record("test_old", True, timestamp=1)
+        history.record("test_new", True, timestamp=2)
+
+        history.save()
+
+        self.assertEqual(list(history.tests), ["test_new"])
+
+
+class TestDurationHistory(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.file_path = durations_file(self.tmp.join("state"))
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_smoothed(self):
+        history = DurationHistory(self.file_path)
+        history.record("test_a", 4.0)
+        history.record("test_a", 2.0)
+
+        self.assertEqual(history.durations(), {"test_a": 3.0})
+
+    def test_saved_and_loaded(self):
+        history = DurationHistory(self.file_path)
+        history.record("test_a", 4.0)
+        history.save()
+
+        loaded = DurationHistory(self.file_path).load()
+
+        self.assertEqual(loaded.durations(), {"test_a": 4.0})
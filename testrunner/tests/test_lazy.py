@@ -0,0 +1,41 @@
+import subprocess
+import sys
+from os import path
+from unittest import TestCase
+
+import testrunner
+from testrunner.lazy import LazyModule
+
+
+class TestLazyModule(TestCase):
+
+    def test_imported_on_access(self):
+        module = LazyModule("json")
+
+        self.assertIsNone(module._module)
+        self.assertEqual(module.dumps([1]), "[1]")
+        self.assertIs(module._module, sys.modules["json"])
+
+    def test_missing_module(self):
+        module = LazyModule("testrunner.no_such_module")
+
+        with self.assertRaises(ImportError):
+            module.anything  # pylint: disable=pointless-statement
+
+    def test_startup_imports(self):
+        """
+        Importing testrunner does not import modules used by test runs
+        """
+
+        code = (
+            "import sys, testrunner; "
+            "print(' '.join(sorted(set(sys.modules) & set(sys.argv[1:]))))"
+        )
+        heavy = ["pexpect", "multiprocessing", "BaseHTTPServer",
+                 "logging.config", "testrunner.zygote"]
+
+        output = subprocess.check_output(
+            [sys.executable, "-c", code] + heavy,
+            cwd=path.dirname(path.dirname(path.abspath(testrunner.__file__))))
+
+        self.assertEqual(output.strip(), "")
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+from os import path
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.history import dump_json
+from testrunner.linecoverage import (
+    OUTSIDE_TESTS, VERSION, CoverageIndex, LineMap, changed_lines,
+    from_ranges, intersects, runs_dir, sources_dir, to_ranges
+)
+
+SOURCE = "import os\n\n\ndef a():\n    return 1\n\n\ndef b():\n    return 2\n"
+
+
+class TestRanges(TestCase):
+
+    def test_to_ranges(self):
+        self.assertEqual(to_ranges([5, 1, 2, 3, 7, 8]),
+                         [[1, 3], [5, 5], [7, 8]])
+        self.assertEqual(to_ranges([]), [])
+
+    def test_from_ranges(self):
+        self.assertEqual(from_ranges([[1, 3], [7, 7]]), set([1, 2, 3, 7]))
+
+    def test_intersects(self):
+        self.assertTrue(intersects([[1, 3], [8, 9]], [[5, 8]]))
+        self.assertFalse(intersects([[1, 3], [8, 9]], [[4, 7], [10, 12]]))
+        self.assertFalse(intersects([], [[1, 1]]))
+
+
+class TestChangedLines(TestCase):
+
+    def test_replaced(self):
+        old = ["a", "b", "c", "d"]
+        new = ["a", "B", "C", "d"]
+
+        self.assertEqual(changed_lines(old, new), [[2, 3]])
+
+    def test_deleted(self):
+        self.assertEqual(changed_lines(["a", "b", "c"], ["a", "c"]), [[2, 2]])
+
+    def test_inserted(self):
+        """
+        Lines around inserted ones count as changed
+        """
+
+        old = ["a", "b", "c"]
+        new = ["a", "b", "x", "c"]
+
+        self.assertEqual(changed_lines(old, new), [[2, 3]])
+
+    def test_inserted_at_start(self):
+        self.assertEqual(changed_lines(["a", "b"], ["x", "a", "b"]), [[1, 1]])
+
+    def test_same(self):
+        self.assertEqual(changed_lines(["a", "b"], ["a", "b"]), [])
+
+
+class TestLineMap(TestCase):
+
+    def test_lines_moved(self):
+        line_map = LineMap(["a", "b", "c"], ["x", "y", "a", "b", "c"])
+
+        self.assertEqual(line_map.lines(1), [3])
+        self.assertEqual(line_map.lines(3), [5])
+
+    def test_replaced(self):
+        line_map = LineMap(["a", "b", "c"], ["a", "x", "y", "c"])
+
+        self.assertEqual(line_map.lines(2), [2, 3])
+        self.assertEqual(line_map.lines(3), [4])
+
+    def test_deleted(self):
+        line_map = LineMap(["a", "b", "c"], ["a", "c"])
+
+        self.assertEqual(line_map.lines(2), [])
+        self.assertEqual(line_map.ranges([[1, 3]]), [[1, 2]])
+
+
+class TestCoverageIndex(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.cov_dir = self.tmp.join("coverage")
+        self.file_path = self.tmp.putfile("mod.py", SOURCE)
+        self.index = CoverageIndex(self.cov_dir)
+
+    def tearDown(self):
+        del self.tmp
+
+    def store(self, content):
+        digest = hashlib.sha1(content).hexdigest()
+        if not path.isdir(sources_dir(self.cov_dir)):
+            os.makedirs(sources_dir(self.cov_dir))
+        with open(path.join(sources_dir(self.cov_dir), digest), "wb") as dst:
+            dst.write(content)
+        return digest
+
+    def add_run(self, name, tests, content=SOURCE, suite=True):
+        dump_json(path.join(runs_dir(self.cov_dir), name), {
+            "version": VERSION,
+            "suite": suite,
+            "digests": {self.file_path: self.store(content)},
+            "tests": dict(
+                (test_id, {self.file_path: ranges})
+                for test_id, ranges in tests.items()
+            ),
+        })
+
+    def suite_run(self):
+        self.add_run("1.json", {
+            OUTSIDE_TESTS: [[1, 1], [4, 4], [8, 8]],
+            "t.test_a": [[5, 5]],
+            "t.test_b": [[9, 9]],
+        })
+        self.index.merge_runs()
+
+    def test_missing_index(self):
+        index = CoverageIndex(self.cov_dir).load()
+
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.changed_tests(self.file_path))
+
+    def test_suite_merged(self):
+        self.suite_run()
+
+        self.assertEqual(self.index.files[self.file_path]["t.test_a"],
+                         [[5, 5]])
+        self.assertEqual(os.listdir(runs_dir(self.cov_dir)), [])
+
+    def test_shards_merged(self):
+        self.add_run("1.json", {OUTSIDE_TESTS: [[1, 1]], "t.test_a": [[5, 5]]})
+        self.add_run("2.json", {OUTSIDE_TESTS: [[4, 4]], "t.test_b": [[9, 9]]})
+
+        self.assertTrue(self.index.merge_runs())
+
+        coverage = self.index.files[self.file_path]
+        self.assertEqual(coverage[OUTSIDE_TESTS], [[1, 1], [4, 4]])
+        self.assertEqual(sorted(coverage), [OUTSIDE_TESTS, "t.test_a",
+                                            "t.test_b"])
+
+    def test_saved_and_loaded(self):
+        self.suite_run()
+        self.index.save()
+
+        index = CoverageIndex(self.cov_dir).load()
+
+        self.assertEqual(index.files, self.index.files)
+        self.assertEqual(index.digests, self.index.digests)
+
+    def test_unchanged_file(self):
+        self.suite_run()
+
+        self.assertEqual(self.index.changed_tests(self.file_path), set())
+
+    def test_changed_test_lines(self):
+        self.suite_run()
+        self.tmp.putfile("mod.py", SOURCE.replace("return 2", "return 3"))
+
+        self.assertEqual(self.index.changed_tests(self.file_path),
+                         set(["t.test_b"]))
+
+    def test_changed_outside_tests(self):
+        """
+        Lines run on import can affect any test
+        """
+
+        self.suite_run()
+        self.tmp.putfile("mod.py", SOURCE.replace("import os", "import sys"))
+
+        self.assertIsNone(self.index.changed_tests(self.file_path))
+
+    def test_source_missing(self):
+        self.suite_run()
+        self.index.save()
+        os.remove(path.join(sources_dir(self.cov_dir),
+                            self.index.digests[self.file_path]))
+
+        self.assertIsNone(self.index.changed_tests(self.file_path))
+
+    def test_single_test_updated(self):
+        """
+        Lines of other tests move to new content of file
+        """
+
+        self.suite_run()
+        content = "# comment\n" + SOURCE.replace("return 1", "x = 1\n    "
+                                                 "return x")
+        self.tmp.putfile("mod.py", content)
+        self.add_run("2.json", {OUTSIDE_TESTS: [[2, 2]],
+                                "t.test_a": [[6, 7]]},
+                     content=content, suite=False)
+
+        self.assertTrue(self.index.merge_runs())
+
+        coverage = self.index.files[self.file_path]
+        self.assertEqual(coverage["t.test_a"], [[6, 7]])
+        self.assertEqual(coverage["t.test_b"], [[11, 11]])
+        self.assertEqual(self.index.changed_tests(self.file_path), set())
+
+    def test_suite_replaces_index(self):
+        self.suite_run()
+        self.add_run("2.json", {"t.test_c": [[5, 5]]})
+
+        self.index.merge_runs()
+
+        self.assertEqual(list(self.index.files[self.file_path]), ["t.test_c"])
+
+    def test_runs_discarded(self):
+        self.add_run("1.json", {"t.test_a": [[5, 5]]})
+
+        self.index.discard_runs()
+
+        self.assertFalse(self.index.merge_runs())
+        self.assertEqual(self.index.files, {})
+
+    def test_unused_sources_pruned(self):
+        self.suite_run()
+        old = self.store("old content")
+
+        self.index.save()
+
+        self.assertEqual(os.listdir(sources_dir(self.cov_dir)),
+                         [self.index.digests[self.file_path]])
+        self.assertNotEqual(old, self.index.digests[self.file_path])
+
+    def test_broken_index(self):
+        os.makedirs(self.cov_dir)
+        with open(path.join(self.cov_dir, "index.json"), "w") as dst:
+            dst.write("{broken")
+
+        index = CoverageIndex(self.cov_dir).load()
+
+        self.assertEqual(index.files, {})
+
+    def test_other_version(self):
+        os.makedirs(self.cov_dir)
+        with open(path.join(self.cov_dir, "index.json"), "w") as dst:
+            json.dump({"version": VERSION + 1, "files": {"a": {}},
+                       "digests": {}}, dst)
+
+        index = CoverageIndex(self.cov_dir).load()
+
+        self.assertEqual(index.files, {})
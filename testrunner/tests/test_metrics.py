@@ -0,0 +1,179 @@
+import json
+import socket
+import urllib2
+from unittest import TestCase
+
+from fixture.io import TempIO
+from mock import patch
+
+from testrunner.metrics import (
+    FIRST_EVENT, FIRST_OUTPUT, SCHEDULED, SPAWNED, STAGE1_DONE, STAGE2_DONE,
+    MetricsLog, MetricsServer, RunStats, durations, percentile, prometheus,
+    serve_metrics
+)
+
+MARKS = {
+    FIRST_EVENT: 10.0,
+    SCHEDULED: 10.5,
+    SPAWNED: 11.0,
+    FIRST_OUTPUT: 12.0,
+    STAGE1_DONE: 14.0,
+    STAGE2_DONE: 20.0,
+}
+
+
+class TestDurations(TestCase):
+
+    def test_all_phases(self):
+        self.assertEqual(durations(MARKS), {
+            "debounce": 0.5,
+            "spawn": 0.5,
+            "startup": 1.0,
+            "stage1": 2.0,
+            "stage2": 6.0,
+            "total": 10.0,
+        })
+
+    def test_missing_moments(self):
+        """
+        Without suite there is no second stage, total ends with first one
+        """
+
+        marks = dict(MARKS)
+        del marks[STAGE2_DONE]
+
+        result = durations(marks)
+
+        self.assertNotIn("stage2", result)
+        self.assertEqual(result["total"], 4.0)
+
+    def test_no_output(self):
+        marks = dict(MARKS)
+        del marks[FIRST_OUTPUT]
+
+        result = durations(marks)
+
+        self.assertNotIn("startup", result)
+        self.assertEqual(result["stage1"], 3.0)
+
+    def test_percentile(self):
+        ordered = range(1, 101)
+
+        self.assertEqual(percentile(ordered, 0.5), 51)
+        self.assertEqual(percentile(ordered, 0.99), 99)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class TestRunStats(TestCase):
+
+    def test_rolling_window(self):
+        stats = RunStats(window=2)
+
+        for delay in (1, 2, 3):
+            stats.record({FIRST_EVENT: 0, SCHEDULED: delay})
+
+        self.assertEqual(len(stats), 2)
+        self.assertEqual(stats.runs_total, 3)
+        self.assertEqual(stats.samples("debounce"), [2, 3])
+
+    def test_summary(self):
+        stats = RunStats()
+        stats.record(MARKS)
+
+        summary = stats.summary()
+
+        self.assertEqual(summary["stage1"]["count"], 1)
+        self.assertEqual(summary["stage1"]["quantiles"][0.9], 2.0)
+
+    def test_prometheus(self):
+        stats = RunStats()
+        stats.record(MARKS)
+
+        text = stats.prometheus()
+
+        self.assertIn("testrunner_runs_total 1\n", text)
+        self.assertIn(
+            'testrunner_phase_seconds{phase="total",quantile="0.5"} 10.0\n',
+            text)
+        self.assertIn('testrunner_phase_seconds_count{phase="spawn"} 1\n',
+                      text)
+
+
+class TestMetricsLog(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_line_per_run(self):
+        metrics_log = MetricsLog(self.tmp.join("state", "metrics.jsonl"))
+
+        metrics_log.write(MARKS, durations(MARKS), True)
+        metrics_log.write({}, {}, False)
+
+        with open(metrics_log.file_path) as src:
+            lines = [json.loads(line) for line in src]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["durations"]["total"], 10.0)
+        self.assertFalse(lines[1]["result"])
+
+
+class TestMetricsServer(TestCase):
+
+    def test_served(self):
+        stats = RunStats()
+        stats.record(MARKS)
+        server = MetricsServer(stats, 0)
+        server.start()
+        url = "http://127.0.0.1:{}".format(server.port)
+
+        try:
+            body = urllib2.urlopen(url + "/metrics", timeout=5).read()
+            with self.assertRaises(urllib2.HTTPError):
+                urllib2.urlopen(url + "/other", timeout=5)
+        finally:
+            server.stop()
+
+        self.assertEqual(body, stats.prometheus())
+
+    @patch.dict("testrunner.metrics._servers")
+    @patch("testrunner.metrics._log", autospec=True)
+    def test_port_in_use(self, logger):
+        """
+        Metrics are not served, tests run anyway
+        """
+
+        sock = socket.socket()
+        self.addCleanup(sock.close)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(1)
+
+        server = serve_metrics(RunStats(), sock.getsockname()[1])
+
+        self.assertIsNone(server)
+        self.assertTrue(logger.warning.called)
+
+    @patch.dict("testrunner.metrics._servers")
+    @patch.object(MetricsServer, "start", autospec=True)
+    def test_shared_by_projects(self, start):
+        """
+        Projects with the same port are served by one server
+        """
+
+        api, web = RunStats(), RunStats()
+        api.record(MARKS)
+
+        server = serve_metrics(api, 0, "api")
+        self.addCleanup(server._server.server_close)
+
+        self.assertIs(serve_metrics(web, 0, "web"), server)
+        start.assert_called_once_with(server)
+        body = prometheus(server.stats)
+        self.assertIn('testrunner_runs_total{project="api"} 1', body)
+        self.assertIn('testrunner_runs_total{project="web"} 0', body)
+        self.assertEqual(body.count("# TYPE testrunner_runs_total"), 1)
+        self.assertIn(
+            'testrunner_phase_seconds_count{phase="total",project="api"} 1',
+            body)
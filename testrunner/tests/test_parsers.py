@@ -0,0 +1,217 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from testrunner.parsers import (
+    ERROR, FAILED, PASSED, NoseParser, PytestParser, UnittestParser,
+    parser_for
+)
+
+UNITTEST_OUTPUT = u"""\
+test_add (test_calc.TestCalc) ... FAIL\r
+test_err (test_calc.TestCalc) ... ERROR\r
+test_ok (test_calc.TestCalc) ... ok\r
+\r
+======================================================================\r
+ERROR: test_err (test_calc.TestCalc)\r
+----------------------------------------------------------------------\r
+Traceback (most recent call last):\r
+ValueError: x\r
+\r
+======================================================================\r
+FAIL: test_add (test_calc.TestCalc)\r
+----------------------------------------------------------------------\r
+Traceback (most recent call last):\r
+AssertionError: 1 != 2\r
+\r
+----------------------------------------------------------------------\r
+Ran 3 tests in 0.000s\r
+\r
+FAILED (failures=1, errors=1)\r
+"""
+
+NOSE_OUTPUT = u"""\
+test_add (test_calc.TestCalc) ... FAIL
+test_calc.test_func ... ok
+test_calc.test_other ... FAIL
+
+======================================================================
+FAIL: test_calc.test_other
+----------------------------------------------------------------------
+AssertionError
+"""
+
+PYTEST_OUTPUT = u"""\
+test_calc.py::TestCalc::test_add FAILED                                [ 33%]
+test_calc.py::TestCalc::test_ok PASSED                                 [ 66%]
+test_calc.py::test_func FAILED                                         [100%]
+
+==================== FAILURES ====================
+____________________ TestCalc.test_add ____________________
+
+>   def test_add(self): self.assertEqual(1, 2)
+E   AssertionError: 1 != 2
+____________________ test_func ____________________
+
+E   assert False
+==================== slowest test durations ====================
+0.50s call     test_calc.py::TestCalc::test_ok
+==================== short test summary info ====================
+FAILED test_calc.py::TestCalc::test_add - AssertionError: 1 != 2
+FAILED test_calc.py::test_func - assert False
+==================== 2 failed, 1 passed in 0.03 seconds ====================
+"""
+
+PYTEST_QUIET_OUTPUT = u"""\
+F.                                                                     [100%]
+==================== FAILURES ====================
+____________________ test_func ____________________
+
+E   assert False
+==================== short test summary info ====================
+FAILED test_calc.py::test_func - assert False
+"""
+
+
+class TestUnittestParser(TestCase):
+
+    def test_results(self):
+        parser = UnittestParser()
+
+        parser.write(UNITTEST_OUTPUT)
+        parser.close()
+
+        results = parser.results
+        self.assertEqual(results["test_calc.TestCalc.test_ok"].outcome, PASSED)
+        self.assertEqual(results["test_calc.TestCalc.test_err"].outcome, ERROR)
+        self.assertEqual(
+            results["test_calc.TestCalc.test_add"].traceback,
+            u"Traceback (most recent call last):\nAssertionError: 1 != 2")
+        self.assertEqual(parser.failed(), [
+            "test_calc.TestCalc.test_add", "test_calc.TestCalc.test_err"])
+        self.assertEqual(parser.tests_run, 3)
+
+    def test_streamed_in_chunks(self):
+        """
+        Output comes in arbitrary pieces
+        """
+
+        callback = Mock()
+        parser = UnittestParser(callback)
+
+        for idx in range(0, len(UNITTEST_OUTPUT), 7):
+            parser.write(UNITTEST_OUTPUT[idx:idx + 7])
+
+        # Outcomes are known before the output ends
+        self.assertEqual(callback.call_args_list[0][0][0].outcome, FAILED)
+        parser.close()
+        self.assertEqual(len(parser.failed()), 2)
+
+    @patch("testrunner.parsers.time")
+    def test_duration(self, time):
+        parser = UnittestParser()
+        time.return_value = 10
+
+        parser.write(u"test_ok (test_calc.TestCalc) ... ")
+        time.return_value = 12
+        parser.write(u"ok\n")
+
+        self.assertEqual(
+            parser.results["test_calc.TestCalc.test_ok"].duration, 2)
+
+    @patch("testrunner.parsers.time")
+    def test_first_output(self, time):
+        parser = UnittestParser()
+        time.side_effect = iter([10, 11, 12])
+
+        parser.write(u"")
+        parser.write(u"test_ok (test_calc.TestCalc) ... ")
+        parser.write(u"ok\n")
+
+        self.assertEqual(parser.first_output, 10)
+
+    def test_not_verbose(self):
+        parser = UnittestParser()
+
+        parser.write(u".F\n" + UNITTEST_OUTPUT.split(u"\r\n\r\n", 1)[1])
+        parser.close()
+
+        self.assertNotIn("test_calc.TestCalc.test_ok", parser.results)
+        self.assertEqual(len(parser.failed()), 2)
+
+    def test_full_test_ids(self):
+        """
+        Newer Python prints test method in test description too
+        """
+
+        parser = UnittestParser()
+
+        parser.write(u"test_ok (test_calc.TestCalc.test_ok) ... ok\n"
+                     u"FAIL: test_add (test_calc.TestCalc.test_add)\n")
+        parser.close()
+
+        self.assertEqual(list(parser.results), [
+            "test_calc.TestCalc.test_ok", "test_calc.TestCalc.test_add"])
+
+
+class TestNoseParser(TestCase):
+
+    def test_results(self):
+        parser = NoseParser()
+
+        parser.write(NOSE_OUTPUT)
+        parser.close()
+
+        self.assertEqual(parser.results["test_calc:test_func"].outcome, PASSED)
+        self.assertEqual(parser.failed(), [
+            "test_calc:TestCalc.test_add", "test_calc:test_other"])
+        self.assertEqual(
+            parser.results["test_calc:test_other"].traceback,
+            u"AssertionError")
+
+
+class TestPytestParser(TestCase):
+
+    def test_results(self):
+        parser = PytestParser()
+
+        parser.write(PYTEST_OUTPUT)
+        parser.close()
+
+        results = parser.results
+        self.assertEqual(
+            parser.failed(),
+            ["test_calc.py::TestCalc::test_add", "test_calc.py::test_func"])
+        self.assertEqual(
+            results["test_calc.py::TestCalc::test_add"].traceback,
+            u">   def test_add(self): self.assertEqual(1, 2)\n"
+            u"E   AssertionError: 1 != 2")
+        self.assertEqual(
+            results["test_calc.py::TestCalc::test_ok"].duration, 0.5)
+        self.assertEqual(parser.tests_run, 3)
+
+    def test_not_verbose(self):
+        """
+        Failed tests are known from short summary
+        """
+
+        parser = PytestParser()
+
+        parser.write(PYTEST_QUIET_OUTPUT)
+        parser.close()
+
+        result = parser.results["test_calc.py::test_func"]
+        self.assertEqual(result.outcome, FAILED)
+        self.assertEqual(result.traceback, u"E   assert False")
+
+
+class TestParserFor(TestCase):
+
+    def test_guessed(self):
+        self.assertIsInstance(parser_for("py.test -x"), PytestParser)
+        self.assertIsInstance(parser_for("python -m pytest"), PytestParser)
+        self.assertIsInstance(parser_for("nosetests"), NoseParser)
+        self.assertIsInstance(parser_for("python -m unittest"), UnittestParser)
+
+    def test_configured(self):
+        self.assertIsInstance(parser_for("./run.sh", "nose"), NoseParser)
@@ -0,0 +1,181 @@
+import shutil
+from unittest import TestCase
+
+import pyinotify
+from fixture.io import TempIO
+from mock import Mock, patch
+
+from testrunner import poller
+from testrunner.poller import DirPoller, diff_dir, list_dir
+
+
+class TestListDir(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tmp.putfile("a.py", "1")
+        self.tmp.mkdir("pkg")
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_entries(self):
+        entries = list_dir(unicode(self.tmp))
+
+        self.assertEqual(sorted(entries), ["a.py", "pkg"])
+        self.assertFalse(entries["a.py"][0])
+        self.assertEqual(entries["a.py"][2], 1)
+        self.assertTrue(entries["pkg"][0])
+
+    def test_without_scandir(self):
+        entries = list_dir(unicode(self.tmp))
+
+        with patch.object(poller, "scandir", None):
+            self.assertEqual(list_dir(unicode(self.tmp)), entries)
+
+
+class TestDiffDir(TestCase):
+
+    def test_changes(self):
+        old = {
+            "same.py": (False, 1, 1, 1),
+            "changed.py": (False, 1, 1, 2),
+            "removed.py": (False, 1, 1, 3),
+            "pkg": (True, 1, 4096, 4),
+        }
+        new = {
+            "same.py": (False, 1, 1, 1),
+            "changed.py": (False, 2, 1, 2),
+            "new.py": (False, 1, 1, 5),
+            # Directory mtime changes with its content, it is not reported
+            "pkg": (True, 2, 4096, 4),
+        }
+
+        self.assertEqual(diff_dir(old, new), [
+            (pyinotify.IN_MODIFY, "changed.py", False),
+            (pyinotify.IN_CREATE, "new.py", False),
+            (pyinotify.IN_DELETE, "removed.py", False),
+        ])
+
+
+class TestDirPoller(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tmp.putfile("a.py", "1")
+        self.root = unicode(self.tmp)
+
+        self.handler = Mock()
+        self.poller = DirPoller()
+        self.poller.add([self.root])
+        self.poller.handler = self.handler
+
+    def tearDown(self):
+        del self.tmp
+
+    def events(self):
+        return [
+            (event.maskname, event.pathname)
+            for (event,), _ in self.handler.call_args_list
+        ]
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.poller.poll(), 0)
+        self.assertFalse(self.handler.called)
+
+    def test_changes_handled(self):
+        self.tmp.putfile("a.py", "22")
+        self.tmp.putfile("b.py", "1")
+
+        self.assertEqual(self.poller.poll(), 2)
+
+        self.assertEqual(self.events(), [
+            ("IN_MODIFY", self.tmp.join("a.py")),
+            ("IN_CREATE", self.tmp.join("b.py")),
+        ])
+
+    def test_new_dir_polled(self):
+        """
+        New dirs are polled too, their content is reported as created
+        """
+
+        self.tmp.mkdir("pkg")
+        self.tmp.putfile("pkg/mod.py", "1")
+
+        self.poller.poll()
+
+        self.assertEqual(self.events(), [
+            ("IN_CREATE|IN_ISDIR", self.tmp.join("pkg")),
+            ("IN_CREATE", self.tmp.join("pkg", "mod.py")),
+        ])
+        self.assertIn(self.tmp.join("pkg"), self.poller)
+
+    def test_excluded_dir(self):
+        self.poller.exclude_filter = lambda dir_path: dir_path.endswith("pkg")
+        self.tmp.mkdir("pkg")
+
+        self.poller.poll()
+
+        self.assertNotIn(self.tmp.join("pkg"), self.poller)
+        self.assertFalse(self.handler.called)
+
+    def test_removed_dir(self):
+        self.poller.add([self.tmp.mkdir("pkg")])
+        self.poller.poll()
+
+        shutil.rmtree(self.tmp.join("pkg"))
+        self.poller.poll()
+
+        self.assertNotIn(self.tmp.join("pkg"), self.poller)
+        self.assertEqual(self.events()[-1],
+                         ("IN_DELETE|IN_ISDIR", self.tmp.join("pkg")))
+
+    def test_removed_polled_dir(self):
+        dir_path = self.tmp.mkdir("pkg")
+        poller = DirPoller()
+        poller.add([dir_path])
+        poller.handler = self.handler
+
+        shutil.rmtree(dir_path)
+        poller.poll()
+
+        self.assertEqual(len(poller), 0)
+        self.assertEqual(self.events(), [("IN_DELETE_SELF", dir_path)])
+
+    def test_mask(self):
+        self.poller.mask = pyinotify.IN_CREATE
+        self.tmp.putfile("a.py", "22")
+
+        self.poller.poll()
+
+        self.assertFalse(self.handler.called)
+
+    def test_adaptive_interval(self):
+        self.poller.poll()
+        self.poller.poll()
+        self.assertEqual(self.poller.interval, DirPoller.min_interval * 4)
+
+        self.tmp.putfile("a.py", "22")
+        self.poller.poll()
+        self.assertEqual(self.poller.interval, DirPoller.min_interval)
+
+    @patch("testrunner.poller.time")
+    def test_slow_scan(self, time):
+        """
+        Polling does not take more than small part of time
+        """
+
+        time.side_effect = iter([10, 11])
+
+        self.poller.poll()
+
+        self.assertEqual(self.poller.interval, DirPoller.cost_factor)
+
+    def test_polled_by_loop(self):
+        loop = Mock()
+
+        self.poller.attach(self.handler, loop)
+        self.poller.add([self.root])
+
+        loop.call_later.assert_called_once_with(
+            DirPoller.min_interval, self.poller._loop_poll)
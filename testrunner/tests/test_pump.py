@@ -0,0 +1,145 @@
+import os
+import pty
+import sys
+from threading import Timer
+from unittest import TestCase
+
+import pexpect
+from mock import Mock
+
+from testrunner.pump import PROMPTS, OutputPump, read_terminal
+
+
+class Collected(object):
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    @property
+    def text(self):
+        return u"".join(self.chunks)
+
+
+class TestOutputPump(TestCase):
+
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.addCleanup(os.close, self.read_fd)
+        self.output = Collected()
+
+    def write(self, data, end=True):
+        os.write(self.write_fd, data)
+        if end:
+            self.end()
+
+    def end(self):
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def pump(self, **kwargs):
+        self.addCleanup(self.end)
+        return OutputPump(self.read_fd, [self.output], **kwargs)
+
+    def test_debugger_prompts(self):
+        self.assertIn(u"(Pdb)", PROMPTS)
+        self.assertIn(u"ipdb>", PROMPTS)
+
+    def test_output_until_end(self):
+        pump = self.pump()
+        self.write(b"test_a ... ok\r\n(Pdb) is not at end\r\n")
+
+        self.assertFalse(pump.run())
+        self.assertEqual(self.output.text,
+                         u"test_a ... ok\r\n(Pdb) is not at end\r\n")
+
+    def test_stopped_in_debugger(self):
+        pump = self.pump()
+        self.write(b"> test.py(10)test_a()\r\n(Pdb) ", end=False)
+
+        self.assertTrue(pump.run())
+        self.assertTrue(self.output.text.endswith(u"(Pdb) "))
+
+    def test_prompt_split_between_chunks(self):
+        pump = self.pump()
+        pump.block_size = 3
+        self.write(b"output\r\nipdb> ", end=False)
+
+        self.assertTrue(pump.run())
+        self.assertEqual(self.output.text, u"output\r\nipdb> ")
+
+    def test_split_character(self):
+        pump = self.pump()
+        pump.block_size = 1
+        self.write(u"\u263A\r\n".encode("utf-8"))
+
+        pump.run()
+
+        self.assertEqual(self.output.text, u"\u263A\r\n")
+
+    def test_silent(self):
+        """
+        Silent test process does not stop pumping
+        """
+
+        on_tick = Mock()
+        pump = self.pump(on_tick=on_tick, interval=0.01)
+        timer = Timer(0.1, self.write, [b"late output"])
+        timer.start()
+
+        self.assertFalse(pump.run())
+        timer.join()
+
+        self.assertTrue(on_tick.called)
+        self.assertEqual(self.output.text, u"late output")
+
+    def test_tick_with_output(self):
+        """
+        Ticks come while test process keeps printing too
+        """
+
+        on_tick = Mock()
+        pump = self.pump(on_tick=on_tick, interval=0)
+        pump.block_size = 1
+        self.write(b"abc")
+
+        pump.run()
+
+        self.assertGreaterEqual(on_tick.call_count, 3)
+
+
+class TestOutputPumpPty(TestCase):
+
+    def test_pexpect_child(self):
+        """
+        Closed pseudo terminal ends output
+        """
+
+        proc = pexpect.spawnu(sys.executable, ["-c", "print('a' * 100000)"])
+        output = Collected()
+
+        stopped = OutputPump(proc.child_fd, [output]).run()
+        proc.close()
+
+        self.assertFalse(stopped)
+        self.assertEqual(output.text, u"a" * 100000 + u"\r\n")
+        self.assertEqual(proc.exitstatus, 0)
+
+
+class TestReadTerminal(TestCase):
+
+    def test_closed_slave(self):
+        """
+        Output ends when slave side is closed (EIO on Linux)
+        """
+
+        master, slave = pty.openpty()
+        self.addCleanup(os.close, master)
+        os.write(slave, b"out\n")
+        os.close(slave)
+
+        self.assertEqual(read_terminal(master, 1024), b"out\r\n")
+        self.assertEqual(read_terminal(master, 1024), b"")
@@ -0,0 +1,97 @@
+import os
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.dependency import DependencyIndex
+from testrunner.hashcache import file_digest
+from testrunner.resultcache import ResultCache, closure_key, failed_in
+
+
+class TestClosureKey(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tmp.putfile("core.py", "X = 1")
+        self.tmp.putfile("other.py", "Y = 1")
+        self.tmp.putfile("test_core.py", "import core")
+
+        self.index = DependencyIndex(unicode(self.tmp))
+        self.index.build()
+
+    def tearDown(self):
+        del self.tmp
+
+    def key(self, salt=u""):
+        return closure_key(self.index, "test_core", file_digest, salt)
+
+    def test_same_code(self):
+        self.assertEqual(self.key(), self.key())
+
+    def test_dependency_changed(self):
+        key = self.key()
+        self.tmp.putfile("core.py", "X = 2")
+
+        self.assertNotEqual(self.key(), key)
+
+    def test_unrelated_module_changed(self):
+        key = self.key()
+        self.tmp.putfile("other.py", "Y = 2")
+
+        self.assertEqual(self.key(), key)
+
+    def test_salt(self):
+        self.assertNotEqual(self.key(u"py.test"), self.key(u"nosetests"))
+
+
+class TestFailedIn(TestCase):
+
+    def test_module_names(self):
+        self.assertTrue(failed_in("pkg.test_a", "pkg.test_a.T.test_x"))
+        self.assertTrue(failed_in("pkg.test_a", "pkg.test_a:T.test_x"))
+        self.assertFalse(failed_in("pkg.test_a", "pkg.test_ab.T.test_x"))
+
+    def test_paths(self):
+        self.assertTrue(failed_in("/src/tests/test_a.py",
+                                  "tests/test_a.py::T::test_x"))
+        self.assertFalse(failed_in("/src/tests/test_a.py",
+                                   "tests/test_b.py::test_x"))
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.cache = ResultCache(self.tmp.join("results"), max_size=2)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_stored(self):
+        self.cache.store({"test_a": "key-a", "test_b": "key-b"})
+
+        self.assertEqual(self.cache.get("key-a"), "passed")
+        self.assertEqual(
+            self.cache.passed({"test_a": "key-a", "test_c": "key-c"}),
+            set(["test_a"]))
+
+    def test_least_recently_used_removed(self):
+        self.cache.store({"test_a": "key-a", "test_b": "key-b"})
+        for key, mtime in (("key-a", 100), ("key-b", 200)):
+            os.utime(self.cache._entry_path(key), (mtime, mtime))
+
+        self.cache.store({"test_c": "key-c"})
+
+        self.assertIsNone(self.cache.get("key-a"))
+        self.assertEqual(self.cache.get("key-b"), "passed")
+        self.assertEqual(self.cache.get("key-c"), "passed")
+
+    def test_broken_entry(self):
+        self.cache.store({"test_a": "key-a"})
+        with open(self.cache._entry_path("key-a"), "w") as dst:
+            dst.write("{")
+
+        self.assertIsNone(self.cache.get("key-a"))
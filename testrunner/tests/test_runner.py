@@ -1,24 +1,49 @@
+import multiprocessing
+import os
+import pickle
+import re
+import signal
 import sys
+import tempfile
+from glob import glob
+from os import path
 from unittest import TestCase
 from mock import Mock, patch, ANY, call
 
-import pexpect
+from testrunner import runner as runner_module
+from testrunner.metrics import (
+    FIRST_OUTPUT, SPAWNED, STAGE1_DONE, STAGE2_DONE
+)
+from testrunner.runner import (
+    Runner, RunControl, RunResult, ShardResult, init_worker, kill_group
+)
 
-from testrunner.runner import Runner
 
+class StreamMixin(object):
 
-@patch("testrunner.runner.pexpect.spawnu", autospec=True)
-class TestRunner(TestCase):
-    def setUp(self):
-        self.runner = Runner()
-
-    def test_expected_console_outputs(self, spawnu=None):
+    def stream(self, proc, *chunks, **kwargs):
         """
-        Script should do stuff for EOF or when debugger is triggered
+        Test process prints chunks and ends, unless end is False.
+        Then it ends when returned fd is closed
         """
 
-        self.assertIn(pexpect.EOF, self.runner._excepted)
-        self.assertIn("pdb", repr(self.runner._excepted).lower())
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        proc.child_fd = read_fd
+
+        for chunk in chunks:
+            os.write(write_fd, chunk.encode("utf-8"))
+
+        if kwargs.get("end", True):
+            os.close(write_fd)
+
+        return write_fd
+
+
+@patch("testrunner.runner.pexpect.spawnu", autospec=True)
+class TestRunner(StreamMixin, TestCase):
+    def setUp(self):
+        self.runner = Runner()
 
     def test_spawning_pocesses_clean_exit(self, spawnu):
         """
@@ -26,31 +51,64 @@ class TestRunner(TestCase):
         """
 
         proc = Mock(logfile=None, exitstatus=0)
-        proc.expect.return_value = 0
+        self.stream(proc, u"output")
         spawnu.return_value = proc
 
         result = self.runner.run_test("test-cmd", progress=False)
 
         spawnu.assert_called_once_with("test-cmd")
         self.assertEqual(proc.logfile, None)
-        proc.expect.assert_called_once_with(self.runner._excepted, timeout=ANY)
+        self.assertFalse(proc.expect.called)
         self.assertTrue(proc.close.called)
         self.assertTrue(result)
 
+    def test_output_parsed(self, spawnu):
+        """
+        Failed tests are known from output streamed to parser
+        """
+
+        proc = Mock(logfile=None, exitstatus=1)
+        self.stream(proc, u"FAIL: test_a (pkg.test.T)\n")
+        spawnu.return_value = proc
+
+        with patch("testrunner.runner._log", autospec=True):
+            result = self.runner.run_test("python -m unittest")
+
+        self.assertFalse(result)
+        self.assertEqual(self.runner.last_failed, ["pkg.test.T.test_a"])
+
+    def test_timings(self, spawnu):
+        """
+        Moments of run are remembered only the first time
+        """
+
+        proc = Mock(logfile=None, exitstatus=0)
+        spawnu.return_value = proc
+        self.runner.timings = {}
+
+        self.stream(proc, u"Ran 1 test in 0.1s\n")
+        self.runner.run_test("test-cmd")
+        timings = dict(self.runner.timings)
+        self.stream(proc, u"Ran 1 test in 0.1s\n")
+        self.runner.run_test("test-cmd")
+
+        self.assertEqual(self.runner.timings, timings)
+        self.assertLessEqual(timings[SPAWNED], timings[FIRST_OUTPUT])
+
     def test_spawning_pocesses_clean_exit_progess(self, spawnu):
         """
         Running simple command that succeeds - with tracking
         """
 
         proc = Mock(logfile=None, exitstatus=0)
-        proc.expect.return_value = 0
+        self.stream(proc, u"output")
         spawnu.return_value = proc
 
-        result = self.runner.run_test("test-cmd", progress=True)
+        with patch("testrunner.runner.sys.stderr") as stderr:
+            result = self.runner.run_test("test-cmd", progress=True)
 
         spawnu.assert_called_once_with("test-cmd")
-        self.assertEqual(proc.logfile, sys.stderr)
-        proc.expect.assert_called_once_with(self.runner._excepted, timeout=ANY)
+        stderr.write.assert_called_once_with(u"output")
         self.assertTrue(proc.close.called)
         self.assertTrue(result)
 
@@ -59,27 +117,58 @@ class TestRunner(TestCase):
         """
         Running simple command that exits with an error
         """
-        proc = Mock(logfile=None, exitstatus=1, before="error message")
-        proc.expect.return_value = 0
+        proc = Mock(logfile=None, exitstatus=1)
+        self.stream(proc, u"error ", u"message")
         spawnu.return_value = proc
 
         result = self.runner.run_test("test-cmd", progress=False)
 
         spawnu.assert_called_once_with("test-cmd")
         self.assertEqual(proc.logfile, None)
-        proc.expect.assert_called_once_with(self.runner._excepted, timeout=ANY)
         self.assertTrue(proc.close.called)
         self.assertIn("error message", repr(logger.error.call_args))
+        self.assertEqual(self.runner.last_traceback, u"error message")
         self.assertFalse(result)
 
+    @patch("testrunner.runner._log", autospec=True)
+    def test_long_output(self, logger, spawnu):
+        """
+        Only tail of long output and tracebacks of failures are reported,
+        whole output is kept in file until next run
+        """
+
+        runner = Runner({"OUTPUT_MEMORY": 20})
+        proc = Mock(logfile=None, exitstatus=1)
+        self.stream(proc, u"test_a (pkg.T) ... FAIL\n", u"x" * 100 + u"\n",
+               u"=" * 70 + u"\n", u"FAIL: test_a (pkg.T)\n",
+               u"-" * 70 + u"\n", u"AssertionError\n", u"\n",
+               u"Ran 1 test\nFAILED\n")
+        spawnu.return_value = proc
+
+        result = runner.run_test("python -m unittest")
+
+        self.assertFalse(result)
+        self.assertIn(u"AssertionError", runner.last_traceback)
+        self.assertTrue(runner.last_traceback.endswith(
+            u"Ran 1 test\nFAILED\n"))
+        self.assertNotIn(u"x" * 100, runner.last_traceback)
+        file_path = re.search(
+            r"whole output in (.+)\]", runner.last_traceback).group(1)
+        with open(file_path) as src:
+            self.assertIn(u"x" * 100, src.read())
+
+        runner.discard_output()
+        self.assertFalse(os.path.exists(file_path))
+
     @patch("testrunner.runner._log", autospec=True)
     def test_spawning_pocesses_with_debugger(self, logger, spawnu):
         """
         Running simple command interrupted with debugger
         """
 
-        proc = Mock(logfile=None, exitstatus=0, before="msg")
-        proc.expect.return_value = 1
+        proc = Mock(logfile=None, exitstatus=0)
+        write_fd = self.stream(proc, u"msg\n", u"(Pdb) ", end=False)
+        self.addCleanup(os.close, write_fd)
         spawnu.return_value = proc
 
         result = self.runner.run_test("test-cmd", progress=False)
@@ -89,11 +178,104 @@ class TestRunner(TestCase):
         proc.sendline.assert_called_once_with("")
         proc.interact.assert_called_once_with()
         self.assertEqual(proc.logfile, None)
-        proc.expect.assert_called_once_with(self.runner._excepted, timeout=ANY)
         self.assertTrue(proc.close.called)
         self.assertTrue(result)
 
 
+@patch("testrunner.runner.zygote.spawn", autospec=True)
+@patch("testrunner.runner.pexpect.spawnu", autospec=True)
+class TestRunnerSpawn(TestCase):
+
+    def test_spawn_mode(self, spawnu, zygote_spawn):
+        """
+        By default every run is a new process
+        """
+
+        runner = Runner()
+
+        proc = runner.spawn("test-cmd")
+
+        self.assertEqual(proc, spawnu.return_value)
+        self.assertFalse(zygote_spawn.called)
+
+    def test_fork_mode(self, spawnu, zygote_spawn):
+        """
+        Forking runs from zygote preloading configured modules
+        """
+
+        runner = Runner({"RUNNER_MODE": "fork", "PRELOAD_MODULES": ["json"]})
+
+        proc = runner.spawn("test-cmd")
+
+        zygote_spawn.assert_called_once_with("test-cmd", ["json"])
+        self.assertEqual(proc, zygote_spawn.return_value)
+        self.assertFalse(spawnu.called)
+
+    def test_fork_mode_fallback(self, spawnu, zygote_spawn):
+        """
+        Command is spawned when zygote can not fork it
+        """
+
+        zygote_spawn.return_value = None
+        runner = Runner({"RUNNER_MODE": "fork", "PRELOAD_MODULES": None})
+
+        proc = runner.spawn("test-cmd")
+
+        zygote_spawn.assert_called_once_with("test-cmd", ())
+        spawnu.assert_called_once_with("test-cmd")
+        self.assertEqual(proc, spawnu.return_value)
+
+
+@patch("testrunner.runner.pexpect.spawnu", autospec=True)
+class TestRunnerShards(StreamMixin, TestCase):
+
+    def _procs(self, spawnu, *statuses):
+        procs = [Mock(exitstatus=status) for status in statuses]
+        for idx, proc in enumerate(procs):
+            self.stream(proc, u"output {}".format(idx))
+        spawnu.side_effect = lambda cmd, cwd=None: procs[int(cmd[-1])]
+        return procs
+
+    def test_all_shards_fine(self, spawnu):
+        procs = self._procs(spawnu, 0, 0)
+        runner = Runner()
+
+        result = runner.run_shards(["cmd 0", "cmd 1"])
+
+        self.assertTrue(result)
+        self.assertEqual(runner.last_traceback, "")
+        for proc in procs:
+            self.assertTrue(proc.close.called)
+
+    @patch("testrunner.runner._log", autospec=True)
+    def test_shard_failed(self, logger, spawnu):
+        self._procs(spawnu, 0, 1, 2)
+        runner = Runner()
+
+        result = runner.run_shards(["cmd 0", "cmd 1", "cmd 2"])
+
+        self.assertFalse(result)
+        self.assertNotIn("output 0", runner.last_traceback)
+        self.assertIn("Shard 2/3: cmd 1\noutput 1", runner.last_traceback)
+        self.assertIn("Shard 3/3: cmd 2\noutput 2", runner.last_traceback)
+        self.assertTrue(logger.error.called)
+
+    def test_shard_durations(self, spawnu):
+        self._procs(spawnu, 0)
+        parser = Mock()
+        parser.results = {"test_a.T.test_x": Mock(
+            test_id="test_a.T.test_x", duration=1.5)}
+        parser.failed.return_value = []
+        runner = Runner()
+        runner.parser = Mock(return_value=parser)
+
+        shard = runner.run_shard("cmd 0")
+
+        self.assertTrue(shard.result)
+        self.assertEqual(shard.durations, {"test_a.T.test_x": 1.5})
+        self.assertGreaterEqual(shard.elapsed, 0)
+
+
 @patch.object(Runner, "run_test", autospec=True)
 class TestRunnerCall(TestCase):
 
@@ -140,6 +322,56 @@ class TestRunnerCall(TestCase):
         ])
         self.assertEqual(run_test.call_count, 2)
 
+    @patch("testrunner.runner._log", autospec=True)
+    def test_main_crashed(self, logger, run_test):
+        """
+        Result is delivered even when running tests raises
+        """
+        run_test.side_effect = OSError("No such file")
+        runner = Runner()
+
+        result, msg = runner("test-cmd", suite_cmd=None)
+
+        self.assertFalse(result)
+        self.assertIn("No such file", msg)
+        self.assertTrue(logger.exception.called)
+
+    @patch.object(Runner, "run_shards", autospec=True)
+    def test_main_ok_sharded_suite(self, run_shards, run_test):
+        """
+        Sharded suite runs in parallel
+        """
+        run_test.return_value = True
+        run_shards.return_value = False
+        runner = Runner()
+
+        result, msg = runner("test-cmd", suite_cmd=["shard-1", "shard-2"])
+
+        self.assertFalse(result)
+        self.assertIsInstance(msg, basestring)
+        run_test.assert_called_once_with(runner, "test-cmd", progress=ANY)
+        run_shards.assert_called_once_with(runner, ["shard-1", "shard-2"])
+
+    @patch("testrunner.runner.distributed.Coordinator", autospec=True)
+    def test_sharded_suite_on_workers(self, Coordinator, run_test):
+        """
+        Shards run on SUITE_WORKERS go through the same path
+        """
+
+        run_test.return_value = True
+        Coordinator.return_value.run.return_value = [
+            ShardResult(True, u"", [], 1, {}),
+            ShardResult(False, u"output", ["test_a"], 1, {}),
+        ]
+        runner = Runner({"SUITE_WORKERS": ["localhost:7100"]})
+
+        result, msg = runner("test-cmd", suite_cmd=["shard-1", "shard-2"])
+
+        self.assertEqual((result, msg), (False, u"Test suite failed"))
+        Coordinator.assert_called_once_with(runner, ["localhost:7100"])
+        self.assertEqual(runner.last_failed, ["test_a"])
+        self.assertIn(u"Shard 2/2: shard-2\noutput", runner.last_traceback)
+
     def test_main_ok_suite_ok(self, run_test):
         """
         Command (test) and suite succeeds
@@ -156,3 +388,313 @@ class TestRunnerCall(TestCase):
             call(runner, "suite-cmd"),
         ])
         self.assertEqual(run_test.call_count, 2)
+
+    def test_timings_returned(self, run_test):
+        run_test.return_value = True
+        runner = Runner()
+
+        run_result = runner("test-cmd", suite_cmd="suite-cmd")
+
+        self.assertIsInstance(run_result, RunResult)
+        self.assertLessEqual(run_result.timings[STAGE1_DONE],
+                             run_result.timings[STAGE2_DONE])
+
+
+class TestRunResult(TestCase):
+
+    def test_tuple(self):
+        self.assertEqual(RunResult(True, u"Info", {SPAWNED: 1}),
+                         (True, u"Info"))
+
+    def test_pickled(self):
+        """
+        Result is sent back from pool worker
+        """
+
+        run_result = pickle.loads(pickle.dumps(
+            RunResult(True, u"Info", {SPAWNED: 1}, {"test_a": "key"}),
+            pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(run_result, (True, u"Info"))
+        self.assertEqual(run_result.timings, {SPAWNED: 1})
+        self.assertEqual(run_result.passed_keys, {"test_a": "key"})
+
+
+@patch.object(Runner, "run_test", autospec=True)
+class TestRunnerFailedFirst(TestCase):
+
+    def _runner(self, fail_fast=False):
+        runner = Runner({"STATE_DIR": "state", "FAIL_FAST": fail_fast})
+        history = Mock()
+        history.failing.return_value = ["test_a.T.test_x"]
+        runner.history = Mock(return_value=history)
+        return runner, history
+
+    def test_failed_tests_first(self, run_test):
+        runner, history = self._runner()
+        run_test.return_value = True
+
+        result, msg = runner("test-cmd", failed_cmd="failed-cmd")
+
+        self.assertTrue(result)
+        run_test.assert_has_calls([
+            call(runner, "failed-cmd"),
+            call(runner, "test-cmd", progress=ANY),
+        ])
+        history.record_run.assert_any_call([], True, ["test_a.T.test_x"])
+        self.assertTrue(history.save.called)
+
+    def test_fail_fast(self, run_test):
+        runner, history = self._runner(fail_fast=True)
+        run_test.return_value = False
+
+        result, msg = runner("test-cmd", "suite-cmd", "failed-cmd")
+
+        self.assertFalse(result)
+        self.assertIn("Previously failed", msg)
+        run_test.assert_called_once_with(runner, "failed-cmd")
+        self.assertTrue(history.save.called)
+        # Tests after first failure did not run, they did not pass
+        history.record_run.assert_called_once_with([], False, ())
+
+    def test_failed_tests_given(self, run_test):
+        """
+        Only tests failed command runs are recorded as passed
+        """
+
+        runner, history = self._runner()
+        run_test.return_value = True
+
+        runner("test-cmd", failed_cmd="failed-cmd",
+               failed_tests=["test_b.T.test_y"])
+
+        history.record_run.assert_any_call([], True, ["test_b.T.test_y"])
+        self.assertFalse(history.failing.called)
+
+    def test_no_fail_fast(self, run_test):
+        runner, history = self._runner()
+        run_test.side_effect = iter([False, True])
+
+        result, msg = runner("test-cmd", failed_cmd="failed-cmd")
+
+        self.assertTrue(result)
+        self.assertEqual(run_test.call_count, 2)
+
+    @patch("testrunner.runner._log", autospec=True)
+    def test_all_tests_cached(self, logger, run_test):
+        runner = Runner()
+
+        result, msg = runner(None, suite_cmd="suite-cmd", cache_keys={})
+
+        self.assertTrue(result)
+        run_test.assert_called_once_with(runner, "suite-cmd")
+        logger.info.assert_any_call(u"Tests are fine (cached) \u263A")
+
+    def test_suite_only(self, run_test):
+        """
+        Suite run on its own (deferred suite)
+        """
+
+        runner = Runner()
+        run_test.return_value = False
+
+        result, msg = runner(None, suite_cmd="suite-cmd")
+
+        self.assertFalse(result)
+        self.assertEqual(msg, u"Test suite failed")
+        run_test.assert_called_once_with(runner, "suite-cmd")
+
+    def test_passed_modules(self, run_test):
+        runner = Runner({"STATE_DIR": "state"})
+        runner.history = Mock(return_value=None)
+        runner.last_failed = ["test_a.T.test_x"]
+        run_test.return_value = False
+
+        run_result = runner(
+            "test-cmd", cache_keys={"test_a": "key-a", "test_b": "key-b"})
+
+        self.assertEqual(run_result.passed_keys, {"test_b": "key-b"})
+
+    def test_crashed_run_not_cached(self, run_test):
+        runner = Runner({"STATE_DIR": "state"})
+        runner.history = Mock(return_value=None)
+        run_test.return_value = False
+
+        run_result = runner("test-cmd", cache_keys={"test_a": "key-a"})
+
+        self.assertEqual(run_result.passed_keys, {})
+
+    @patch("testrunner.runner.DurationHistory", autospec=True)
+    @patch.object(Runner, "run_shards", autospec=True)
+    def test_shard_durations_recorded(self, run_shards, DurationHistory,
+                                      run_test):
+        runner = Runner({"STATE_DIR": "state"})
+        runner.history = Mock(return_value=None)
+        history = DurationHistory.return_value.load.return_value
+        history.durations.return_value = {"test_a": 1.0}
+        run_test.return_value = True
+
+        def shards_done(runner, test_cmds):
+            runner.last_shards = [
+                ShardResult(True, "", [], 2.0, {"test_a.T.test_x": 1.5}),
+                ShardResult(True, "", [], 3.0, {}),
+            ]
+            return True
+
+        run_shards.side_effect = shards_done
+
+        result, msg = runner("test-cmd", ["shard-1", "shard-2"],
+                             shards=[["test_a"], ["test_b", "test_c"]])
+
+        self.assertTrue(result)
+        DurationHistory.assert_called_once_with("state/durations.json")
+        history.record.assert_has_calls([
+            call("test_a", 1.5),
+            call("test_b", 1.5),
+            call("test_c", 1.5),
+        ], any_order=True)
+        history.save.assert_called_once_with()
+
+    @patch("testrunner.runner.DurationHistory", autospec=True)
+    @patch.object(Runner, "run_shards", autospec=True)
+    def test_cancelled_shards_not_recorded(self, run_shards, DurationHistory,
+                                           run_test):
+        runner = Runner({"STATE_DIR": "state"})
+        runner.history = Mock(return_value=None)
+        runner.cancelled = Mock(side_effect=iter([False, True]))
+        run_test.return_value = True
+        run_shards.return_value = False
+
+        runner("test-cmd", ["shard-1"], shards=[["test_a"]])
+
+        self.assertFalse(DurationHistory.called)
+
+    def test_history_not_kept(self, run_test):
+        runner = Runner()
+        run_test.return_value = True
+
+        result, msg = runner("test-cmd")
+
+        self.assertTrue(result)
+        self.assertIsNone(runner.history())
+
+
+class TestRunControl(TestCase):
+
+    def setUp(self):
+        self.control = RunControl(grace_period=0)
+
+    @patch("testrunner.runner.kill_group", autospec=True)
+    def test_cancel_nothing_running(self, kill_group_mock):
+        self.control.cancel()
+
+        self.assertTrue(self.control.cancelled())
+        self.assertFalse(kill_group_mock.called)
+
+    @patch("testrunner.runner.Timer", autospec=True)
+    @patch("testrunner.runner.kill_group", autospec=True)
+    def test_cancel_running(self, kill_group_mock, Timer):
+        self.control.started(123)
+
+        self.control.cancel()
+
+        kill_group_mock.assert_called_once_with(123, signal.SIGTERM)
+        Timer.assert_called_once_with(
+            0, kill_group_mock, [123, signal.SIGKILL])
+        self.assertTrue(Timer.return_value.start.called)
+
+    @patch("testrunner.runner.kill_group", autospec=True)
+    def test_cancel_finished(self, kill_group_mock):
+        self.control.started(123)
+        self.control.finished()
+
+        self.control.cancel()
+
+        self.assertFalse(kill_group_mock.called)
+
+    def test_reset(self):
+        self.control.cancel()
+        self.control.reset()
+
+        self.assertFalse(self.control.cancelled())
+
+    @patch("testrunner.runner.os.killpg", autospec=True)
+    def test_kill_group_gone(self, killpg):
+        killpg.side_effect = OSError(3, "No such process")
+
+        kill_group(123, signal.SIGTERM)
+
+        killpg.assert_called_once_with(123, signal.SIGTERM)
+
+
+@patch("testrunner.runner.control")
+class TestRunnerCancelled(StreamMixin, TestCase):
+
+    @patch("testrunner.runner.pexpect.spawnu", autospec=True)
+    def test_pid_registered(self, spawnu, control):
+        proc = Mock(logfile=None, exitstatus=0, pid=123)
+        self.stream(proc)
+        spawnu.return_value = proc
+        control.cancelled.return_value = False
+
+        Runner().run_test("test-cmd")
+
+        control.started.assert_called_once_with(123)
+        control.finished.assert_called_once_with()
+
+    @patch.object(Runner, "run_test", autospec=True)
+    def test_suite_skipped(self, run_test, control):
+        run_test.return_value = True
+        control.cancelled.return_value = True
+        runner = Runner()
+
+        result, msg = runner("test-cmd", suite_cmd="suite-cmd")
+
+        self.assertFalse(result)
+        run_test.assert_called_once_with(runner, "test-cmd", progress=ANY)
+
+    @patch("testrunner.runner.kill_group", autospec=True)
+    @patch("testrunner.runner.pexpect.spawnu", autospec=True)
+    def test_shard_killed(self, spawnu, kill_group_mock, control):
+        proc = Mock(exitstatus=None, pid=123)
+        write_fd = self.stream(proc, end=False)
+        spawnu.return_value = proc
+        control.cancelled.return_value = True
+        kill_group_mock.side_effect = lambda pid, sig: os.close(write_fd)
+        runner = Runner()
+        runner.poll_interval = 0.01
+
+        shard = runner.run_shard("cmd")
+
+        self.assertFalse(shard.result)
+        kill_group_mock.assert_called_once_with(123, signal.SIGKILL)
+
+
+class TestRunnerPool(TestCase):
+
+    def test_output_discarded(self):
+        """
+        Spilled output of previous run is removed by next run in pool
+        worker, though runner is pickled there for each run
+        """
+
+        pool = multiprocessing.Pool(
+            1, initializer=init_worker, initargs=[RunControl()])
+        self.addCleanup(pool.terminate)
+        runner = Runner({"OUTPUT_MEMORY": 20, "WATCH_DIR": "/src"})
+        test_cmd = "{} -c 'print(\"x\" * 100); raise SystemExit(1)'".format(
+            sys.executable)
+
+        spill_files = path.join(tempfile.gettempdir(), "testrunner-*.log")
+
+        before = set(glob(spill_files))
+        self.assertFalse(pool.apply(runner, [test_cmd])[0])
+        first = set(glob(spill_files)) - before
+        self.assertFalse(pool.apply(runner, [test_cmd])[0])
+        second = set(glob(spill_files)) - before
+        for file_path in second:
+            self.addCleanup(os.remove, file_path)
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first, second)
@@ -0,0 +1,88 @@
+from unittest import TestCase
+
+from mock import patch
+
+from testrunner.sharding import (
+    DEFAULT_DURATION, balance_tests, estimate_durations, module_durations,
+    shard_count, split_tests
+)
+
+
+class TestShardCount(TestCase):
+
+    @patch("testrunner.sharding.multiprocessing.cpu_count", autospec=True)
+    def test_default_cpu_count(self, cpu_count):
+        cpu_count.return_value = 16
+
+        self.assertEqual(shard_count(None, 100), 16)
+
+    def test_configured(self):
+        self.assertEqual(shard_count(4, 100), 4)
+
+    def test_not_more_than_tests(self):
+        self.assertEqual(shard_count(4, 2), 2)
+
+    def test_at_least_one(self):
+        self.assertEqual(shard_count(4, 0), 1)
+
+
+class TestSplitTests(TestCase):
+
+    def test_round_robin(self):
+        shards = split_tests(["e", "d", "c", "b", "a"], 2)
+
+        self.assertEqual(shards, [["a", "c", "e"], ["b", "d"]])
+
+    def test_no_empty_shards(self):
+        self.assertEqual(split_tests(["a"], 3), [["a"]])
+
+
+class TestEstimateDurations(TestCase):
+
+    def test_median_for_new_tests(self):
+        durations = estimate_durations(
+            ["a", "new"], {"a": 1.0, "b": 5.0, "c": 9.0})
+
+        self.assertEqual(durations, {"a": 1.0, "new": 5.0})
+
+    def test_nothing_known(self):
+        self.assertEqual(estimate_durations(["a"], {}),
+                         {"a": DEFAULT_DURATION})
+
+
+class TestBalanceTests(TestCase):
+
+    def test_longest_first(self):
+        shards = balance_tests(
+            ["a", "b", "c", "d", "e"], 2,
+            {"a": 8.0, "b": 5.0, "c": 4.0, "d": 3.0, "e": 1.0})
+
+        self.assertEqual(shards, [(["a", "d"], 11.0), (["b", "c", "e"], 10.0)])
+
+    def test_no_empty_shards(self):
+        self.assertEqual(balance_tests(["a"], 3, {"a": 1.0}),
+                         [(["a"], 1.0)])
+
+
+class TestModuleDurations(TestCase):
+
+    def test_reported_durations(self):
+        durations = module_durations(
+            ["pkg.test_a", "test_b"], 10.0, {
+                "pkg.test_a.T.test_x": 1.0,
+                "pkg.test_a.T.test_y": 2.0,
+                "test_b.T.test_z": 4.0,
+            })
+
+        self.assertEqual(durations, {"pkg.test_a": 3.0, "test_b": 4.0})
+
+    def test_rest_of_shard_split(self):
+        """
+        Modules without reported durations share the rest of shard time
+        """
+
+        durations = module_durations(
+            ["test_a", "test_b", "test_c"], 10.0, {"test_a.T.test_x": 4.0})
+
+        self.assertEqual(durations,
+                         {"test_a": 4.0, "test_b": 3.0, "test_c": 3.0})
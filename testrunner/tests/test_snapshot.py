@@ -0,0 +1,50 @@
+import json
+from os import path
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.snapshot import VERSION, IndexSnapshot, snapshot_file
+
+
+class TestIndexSnapshot(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.file_path = snapshot_file(self.tmp.join("state"))
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_missing_file(self):
+        snapshot = IndexSnapshot(self.file_path).load()
+
+        self.assertIsNone(snapshot.index)
+        self.assertEqual(snapshot.hashes, [])
+
+    def test_broken_file(self):
+        file_path = self.tmp.putfile("index.json", "{broken")
+
+        snapshot = IndexSnapshot(file_path).load()
+
+        self.assertIsNone(snapshot.index)
+
+    def test_other_version(self):
+        file_path = self.tmp.putfile("index.json", json.dumps(
+            {"version": VERSION - 1, "index": {"root": "/src"}}))
+
+        snapshot = IndexSnapshot(file_path).load()
+
+        self.assertIsNone(snapshot.index)
+
+    def test_saved_and_loaded(self):
+        snapshot = IndexSnapshot(self.file_path)
+        snapshot.index = {"root": "/src", "files": {"a.py": [1, 2.5, []]}}
+        snapshot.hashes = [["/src/a.py", 1, 2.5, "digest"]]
+        snapshot.save()
+
+        loaded = IndexSnapshot(self.file_path).load()
+
+        self.assertTrue(path.isfile(self.file_path))
+        self.assertEqual(loaded.index, snapshot.index)
+        self.assertEqual(loaded.hashes, snapshot.hashes)
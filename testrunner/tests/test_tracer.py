@@ -0,0 +1,130 @@
+import json
+import os
+import subprocess
+import sys
+from os import path
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+import testrunner
+from testrunner.linecoverage import (
+    OUTSIDE_TESTS, CoverageIndex, from_ranges, runs_dir
+)
+from testrunner.tracer import nose_id, traced_command, unittest_id
+
+TEST_MODULE = """\
+import unittest
+
+import mod
+
+
+class TestMod(unittest.TestCase):
+
+    def test_a(self):
+        self.assertEqual(mod.a(), 1)
+
+    def test_b(self):
+        self.assertEqual(mod.b(), 2)
+"""
+
+MODULE = """\
+X = 1
+
+
+def a():
+    return 1
+
+
+def b():
+    return 2
+"""
+
+
+class TestTracedCommand(TestCase):
+
+    def test_python_command(self):
+        cmd = traced_command("python -m unittest test_a", "/state/coverage",
+                             "/src", kind="unittest")
+
+        self.assertEqual(
+            cmd, "python -m testrunner.tracer --output /state/coverage "
+            "--root /src --ids unittest -- -m unittest test_a")
+
+    def test_suite_quoted(self):
+        cmd = traced_command("python -m unittest 'a b'", "/cov", "/src",
+                             kind="nose", suite=True)
+
+        self.assertEqual(
+            cmd, "python -m testrunner.tracer --output /cov --root /src "
+            "--ids nose --suite -- -m unittest 'a b'")
+
+    def test_not_python(self):
+        self.assertIsNone(traced_command("nosetests a", "/cov", "/src"))
+        self.assertIsNone(traced_command("python 'a", "/cov", "/src"))
+
+
+class TestTestIds(TestCase):
+
+    def test_unittest_id(self):
+        self.assertEqual(unittest_id(self),
+                         "testrunner.tests.test_tracer.TestTestIds."
+                         "test_unittest_id")
+
+    def test_nose_id(self):
+        self.assertEqual(nose_id(self),
+                         "testrunner.tests.test_tracer:TestTestIds."
+                         "test_nose_id")
+
+
+class TestTracerRun(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.src = self.tmp.mkdir("src")
+        self.module = self.src.putfile("mod.py", MODULE)
+        self.src.putfile("test_mod.py", TEST_MODULE)
+        self.cov_dir = self.tmp.join("coverage")
+
+    def tearDown(self):
+        del self.tmp
+
+    def run_tests(self):
+        root = path.dirname(path.dirname(path.abspath(testrunner.__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        cmd = [sys.executable, "-m", "testrunner.tracer",
+               "--output", self.cov_dir, "--root", self.src, "--suite",
+               "--", "-m", "unittest", "test_mod"]
+        with open(os.devnull, "w") as devnull:
+            return subprocess.call(cmd, cwd=self.src, env=env,
+                                   stdout=devnull, stderr=devnull)
+
+    def test_lines_of_tests(self):
+        """
+        Each test runs its function, module body runs on import
+        """
+
+        self.assertEqual(self.run_tests(), 0)
+
+        names = os.listdir(runs_dir(self.cov_dir))
+        self.assertEqual(len(names), 1)
+        with open(path.join(runs_dir(self.cov_dir), names[0])) as src:
+            run = json.load(src)
+
+        self.assertTrue(run["suite"])
+        self.assertIn(self.module, run["digests"])
+        tests = run["tests"]
+        self.assertEqual(from_ranges(tests["test_mod.TestMod.test_a"][
+            self.module]), set([4, 5]))
+        self.assertEqual(from_ranges(tests["test_mod.TestMod.test_b"][
+            self.module]), set([8, 9]))
+        self.assertIn(1, from_ranges(tests[OUTSIDE_TESTS][self.module]))
+
+    def test_changed_function_selects_test(self):
+        self.assertEqual(self.run_tests(), 0)
+        index = CoverageIndex(self.cov_dir)
+        index.merge_runs()
+        self.src.putfile("mod.py", MODULE.replace("return 2", "return 1 + 1"))
+
+        self.assertEqual(index.changed_tests(self.module),
+                         set(["test_mod.TestMod.test_b"]))
@@ -1,81 +1,167 @@
+import os
 from unittest import TestCase
 
+from fixture.io import TempIO
 from mock import Mock, patch, call
-from pyinotify import Event
+from pyinotify import IN_CREATE, Event
 
+from testrunner.astdiff import BODY, AstChange, FingerprintCache
+from testrunner.coalescer import ChangeBatch, EventCoalescer
 from testrunner.configurator import Config
-from testrunner.watcher import FileChangeHandler, watch
-
+from testrunner.dependency import DependencyIndex
+from testrunner.hashcache import ContentHashCache
+from testrunner.linecoverage import CoverageIndex
+from testrunner.metrics import (
+    FIRST_EVENT, SCHEDULED, SPAWNED, STAGE1_DONE, RunStats
+)
+from testrunner.runner import RunControl, RunResult, init_worker
+from testrunner.snapshot import IndexSnapshot, snapshot_file
+from testrunner.watcher import (
+    FileChangeHandler, ProjectEvents, watch, watch_projects
+)
 
 class TestFileChangeHandler(TestCase):
 
     @patch("testrunner.watcher.Runner", autospec=True)
-    @patch("testrunner.watcher.Pool", autospec=True)
+    @patch("testrunner.watcher.multiprocessing.Pool", autospec=True)
     def test_constructor(self, Pool, Runner):
         """
         Constructor has to create correct state. Checking main variables
         """
         config = Mock(spec=Config)
+        config.get_value.return_value = None
         Runner.return_value = "runner"
         Pool.return_value = "proc pool"
 
         handler = FileChangeHandler(config=config)
 
-        Pool.assert_called_once_with(1)
+        Pool.assert_called_once_with(1, initializer=init_worker,
+                                     initargs=[handler._control])
         self.assertEqual(handler._pool, "proc pool")
         self.assertEqual(handler.config, config)
         config.load_config.assert_called_once_with()
-        Runner.assert_called_once_with()
+        Runner.assert_called_once_with(config.runner_options.return_value)
         self.assertEqual(handler.test_runner, "runner")
+        self.assertEqual(handler.coalescer.callback, handler.start_tests_async)
         self.assertEqual(handler.pevent, handler.exclude_filter_wrapper)
+        self.assertEqual(len(handler.stats), 0)
+        self.assertIsNone(handler.metrics_server)
 
-    @patch.object(FileChangeHandler, "start_tests_async", autospec=True)
     @patch.object(FileChangeHandler, "show_notification", autospec=True)
     @patch.object(FileChangeHandler, "__init__", return_value=None)
-    def test_task_done_early(self, init, show_notification, start_tests_async):
+    def test_task_done(self, init, show_notification):
         """
-        Test are done, nothing intersting happened since test started (+delay)
+        Test are done, changes collected in meantime can be handled
         """
 
         handler = FileChangeHandler()
-        handler._last_event = 2
-        handler._started = 1
-        handler.delay = 5
+        handler.coalescer = Mock(spec=EventCoalescer)
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.return_value = None
+        handler._atask = Mock()
 
         handler.task_done(("Result", "Info"))
 
         show_notification.assert_called_with(handler, "Result", "Info")
-        self.assertFalse(start_tests_async.called)
+        handler.coalescer.release.assert_called_once_with()
+        self.assertIsNone(handler._atask)
 
-    @patch.object(FileChangeHandler, "start_tests_async", autospec=True)
+    @patch("testrunner.watcher.MetricsLog", autospec=True)
     @patch.object(FileChangeHandler, "show_notification", autospec=True)
     @patch.object(FileChangeHandler, "__init__", return_value=None)
-    def test_task_done_run_next(self, init, notification, start_tests_async):
+    def test_task_done_timings(self, init, show_notification, MetricsLog):
         """
-        Test are done, something interesting happened since test started +delay
+        Moments known to handler and runner make timings of run
         """
 
         handler = FileChangeHandler()
-        handler._last_event = 10
-        handler._started = 2
-        handler.delay = 5
+        handler.coalescer = Mock(spec=EventCoalescer)
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.return_value = "metrics.jsonl"
+        handler.stats = RunStats()
+        handler._marks = {FIRST_EVENT: 1, SCHEDULED: 2}
+
+        handler.task_done(
+            RunResult(True, "Info", {SPAWNED: 4, STAGE1_DONE: 7}))
+
+        self.assertEqual(handler.stats.percentiles("debounce"), {
+            0.5: 1, 0.9: 1, 0.99: 1})
+        self.assertEqual(handler.stats.samples("total"), [6])
+        MetricsLog.assert_called_once_with("metrics.jsonl")
+        MetricsLog.return_value.write.assert_called_once_with(
+            {FIRST_EVENT: 1, SCHEDULED: 2, SPAWNED: 4, STAGE1_DONE: 7},
+            {"debounce": 1, "spawn": 2, "stage1": 3, "total": 6}, True)
+        self.assertIsNone(handler._marks)
+
+    @patch.object(FileChangeHandler, "show_notification", autospec=True)
+    @patch.object(FileChangeHandler, "__init__", return_value=None)
+    def test_task_done_before_ready(self, init, show_notification):
+        """
+        Pool calls back before task is marked ready, changes collected
+        during run are not refused as if run was still in progress
+        """
+
+        handler = FileChangeHandler()
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.return_value = None
+        handler._atask = Mock()
+        handler._atask.ready.return_value = False
+        started = []
+        handler.coalescer = EventCoalescer(
+            lambda batch: started.append(handler._atask) or True)
+        handler.coalescer._running = True
+        handler.coalescer.add("/src/a.py")
 
         handler.task_done(("Result", "Info"))
 
-        notification.assert_called_with(handler, "Result", "Info")
-        start_tests_async.assert_called_once_with(handler)
+        self.assertEqual(started, [None])
+
+    @patch.object(FileChangeHandler, "show_notification", autospec=True)
+    @patch.object(FileChangeHandler, "__init__", return_value=None)
+    def test_task_done_preempted(self, init, show_notification):
+        """
+        Result of cancelled run is outdated, it is not shown
+        """
+
+        handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer)
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.return_value = None
+        handler._control = Mock(spec=RunControl)
+        handler._preempted = True
+
+        handler.task_done((False, "Info"))
+
+        self.assertFalse(show_notification.called)
+        self.assertFalse(handler._preempted)
+        handler._control.reset.assert_called_once_with()
+        handler.coalescer.release.assert_called_once_with()
+
+    @patch.object(FileChangeHandler, "__init__", return_value=None)
+    def test_preempt_once(self, init):
+        handler = FileChangeHandler()
+        handler._control = Mock(spec=RunControl)
+
+        handler.preempt()
+        handler.preempt()
 
+        handler._control.cancel.assert_called_once_with()
+        self.assertTrue(handler._preempted)
+
+    @patch("testrunner.watcher.setup_logging", autospec=True)
+    @patch("testrunner.watcher.parse_projects", return_value=([], 1))
     @patch("testrunner.watcher.pyinotify.WatchManager", autospec=True)
     @patch("testrunner.watcher.pyinotify.ThreadedNotifier", autospec=True)
     @patch("testrunner.watcher.FileChangeHandler", autospec=True)
     @patch("testrunner.watcher.Config", autospec=True)
-    def test_main(self, config, f_c_handler, ThreadedNotifier, WatchManager):
+    def test_main(self, config, f_c_handler, ThreadedNotifier, WatchManager,
+                  parse_projects, setup_logging):
         """
         Main entry point
         """
 
         WatchManager.return_value = "wm"
-        config.return_value = "conf"
+        config.return_value.get_value.return_value = "pool"
         f_c_handler.return_value = "handler"
         notifier = Mock()
         ThreadedNotifier.return_value = notifier
@@ -84,9 +170,117 @@ class TestFileChangeHandler(TestCase):
 
         WatchManager.assert_called_once_with()
         config.assert_called_once_with(watch_manager="wm")
-        f_c_handler.assert_called_once_with(config="conf")
+        f_c_handler.assert_called_once_with(config=config.return_value)
+        config.return_value.poller.attach.assert_called_once_with("handler")
         ThreadedNotifier.assert_called_once_with("wm", "handler")
         notifier.loop.assert_called_once_with()
+        setup_logging.assert_called_once_with()
+
+    @patch("testrunner.watcher.setup_logging", autospec=True)
+    @patch("testrunner.watcher.parse_projects", return_value=([], 1))
+    @patch("testrunner.watcher.engine.EventLoop", autospec=True)
+    @patch("testrunner.watcher.pyinotify.WatchManager", autospec=True)
+    @patch("testrunner.watcher.pyinotify.AsyncNotifier", autospec=True)
+    @patch("testrunner.watcher.FileChangeHandler", autospec=True)
+    @patch("testrunner.watcher.Config", autospec=True)
+    def test_main_loop(self, config, f_c_handler, AsyncNotifier,
+                       WatchManager, EventLoop, parse_projects,
+                       setup_logging):
+        """
+        Everything runs in single event loop
+        """
+
+        config.return_value.get_value.return_value = "loop"
+        loop = EventLoop.return_value
+        loop.map = {}
+
+        watch()
+
+        f_c_handler.assert_called_once_with(
+            config=config.return_value, loop=loop)
+        AsyncNotifier.assert_called_once_with(
+            WatchManager.return_value, f_c_handler.return_value,
+            channel_map=loop.map)
+        loop.run.assert_called_once_with()
+
+    @patch("testrunner.watcher.setup_logging", autospec=True)
+    @patch("testrunner.watcher.watch_projects", autospec=True)
+    @patch("testrunner.watcher.parse_projects")
+    @patch("testrunner.watcher.Config", autospec=True)
+    def test_main_projects(self, config, parse_projects, watch_projects,
+                           setup_logging):
+        """
+        Projects given on command line are watched together
+        """
+
+        parse_projects.return_value = (["a", "b"], 2)
+
+        watch()
+
+        watch_projects.assert_called_once_with(["a", "b"], 2)
+        self.assertFalse(config.called)
+
+    @patch("testrunner.watcher.engine.RunSlots", autospec=True)
+    @patch("testrunner.watcher.engine.EventLoop", autospec=True)
+    @patch("testrunner.watcher.pyinotify.WatchManager", autospec=True)
+    @patch("testrunner.watcher.pyinotify.AsyncNotifier", autospec=True)
+    @patch("testrunner.watcher.FileChangeHandler", autospec=True)
+    @patch("testrunner.watcher.Config", autospec=True)
+    def test_watch_projects(self, config, f_c_handler, AsyncNotifier,
+                            WatchManager, EventLoop, RunSlots):
+        """
+        Projects share watch manager, event loop and run slots
+        """
+
+        loop = EventLoop.return_value
+        loop.map = {}
+        wmgr = WatchManager.return_value
+
+        watch_projects(["a", "b"], 2)
+
+        RunSlots.assert_called_once_with(2)
+        config.assert_has_calls([
+            call(watch_manager=wmgr, project="a"),
+            call(watch_manager=wmgr, project="b"),
+        ], any_order=True)
+        self.assertEqual(f_c_handler.call_count, 2)
+        f_c_handler.assert_called_with(
+            config=config.return_value, loop=loop,
+            slots=RunSlots.return_value)
+        handlers = AsyncNotifier.call_args[0][1]
+        self.assertIsInstance(handlers, ProjectEvents)
+        self.assertEqual(len(handlers.handlers), 2)
+        loop.run.assert_called_once_with()
+
+
+class TestProjectEvents(TestCase):
+
+    def setUp(self):
+        self.wmgr = Mock()
+        self.first = Mock()
+        self.first.config.owns_watch.return_value = False
+        self.second = Mock()
+        self.second.config.owns_watch.return_value = True
+        self.events = ProjectEvents(self.wmgr, [self.first, self.second])
+
+    def test_owner_handles(self):
+        event = Mock(wd=3)
+
+        self.events(event)
+
+        self.wmgr.get_watch.assert_called_once_with(3)
+        self.second.config.owns_watch.assert_called_once_with(
+            self.wmgr.get_watch.return_value)
+        self.assertFalse(self.first.called)
+        self.second.assert_called_once_with(event)
+
+    def test_watch_removed(self):
+        self.wmgr.get_watch.return_value = None
+
+        self.events(Mock(wd=3))
+
+        self.assertFalse(self.first.called)
+        self.assertFalse(self.second.called)
 
 
 @patch.object(FileChangeHandler, "__init__", return_value=None)
@@ -104,8 +298,9 @@ class TestFileChangeHandlerAsync(TestCase):
         handler._atask = atask
         handler.config = config
 
-        handler.start_tests_async()
+        started = handler.start_tests_async()
 
+        self.assertFalse(started)
         self.assertFalse(config.tests_command.called)
 
     @patch("testrunner.watcher.time", autospec=True)
@@ -116,6 +311,7 @@ class TestFileChangeHandlerAsync(TestCase):
 
         handler = FileChangeHandler()
         config = Mock(spec=Config)
+        config.get_value.return_value = None
         config.tests_command.side_effect = iter(["test-cmd", "suite-cmd"])
         atask = Mock()
         atask.ready.return_value = True
@@ -126,14 +322,17 @@ class TestFileChangeHandlerAsync(TestCase):
         handler.test_runner = "test runner"
         time.return_value = 1
 
-        handler.start_tests_async()
+        started = handler.start_tests_async()
 
-        config.tests_command.assert_has_calls([call(), call(suite=True)])
+        config.tests_command.assert_has_calls(
+            [call(tests=None, exclude=[]), call(suite=True)])
         pool.apply_async.assert_called_once_with(
-            "test runner", ["test-cmd", "suite-cmd"],
+            "test runner", ["test-cmd", "suite-cmd", None, None, None, None],
             callback=handler.task_done
         )
+        self.assertTrue(started)
         self.assertEqual(handler._started, 1)
+        self.assertEqual(handler._marks, {FIRST_EVENT: 1, SCHEDULED: 1})
 
     @patch("testrunner.watcher.time", autospec=True)
     def test_async_task_started_first_time(self, time, init):
@@ -143,6 +342,7 @@ class TestFileChangeHandlerAsync(TestCase):
 
         handler = FileChangeHandler()
         config = Mock(spec=Config)
+        config.get_value.return_value = None
         config.tests_command.side_effect = iter(["test-cmd", "suite-cmd"])
         pool = Mock()
         handler._atask = None
@@ -151,13 +351,15 @@ class TestFileChangeHandlerAsync(TestCase):
         handler.test_runner = "test runner"
         time.return_value = 1
 
-        handler.start_tests_async()
+        started = handler.start_tests_async()
 
-        config.tests_command.assert_has_calls([call(), call(suite=True)])
+        config.tests_command.assert_has_calls(
+            [call(tests=None, exclude=[]), call(suite=True)])
         pool.apply_async.assert_called_once_with(
-            "test runner", ["test-cmd", "suite-cmd"],
+            "test runner", ["test-cmd", "suite-cmd", None, None, None, None],
             callback=handler.task_done
         )
+        self.assertTrue(started)
         self.assertEqual(handler._started, 1)
 
     def test_filter_wrapper(self, init):
@@ -189,8 +391,12 @@ class TestFileChangeHandlerDefaultProcess(TestCase):
         """
 
         handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer, running=False)
+        handler.hash_cache = ContentHashCache()
+        handler.fingerprints = FingerprintCache()
         handler.config = Mock(spec=Config)
         handler.config.config_file.return_value = "local conf path"
+        handler.test_runner = Mock()
         event = Mock(spec=Event, pathname="conf path")
         time.return_value = 1
         path.exists.return_value = True
@@ -204,6 +410,12 @@ class TestFileChangeHandlerDefaultProcess(TestCase):
         ])
         path.samefile.assert_called_once_with("conf path", "local conf path")
         self.assertTrue(handler.config.load_config.called)
+        self.assertEqual(handler.test_runner.options,
+                         handler.config.runner_options.return_value)
+        self.assertEqual(handler.coalescer.quiet_period,
+                         handler.config.get_value.return_value)
+        self.assertEqual(handler.hash_cache.max_size,
+                         handler.config.get_value.return_value)
 
     @patch("testrunner.watcher.path", autospec=True)
     def test_config_deleted(self, path, init, start_tests_async):
@@ -212,6 +424,7 @@ class TestFileChangeHandlerDefaultProcess(TestCase):
         """
 
         handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer, running=False)
         handler.config = Mock(spec=Config)
         handler.config.config_file.return_value = "local conf path"
         event = Mock(spec=Event, pathname="conf path")
@@ -229,6 +442,7 @@ class TestFileChangeHandlerDefaultProcess(TestCase):
         """
 
         handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer, running=False)
         handler.config = Mock(spec=Config)
         handler.config.config_file.return_value = "local conf path"
         event = Mock(spec=Event, pathname="conf path")
@@ -239,21 +453,524 @@ class TestFileChangeHandlerDefaultProcess(TestCase):
 
         self.assertFalse(handler.config.load_config.called)
 
-    @patch("testrunner.watcher.time", autospec=True)
-    def test_run_test_on_event(self, time, init, start_tests_async):
+    def test_run_test_on_event(self, init, start_tests_async):
         """
         Some file generated event
         """
 
         handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer, running=False)
         handler.config = Mock(spec=Config)
         event = Mock(spec=Event, pathname="conf path")
-        time.return_value = 1
 
         handler.process_default(event=event)
 
-        self.assertTrue(start_tests_async.called)
-        self.assertEqual(handler._last_event, 1)
+        handler.coalescer.add.assert_called_once_with("conf path")
+
+    def test_dir_created(self, init, start_tests_async):
+        """
+        New dir is polled when inotify could not watch it
+        """
+
+        handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer, running=False)
+        handler.config = Mock(spec=Config)
+        handler.config.config_file.return_value = "local conf path"
+        event = Mock(spec=Event, pathname="/src/new", mask=IN_CREATE, dir=True)
+
+        handler.process_default(event=event)
+
+        handler.config.check_created_dir.assert_called_once_with("/src/new")
+
+
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerUnchanged(TestCase):
+
+    def _handler(self, changed, skip=True):
+        handler = FileChangeHandler()
+        handler._atask = None
+        handler._pool = Mock()
+        handler.test_runner = "test runner"
+        handler.defer_suite = False
+        handler.hash_cache = Mock(spec=ContentHashCache)
+        handler.hash_cache.changed.return_value = changed
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.side_effect = lambda name: {
+            "SKIP_UNCHANGED": skip,
+            "COVERAGE_SELECT": False,
+            "SKIP_NOOP_EDITS": False,
+            "FAILURE_FIRST": False,
+            "SELECT_TESTS": False,
+            "SHARD_SUITE": False,
+        }[name]
+        batch = ChangeBatch()
+        batch.add("/src/a.py")
+        return handler, batch
+
+    def test_content_same(self, init):
+        handler, batch = self._handler(changed=set())
+
+        started = handler.start_tests_async(batch)
+
+        self.assertFalse(started)
+        handler.hash_cache.changed.assert_called_once_with(set(["/src/a.py"]))
+        self.assertFalse(handler._pool.apply_async.called)
+
+    def test_content_changed(self, init):
+        handler, batch = self._handler(changed=set(["/src/a.py"]))
+
+        started = handler.start_tests_async(batch)
+
+        self.assertTrue(started)
+        self.assertTrue(handler._pool.apply_async.called)
+
+    def test_check_disabled(self, init):
+        handler, batch = self._handler(changed=set(), skip=False)
+
+        started = handler.start_tests_async(batch)
+
+        self.assertTrue(started)
+        self.assertFalse(handler.hash_cache.changed.called)
+
+
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerSeedHashes(TestCase):
+
+    def _handler(self, watch_dir="/src", state_dir="/state",
+                 snapshot=False):
+        handler = FileChangeHandler()
+        handler.hash_cache = ContentHashCache()
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.side_effect = lambda name: {
+            "SKIP_UNCHANGED": True,
+            "INDEX_SNAPSHOT": snapshot,
+            "STATE_DIR": state_dir,
+            "WATCH_DIR": watch_dir,
+        }[name]
+        return handler
+
+    def _seed(self, handler):
+        handler.seed_hashes()
+        handler._seeding[0].join()
+        handler.merge_seeds()
+
+    def test_hashes_seeded(self, init):
+        """
+        Files are known on start, touching one does not run tests.
+        Paths are absolute as in events, though WATCH_DIR is not
+        """
+
+        tmp = TempIO(deferred=True)
+        module = tmp.putfile("pkg/a.py", "X = 1\n")
+        tmp.putfile("build/b.py", "X = 1\n")
+        handler = self._handler(watch_dir=os.path.relpath(tmp))
+        handler.config.filter_wrapper.side_effect = \
+            lambda pathname: pathname.endswith("build")
+
+        self._seed(handler)
+
+        self.assertEqual(handler.hash_cache.snapshot()[0][0], module)
+        self.assertEqual(len(handler.hash_cache), 1)
+        self.assertEqual(handler.hash_cache.changed([module]), set())
+
+    def test_seen_files_kept(self, init):
+        """
+        Files changed before hashes are merged stay as they were seen
+        """
+
+        tmp = TempIO(deferred=True)
+        module = tmp.putfile("pkg/a.py", "X = 1\n")
+        handler = self._handler(watch_dir=unicode(tmp))
+        handler.config.filter_wrapper.return_value = False
+        handler.seed_hashes()
+        handler._seeding[0].join()
+        os.utime(module, (1, 1))
+        handler.hash_cache.changed([module])
+
+        handler.merge_seeds()
+
+        self.assertIsNone(handler._seeding)
+        self.assertEqual(handler.hash_cache.snapshot()[0][2], 1)
+
+    def test_hashes_seeded_from_snapshot(self, init):
+        tmp = TempIO(deferred=True)
+        handler = self._handler(state_dir=unicode(tmp), snapshot=True)
+        snapshot = IndexSnapshot(snapshot_file(unicode(tmp)))
+        snapshot.hashes = [["/src/a.py", 1, 2, "digest"]]
+        snapshot.save()
+
+        self._seed(handler)
+
+        self.assertIn("/src/a.py", handler.hash_cache)
+        self.assertFalse(handler.config.filter_wrapper.called)
+
+
+@patch("testrunner.watcher.RunHistory", autospec=True)
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerFailedFirst(TestCase):
+
+    def _handler(self, RunHistory, failure_first, fail_fast=False,
+                 failing=()):
+        RunHistory.return_value.load.return_value.failing.return_value = \
+            list(failing)
+        handler = FileChangeHandler()
+        handler._atask = None
+        handler._pool = Mock()
+        handler.test_runner = "test runner"
+        handler.defer_suite = False
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.side_effect = lambda name: {
+            "FAILURE_FIRST": failure_first,
+            "FAIL_FAST": fail_fast,
+            "STATE_DIR": "state",
+            "WATCH_DIR": "/src",
+            "COVERAGE_SELECT": False,
+            "SHARD_SUITE": False,
+        }[name]
+        return handler
+
+    def test_disabled(self, init, RunHistory):
+        handler = self._handler(RunHistory, False)
+
+        self.assertEqual(handler.failed_tests(None), [])
+        self.assertIsNone(handler.failed_command([]))
+        self.assertFalse(RunHistory.called)
+
+    def test_failed_tests(self, init, RunHistory):
+        handler = self._handler(RunHistory, True, failing=["test_a.T.test_x"])
+
+        failed = handler.failed_tests(None)
+        failed_cmd = handler.failed_command(failed)
+
+        RunHistory.assert_called_once_with("state/history.json")
+        self.assertEqual(failed, ["test_a.T.test_x"])
+        handler.config.tests_command.assert_called_once_with(
+            tests=["test_a.T.test_x"], fail_fast=False)
+        self.assertEqual(failed_cmd, handler.config.tests_command.return_value)
+
+    def test_fail_fast(self, init, RunHistory):
+        handler = self._handler(RunHistory, True, fail_fast=True)
+
+        handler.failed_command(["test_a.T.test_x"])
+
+        handler.config.tests_command.assert_called_once_with(
+            tests=["test_a.T.test_x"], fail_fast=True)
+
+    def test_failed_of_selected_tests(self, init, RunHistory):
+        """
+        Failed tests of modules which are not selected do not run
+        """
+
+        handler = self._handler(RunHistory, True, failing=[
+            "test_a.T.test_x", "pkg.test_b.T.test_y", "test_c.T.test_z",
+            "test_d.py::T::test_w"])
+
+        failed = handler.failed_tests(
+            ["test_a", "pkg.test_b", "/src/test_d.py"])
+
+        self.assertEqual(
+            failed,
+            ["test_a.T.test_x", "pkg.test_b.T.test_y", "test_d.py::T::test_w"])
+
+    def test_failed_tests_excluded(self, init, RunHistory):
+        """
+        Tests of failed command are not run again by tests command
+        """
+
+        handler = self._handler(RunHistory, True, failing=["test_a.T.test_x"])
+        handler.select_tests = Mock(return_value=["test_a", "test_b"])
+
+        handler.start_tests_async(ChangeBatch())
+
+        handler.config.tests_command.assert_any_call(
+            tests=["test_a", "test_b"], exclude=["test_a.T.test_x"])
+        args = handler._pool.apply_async.call_args[0][1]
+        self.assertEqual(args[5], ["test_a.T.test_x"])
+
+    def test_single_tests_ordered(self, init, RunHistory):
+        """
+        Single tests run at once, failing ones first
+        """
+
+        handler = self._handler(RunHistory, True, failing=["test_a.T.test_y"])
+        handler.covering_tests = Mock(
+            return_value=["test_a.T.test_x", "test_a.T.test_y"])
+
+        handler.start_tests_async(ChangeBatch())
+
+        handler.config.tests_command.assert_any_call(
+            tests=["test_a.T.test_y", "test_a.T.test_x"], exclude=[])
+        args = handler._pool.apply_async.call_args[0][1]
+        self.assertEqual((args[2], args[5]), (None, None))
+
+
+@patch("testrunner.watcher.resultcache.closure_key", autospec=True)
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerResultCache(TestCase):
+
+    def _handler(self, cached, names="module"):
+        handler = FileChangeHandler()
+        handler._atask = None
+        handler._pool = Mock()
+        handler.test_runner = "test runner"
+        handler.defer_suite = False
+        handler.key_hashes = ContentHashCache()
+        handler.dependency_index = Mock(root="/src")
+        handler.select_tests = Mock(return_value=["test_a", "test_b"])
+        handler.result_cache = Mock()
+        handler.result_cache.return_value.passed.return_value = set(cached)
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.side_effect = lambda name: {
+            "SKIP_UNCHANGED": False,
+            "COVERAGE_SELECT": False,
+            "SKIP_NOOP_EDITS": False,
+            "FAILURE_FIRST": False,
+            "SHARD_SUITE": False,
+            "RESULT_CACHE": True,
+            "RESULT_CACHE_DATA": [],
+            "TEST_NAMES": names,
+        }[name]
+        handler.config.get_values.return_value = ["python", "-m", ""]
+        handler.config.tests_command.side_effect = \
+            lambda suite=False, tests=None, exclude=(): \
+            "suite" if suite else tests
+        return handler
+
+    def test_keys(self, init, closure_key):
+        handler = self._handler([])
+        closure_key.side_effect = lambda index, name, digest, salt: name
+
+        keys = handler.result_keys(["/src/test_a.py"])
+
+        self.assertEqual(keys, {"/src/test_a.py": "/src/test_a.py"})
+        handler = self._handler([], names="path")
+        self.assertEqual(handler.result_keys(["/src/test_a.py"]),
+                         {"/src/test_a.py": "test_a"})
+
+    def test_no_cache_without_index(self, init, closure_key):
+        handler = self._handler([])
+        handler.dependency_index = None
+
+        self.assertIsNone(handler.result_keys(["test_a"]))
+
+    def test_cached_tests_skipped(self, init, closure_key):
+        handler = self._handler(["test_a"])
+        closure_key.side_effect = lambda index, name, digest, salt: name
+
+        started = handler.start_tests_async(ChangeBatch())
+
+        self.assertTrue(started)
+        handler._pool.apply_async.assert_called_once_with(
+            "test runner",
+            [["test_b"], "suite", None, {"test_b": "test_b"}, None, None],
+            callback=handler.task_done)
+
+    def test_results_cached(self, init, closure_key):
+        """
+        Modules which changed during run are not cached, key computed
+        before run is outdated
+        """
+
+        handler = self._handler([])
+        closure_key.side_effect = lambda index, name, digest, salt: \
+            "new-b" if name == "test_b" else "key-a"
+
+        handler.cache_results({"test_a": "key-a", "test_b": "key-b"})
+
+        handler.result_cache.return_value.store.assert_called_once_with(
+            {"test_a": "key-a"})
+
+    def test_all_tests_cached(self, init, closure_key):
+        handler = self._handler(["test_a", "test_b"])
+
+        handler.start_tests_async(ChangeBatch())
+
+        args = handler._pool.apply_async.call_args[0][1]
+        self.assertEqual(args[0], None)
+
+
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerDeferredSuite(TestCase):
+
+    def _handler(self, skip_unchanged=False):
+        handler = FileChangeHandler()
+        handler.defer_suite = True
+        handler.last_result = None
+        handler._atask = None
+        handler._pool = Mock()
+        handler._control = Mock(spec=RunControl)
+        handler.test_runner = "test runner"
+        handler.show_notification = Mock()
+        handler.coalescer = Mock(spec=EventCoalescer, timer=Mock(),
+                                 pending=ChangeBatch())
+        handler.config = Mock(spec=Config)
+        handler.config.config_file.return_value = "/conf.py"
+        handler.config.get_value.side_effect = lambda name: {
+            "SKIP_UNCHANGED": skip_unchanged,
+            "COVERAGE_SELECT": False,
+            "SKIP_NOOP_EDITS": False,
+            "SELECT_TESTS": False,
+            "RESULT_CACHE": False,
+            "FAILURE_FIRST": False,
+            "SHARD_SUITE": False,
+            "PREEMPT_RUNS": False,
+            "SUITE_QUIET_PERIOD": 2.0,
+        }[name]
+        handler.config.tests_command.side_effect = \
+            lambda suite=False, tests=None, exclude=(): \
+            "suite" if suite else "tests"
+        return handler
+
+    def test_tests_without_suite(self, init):
+        handler = self._handler()
+
+        handler.start_tests_async(ChangeBatch())
+
+        handler._pool.apply_async.assert_called_once_with(
+            "test runner", ["tests", None, None, None, None, None],
+            callback=handler.task_done)
+
+    def test_suite_scheduled(self, init):
+        """
+        Tests of change passed, suite runs when files are quiet
+        """
+
+        handler = self._handler()
+        handler._suite_due = True
+
+        handler.task_done((True, "Info"))
+
+        timer = handler.coalescer.timer
+        timer.assert_called_once_with(2.0, handler.start_suite_async)
+        timer.return_value.start.assert_called_once_with()
+        handler.coalescer.release.assert_called_once_with()
+
+    def test_suite_not_scheduled_after_failure(self, init):
+        handler = self._handler()
+        handler._suite_due = True
+        handler.last_result = False
+
+        handler.task_done((False, "Info"))
+
+        self.assertFalse(handler.coalescer.timer.called)
+
+    def test_suite_started(self, init):
+        handler = self._handler()
+        handler._suite_due = True
+        handler.coalescer.acquire.return_value = True
+
+        started = handler.start_suite_async()
+
+        self.assertTrue(started)
+        self.assertTrue(handler._suite_running)
+        handler._pool.apply_async.assert_called_once_with(
+            "test runner", [None, "suite", None, None, None],
+            callback=handler.task_done)
+
+    def test_suite_waits_for_changes(self, init):
+        handler = self._handler()
+        handler._suite_due = True
+        handler.coalescer.pending.add("/src/a.py")
+
+        self.assertFalse(handler.start_suite_async())
+        self.assertFalse(handler.coalescer.acquire.called)
+
+    def test_suite_waits_for_run(self, init):
+        handler = self._handler()
+        handler._suite_due = True
+        handler.coalescer.acquire.return_value = False
+
+        self.assertFalse(handler.start_suite_async())
+        self.assertFalse(handler._pool.apply_async.called)
+
+    def test_suite_done(self, init):
+        handler = self._handler()
+        handler._suite_due = True
+        handler._suite_running = True
+
+        handler.task_done((False, "Info"))
+
+        self.assertFalse(handler._suite_due)
+        self.assertFalse(handler._suite_running)
+        self.assertFalse(handler.coalescer.timer.called)
+
+    def test_suite_rescheduled_same_content(self, init):
+        """
+        File touched with the same content cancels waiting suite, it is
+        scheduled again
+        """
+
+        tmp = TempIO(deferred=True)
+        module = tmp.putfile("a.py", "X = 1\n")
+        handler = self._handler(skip_unchanged=True)
+        handler.hash_cache = ContentHashCache()
+        handler.hash_cache.changed([module])
+        handler._suite_due = True
+        handler.coalescer.running = False
+        handler.process_default(Mock(spec=Event, pathname=module))
+        self.assertIsNone(handler._suite_timer)
+        batch = ChangeBatch()
+        batch.add(module)
+
+        started = handler.start_tests_async(batch)
+
+        self.assertFalse(started)
+        handler.coalescer.timer.assert_called_once_with(
+            2.0, handler.start_suite_async)
+        self.assertIsNotNone(handler._suite_timer)
+
+    def test_change_cancels_suite(self, init):
+        """
+        Change cancels waiting and running suite, tests of change go first
+        """
+
+        handler = self._handler()
+        handler._suite_running = True
+        timer = handler._suite_timer = Mock()
+        handler.coalescer.running = True
+
+        handler.process_default(Mock(spec=Event, pathname="/src/a.py"))
+
+        timer.cancel.assert_called_once_with()
+        self.assertIsNone(handler._suite_timer)
+        handler._control.cancel.assert_called_once_with()
+        self.assertTrue(handler._preempted)
+        self.assertTrue(handler._suite_due)
+
+
+@patch.object(FileChangeHandler, "preempt", autospec=True)
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerPreemption(TestCase):
+
+    def _handler(self, preempt, running):
+        handler = FileChangeHandler()
+        handler.coalescer = Mock(spec=EventCoalescer, running=running)
+        handler.config = Mock(spec=Config)
+        handler.config.config_file.return_value = "/conf.py"
+        handler.config.get_value.side_effect = \
+            lambda name: {"PREEMPT_RUNS": preempt}[name]
+        return handler
+
+    def test_change_during_run(self, init, preempt):
+        handler = self._handler(True, running=True)
+
+        handler.process_default(Mock(spec=Event, pathname="/src/a.py"))
+
+        preempt.assert_called_once_with(handler)
+
+    def test_preemption_disabled(self, init, preempt):
+        handler = self._handler(False, running=True)
+
+        handler.process_default(Mock(spec=Event, pathname="/src/a.py"))
+
+        self.assertFalse(preempt.called)
+
+    def test_nothing_running(self, init, preempt):
+        handler = self._handler(True, running=False)
+
+        handler.process_default(Mock(spec=Event, pathname="/src/a.py"))
+
+        self.assertFalse(preempt.called)
 
 
 @patch("testrunner.watcher.pynotify.Notification", autospec=True)
@@ -300,3 +1017,562 @@ class TestFileChangeHandlerNotification(TestCase):
         self.assertEqual(call_args[1], "info")
         self.assertEqual(call_args[2], "")
         self.assertTrue(notification_obj.show.called)
+
+    @patch("testrunner.watcher._notify_ready", False)
+    @patch("testrunner.watcher.pynotify.init")
+    def test_init_on_first_notification(self, notify_init, init,
+                                        Notification):
+        handler = FileChangeHandler()
+        handler.last_result = None
+
+        handler.show_notification(True, "info")
+        handler.show_notification(False, "info")
+
+        notify_init.assert_called_once_with("basic")
+        self.assertEqual(Notification.call_count, 2)
+
+    def test_project_title(self, init, Notification):
+        handler = FileChangeHandler()
+        handler.last_result = None
+        handler.title = "Test runner: api"
+
+        handler.show_notification(True, "info")
+
+        self.assertEqual(Notification.call_args[0][0], "Test runner: api")
+
+
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerSelection(TestCase):
+
+    def _handler(self, select, names="module", shard=False,
+                 by_duration=False, suite="discover"):
+        handler = FileChangeHandler()
+        handler._atask = None
+        handler._pool = Mock()
+        handler.test_runner = "test runner"
+        handler.defer_suite = False
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.side_effect = lambda name: {
+            "SELECT_TESTS": select,
+            "SKIP_UNCHANGED": False,
+            "COVERAGE_SELECT": False,
+            "SKIP_NOOP_EDITS": False,
+            "FAILURE_FIRST": False,
+            "RESULT_CACHE": False,
+            "TEST_NAMES": names,
+            "SHARD_SUITE": shard,
+            "TEST_SUITE": suite,
+            "SUITE_SHARDS": 2,
+            "SHARD_BY_DURATION": by_duration,
+            "STATE_DIR": "/state",
+            "WATCH_DIR": "/src",
+            "TEST_MODULE_PATTERN": "test*.py",
+            "INDEX_SNAPSHOT": False,
+        }[name]
+        return handler
+
+    def test_selection_disabled(self, init):
+        handler = self._handler(False)
+
+        self.assertIsNone(handler.select_tests(["/src/a.py"]))
+
+    @patch("testrunner.watcher.dependency.DependencyIndex", autospec=True)
+    def test_index_built_once(self, DependencyIndex, init):
+        handler = self._handler(True)
+        index = DependencyIndex.return_value
+        index.affected_tests.return_value = ["test_a"]
+        index.file_path.return_value = "/src/test_a.py"
+
+        handler.select_tests(["/src/a.py"])
+        tests = handler.select_tests(["/src/a.py"])
+
+        DependencyIndex.assert_called_once_with(
+            "/src", test_pattern="test*.py",
+            exclude_filter=handler.config.filter_wrapper)
+        index.build.assert_called_once_with()
+        self.assertEqual(tests, ["test_a"])
+
+    def test_selection_as_paths(self, init):
+        handler = self._handler(True, names="path")
+        handler.dependency_index = Mock()
+        handler.dependency_index.affected_tests.return_value = ["test_a"]
+        handler.dependency_index.file_path.return_value = "/src/test_a.py"
+
+        tests = handler.select_tests(["/src/a.py"])
+
+        self.assertEqual(tests, ["/src/test_a.py"])
+
+    def test_selection_not_possible(self, init):
+        handler = self._handler(True)
+        handler.dependency_index = Mock()
+        handler.dependency_index.affected_tests.return_value = None
+
+        self.assertIsNone(handler.select_tests(["/src/data.json"]))
+
+    @patch("testrunner.watcher.dependency.DependencyIndex", autospec=True)
+    def test_index_built_from_snapshot(self, DependencyIndex, init):
+        tmp = TempIO(deferred=True)
+        handler = self._handler(True)
+        handler.config.get_value.side_effect = lambda name: {
+            "INDEX_SNAPSHOT": True,
+            "STATE_DIR": unicode(tmp),
+        }.get(name, "test*.py")
+        handler.key_hashes = ContentHashCache()
+        index = DependencyIndex.return_value
+        index.changes = 0
+        snapshot = IndexSnapshot(snapshot_file(unicode(tmp)))
+        snapshot.index = {"root": "/src", "files": {}}
+        snapshot.hashes = [["/src/a.py", 1, 2, "digest"]]
+        snapshot.save()
+
+        handler.select_tests(["/src/a.py"])
+
+        index.build.assert_called_once_with(snapshot.index)
+        self.assertIn("/src/a.py", handler.key_hashes)
+
+    def test_snapshot_saved_when_changed(self, init):
+        tmp = TempIO(deferred=True)
+        handler = self._handler(True)
+        handler.config.get_value.side_effect = lambda name: {
+            "INDEX_SNAPSHOT": True,
+            "STATE_DIR": unicode(tmp),
+        }[name]
+        handler.key_hashes = ContentHashCache()
+        handler.dependency_index = Mock(changes=1)
+        handler.dependency_index.snapshot.return_value = {"root": "/src"}
+
+        handler.save_snapshot()
+        handler.dependency_index.changes = 2
+        handler.save_snapshot()
+        handler.save_snapshot()
+
+        self.assertEqual(handler.dependency_index.snapshot.call_count, 2)
+        snapshot = IndexSnapshot(snapshot_file(unicode(tmp))).load()
+        self.assertEqual(snapshot.index, {"root": "/src"})
+
+    def test_index_updated(self, init):
+        handler = self._handler(True)
+        handler.dependency_index = Mock()
+        handler.dependency_index.affected_tests.return_value = None
+
+        handler.select_tests(["/src/a.py"])
+
+        handler.dependency_index.update.assert_called_once_with("/src/a.py")
+
+    def _batch(self, *paths):
+        batch = ChangeBatch()
+        for changed_path in paths:
+            batch.add(changed_path)
+        return batch
+
+    def test_nothing_selected(self, init):
+        handler = self._handler(True)
+        handler.dependency_index = Mock()
+        handler.dependency_index.affected_tests.return_value = []
+
+        started = handler.start_tests_async(self._batch("/src/a.py"))
+
+        self.assertFalse(started)
+        self.assertFalse(handler._pool.apply_async.called)
+
+    def test_selected_tests_command(self, init):
+        handler = self._handler(True)
+        handler.dependency_index = Mock()
+        handler.dependency_index.affected_tests.return_value = ["test_a"]
+        handler.dependency_index.file_path.return_value = "/src/test_a.py"
+
+        started = handler.start_tests_async(self._batch("/src/a.py"))
+
+        self.assertTrue(started)
+        handler.config.tests_command.assert_any_call(
+            tests=["test_a"], exclude=[])
+        self.assertTrue(handler._pool.apply_async.called)
+
+    @patch.object(FileChangeHandler, "show_notification", autospec=True)
+    def test_preempted_tests_run_next(self, show_notification, init):
+        """
+        Tests selected for cancelled run are not lost, next run covers
+        changes of both runs
+        """
+
+        handler = self._handler(True)
+        handler._control = Mock(spec=RunControl)
+        handler.key_hashes = ContentHashCache()
+        handler.dependency_index = Mock()
+        tests = {"/src/a.py": "test_a", "/src/b.py": "test_b"}
+        handler.dependency_index.affected_tests.side_effect = \
+            lambda paths: sorted(tests[changed] for changed in paths)
+        handler.dependency_index.file_path.side_effect = \
+            lambda name: "/src/{}.py".format(name)
+        handler.coalescer = EventCoalescer(handler.start_tests_async)
+
+        handler.coalescer.add("/src/a.py")
+        handler.coalescer.add("/src/b.py")
+        handler.preempt()
+        handler.task_done((False, "Info"))
+
+        handler.config.tests_command.assert_any_call(
+            tests=["test_a", "test_b"], exclude=[])
+        self.assertEqual(handler._pool.apply_async.call_count, 2)
+
+    def test_suite_not_sharded(self, init):
+        handler = self._handler(False)
+
+        shards = handler.suite_shards()
+        suite_cmd = handler.suite_command(shards)
+
+        self.assertIsNone(shards)
+        handler.config.tests_command.assert_called_once_with(suite=True)
+        self.assertEqual(suite_cmd, handler.config.tests_command.return_value)
+
+    def test_suite_command_sharded(self, init):
+        handler = self._handler(False)
+        handler.config.tests_command.side_effect = \
+            lambda suite, tests: " ".join(tests)
+
+        suite_cmd = handler.suite_command([["test_a", "test_b"], ["test_c"]])
+
+        self.assertEqual(suite_cmd, ["test_a test_b", "test_c"])
+
+    @patch("testrunner.watcher.dependency.find_test_files", autospec=True)
+    def test_suite_sharded(self, find_test_files, init):
+        handler = self._handler(False, shard=True)
+        find_test_files.return_value = [
+            "/src/test_a.py", "/src/test_b.py", "/src/pkg/test_c.py"]
+
+        shards = handler.suite_shards()
+
+        find_test_files.assert_called_once_with(
+            "/src", "test*.py", handler.config.filter_wrapper)
+        self.assertEqual(shards, [["pkg.test_c", "test_b"], ["test_a"]])
+
+    def test_suite_sharded_from_index(self, init):
+        handler = self._handler(False, names="path", shard=True)
+        handler.dependency_index = Mock()
+        handler.dependency_index.test_files.return_value = ["/src/test_a.py"]
+
+        shards = handler.suite_shards()
+
+        self.assertEqual(shards, [["/src/test_a.py"]])
+
+    @patch("testrunner.watcher.dependency.find_test_files", autospec=True)
+    def test_suite_not_configured(self, find_test_files, init):
+        """
+        Without TEST_SUITE there is no suite to shard
+        """
+
+        handler = self._handler(False, shard=True, suite=None)
+
+        self.assertIsNone(handler.suite_shards())
+        self.assertFalse(find_test_files.called)
+
+    @patch("testrunner.watcher.dependency.find_test_files", autospec=True)
+    def test_suite_sharded_no_tests(self, find_test_files, init):
+        handler = self._handler(False, shard=True)
+        find_test_files.return_value = []
+
+        self.assertIsNone(handler.suite_shards())
+
+    @patch("testrunner.watcher.DurationHistory", autospec=True)
+    @patch("testrunner.watcher.dependency.find_test_files", autospec=True)
+    def test_suite_sharded_by_duration(self, find_test_files,
+                                       DurationHistory, init):
+        """
+        Slow test modules are spread over shards, new one is expected
+        to take median of known durations
+        """
+
+        handler = self._handler(False, shard=True, by_duration=True)
+        find_test_files.return_value = [
+            "/src/test_a.py", "/src/test_b.py", "/src/test_c.py",
+            "/src/test_d.py"]
+        DurationHistory.return_value.load.return_value.durations\
+            .return_value = {"test_a": 10, "test_b": 9, "test_c": 1}
+
+        shards = handler.suite_shards()
+
+        DurationHistory.assert_called_once_with("/state/durations.json")
+        self.assertEqual(shards, [["test_a", "test_c"], ["test_b", "test_d"]])
+
+
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerCoverage(TestCase):
+
+    def _handler(self, enabled=True):
+        handler = FileChangeHandler()
+        handler._atask = None
+        handler._pool = Mock()
+        handler.test_runner = "test runner"
+        handler.defer_suite = False
+        handler.config = Mock(spec=Config)
+        handler.config.get_value.side_effect = lambda name: {
+            "COVERAGE_SELECT": enabled,
+            "SKIP_NOOP_EDITS": False,
+            "SELECT_TESTS": False,
+            "SKIP_UNCHANGED": False,
+            "FAILURE_FIRST": False,
+            "RESULT_CACHE": True,
+            "SHARD_SUITE": False,
+            "STATE_DIR": "/state",
+            "TEST_MODULE_PATTERN": "test*.py",
+        }[name]
+        handler.coverage_index = Mock(spec=CoverageIndex)
+        return handler
+
+    def test_selection_disabled(self, init):
+        handler = self._handler(enabled=False)
+
+        self.assertIsNone(handler.covering_tests(["/src/a.py"]))
+
+    def test_covering_tests(self, init):
+        handler = self._handler()
+        handler.coverage_index.changed_tests.side_effect = [
+            set(["t.test_b"]), set(["t.test_a", "t.test_b"])]
+
+        tests = handler.covering_tests(["/src/a.py", "/src/b.py"])
+
+        self.assertEqual(tests, ["t.test_a", "t.test_b"])
+
+    def test_coverage_not_known(self, init):
+        handler = self._handler()
+        handler.coverage_index.changed_tests.side_effect = [set(), None]
+
+        self.assertIsNone(handler.covering_tests(["/src/a.py", "/src/b.py"]))
+
+    def test_test_module_changed(self, init):
+        """
+        New tests are not covered yet, test module selects as without it
+        """
+
+        handler = self._handler()
+
+        self.assertIsNone(handler.covering_tests(["/src/test_a.py"]))
+        self.assertFalse(handler.coverage_index.changed_tests.called)
+
+    @patch("testrunner.watcher.linecoverage.CoverageIndex", autospec=True)
+    def test_index_loaded_once(self, CoverageIndex, init):
+        handler = self._handler()
+        handler.coverage_index = None
+
+        handler.load_coverage()
+        index = handler.load_coverage()
+
+        CoverageIndex.assert_called_once_with("/state/coverage")
+        self.assertEqual(index, CoverageIndex.return_value.load.return_value)
+
+    def test_covered_tests_run(self, init):
+        """
+        Single tests are run, results of modules are not cached for them
+        """
+
+        handler = self._handler()
+        handler.select_tests = Mock()
+        handler.result_keys = Mock()
+        handler.coverage_index.changed_tests.return_value = set(["t.test_a"])
+        batch = ChangeBatch()
+        batch.add("/src/a.py")
+
+        started = handler.start_tests_async(batch)
+
+        self.assertTrue(started)
+        self.assertFalse(handler.select_tests.called)
+        self.assertFalse(handler.result_keys.called)
+        handler.config.tests_command.assert_any_call(
+            tests=["t.test_a"], exclude=[])
+        self.assertIsNone(handler._pool.apply_async.call_args[0][1][3])
+
+    def test_coverage_merged_and_saved(self, init):
+        handler = self._handler()
+        handler.coverage_index.merge_runs.return_value = True
+
+        handler.update_coverage()
+
+        handler.coverage_index.save.assert_called_once_with()
+
+    def test_nothing_to_merge(self, init):
+        handler = self._handler()
+        handler.coverage_index.merge_runs.return_value = False
+
+        handler.update_coverage()
+
+        self.assertFalse(handler.coverage_index.save.called)
+
+    @patch.object(FileChangeHandler, "show_notification", autospec=True)
+    def test_preempted_run_discarded(self, show_notification, init):
+        """
+        Cancelled run could record coverage of tests only partly
+        """
+
+        handler = self._handler()
+        handler.coalescer = Mock(spec=EventCoalescer)
+        handler._control = Mock(spec=RunControl)
+        handler._preempted = True
+
+        handler.task_done((False, "Info"))
+
+        handler.coverage_index.discard_runs.assert_called_once_with()
+        self.assertFalse(handler.coverage_index.merge_runs.called)
+
+
+@patch.object(FileChangeHandler, "__init__", return_value=None)
+class TestFileChangeHandlerNoopEdits(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.module = self.tmp.putfile("mod.py", "def a():\n    return 1\n")
+        self.test_module = self.tmp.putfile(
+            "test_mod.py",
+            "class TestA(object):\n\n"
+            "    def setUp(self):\n        pass\n\n"
+            "    def test_a(self):\n        pass\n")
+
+    def tearDown(self):
+        del self.tmp
+
+    def _handler(self, kind="unittest", names="module", select=True):
+        handler = FileChangeHandler()
+        handler._atask = None
+        handler._pool = Mock()
+        handler.test_runner = "test runner"
+        handler.defer_suite = False
+        handler.fingerprints = FingerprintCache()
+        handler.fingerprints.changes([self.module, self.test_module])
+        handler.select_tests = Mock(return_value=["test_mod"])
+        handler.config = Mock(spec=Config)
+        handler.config.runner_kind.return_value = kind
+        handler.config.get_value.side_effect = lambda name: {
+            "SKIP_UNCHANGED": False,
+            "SKIP_NOOP_EDITS": True,
+            "SELECT_TESTS": select,
+            "COVERAGE_SELECT": False,
+            "FAILURE_FIRST": False,
+            "RESULT_CACHE": False,
+            "SHARD_SUITE": False,
+            "TEST_NAMES": names,
+            "TEST_MODULE_PATTERN": "test*.py",
+            "WATCH_DIR": unicode(self.tmp),
+        }[name]
+        return handler
+
+    def _batch(self, *paths):
+        batch = ChangeBatch()
+        for changed_path in paths:
+            batch.add(changed_path)
+        return batch
+
+    def test_noop_edit_skipped(self, init):
+        handler = self._handler()
+        self.tmp.putfile("mod.py", "def a():\n    # One\n    return 1\n")
+
+        started = handler.start_tests_async(self._batch(self.module))
+
+        self.assertFalse(started)
+        self.assertFalse(handler._pool.apply_async.called)
+
+    def test_body_change_runs(self, init):
+        handler = self._handler()
+        self.tmp.putfile("mod.py", "def a():\n    return 2\n")
+
+        started = handler.start_tests_async(self._batch(self.module))
+
+        self.assertTrue(started)
+        handler.select_tests.assert_called_once_with(set([self.module]))
+
+    def test_changed_test_run(self, init):
+        """
+        Only edited test runs, not whole test module
+        """
+
+        handler = self._handler()
+        self.tmp.putfile("test_mod.py",
+                         "class TestA(object):\n\n"
+                         "    def setUp(self):\n        pass\n\n"
+                         "    def test_a(self):\n        assert 1\n")
+
+        started = handler.start_tests_async(self._batch(self.test_module))
+
+        self.assertTrue(started)
+        self.assertFalse(handler.select_tests.called)
+        handler.config.tests_command.assert_any_call(
+            tests=["test_mod.TestA.test_a"], exclude=[])
+
+    def test_selection_disabled(self, init):
+        """
+        Test ids would replace TESTS, options may not accept them
+        """
+
+        handler = self._handler(select=False)
+        changes = {self.test_module: AstChange(BODY, ["TestA.test_a"])}
+
+        self.assertIsNone(handler.edited_tests([self.test_module], changes))
+
+    def test_changed_base_test(self, init):
+        """
+        Test of base class runs in its subclasses, whole module runs
+        """
+
+        handler = self._handler()
+        self.tmp.putfile("test_mod.py",
+                         "class TestA(object):\n\n"
+                         "    def setUp(self):\n        pass\n\n"
+                         "    def test_a(self):\n        pass\n\n"
+                         "class TestB(TestA):\n    pass\n")
+        handler.fingerprints.changes([self.test_module])
+        self.tmp.putfile("test_mod.py",
+                         "class TestA(object):\n\n"
+                         "    def setUp(self):\n        pass\n\n"
+                         "    def test_a(self):\n        assert 1\n\n"
+                         "class TestB(TestA):\n    pass\n")
+
+        started = handler.start_tests_async(self._batch(self.test_module))
+
+        self.assertTrue(started)
+        handler.select_tests.assert_called_once_with(set([self.test_module]))
+
+    def test_test_module_imported(self, init):
+        """
+        Other test modules may derive from test cases of changed one
+        """
+
+        handler = self._handler()
+        handler.dependency_index = Mock(spec=DependencyIndex)
+        handler.dependency_index.affected_tests.return_value = [
+            "test_mod", "test_other"]
+        changes = {self.test_module: AstChange(BODY, ["TestA.test_a"])}
+
+        self.assertIsNone(handler.edited_tests([self.test_module], changes))
+
+    def test_changed_set_up(self, init):
+        handler = self._handler(kind="nose")
+        changes = {self.test_module: AstChange(
+            BODY, ["TestA.setUp", "TestA.test_a"])}
+
+        self.assertIsNone(handler.edited_tests([self.test_module], changes))
+
+    def test_changed_test_pytest(self, init):
+        handler = self._handler(kind="pytest", names="path")
+        changes = {self.test_module: AstChange(BODY, ["TestA.test_a"])}
+
+        tests = handler.edited_tests([self.test_module], changes)
+
+        self.assertEqual(tests, [self.test_module + "::TestA::test_a"])
+
+    def test_pytest_by_module_name(self, init):
+        """
+        pytest does not run tests of module given by name
+        """
+
+        handler = self._handler(kind="pytest")
+        changes = {self.test_module: AstChange(BODY, ["TestA.test_a"])}
+
+        self.assertIsNone(handler.edited_tests([self.test_module], changes))
+
+    def test_other_file_changed(self, init):
+        handler = self._handler()
+        changes = {
+            self.test_module: AstChange(BODY, ["TestA.test_a"]),
+            self.module: AstChange(BODY, ["a"]),
+        }
+
+        self.assertIsNone(handler.edited_tests(
+            [self.test_module, self.module], changes))
@@ -0,0 +1,154 @@
+import base64
+import os
+import socket
+import sys
+import threading
+from unittest import TestCase
+
+from fixture.io import TempIO
+
+from testrunner.distributed import PROTOCOL, Connection
+from testrunner.hashcache import file_digest
+from testrunner.worker import JobControl, ShardWorker
+
+
+class TestShardWorker(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.worker = ShardWorker(unicode(self.tmp))
+        left, right = socket.socketpair()
+        self.conn = Connection(left)
+        self.coordinator = Connection(right)
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.coordinator.close)
+
+    def tearDown(self):
+        del self.tmp
+
+    def send_files(self, files):
+        for rel_path in self.coordinator.receive()["paths"]:
+            self.coordinator.send({
+                "type": "file", "path": rel_path,
+                "data": base64.b64encode(files[rel_path])})
+
+    def manifest(self, files):
+        digests = {}
+        for rel_path, data in files.items():
+            source = self.tmp.putfile("source.tmp", data)
+            digests[rel_path] = file_digest(source)
+            os.remove(source)
+        return digests
+
+    def test_sync(self):
+        self.tmp.putfile("same.py", "X = 1\n")
+        self.tmp.putfile("changed.py", "X = 1\n")
+        self.tmp.putfile("removed.py", "X = 1\n")
+        self.tmp.putfile("same.pyc", "compiled")
+        self.tmp.putfile("removed.pyc", "compiled")
+        self.tmp.putfile(".cache/v", "kept")
+        files = {"same.py": "X = 1\n", "changed.py": "X = 2\n",
+                 "pkg/new.py": "X = 3\n"}
+
+        thread = threading.Thread(target=self.send_files, args=(files,))
+        thread.start()
+        self.worker.sync(self.conn, self.manifest(files))
+        thread.join()
+
+        for rel_path, data in files.items():
+            with open(self.tmp.join(rel_path)) as src:
+                self.assertEqual(src.read(), data)
+        self.assertFalse(os.path.exists(self.tmp.join("removed.py")))
+        self.assertFalse(os.path.exists(self.tmp.join("removed.pyc")))
+        self.assertTrue(os.path.exists(self.tmp.join("same.pyc")))
+        self.assertTrue(os.path.exists(self.tmp.join(".cache/v")))
+
+    def test_only_changed_files_asked(self):
+        self.tmp.putfile("same.py", "X = 1\n")
+        files = {"same.py": "X = 1\n", "new.py": "X = 2\n"}
+
+        thread = threading.Thread(target=self.send_files, args=(files,))
+        thread.start()
+        self.worker.sync(self.conn, self.manifest(files))
+        thread.join()
+
+        self.assertTrue(os.path.exists(self.tmp.join("new.py")))
+
+    def test_path_outside_tree(self):
+        self.assertRaises(ValueError, self.worker.local_path, "../x.py")
+        self.assertRaises(ValueError, self.worker.local_path, "/etc/x.py")
+
+    def test_unknown_protocol(self):
+        self.coordinator.send({"type": "job", "protocol": PROTOCOL + 1})
+
+        self.worker.handle(self.conn)
+
+        message = self.coordinator.receive()
+        self.assertEqual(message["type"], "error")
+        self.assertIn("protocol", message["error"])
+
+    def test_busy(self):
+        self.worker._busy.acquire()
+
+        self.worker.handle(self.conn)
+
+        self.assertEqual(self.coordinator.receive(),
+                         {"type": "error", "error": "worker is busy"})
+
+
+class TestShardWorkerRun(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.worker = ShardWorker(unicode(self.tmp))
+        self.worker.heartbeat = 0.05
+        left, right = socket.socketpair()
+        self.conn = Connection(left)
+        self.coordinator = Connection(right)
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.coordinator.close)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_results_sent(self):
+        self.tmp.putfile("test_a.py", (
+            "import time, unittest\n"
+            "class T(unittest.TestCase):\n"
+            "    def test_a(self):\n"
+            "        time.sleep(0.3)\n"))
+
+        shard = self.worker.run(
+            self.conn, "{} -m unittest -v test_a".format(sys.executable), {})
+
+        self.assertTrue(shard.result)
+        messages = []
+        self.coordinator.sock.settimeout(1)
+        while not messages or messages[-1]["type"] != "result":
+            messages.append(self.coordinator.receive())
+        self.assertIn({"type": "alive"}, messages)
+        self.assertEqual(messages[-1]["test_id"], "test_a.T.test_a")
+
+    def test_coordinator_gone(self):
+        """
+        Test process is killed once coordinator closes connection
+        """
+
+        self.coordinator.close()
+
+        shard = self.worker.run(
+            self.conn, "{} -c 'import time; time.sleep(30)'".format(
+                sys.executable), {})
+
+        self.assertIsNone(shard)
+
+
+class TestJobControl(TestCase):
+
+    def test_cancel(self):
+        control = JobControl()
+        self.assertFalse(control.cancelled())
+
+        control.cancel()
+
+        self.assertTrue(control.cancelled())
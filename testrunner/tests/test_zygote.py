@@ -0,0 +1,164 @@
+import sys
+from unittest import TestCase
+
+import pexpect
+from fixture.io import TempIO
+from mock import patch
+
+from testrunner import zygote
+from testrunner.zygote import Zygote, parse_command
+
+
+class TestParseCommand(TestCase):
+
+    def test_module(self):
+        self.assertEqual(parse_command("python -m unittest discover -v"),
+                         ("-m", "unittest", ["discover", "-v"]))
+
+    def test_code(self):
+        self.assertEqual(parse_command("python2.7 -c 'print 1'"),
+                         ("-c", "print 1", []))
+
+    def test_script(self):
+        self.assertEqual(parse_command("/usr/bin/python run.py a"),
+                         ("path", "run.py", ["a"]))
+
+    def test_not_python(self):
+        self.assertIsNone(parse_command("nosetests -v"))
+        self.assertIsNone(parse_command("bash -c 'echo a'"))
+
+    def test_interpreter_options(self):
+        self.assertIsNone(parse_command("python -O -m unittest"))
+
+
+class TestZygote(TestCase):
+
+    def setUp(self):
+        self.tmp = TempIO(deferred=True)
+        self.tmp.putfile("preloaded_mod.py", "VALUE = 1")
+        sys.path.insert(0, unicode(self.tmp))
+
+    def tearDown(self):
+        sys.path.remove(unicode(self.tmp))
+        sys.modules.pop("preloaded_mod", None)
+        sys.modules.pop("preloaded_user", None)
+        del self.tmp
+
+    def _run(self, zygote_obj, test_cmd):
+        proc = zygote_obj.fork(test_cmd)
+        proc.expect(pexpect.EOF, timeout=5)
+        proc.close()
+        return proc
+
+    def test_forked_child_exit_status(self):
+        zygote_obj = Zygote([])
+        zygote_obj.preload()
+
+        proc = self._run(zygote_obj, "python -c 'import sys; sys.exit(3)'")
+
+        self.assertEqual(proc.exitstatus, 3)
+
+    def test_forked_child_output(self):
+        zygote_obj = Zygote(["preloaded_mod"])
+        zygote_obj.preload()
+
+        proc = self._run(
+            zygote_obj,
+            "python -c 'import preloaded_mod; print(preloaded_mod.VALUE)'")
+
+        self.assertEqual(proc.exitstatus, 0)
+        self.assertIn("1", proc.before)
+
+    def test_forked_child_exception(self):
+        zygote_obj = Zygote([])
+        zygote_obj.preload()
+
+        proc = self._run(zygote_obj, "python -c 'raise ValueError(\"x\")'")
+
+        self.assertEqual(proc.exitstatus, 1)
+        self.assertIn("ValueError", proc.before)
+
+    def test_discard_changed_module(self):
+        zygote_obj = Zygote(["preloaded_mod"])
+        zygote_obj.preload()
+        zygote_obj._sources["preloaded_mod"] = (
+            self.tmp.join("preloaded_mod.py"), 0)
+
+        stale = zygote_obj.discard_stale()
+
+        self.assertEqual(stale, ["preloaded_mod"])
+        self.assertNotIn("preloaded_mod", sys.modules)
+
+    # Compiled module of same second would be taken as up to date
+    @patch.object(sys, "dont_write_bytecode", True)
+    def test_discard_importers(self):
+        """
+        Module importing changed one refers to its old code, it is
+        discarded too
+        """
+
+        self.tmp.putfile(
+            "preloaded_user.py",
+            "from preloaded_mod import VALUE\n\ndef value():\n"
+            "    return VALUE\n")
+        zygote_obj = Zygote(["preloaded_user"])
+        zygote_obj.preload()
+        zygote_obj._sources["preloaded_mod"] = (
+            self.tmp.join("preloaded_mod.py"), 0)
+        self.tmp.putfile("preloaded_mod.py", "VALUE = 2")
+
+        stale = zygote_obj.discard_stale()
+
+        self.assertEqual(stale, ["preloaded_mod", "preloaded_user"])
+        self.assertNotIn("preloaded_user", sys.modules)
+        proc = self._run(
+            zygote_obj,
+            "python -c 'import preloaded_user; print(preloaded_user.value())'")
+        self.assertIn("2", proc.before)
+
+    def test_unchanged_modules_kept(self):
+        zygote_obj = Zygote(["preloaded_mod"])
+        zygote_obj.preload()
+
+        self.assertEqual(zygote_obj.discard_stale(), [])
+        self.assertIn("preloaded_mod", sys.modules)
+
+    def test_preload_failure_is_unhealthy(self):
+        zygote_obj = Zygote(["module_that_does_not_exist"])
+        zygote_obj.preload()
+
+        self.assertFalse(zygote_obj.healthy)
+        self.assertIsNone(zygote_obj.fork("python -c 'pass'"))
+
+    def test_command_not_forkable(self):
+        zygote_obj = Zygote([])
+
+        self.assertIsNone(zygote_obj.fork("bash -c 'echo a'"))
+
+    @patch("testrunner.zygote.ForkedChild", autospec=True)
+    def test_fork_failure_is_unhealthy(self, ForkedChild):
+        ForkedChild.side_effect = OSError("no pty")
+        zygote_obj = Zygote([])
+
+        self.assertIsNone(zygote_obj.fork("python -c 'pass'"))
+        self.assertFalse(zygote_obj.healthy)
+
+
+@patch("testrunner.zygote.Zygote", autospec=True)
+class TestZygoteSpawn(TestCase):
+
+    def setUp(self):
+        zygote._zygote = None
+
+    def tearDown(self):
+        zygote._zygote = None
+
+    def test_zygote_reused(self, ZygoteMock):
+        ZygoteMock.return_value.modules = ("json",)
+
+        zygote.spawn("cmd", ["json"])
+        result = zygote.spawn("cmd", ["json"])
+
+        ZygoteMock.assert_called_once_with(["json"])
+        ZygoteMock.return_value.preload.assert_called_once_with()
+        self.assertEqual(result, ZygoteMock.return_value.fork.return_value)
@@ -0,0 +1,280 @@
+"""
+Line coverage of single tests, recorded in test process.
+
+Test command is run by this module:
+
+    python -m testrunner.tracer --output DIR --root DIR -- -m unittest ...
+
+Lines executed in python files under root are recorded by test running
+at the time, and written to output dir when tests end (see linecoverage)
+"""
+import hashlib
+import os
+import pipes
+import shlex
+import sys
+import threading
+import unittest
+from argparse import ArgumentParser
+from os import path
+
+from testrunner.history import dump_json
+from testrunner.lazy import LazyModule
+from testrunner.linecoverage import (
+    OUTSIDE_TESTS, VERSION, runs_dir, sources_dir, to_ranges
+)
+
+zygote = LazyModule("testrunner.zygote")
+
+# Tracer of this process, used by pytest hooks
+_tracer = None
+
+
+class LineTracer(object):
+    """
+    Lines executed in files under root by tests (OUTSIDE_TESTS
+    when no test is running)
+    """
+
+    def __init__(self, root, sources):
+        self.root = path.join(path.abspath(root), "")
+        self.sources = sources
+        # Test id -> file -> lines
+        self.tests = {}
+        # File -> digest of its content
+        self.digests = {}
+
+        self._running = []
+        self._files = {}
+
+    @property
+    def test_id(self):
+        return self._running[-1] if self._running else OUTSIDE_TESTS
+
+    def start_test(self, test_id):
+        self._running.append(test_id)
+
+    def end_test(self):
+        if self._running:
+            self._running.pop()
+
+    def start(self):
+        # Modules already imported (ie. by zygote) are not traced on
+        # import, their changes can not be mapped to tests
+        for module in sys.modules.values():
+            file_path = self._file(getattr(module, "__file__", None) or "")
+            if file_path is not None:
+                self._outside_tests(file_path).update(
+                    range(1, self._lines_count(file_path) + 1))
+
+        threading.settrace(self._call)
+        sys.settrace(self._call)
+
+    def stop(self):
+        sys.settrace(None)
+        threading.settrace(None)
+
+    def _outside_tests(self, file_path):
+        return self.tests.setdefault(OUTSIDE_TESTS, {}).setdefault(
+            file_path, set())
+
+    def _lines_count(self, file_path):
+        with open(file_path, "rb") as src:
+            return len(src.read().splitlines())
+
+    def _file(self, file_name):
+        """
+        Absolute path of traced file, None if it is not traced
+        """
+
+        try:
+            return self._files[file_name]
+        except KeyError:
+            pass
+
+        file_path = path.abspath(file_name)
+        if file_path.endswith((".pyc", ".pyo")):
+            file_path = file_path[:-1]
+
+        if not file_path.startswith(self.root) or \
+                not file_path.endswith(".py") or \
+                not self._store_source(file_path):
+            file_path = None
+
+        self._files[file_name] = file_path
+        return file_path
+
+    def _store_source(self, file_path):
+        """
+        Keep content of traced file, lines of coverage refer to it
+        """
+
+        try:
+            with open(file_path, "rb") as src:
+                content = src.read()
+        except (IOError, OSError):
+            return False
+
+        digest = hashlib.sha1(content).hexdigest()
+        self.digests[file_path] = digest
+
+        source_path = path.join(self.sources, digest)
+        if not path.exists(source_path):
+            if not path.isdir(self.sources):
+                try:
+                    os.makedirs(self.sources)
+                except OSError:
+                    pass  # made by other process in meantime
+            tmp_path = "{}.{}".format(source_path, os.getpid())
+            with open(tmp_path, "wb") as dst:
+                dst.write(content)
+            os.rename(tmp_path, source_path)
+
+        return True
+
+    def _call(self, frame, event, arg):  # pylint: disable=unused-argument
+        file_path = self._file(frame.f_code.co_filename)
+        if file_path is None:
+            return None
+
+        lines = self.tests.setdefault(self.test_id, {}).setdefault(
+            file_path, set())
+        lines.add(frame.f_lineno)
+
+        def trace_lines(frame, event, arg):  # pylint: disable=unused-argument
+            if event == "line":
+                lines.add(frame.f_lineno)
+            return trace_lines
+
+        return trace_lines
+
+    def write(self, output, suite=False):
+        dump_json(path.join(runs_dir(output), "{}.json".format(os.getpid())), {
+            "version": VERSION,
+            "suite": suite,
+            "digests": self.digests,
+            "tests": dict(
+                (test_id, dict(
+                    (file_path, to_ranges(lines))
+                    for file_path, lines in files.items()
+                ))
+                for test_id, files in self.tests.items()
+            ),
+        })
+
+
+def unittest_id(test):
+    return test.id()
+
+
+def nose_id(test):
+    """
+    Test id as reported by nose, module:Class.test
+    """
+
+    name = test.id()
+    # Nose wraps tests (and test functions)
+    inner = getattr(test, "test", test)
+    if isinstance(inner, unittest.TestCase):
+        module = type(inner).__module__
+    else:
+        module = getattr(inner, "__module__", None)
+
+    if module and name.startswith(module + "."):
+        return "{}:{}".format(module, name[len(module) + 1:])
+
+    return name
+
+
+def trace_unittest(tracer, test_id=unittest_id):
+    """
+    Tests of unittest (and nose) tell tracer when they run
+    """
+
+    original = unittest.TestCase.run
+
+    def run(test, *args, **kwargs):
+        tracer.start_test(test_id(test))
+        try:
+            return original(test, *args, **kwargs)
+        finally:
+            tracer.end_test()
+
+    unittest.TestCase.run = run
+
+
+# pytest hooks, module is loaded as plugin (PYTEST_PLUGINS)
+def pytest_runtest_logstart(nodeid, location):  # pylint: disable=W0613
+    if _tracer is not None:
+        _tracer.start_test(nodeid)
+
+
+def pytest_runtest_logfinish(nodeid, location):  # pylint: disable=W0613
+    if _tracer is not None:
+        _tracer.end_test()
+
+
+def traced_command(test_cmd, output, root, kind="unittest", suite=False):
+    """
+    Test command run by tracer, None if it is not python command
+    """
+
+    try:
+        argv = shlex.split(test_cmd)
+    except ValueError:
+        return None
+
+    if zygote.parse_argv(argv) is None:
+        return None
+
+    traced = [argv[0], "-m", "testrunner.tracer",
+              "--output", path.abspath(output), "--root", path.abspath(root),
+              "--ids", kind]
+    if suite:
+        traced.append("--suite")
+    traced.append("--")
+
+    return " ".join(pipes.quote(arg) for arg in traced + argv[1:])
+
+
+def main(args=None):
+    global _tracer  # pylint: disable=global-statement
+
+    parser = ArgumentParser(
+        prog="testrunner.tracer",
+        description="Run tests recording lines run by each of them")
+    parser.add_argument("--output", required=True,
+                        help="Coverage dir (see linecoverage)")
+    parser.add_argument("--root", required=True, help="Dir of traced files")
+    parser.add_argument("--ids", default="unittest",
+                        choices=["unittest", "nose", "pytest"],
+                        help="Test runner, its form of test ids")
+    parser.add_argument("--suite", action="store_true",
+                        help="Command runs whole test suite")
+    parser.add_argument("command", nargs="+",
+                        help="Python arguments of test command")
+    args = parser.parse_args(args)
+
+    parsed = zygote.parse_argv([sys.executable] + args.command)
+    if parsed is None:
+        parser.error("Not python command: {}".format(" ".join(args.command)))
+
+    _tracer = LineTracer(args.root, sources_dir(args.output))
+    if args.ids == "pytest":
+        os.environ["PYTEST_PLUGINS"] = ",".join(filter(None, [
+            os.environ.get("PYTEST_PLUGINS"), "testrunner.tracer"]))
+    else:
+        trace_unittest(_tracer, nose_id if args.ids == "nose" else unittest_id)
+
+    _tracer.start()
+    try:
+        return zygote.run_command(*parsed)
+    finally:
+        _tracer.stop()
+        _tracer.write(args.output, args.suite)
+
+
+if __name__ == "__main__":
+    # State has to live in module, pytest imports it as plugin
+    from testrunner import tracer
+    sys.exit(tracer.main())  # pragma: no cover
@@ -1,7 +1,11 @@
 import logging
+import os
+import sys
+from fnmatch import fnmatch
+from glob import glob
 from time import time
 from os import path
-from multiprocessing import Pool
+from threading import Thread, Timer
 
 import pyinotify
 
@@ -11,60 +15,780 @@ try:
 except ImportError:
     from nosenotify import adapters as pynotify
 
-from configurator import Config
-from runner import Runner
+from coalescer import ChangeBatch, EventCoalescer
+from configurator import Config, parse_projects, setup_logging, watch_path
+from hashcache import ContentHashCache
+from history import (
+    DurationHistory, RunHistory, durations_file, history_file
+)
+from lazy import LazyModule
+from metrics import (
+    FIRST_EVENT, SCHEDULED, MetricsLog, RunStats, serve_metrics
+)
+from runner import Runner, RunControl, init_worker
 
 _log = logging.getLogger(__name__)
 
-pynotify.init("basic")
+# Imported on first use, loop engine does not need worker process
+multiprocessing = LazyModule("multiprocessing")
+# Modules of optional features (see default_config)
+astdiff = LazyModule("testrunner.astdiff")
+dependency = LazyModule("testrunner.dependency")
+engine = LazyModule("testrunner.engine")
+linecoverage = LazyModule("testrunner.linecoverage")
+resultcache = LazyModule("testrunner.resultcache")
+sharding = LazyModule("testrunner.sharding")
+snapshots = LazyModule("testrunner.snapshot")
+
+# Logged when start up is over and file events are processed
+WAITING_MARK = "Waiting for file events"
+
+# pynotify.init talks to notification daemon (D-Bus), it is done
+# when first notification is shown, not on import
+_notify_ready = False
+
+
+def test_scopes(test_id, root):
+    """
+    Names test can be selected by, test module first: a.T.test_x ->
+    a, a.T, a.T.test_x. Files of pytest ids are absolute paths in root
+    """
+
+    if "::" in test_id:
+        sep = "::"
+        parts = test_id.split(sep)
+        parts[0] = path.normpath(path.join(root, parts[0]))
+    else:
+        sep = "."
+        parts = test_id.split(sep)
+
+    return [sep.join(parts[:idx]) for idx in range(1, len(parts) + 1)]
+
+
+def notify_init():
+    global _notify_ready  # pylint: disable=global-statement
+    if not _notify_ready:
+        pynotify.init("basic")
+        _notify_ready = True
 
 
 class FileChangeHandler(pyinotify.ProcessEvent):
-    def my_init(self, config):
-        self._pool = Pool(1)
+    dependency_index = None
+    coverage_index = None
+    stats = None
+    metrics_server = None
+    title = "Test runner"
+    # Suite runs on its own, after tests of latest change passed
+    defer_suite = False
+    _preempted = False
+    _marks = None
+    _suite_due = False
+    _suite_running = False
+    _suite_timer = None
+    # Batch of changes tests run for
+    _running_batch = None
+    # Changes of index and hashes when snapshot was saved or loaded
+    _snapshot_changes = None
+    # Fingerprints of changed modules, made by first run which skips
+    # no-op edits
+    fingerprints = None
+    # Thread hashing watched files on start and hashes it found
+    _seeding = None
+
+    def my_init(self, config, loop=None, slots=None):
+        """
+        With event loop tests run in it (see engine), otherwise in pool
+        worker process. Slots limit runs of projects sharing the loop
+        """
+
+        if loop is not None:
+            self._pool = engine.LoopPool(loop, slots=slots)
+            self._control = self._pool.control
+        else:
+            self._control = RunControl()
+            self._pool = multiprocessing.Pool(
+                1, initializer=init_worker, initargs=[self._control])
         self._atask = None
         self._started = 0
-        self._last_event = 0
-        self.delay = 2
         self.config = config
+        if config.project is not None:
+            self.title = "Test runner: {}".format(config.project.name)
 
         self.config.load_config()
-        self.test_runner = Runner()
+        self.defer_suite = self.config.get_value("DEFER_SUITE")
+        self.test_runner = Runner(self.config.runner_options())
+        self.coalescer = EventCoalescer(
+            self.start_tests_async, self.config.get_value("QUIET_PERIOD"),
+            timer=loop.timer if loop is not None else None)
+        self.hash_cache = ContentHashCache(
+            self.config.get_value("HASH_CACHE_SIZE"))
+        self.seed_hashes()
+        # Digests for result cache keys, hash_cache tracks changes
+        self.key_hashes = ContentHashCache(
+            self.config.get_value("HASH_CACHE_SIZE"))
         self.last_result = None
 
+        self.stats = RunStats(self.config.get_value("METRICS_WINDOW"))
+        port = self.config.get_value("METRICS_PORT")
+        if port is not None:
+            # Projects of one process share server, see serve_metrics
+            project = config.project.name if config.project else None
+            self.metrics_server = serve_metrics(self.stats, port, project)
+
         self.pevent = self.exclude_filter_wrapper
 
     def task_done(self, callback_result):
         result, info = callback_result
-        delta = self._last_event - self._started
+        # Pool calls back before marking task as ready
+        self._atask = None
+        suite_run, self._suite_running = self._suite_running, False
+        batch, self._running_batch = self._running_batch, None
+
+        if self._preempted:
+            _log.info("Outdated test run cancelled")
+            self._preempted = False
+            # Next run covers changes of cancelled one too
+            if batch is not None:
+                self.coalescer.retry(batch)
+            self.discard_coverage()
+            self._control.reset()
+        else:
+            timings = getattr(callback_result, "timings", {})
+            self.record_timings(result, timings)
+            self.cache_results(getattr(callback_result, "passed_keys", None))
+            self.update_coverage()
+            self.show_notification(result, info)
 
-        self.show_notification(result, info)
+            if suite_run:
+                self._suite_due = False
+            elif self.defer_suite:
+                self.schedule_suite()
 
-        if delta > self.delay:
-            self.start_tests_async()
+        self.save_snapshot()
+        self.coalescer.release()
+
+    def preempt(self):
+        """
+        Cancel run in progress, new changes make its result outdated
+        """
+
+        if self._preempted:
+            return
+
+        self._preempted = True
+        self._control.cancel()
+
+    def start_tests_async(self, batch=None):
+        """
+        Start test run for batch of changes, returns True if run started
+        """
 
-    def start_tests_async(self, event=None):
         if self._atask and not self._atask.ready():
-            #print "Not ready yet:", event
+            return False
+
+        batch = batch or ChangeBatch()
+        paths = batch.paths
+
+        if paths and self.config.get_value("SKIP_UNCHANGED"):
+            self.merge_seeds()
+            paths = self.hash_cache.changed(paths) | batch.retried
+            if not paths:
+                _log.info("Content of changed files is the same, no run")
+                if self.defer_suite:
+                    self.schedule_suite()
+                return False
+
+        changes = None
+        if paths and self.config.get_value("SKIP_NOOP_EDITS"):
+            if self.fingerprints is None:
+                self.fingerprints = astdiff.FingerprintCache(
+                    self.hash_cache.max_size)
+            changes = self.fingerprints.changes(paths)
+            # Edits of cancelled run are not known anymore
+            for retried_path in batch.retried:
+                changes.pop(retried_path, None)
+            paths = set(
+                changed_path for changed_path in paths
+                if changed_path not in changes or
+                changes[changed_path].kind != astdiff.NOOP
+            )
+            if not paths:
+                _log.info("Only comments, docstrings or formatting changed, "
+                          "no run")
+                if self.defer_suite:
+                    self.schedule_suite()
+                return False
+
+        tests = self.covering_tests(paths)
+        if tests is None:
+            tests = self.edited_tests(paths, changes)
+        # Single tests are selected
+        precise = tests is not None
+        if not precise:
+            tests = self.select_tests(paths)
+
+        if tests is not None and not tests:
+            _log.info("No tests depend on changed files")
+            if self.defer_suite:
+                self.schedule_suite()
+            return False
+
+        # Results are cached per test module, not single tests
+        cache_keys = None if precise else self.result_keys(tests)
+        if cache_keys:
+            cached = self.result_cache().passed(cache_keys)
+            if cached:
+                _log.info("%d test modules passed before with the same code",
+                          len(cached))
+            tests = [name for name in tests if name not in cached]
+            cache_keys = dict(
+                (name, key) for name, key in cache_keys.items()
+                if name not in cached
+            )
+
+        _log.info("Run tests for %d changed paths (%d events)",
+                  len(batch), batch.events)
+        self._started = time()
+        self._marks = {
+            FIRST_EVENT: batch.first_event or self._started,
+            SCHEDULED: self._started,
+        }
+        failing = self.failed_tests(tests)
+        if precise and failing:
+            # Single tests run at once, ones failing last time first
+            root = path.abspath(self.config.get_value("WATCH_DIR"))
+            failed = set(test_scopes(test_id, root)[-1] for test_id in failing)
+            tests = sorted(tests, key=lambda name: (
+                test_scopes(name, root)[-1] not in failed))
+            failing = []
+
+        if tests == []:
+            # All selected tests are cached
+            test_cmd = None
+        else:
+            test_cmd = self.config.tests_command(tests=tests, exclude=failing)
+        shards = suite_cmd = None
+        if not self.defer_suite:
+            shards = self.suite_shards()
+            suite_cmd = self.suite_command(shards)
+        failed_cmd = self.failed_command(failing)
+        self._running_batch = batch
+        self._atask = self._pool.apply_async(
+            self.test_runner,
+            [test_cmd, suite_cmd, failed_cmd, cache_keys, shards,
+             failing or None],
+            callback=self.task_done)
+        return True
+
+    def schedule_suite(self):
+        """
+        Run suite once files did not change for SUITE_QUIET_PERIOD,
+        if it is due and tests of latest change passed
+        """
+
+        if not self._suite_due or self.last_result is False:
             return
 
-        _log.debug("Run test because of %r", event)
+        self.cancel_suite()
+        self._suite_timer = (self.coalescer.timer or Timer)(
+            self.config.get_value("SUITE_QUIET_PERIOD"),
+            self.start_suite_async)
+        self._suite_timer.daemon = True
+        self._suite_timer.start()
+
+    def cancel_suite(self):
+        """
+        Files changed: scheduled suite waits for tests of the change,
+        suite in progress is cancelled (it runs again later)
+        """
+
+        if self._suite_timer is not None:
+            self._suite_timer.cancel()
+            self._suite_timer = None
+
+        if self._suite_running and not self._preempted:
+            _log.info("Test suite cancelled by changes")
+            self.preempt()
+
+    def start_suite_async(self):
+        """
+        Start low priority run of suite, only when nothing else runs
+        or waits. Returns True if run started
+        """
+
+        self._suite_timer = None
+        if not self._suite_due or self.coalescer.pending or \
+                not self.coalescer.acquire():
+            return False
+
+        shards = self.suite_shards()
+        suite_cmd = self.suite_command(shards)
+
+        _log.info("Run test suite")
+        self._suite_running = True
         self._started = time()
-        test_cmd = self.config.tests_command()
-        suite_cmd = self.config.tests_command(suite=True)
-        self._atask = self._pool.apply_async(self.test_runner,
-                                             [test_cmd, suite_cmd],
-                                             callback=self.task_done)
+        self._marks = {SCHEDULED: self._started}
+        self._atask = self._pool.apply_async(
+            self.test_runner, [None, suite_cmd, None, None, shards],
+            callback=self.task_done)
+        return True
 
     def process_default(self, event):
+        if getattr(event, "dir", False) and event.mask & pyinotify.IN_CREATE:
+            self.config.check_created_dir(event.pathname)
+
         # on DELETE file will not exits any more
         if path.exists(event.pathname) and \
                 path.exists(self.config.config_file()) and \
                 path.samefile(event.pathname, self.config.config_file()):
             self.config.load_config()
+            self.defer_suite = self.config.get_value("DEFER_SUITE")
+            self.test_runner.options = self.config.runner_options()
+            self.coalescer.quiet_period = self.config.get_value("QUIET_PERIOD")
+            self.hash_cache.max_size = self.config.get_value("HASH_CACHE_SIZE")
+            if self.fingerprints is not None:
+                self.fingerprints.max_size = self.hash_cache.max_size
+            # Settings of index could change, rebuild it on next run
+            self.dependency_index = None
+            self.coverage_index = None
+
+        self.coalescer.add(event.pathname)
+
+        if self.defer_suite:
+            self._suite_due = True
+            self.cancel_suite()
+
+        if self.coalescer.running and self.config.get_value("PREEMPT_RUNS"):
+            self.preempt()
+
+    def select_tests(self, paths):
+        """
+        Test modules affected by changed paths.
+        None if selection is disabled or not possible
+        """
+
+        if not self.config.get_value("SELECT_TESTS") or not paths:
+            return None
+
+        index = self.dependency_index
+        if index is None:
+            index = self.dependency_index = dependency.DependencyIndex(
+                self.config.get_value("WATCH_DIR"),
+                test_pattern=self.config.get_value("TEST_MODULE_PATTERN"),
+                exclude_filter=self.config.filter_wrapper)
+            self.load_snapshot()
+        else:
+            for changed_path in paths:
+                index.update(changed_path)
+
+        tests = index.affected_tests(paths)
+        if tests is None:
+            return None
+
+        return self.test_names([index.file_path(name) for name in tests])
+
+    def covering_tests(self, paths):
+        """
+        Tests which run changed lines of paths (see linecoverage).
+        None if selection by coverage is disabled or not possible
+        """
+
+        if not self.config.get_value("COVERAGE_SELECT") or not paths:
+            return None
+
+        test_pattern = self.config.get_value("TEST_MODULE_PATTERN")
+        index = self.load_coverage()
+        tests = set()
+        for changed_path in paths:
+            # New tests in test module are not covered yet
+            if fnmatch(path.basename(changed_path), test_pattern):
+                return None
+
+            changed = index.changed_tests(changed_path)
+            if changed is None:
+                _log.debug("Coverage of %s is not known", changed_path)
+                return None
+            tests.update(changed)
+
+        _log.info("%d tests run changed lines", len(tests))
+        return sorted(tests)
+
+    def edited_tests(self, paths, changes):
+        """
+        Changed test functions, when only their bodies changed in test
+        modules (see astdiff). None if it is not the case or other test
+        modules import changed ones (they may derive from test cases).
+        Tests are selected only when selection is on: test ids are
+        accepted by test runner options then
+        """
+
+        if not changes or not (self.config.get_value("SELECT_TESTS") or
+                               self.config.get_value("COVERAGE_SELECT")):
+            return None
+
+        test_pattern = self.config.get_value("TEST_MODULE_PATTERN")
+        kind = self.config.runner_kind()
+        # Test ids of pytest are paths, of other runners module names
+        if (self.config.get_value("TEST_NAMES") == "path") != \
+                (kind == "pytest"):
+            return None
+
+        tests = []
+        for changed_path in sorted(paths):
+            change = changes.get(changed_path)
+            if change is None or change.kind != astdiff.BODY or \
+                    not fnmatch(path.basename(changed_path), test_pattern):
+                return None
+
+            index = self.dependency_index
+            if index is not None and \
+                    len(index.affected_tests([changed_path]) or ()) > 1:
+                return None
+
+            name = self.test_names([changed_path])[0]
+            classes = self.fingerprints.test_classes(changed_path)
+            for symbol in change.symbols:
+                test = astdiff.symbol_test_id(kind, name, symbol, classes) \
+                    if name else None
+                if test is None:
+                    # Helpers or set up of tests changed
+                    return None
+                tests.append(test)
+
+        _log.info("%d changed tests", len(tests))
+        return tests
+
+    def load_coverage(self):
+        if self.coverage_index is None:
+            state_dir = self.config.get_value("STATE_DIR")
+            self.coverage_index = linecoverage.CoverageIndex(
+                linecoverage.coverage_dir(state_dir)).load()
+
+        return self.coverage_index
+
+    def update_coverage(self):
+        """
+        Add coverage recorded by finished run to index
+        """
+
+        if not self.config.get_value("COVERAGE_SELECT"):
+            return
+
+        index = self.load_coverage()
+        if not index.merge_runs():
+            return
+
+        try:
+            index.save()
+        except (IOError, OSError) as err:
+            _log.warning("Can not save coverage %s: %s", index.file_path, err)
+
+    def discard_coverage(self):
+        if self.config.get_value("COVERAGE_SELECT"):
+            self.load_coverage().discard_runs()
+
+    def index_snapshot(self):
+        """
+        Snapshot file of index and hashes, None if it is not kept
+        """
+
+        state_dir = self.config.get_value("STATE_DIR")
+        if not state_dir or not self.config.get_value("INDEX_SNAPSHOT"):
+            return None
+
+        return snapshots.IndexSnapshot(snapshots.snapshot_file(state_dir))
+
+    def load_snapshot(self):
+        """
+        Build dependency index from snapshot, files which did not change
+        since it was saved are not parsed (nor hashed) again
+        """
+
+        snapshot = self.index_snapshot()
+        if snapshot is None:
+            self.dependency_index.build()
+            return
+
+        snapshot.load()
+        self.dependency_index.build(snapshot.index)
+        self.key_hashes.restore(snapshot.hashes)
+        if snapshot.index is not None:
+            self._snapshot_changes = (
+                self.dependency_index.changes, self.key_hashes.changes)
+
+    def seed_hashes(self):
+        """
+        Remember content of watched files on start, first touch of file
+        which did not change does not run tests. Files are hashed
+        in thread, watching does not wait for it (see merge_seeds)
+        """
+
+        if not self.config.get_value("SKIP_UNCHANGED"):
+            return
 
-        self._last_event = time()
-        self.start_tests_async(event)
+        seeds = ContentHashCache(self.hash_cache.max_size)
+        thread = Thread(target=self.find_seeds, args=(seeds,),
+                        name="testrunner-seed")
+        thread.daemon = True
+        self._seeding = (thread, seeds)
+        thread.start()
+
+    def find_seeds(self, seeds):
+        """
+        Hashes of snapshot when there are some, otherwise of watched files
+        """
+
+        snapshot = self.index_snapshot()
+        if snapshot is not None and snapshot.load().hashes:
+            seeds.restore(snapshot.hashes)
+            return
+
+        exclude = self.config.filter_wrapper
+        watch_dir = path.abspath(self.config.get_value("WATCH_DIR"))
+        for dir_path, dir_names, file_names in os.walk(watch_dir):
+            dir_names[:] = [
+                name for name in dir_names
+                if not exclude(path.join(dir_path, name))
+            ]
+            # Paths as in events (absolute), see watch_path
+            dir_path = watch_path(dir_path)
+            for name in file_names:
+                if len(seeds) >= seeds.max_size:
+                    return
+                file_path = path.join(dir_path, name)
+                if not exclude(file_path):
+                    seeds.digest(file_path)
+
+    def merge_seeds(self):
+        """
+        Add hashes found on start once they are all known, files seen
+        meanwhile keep their state
+        """
+
+        if self._seeding is None or self._seeding[0].is_alive():
+            return
+
+        self.hash_cache.restore(self._seeding[1].snapshot())
+        self._seeding = None
+
+    def save_snapshot(self):
+        """
+        Save index and hashes if they changed since last time
+        """
+
+        index = self.dependency_index
+        if index is None:
+            return
+
+        changes = (index.changes, self.key_hashes.changes)
+        snapshot = self.index_snapshot()
+        if snapshot is None or changes == self._snapshot_changes:
+            return
+
+        snapshot.index = index.snapshot()
+        snapshot.hashes = self.key_hashes.snapshot()
+        try:
+            snapshot.save()
+        except (IOError, OSError) as err:
+            _log.warning("Can not save snapshot %s: %s",
+                         snapshot.file_path, err)
+            return
+
+        self._snapshot_changes = changes
+
+    def test_names(self, files):
+        """
+        Test files as understood by test runner
+        """
+
+        if self.config.get_value("TEST_NAMES") == "path":
+            return files
+
+        root = path.abspath(self.config.get_value("WATCH_DIR"))
+        return [dependency.module_name(root, file_path) for file_path in files]
+
+    def suite_command(self, shards=None):
+        """
+        Command running test suite, list of commands (one per shard)
+        when suite is sharded
+        """
+
+        if not shards:
+            return self.config.tests_command(suite=True)
+
+        return [
+            self.config.tests_command(suite=True, tests=shard)
+            for shard in shards
+        ]
+
+    def suite_shards(self):
+        """
+        Tests of suite shards, None when suite is not sharded
+        """
+
+        # No TEST_SUITE means there is no suite to run
+        if not self.config.get_value("SHARD_SUITE") or \
+                self.config.get_value("TEST_SUITE") is None:
+            return None
+
+        if self.dependency_index is not None:
+            files = self.dependency_index.test_files()
+        else:
+            files = dependency.find_test_files(
+                self.config.get_value("WATCH_DIR"),
+                self.config.get_value("TEST_MODULE_PATTERN"),
+                self.config.filter_wrapper)
+
+        tests = self.test_names(files)
+        if not tests:
+            return None
+
+        count = sharding.shard_count(
+            self.config.get_value("SUITE_SHARDS"), len(tests))
+        if not self.config.get_value("SHARD_BY_DURATION"):
+            return sharding.split_tests(tests, count)
+
+        shards = sharding.balance_tests(
+            tests, count,
+            sharding.estimate_durations(tests, self.test_durations()))
+        _log.debug("Shards expected to take: %s", ", ".join(
+            "{:.2f}s".format(expected) for _, expected in shards))
+        return [shard for shard, _ in shards]
+
+    def test_durations(self):
+        """
+        Test module -> seconds it took in earlier runs
+        """
+
+        state_dir = self.config.get_value("STATE_DIR")
+        if not state_dir:
+            return {}
+
+        return DurationHistory(durations_file(state_dir)).load().durations()
+
+    def failed_tests(self, tests):
+        """
+        Tests which failed last time, only ones of selected tests (None
+        is all of them). Empty if ordering is disabled
+        """
+
+        if not self.config.get_value("FAILURE_FIRST"):
+            return []
+
+        state_dir = self.config.get_value("STATE_DIR")
+        failing = RunHistory(history_file(state_dir)).load().failing()
+        if tests is None:
+            return failing
+
+        root = path.abspath(self.config.get_value("WATCH_DIR"))
+        selected = set(tests)
+        return [
+            test_id for test_id in failing
+            if selected.intersection(test_scopes(test_id, root))
+        ]
+
+    def failed_command(self, failing):
+        """
+        Command running tests which failed last time, it stops on first
+        failure with FAIL_FAST. None if there are none
+        """
+
+        if not failing:
+            return None
+
+        return self.config.tests_command(
+            tests=failing, fail_fast=self.config.get_value("FAIL_FAST"))
+
+    def result_cache(self):
+        return resultcache.ResultCache(
+            resultcache.results_dir(self.config.get_value("STATE_DIR")),
+            self.config.get_value("RESULT_CACHE_SIZE"))
+
+    def result_keys(self, tests):
+        """
+        Test -> result cache key, for selected tests.
+        None if results are not cached
+        """
+
+        index = self.dependency_index
+        if not tests or index is None or \
+                not self.config.get_value("RESULT_CACHE"):
+            return None
+
+        salt = self.cache_salt(index.root)
+        by_path = self.config.get_value("TEST_NAMES") == "path"
+
+        keys = {}
+        for test_name in tests:
+            name = dependency.module_name(index.root, test_name) \
+                if by_path else test_name
+            keys[test_name] = resultcache.closure_key(
+                index, name, self.key_hashes.digest, salt)
+
+        return keys
+
+    def cache_results(self, passed_keys):
+        """
+        Cache test modules which passed, unless code changed during run
+        (key computed now is not the one tests run with)
+        """
+
+        if not passed_keys:
+            return
+
+        current = self.result_keys(sorted(passed_keys)) or {}
+        same = dict(
+            (test_name, key) for test_name, key in passed_keys.items()
+            if current.get(test_name) == key
+        )
+        if len(same) < len(passed_keys):
+            _log.info("%d test modules changed during run, not caching them",
+                      len(passed_keys) - len(same))
+
+        try:
+            self.result_cache().store(same)
+        except (IOError, OSError) as err:
+            _log.warning("Can not cache results: %s", err)
+
+    def cache_salt(self, root):
+        """
+        Part of cache key shared by all tests: how tests are run
+        and content of data files they use
+        """
+
+        parts = self.config.get_values(
+            ["TEST_RUNNER", "TEST_RUNNER_OPTIONS", "TESTS_OPTIONS"])
+        parts.append(sys.version)
+
+        for pattern in self.config.get_value("RESULT_CACHE_DATA") or ():
+            for file_path in sorted(glob(path.join(root, pattern))):
+                parts.append(u"{}={}".format(
+                    file_path, self.key_hashes.digest(file_path)))
+
+        return u"\0".join(unicode(part) for part in parts)
+
+    def record_timings(self, result, timings):
+        """
+        Add moments of finished run known to runner to those known here
+        """
+
+        if self.stats is None or self._marks is None:
+            return
+
+        marks = dict(self._marks, **timings)
+        self._marks = None
+
+        run_durations = self.stats.record(marks)
+        _log.debug("Run timings: %s", ", ".join(
+            "{} {:.3f}s".format(phase, duration)
+            for phase, duration in sorted(run_durations.items())))
+
+        log_file = self.config.get_value("METRICS_LOG")
+        if log_file:
+            try:
+                MetricsLog(log_file).write(marks, run_durations, result)
+            except (IOError, OSError) as err:
+                _log.warning("Can not write metrics log: %s", err)
 
     def exclude_filter_wrapper(self, event):
         return self.config.filter_wrapper(event.pathname)
@@ -79,17 +803,84 @@ class FileChangeHandler(pyinotify.ProcessEvent):
         if result is True:
             ico = "dialog-info"
 
-        notification = pynotify.Notification("Test runner", info, ico)
+        notify_init()
+        notification = pynotify.Notification(self.title, info, ico)
         notification.show()
 
 
+class ProjectEvents(object):
+    """
+    Hands events of watch manager shared by projects to handler
+    of project which owns the watch
+    """
+
+    def __init__(self, watch_manager, handlers):
+        self.watch_manager = watch_manager
+        self.handlers = handlers
+
+    def __call__(self, event):
+        watch_obj = self.watch_manager.get_watch(event.wd)
+        if watch_obj is None:
+            # Watch is already removed (IN_IGNORED)
+            return
+
+        for handler in self.handlers:
+            if handler.config.owns_watch(watch_obj):
+                handler(event)
+                return
+
+        _log.debug("No project for event %s", event)
+
+
+def watch_projects(projects, max_runs=1):
+    """
+    Several projects in one event loop with shared watch manager,
+    at most max_runs test runs at once
+    """
+
+    _log.info("Start watching %d projects", len(projects))
+
+    wmgr = pyinotify.WatchManager()
+    loop = engine.EventLoop()
+    slots = engine.RunSlots(max_runs)
+
+    handlers = []
+    for project in projects:
+        config = Config(watch_manager=wmgr, project=project)
+        handler = FileChangeHandler(config=config, loop=loop, slots=slots)
+        config.poller.attach(handler, loop)
+        handlers.append(handler)
+
+    pyinotify.AsyncNotifier(wmgr, ProjectEvents(wmgr, handlers),
+                            channel_map=loop.map)
+    _log.info(WAITING_MARK)
+    loop.run()
+
+
 def watch():
+    setup_logging()
+    projects, max_runs = parse_projects()
+    if projects:
+        watch_projects(projects, max_runs)
+        return
+
     _log.info("Start watching")
 
     wmgr = pyinotify.WatchManager()
     config = Config(watch_manager=wmgr)
 
+    if config.get_value("ENGINE") == "loop":
+        loop = engine.EventLoop()
+        handler = FileChangeHandler(config=config, loop=loop)
+        config.poller.attach(handler, loop)
+        pyinotify.AsyncNotifier(wmgr, handler, channel_map=loop.map)
+        _log.info(WAITING_MARK)
+        loop.run()
+        return
+
     handler = FileChangeHandler(config=config)
+    config.poller.attach(handler)
     notifier = pyinotify.ThreadedNotifier(wmgr, handler)
 
+    _log.info(WAITING_MARK)
     notifier.loop()
@@ -0,0 +1,276 @@
+"""
+Worker daemon running suite shards for coordinator (see distributed):
+
+    python -m testrunner.worker --port 7100 --dir /tmp/project-mirror
+
+Directory is kept as mirror of tree of coordinator, files which are not
+in it are removed (except compiled python files and hidden ones). Worker
+runs any command coordinator sends, so it should listen only where
+trusted coordinators can reach it. One shard runs at a time, jobs coming
+meanwhile are refused and go to other workers
+"""
+import base64
+import logging
+import os
+import socket
+import sys
+import threading
+from argparse import ArgumentParser
+from os import path
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+from testrunner.distributed import (
+    DEFAULT_PORT, PROTOCOL, Connection, done_message, result_message
+)
+from testrunner.hashcache import ContentHashCache
+from testrunner.runner import Runner
+
+_log = logging.getLogger("testrunner.worker")
+
+
+class JobControl(object):
+    """
+    RunControl of single job, cancelled when coordinator goes away
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class ShardWorker(object):
+    """
+    Runs jobs of coordinators in tree_dir
+    """
+
+    # Seconds between "alive" messages while shard runs
+    heartbeat = 5
+
+    def __init__(self, tree_dir):
+        self.tree_dir = path.abspath(tree_dir)
+        self.hashes = ContentHashCache(max_size=1 << 20)
+        self._busy = threading.Lock()
+
+    def local_path(self, rel_path):
+        """
+        Path of file of manifest in tree, it has to be inside of it
+        """
+
+        local = path.normpath(path.join(self.tree_dir, rel_path))
+        if not local.startswith(path.join(self.tree_dir, "")):
+            raise ValueError(u"Path outside of tree: {}".format(rel_path))
+
+        return local
+
+    def handle(self, conn):
+        if not self._busy.acquire(False):
+            conn.send({"type": "error", "error": "worker is busy"})
+            return
+
+        try:
+            self.handle_job(conn)
+        except (socket.error, IOError, OSError, ValueError, KeyError,
+                TypeError) as err:
+            _log.warning("Job failed: %s", err)
+            try:
+                conn.send({"type": "error", "error": unicode(err)})
+            except socket.error:
+                pass
+        finally:
+            self._busy.release()
+
+    def handle_job(self, conn):
+        job = conn.receive()
+        if job is None:
+            return
+
+        if job.get("type") != "job" or job.get("protocol") != PROTOCOL:
+            raise ValueError(u"Unknown job, protocol {} is expected".format(
+                PROTOCOL))
+
+        self.sync(conn, job["manifest"])
+        shard = self.run(conn, job["cmd"], job.get("options") or {})
+        if shard is not None:
+            conn.send(done_message(shard))
+
+    def sync(self, conn, manifest):
+        """
+        Make tree match manifest, files which differ are asked for
+        """
+
+        need = [
+            rel_path for rel_path, digest in sorted(manifest.items())
+            if self.hashes.digest(self.local_path(rel_path)) != digest
+        ]
+        conn.send({"type": "need", "paths": need})
+
+        for _ in need:
+            message = conn.receive()
+            if message is None or message.get("type") != "file":
+                raise ValueError(u"File is expected")
+            self.write(message["path"], message["data"])
+
+        self.remove_stale(manifest)
+        _log.info("Tree synced, %d of %d files updated",
+                  len(need), len(manifest))
+
+    def write(self, rel_path, data):
+        local = self.local_path(rel_path)
+        if data is None:
+            return
+
+        dir_path = path.dirname(local)
+        if not path.isdir(dir_path):
+            os.makedirs(dir_path)
+
+        tmp_path = local + ".tmp-testrunner"
+        with open(tmp_path, "wb") as dst:
+            dst.write(base64.b64decode(data))
+        os.rename(tmp_path, local)
+
+    def remove_stale(self, manifest):
+        """
+        Remove files of tree which are not in manifest
+        """
+
+        for dir_path, dir_names, file_names in os.walk(self.tree_dir):
+            dir_names[:] = [
+                name for name in dir_names
+                if not name.startswith(".") and name != "__pycache__"
+            ]
+
+            for name in file_names:
+                local = path.join(dir_path, name)
+                rel_path = path.relpath(local, self.tree_dir)
+                if name.startswith(".") or rel_path in manifest:
+                    continue
+                # Compiled module of source which is still there
+                if name.endswith((".pyc", ".pyo")) and \
+                        rel_path[:-1] in manifest:
+                    continue
+
+                _log.debug("Removing %s", rel_path)
+                os.remove(local)
+
+    def run(self, conn, test_cmd, options):
+        """
+        Run shard, results of tests are sent as they come. Returns
+        ShardResult, None if coordinator went away (process is killed)
+        """
+
+        control = JobControl()
+        finished = threading.Event()
+        runner = Runner(options)
+        runner.run_control = control
+        # Output of previous shard is kept until now
+        runner.discard_output()
+
+        def send_result(result):
+            try:
+                conn.send(result_message(result))
+            except socket.error:
+                control.cancel()
+
+        runner.on_result = send_result
+
+        watcher = threading.Thread(
+            target=self.watch, args=(conn, control, finished))
+        watcher.daemon = True
+        watcher.start()
+
+        _log.info("Running shard: %s", test_cmd)
+        try:
+            shard = runner.run_shard(test_cmd, cwd=self.tree_dir)
+        finally:
+            finished.set()
+
+        if control.cancelled():
+            _log.info("Shard cancelled by coordinator")
+            return None
+
+        _log.info("Shard %s in %.2fs", "passed" if shard.result else "failed",
+                  shard.elapsed)
+        return shard
+
+    def watch(self, conn, control, finished):
+        """
+        Tell coordinator shard is still running, cancel it once
+        coordinator closes connection
+        """
+
+        conn.sock.settimeout(self.heartbeat)
+        while not finished.is_set():
+            try:
+                if conn.receive() is None:
+                    break
+            except socket.timeout:
+                try:
+                    conn.send({"type": "alive"})
+                except socket.error:
+                    break
+            except (socket.error, ValueError):
+                break
+
+        if not finished.is_set():
+            control.cancel()
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, worker):
+        self.worker = worker
+        socketserver.ThreadingTCPServer.__init__(self, address, JobHandler)
+
+
+class JobHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.server.worker.handle(Connection(self.request))
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        prog="python -m testrunner.worker",
+        description="Run suite shards for testrunner coordinators")
+    parser.add_argument("--host", default="localhost",
+                        help="Address to listen on (default: localhost)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--dir", required=True,
+                        help="Directory of tree mirror, used only by worker")
+    parser.add_argument("--log-level", default="INFO")
+    options = parser.parse_args(args)
+
+    logging.basicConfig(level=options.log_level,
+                        format="%(asctime)s %(levelname)-7s %(message)s")
+
+    if not path.isdir(options.dir):
+        os.makedirs(options.dir)
+
+    server = WorkerServer((options.host, options.port),
+                          ShardWorker(options.dir))
+    _log.info("Worker listening on %s:%d, tree in %s",
+              options.host, server.server_address[1], options.dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
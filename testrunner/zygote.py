@@ -0,0 +1,263 @@
+"""
+Forking test runs from a process with heavy modules already imported.
+
+Runner is executed by long living pool worker, which serves as zygote:
+it imports configured modules once and forks a child (on a pty) per run.
+"""
+import logging
+import os
+import pty
+import re
+import runpy
+import shlex
+import signal
+import sys
+import traceback
+from os import path
+
+import pexpect
+
+from dependency import parse_imports
+
+_log = logging.getLogger(__name__)
+
+_PYTHON_NAME = re.compile(r"^python[\d.]*$")
+
+_zygote = None
+
+
+def parse_command(test_cmd):
+    """
+    Split python command into (kind, target, args), None if command
+    can not be run by forking
+    """
+
+    try:
+        argv = shlex.split(test_cmd)
+    except ValueError:
+        return None
+
+    return parse_argv(argv)
+
+
+def parse_argv(argv):
+    """
+    Same as parse_command, for already split command
+    """
+
+    if len(argv) < 2 or not _PYTHON_NAME.match(path.basename(argv[0])):
+        return None
+
+    if argv[1] in ("-m", "-c"):
+        if len(argv) < 3:
+            return None
+        return argv[1], argv[2], argv[3:]
+
+    if argv[1].startswith("-"):
+        return None
+
+    return "path", argv[1], argv[2:]
+
+
+def run_command(kind, target, args):
+    """
+    Execute parsed command in current process, returns exit status
+    """
+
+    # Same as interpreter would do for given command
+    if kind == "path":
+        sys.path.insert(0, path.dirname(path.abspath(target)))
+    elif os.getcwd() not in sys.path and "" not in sys.path:
+        sys.path.insert(0, os.getcwd())
+
+    try:
+        if kind == "-m":
+            sys.argv = [target] + args
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+        elif kind == "-c":
+            sys.argv = ["-c"] + args
+            code = compile(target, "<string>", "exec")
+            exec(code, {"__name__": "__main__"})  # pylint: disable=exec-used
+        else:
+            sys.argv = [target] + args
+            runpy.run_path(target, run_name="__main__")
+    except SystemExit as err:
+        if err.code is None or isinstance(err.code, int):
+            return err.code or 0
+        sys.stderr.write("{}\n".format(err.code))
+        return 1
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+
+class ForkedChild(pexpect.spawnu):
+    """
+    pexpect child forked from zygote instead of exec-ing new interpreter
+    """
+
+    def __init__(self, test_cmd, parsed, **kwargs):
+        self._parsed = parsed
+        super(ForkedChild, self).__init__(test_cmd, **kwargs)
+
+    def _spawn(self, command, args=()):
+        self.args = [command]
+        self.command = command
+        self.name = "<forked {}>".format(command)
+
+        self.pid, self.child_fd = pty.fork()
+
+        if self.pid == 0:  # pragma: no cover
+            # Child, never returns
+            code = 1
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                sys.stdin = sys.__stdin__ = os.fdopen(0, "r")
+                sys.stdout = sys.__stdout__ = os.fdopen(1, "w")
+                sys.stderr = sys.__stderr__ = os.fdopen(2, "w", 0)
+                code = run_command(*self._parsed)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)  # pylint: disable=protected-access
+
+        self.terminated = False
+        self.closed = False
+
+
+class Zygote(object):
+    """
+    Imports given modules once, forks children running tests
+    """
+
+    def __init__(self, modules):
+        self.modules = tuple(modules)
+        self.healthy = True
+        self._sources = {}
+        self._imports = {}
+
+    def preload(self):
+        loaded = set(sys.modules)
+
+        for name in self.modules:
+            try:
+                __import__(name)
+            except Exception as err:  # pylint: disable=broad-except
+                _log.warning("Zygote can not preload %s: %s", name, err)
+                self.healthy = False
+
+        for name in set(sys.modules) - loaded:
+            source = self._source(sys.modules[name])
+            if source is not None:
+                self._sources[name] = (source, self._mtime(source))
+
+        _log.debug("Zygote preloaded %d modules", len(self._sources))
+
+    @staticmethod
+    def _source(module):
+        file_name = getattr(module, "__file__", None)
+        if not file_name:
+            return None
+
+        if file_name.endswith((".pyc", ".pyo")):
+            file_name = file_name[:-1]
+
+        return file_name
+
+    @staticmethod
+    def _mtime(file_name):
+        try:
+            return path.getmtime(file_name)
+        except OSError:
+            return None
+
+    def imports(self, name):
+        """
+        Modules preloaded module could import, parsed on first use
+        """
+
+        imports = self._imports.get(name)
+        if imports is not None:
+            return imports
+
+        source = self._sources[name][0]
+        imports = set()
+        if source.endswith(".py"):
+            try:
+                with open(source, "rb") as src:
+                    imports = parse_imports(
+                        src.read(), name,
+                        path.basename(source) == "__init__.py")
+            except (IOError, OSError, SyntaxError, TypeError, ValueError):
+                pass
+
+        self._imports[name] = imports
+        return imports
+
+    def discard_stale(self):
+        """
+        Throw away modules which source changed since import, and
+        modules importing them (directly or not) as they still refer
+        to old code, so children import them again
+        """
+
+        stale = set(
+            name for name, (source, mtime) in self._sources.items()
+            if self._mtime(source) != mtime
+        )
+
+        importers = stale
+        while importers:
+            importers = set(
+                name for name in self._sources
+                if name not in stale and self.imports(name) & stale
+            )
+            stale.update(importers)
+
+        for name in sorted(stale):
+            _log.info("Zygote discards changed module %s", name)
+            sys.modules.pop(name, None)
+            del self._sources[name]
+            self._imports.pop(name, None)
+
+        return sorted(stale)
+
+    def fork(self, test_cmd):
+        """
+        Forked child running test_cmd, None if it is not possible
+        """
+
+        if not self.healthy:
+            return None
+
+        parsed = parse_command(test_cmd)
+        if parsed is None:
+            _log.debug("Command can not be forked: %s", test_cmd)
+            return None
+
+        self.discard_stale()
+
+        try:
+            return ForkedChild(test_cmd, parsed)
+        except (OSError, pexpect.ExceptionPexpect) as err:
+            _log.warning("Zygote is unhealthy: %s", err)
+            self.healthy = False
+            return None
+
+
+def spawn(test_cmd, modules):
+    """
+    Fork test_cmd from zygote of current process preloading given modules.
+    Returns None when command has to be spawned normally
+    """
+
+    global _zygote  # pylint: disable=global-statement
+
+    if _zygote is None or _zygote.modules != tuple(modules):
+        _zygote = Zygote(modules)
+        _zygote.preload()
+
+    return _zygote.fork(test_cmd)